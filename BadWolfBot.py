@@ -17,6 +17,9 @@ from data_tracking import DataTracker
 import InteractionUtils
 from api import api_channelbot_interface, endpoints
 import MiiPuller
+import MiiDataCache
+import UserDataStore
+import MiiImageCache
 import WiimmfiSiteFunctions
 
 #External library imports for this file
@@ -172,6 +175,9 @@ REMOVE_BLACKLISTED_WORD_TERMS = {"removeblacklistword", "removeblacklistedword",
 SERVER_USAGE_TERMS = {"serverusage", "usage", "serverstats"}
 TABLE_BOT_MEMORY_USAGE_TERMS = {"memory", "memoryusage"}
 GARBAGE_COLLECT_TERMS = {"gc", "garbagecollect"}
+IMAGE_QUEUE_TERMS = {"imagequeue", "imagestats"}
+DATABASE_QUEUE_TERMS = {"dbqueue", "databasequeue"}
+DATABASE_CACHE_TERMS = {"dbcache", "databasecache", "statscache"}
 TOTAL_CLEAR_TERMS = {'totalclear'}
 DUMP_DATA_TERMS = {"dtt", "dothething"}
 LOOKUP_TERMS = {"lookup"}
@@ -332,6 +338,10 @@ class BadWolfBot(ext_commands.Bot):
             self.update_ctww_regions.start()
         except RuntimeError:
             print("update_ctww_regions task already started")
+        try:
+            self.database_maintenance.start()
+        except RuntimeError:
+            print("database_maintenance task already started")
 
         self.mentions = [f'<@!{self.user.id}>', f'<@{self.user.id}>']
         finished_on_ready = True
@@ -352,16 +362,21 @@ class BadWolfBot(ext_commands.Bot):
         regions = await WiimmfiSiteFunctions.get_valid_ctww_regions()
         Race.CTGP_CTWW_REGIONS = regions
     
+    #The tracking database is no longer vacuumed every time the bot starts - this vacuums it (when enough of it is free pages) once a day instead
+    @tasks.loop(hours=24)
+    async def database_maintenance(self):
+        #The first iteration runs right when the bot logs in, which is when it's busiest
+        if self.database_maintenance.current_loop == 0:
+            return
+        await DataTracker.database_maintenance()
+    
     @tasks.loop(hours=2)
     async def clear_mii_cache(self):
-        for fc in list(MiiPuller.MII_CACHE.keys())[::-1]:
-            if (MiiPuller.cache_time_expired(MiiPuller.MII_CACHE[fc][1])):
-                MiiPuller.MII_CACHE.pop(fc)
+        #Mii data is kept past its cache time so it can be used when SAKE is down, but miis that haven't been pulled in a long time are removed
+        await asyncio.get_running_loop().run_in_executor(None, MiiDataCache.remove_old_mii_datas)
         
-        for fc in list(MiiPuller.MII_PHOTO_CACHE.keys())[::-1]:
-            if (MiiPuller.photo_cache_is_expired(MiiPuller.MII_PHOTO_CACHE[fc])):
-                MiiPuller.MII_PHOTO_CACHE.pop(fc)
-                common.delete_file(f"{common.MIIS_CACHE_PATH}{fc}.png")
+        #Rendered mii pictures are no longer expired on a timer - the mii picture cache removes the least recently used ones when it's over its byte budget
+        await asyncio.get_running_loop().run_in_executor(None, MiiImageCache.evict_if_needed)
 
     # For memory purposes; don't want dictionary to keep ballooning
     @tasks.loop(hours=8)
@@ -439,7 +454,7 @@ class BadWolfBot(ext_commands.Bot):
         self.pickle_lounge_updates()
         Stats.save_metadata()
         if common.is_prod:
-            Stats.backup_files()
+            await Stats.backup_files()
             await Stats.prune_backups()
         
         print(f"{str(datetime.now())}: Finished saving data")
@@ -695,6 +710,9 @@ class BadWolfBot(ext_commands.Bot):
             await common.safe_send(message,"This command has been disabled.")
         except (ext_commands.CommandNotFound,TableBotExceptions.CommandNotFound):
             await common.safe_send(message,f"Not a valid command. For more help, do the command: `{server_prefix}help`")
+        except TableBotExceptions.ImageQueueSaturated:
+            await common.safe_send(message,
+                                   "Table Bot is making a lot of table pictures right now and the picture queue is full. Please wait a few seconds and try again.")
         except TableBotExceptions.BackupPictureGeneratorFailed as e:
             await common.safe_send(message, "Local table picture generator failed. This shouldn't have happened, so report it as a bug in MKW Table Bot server.")
             raise e
@@ -865,6 +883,15 @@ class BadWolfBot(ext_commands.Bot):
 
         elif main_command in SERVER_USAGE_TERMS:
             await commands.BotOwnerCommands.server_process_memory_command(message)
+
+        elif main_command in IMAGE_QUEUE_TERMS:
+            await commands.BotOwnerCommands.image_queue_command(message)
+
+        elif main_command in DATABASE_QUEUE_TERMS:
+            await commands.BotOwnerCommands.database_queue_command(message)
+
+        elif main_command in DATABASE_CACHE_TERMS:
+            await commands.BotOwnerCommands.database_cache_command(message)
             
         elif main_command in LOUNGE_WHO_IS_TERMS:
             await commands.LoungeCommands.who_is_command(message, args)
@@ -877,14 +904,12 @@ class BadWolfBot(ext_commands.Bot):
 
             print(f"get_size: Lounge table reports size (KiB):")
             size_str += "Lounge submission tracking size (KiB): " + str(get_size(lounge_submissions)//1024)
-            print(f"get_size: FC_DiscordID:")
-            size_str += "\nFC_DiscordID (KiB): " + str(get_size(UserDataProcessing.fc_discordId) // 1024)
-            print(f"get_size: discordID_Lounges:")
-            size_str += "\ndiscordID_Lounges (KiB): " + str(get_size(UserDataProcessing.discordId_lounges) // 1024)
-            print(f"get_size: discordID_Flags (KiB):")
-            size_str += "\ndiscordID_Flags (KiB): " + str(get_size(UserDataProcessing.discordId_flags) // 1024)
-            print(f"get_size: blacklisted_Users (KiB):")
-            size_str += "\nblacklisted_Users (KiB): " + str(get_size(UserDataProcessing.blacklisted_users) // 1024)
+            #The user data is read through from UserDataStore, so only each table's cache of looked up keys is in memory
+            for table_name, user_data_table in (("FC_DiscordID", UserDataProcessing.fc_discordId), ("discordID_Lounges", UserDataProcessing.discordId_lounges),
+                                                ("discordID_Flags", UserDataProcessing.discordId_flags), ("blacklisted_Users", UserDataProcessing.blacklisted_users)):
+                print(f"get_size: {table_name}:")
+                row_count = await asyncio.get_running_loop().run_in_executor(None, len, user_data_table)
+                size_str += f"\n{table_name}: {len(user_data_table.cache)} cached keys, {row_count} rows"
             print(f"get_size: valid_flag_codes (KiB):")
             size_str += "\nvalid_flag_codes (KiB): " + str(get_size(UserDataProcessing.valid_flag_codes)//1024)
             print(f"get_size: bot_abuse_tracking (KiB):")
@@ -1061,6 +1086,8 @@ class BadWolfBot(ext_commands.Bot):
         await self.save_data()
         self.destroy_all_tablebots()
         await DataTracker.on_exit()
+        MiiDataCache.close()
+        UserDataStore.close()
         print(f"{str(datetime.now())}: All table bots cleaned up.")
 
 def commandIsAllowed(isLoungeServer: bool, message_author: discord.Member, this_bot: TableBot.ChannelBot, command: str, is_interaction: bool = False):
@@ -1226,6 +1253,8 @@ def data_init():
     UtilityFunctions.initialize()
     TagAIShell.initialize()
     Stats.initialize()
+    MiiImageCache.load()
+    MiiDataCache.load()
 
 async def initialize():
     global bot
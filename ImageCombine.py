@@ -3,6 +3,7 @@ Created on Aug 2, 2020
 
 @author: willg
 '''
+import io
 import cv2
 import numpy as np
 from PIL import Image, ImageFont, ImageDraw
@@ -31,6 +32,7 @@ MII_PADDING_SECTION_RIGHT = 7
 #Team tag text constants
 TEAM_TAG_TEXT_COLOR = (255,255,255)
 DEFAULT_TEAM_TAG_FONT = f"{common.FONT_PATH}Roboto-Medium.ttf"
+TEAM_TAG_FONT_SIZE = 30
 MAX_TEAM_TAG_HEIGHT_BOX = 50
 TEAM_TAG_TEXT_MAX_HEIGHT = 30
 TEAM_TAG_WIDTH_PADDING = 15
@@ -42,6 +44,7 @@ assert MAX_TEAM_TAG_HEIGHT_BOX > TEAM_TAG_TEXT_MAX_HEIGHT
 #Mii name text constants
 MII_NAME_TEXT_COLOR = (255,255,255)
 DEFAULT_MII_NAME_FONT = f"{common.FONT_PATH}Roboto-Medium.ttf"
+MII_NAME_FONT_SIZE = 20
 MII_NAME_WIDTH_PADDING = 5
 MII_NAME_CHAR_SET_TO_INCREASE_SIZE = {'j', 'g', 'y', 'q', 'p'}
 MAX_MII_NAME_HEIGHT_BOX = 36
@@ -58,7 +61,9 @@ TEAM_LEFT_BORDER_COLOR = np.array([255,255,255], dtype=np.uint8)
 
 MAX_FONT_ITERATIONS = 20
 
-TESTING_IMAGE = "851185374897504276.png"
+#Table pictures are composed entirely in memory. Turn this on to also write each finished picture to the temp folder for debugging.
+DEBUG_DUMP_TABLE_PICTURES = False
+DEBUG_DUMP_PATH = "./temp/"
 
 
 AUTOGENERATED_FILE_NAME = "AutoGenerateHeader.png"
@@ -71,18 +76,120 @@ ERRORS_HEADER_PATH = f"{common.TABLE_HEADERS_PATH}{ERRORS_HEADER_FILE_NAME}"
 EDITS_HEADER_PATH = f"{common.TABLE_HEADERS_PATH}{EDITS_HEADER_FILE_NAME}"
 NO_ERRORS_HEADER_PATH = f"{common.TABLE_HEADERS_PATH}{NO_ERRORS_HEADER_FILE_NAME}"
 
+#Process-wide caches of decoded assets, so ?wp doesn't decode the same header PNGs and load the same fonts every time
+#Header images, keyed by path. Never modified after being decoded, since np.concatenate always makes a new array.
+_HEADER_IMAGE_CACHE: Dict[str, np.ndarray] = {}
+#Headers already extended to a table width, keyed by (path, table width). Tables are almost always one of a handful of widths.
+_EXTENDED_HEADER_CACHE: Dict[Tuple[str, int], np.ndarray] = {}
+MAX_EXTENDED_HEADER_CACHE_SIZE = 64
+#FreeTypeFont objects, keyed by (path, size)
+_FONT_CACHE: Dict[Tuple[str, int], ImageFont.FreeTypeFont] = {}
+#Text measurements, keyed by (path, size, text). Cleared when it gets large, since player names come and go.
+_TEXT_SIZE_CACHE: Dict[Tuple[str, int, str], Tuple[int, int]] = {}
+MAX_TEXT_SIZE_CACHE_SIZE = 20000
+
+
+def get_header_image(image_path: str) -> np.ndarray:
+    if image_path not in _HEADER_IMAGE_CACHE:
+        _HEADER_IMAGE_CACHE[image_path] = cv2.imread(image_path)
+    return _HEADER_IMAGE_CACHE[image_path]
+
+def get_extended_header_image(image_path: str, table_width: int) -> np.ndarray:
+    '''Returns the header centered and extended (with its top left pixel color) to the given table width.
+    Returns None if the table is narrower than the header.'''
+    cache_key = (image_path, table_width)
+    #This runs on the image workers, and another worker can clear the cache between a check and a read, so the cache is only read once
+    cached_header = _EXTENDED_HEADER_CACHE.get(cache_key)
+    if cached_header is not None:
+        return cached_header
+
+    header_cv2 = get_header_image(image_path)
+    header_extend = header_cv2[0][0]
+    header_height = len(header_cv2)
+    header_width = len(header_cv2[0])
+    add_left = int((table_width - header_width)/2)
+    add_right = int(table_width - (add_left + header_width))
+
+    if add_left > 0 and add_right > 0:
+        left_data = np.full((header_height, add_left, 3), header_extend)
+        right_data = np.full((header_height, add_right, 3), header_extend)
+        header_cv2 = np.concatenate((left_data, header_cv2, right_data), axis=1)
+    elif add_left < 0 or add_right < 0:
+        return None
+
+    if len(_EXTENDED_HEADER_CACHE) >= MAX_EXTENDED_HEADER_CACHE_SIZE:
+        _EXTENDED_HEADER_CACHE.clear()
+    _EXTENDED_HEADER_CACHE[cache_key] = header_cv2
+    return header_cv2
+
+def get_font(font_path: str, font_size: int) -> ImageFont.FreeTypeFont:
+    cache_key = (font_path, font_size)
+    if cache_key not in _FONT_CACHE:
+        _FONT_CACHE[cache_key] = ImageFont.truetype(font_path, font_size)
+    return _FONT_CACHE[cache_key]
+
+def get_text_size(font_path: str, font_size: int, text: str) -> Tuple[int, int]:
+    '''Returns the (width, height) of the text's bounding box in the given font'''
+    cache_key = (font_path, font_size, text)
+    text_size = _TEXT_SIZE_CACHE.get(cache_key)
+    if text_size is None:
+        if len(_TEXT_SIZE_CACHE) >= MAX_TEXT_SIZE_CACHE_SIZE:
+            _TEXT_SIZE_CACHE.clear()
+        left, top, right, bottom = get_font(font_path, font_size).getbbox(text)
+        text_size = (right - left, bottom - top)
+        _TEXT_SIZE_CACHE[cache_key] = text_size
+    return text_size
+
+def fit_font_size(font_path: str, text: str, max_font_size: int, max_width: int, max_height: int, min_font_size: int) -> Tuple[int, int, int]:
+    '''Returns (font size, text width, text height) for the largest font size (no smaller than min_font_size) at which the text fits in the given box.
+    Text size grows with font size, so this binary searches instead of trying every size. If the text doesn't fit at any size, min_font_size is used.'''
+    def fits(font_size):
+        width, height = get_text_size(font_path, font_size, text)
+        return width <= max_width and height <= max_height
+
+    low, high = min_font_size, max_font_size
+    if not fits(low):
+        high = low
+    while low < high:
+        middle = (low + high + 1) // 2
+        if fits(middle):
+            low = middle
+        else:
+            high = middle - 1
+    return (low, *get_text_size(font_path, low, text))
+
 
 def create_numpy_image_with_color(dimensions, color):
     image = np.empty((*dimensions, len(color)), dtype=np.uint8)
     image[:] = color
     return image
 
-#Takes a footer (pillow image) and a path to the table, adds the footer to the bottom of the table and saves the table in the specified location
+def decode_image(image_bytes: bytes) -> np.ndarray:
+    '''Decodes PNG (or any other format OpenCV supports) bytes into a BGR numpy array. Returns None if the bytes aren't a valid image.'''
+    if not image_bytes:
+        return None
+    return cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+def encode_image(image: np.ndarray) -> bytes:
+    '''Encodes a BGR numpy array as PNG bytes'''
+    success, encoded = cv2.imencode(".png", image)
+    if not success:
+        return None
+    return encoded.tobytes()
+
+def get_discord_file_bytes(image_png: bytes) -> io.BytesIO:
+    '''discord.File consumes the file object it is given, so each send needs its own stream over the encoded picture'''
+    return io.BytesIO(image_png)
+
+def debug_dump(image: np.ndarray, file_name: str):
+    if DEBUG_DUMP_TABLE_PICTURES:
+        cv2.imwrite(f"{DEBUG_DUMP_PATH}{file_name}", image)
+
+#Takes a footer (numpy image) and a table (numpy image), adds the footer to the bottom of the table and returns the combined table (or None if they couldn't be combined)
 #If the footer has a smaller width than the table, the left and right part of the footer are extended by an equal amount - the color of the extension is based on the left and right edges
 #If the footer has a larger width than the table, the left and right are cropped by an equal amount
 #Therefore, it is suggested that everything in the footer is centered in case it is cropped.
-def add_autotable_footer(footer, table_image_path=TESTING_IMAGE, out_image_path="combined_test.png", extension_should_reflect=True):
-    table_cv2 = cv2.imread(table_image_path)
+def add_autotable_footer(footer, table_cv2: np.ndarray, extension_should_reflect=True) -> np.ndarray:
     table_width = len(table_cv2[0])
     
     footer_width, footer_height = len(footer[0]), len(footer)
@@ -105,7 +212,7 @@ def add_autotable_footer(footer, table_image_path=TESTING_IMAGE, out_image_path=
         add_left_footer = int((table_width - footer_width)/2)
         add_right_footer = int(table_width - (add_left_footer + footer_width))
         if add_left_footer < 1 or add_right_footer < 1:
-            return False
+            return None
         if SHOULD_REFLECT_WITH_TEAMS and extension_should_reflect:
             left_footer_extend = footer_array[:, 0]
             right_footer_extend = footer_array[:, -1]
@@ -126,38 +233,45 @@ def add_autotable_footer(footer, table_image_path=TESTING_IMAGE, out_image_path=
     else:
         pass
     
-    total_combined = np.concatenate((table_cv2, footer_array), axis=0)
-    cv2.imwrite(out_image_path, total_combined)
-    return True
+    return np.concatenate((table_cv2, footer_array), axis=0)
 
 #Takes team scores and adds the miis to the table
 #The exact structure of team_scores can be found in ScoreKeeper.get_war_table_DCS, but as of 6/7/2021, the structure as the following:
 #A list of tuples. Tuples have 2 pieces of data. The first is a str which is the team tag. The 2nd is a list of tuples (a tuple contains information about that player on the team).
 #The first index of that tuple is the players FC, the 2nd index of that tuple is a tuple if 2 length. The first index of that tuple is the table str for Lorenzi's website, the 2nd index is their total score, including penalties.
-def add_miis_to_table(channel_bot:ChannelBot, table_data:List[Tuple[str, List[Tuple[str, Tuple[str, int]]]]], table_image_path=TESTING_IMAGE, out_image_path="combined_test.png"):
+#Returns what the mii footer needs from the channel bot's room and war: whether the footer extension should reflect, and a list of (team tag, [(mii name, mii)]).
+#The room is changed on the event loop (by background mii pulls and other commands), so this is called there, and only its result is given to add_miis_to_table
+def get_mii_footer_teams(channel_bot:ChannelBot, table_data:List[Tuple[str, List[Tuple[str, Tuple[str, int]]]]]) -> Tuple[bool, List[Tuple[str, List[Tuple[str, Mii.Mii]]]]]:
+    is_ffa = channel_bot.getWar().is_ffa()
+    teams = []
+    for team_tag, team_data in table_data["teams"].items():
+        available_miis = channel_bot.room.get_available_miis_dict([fc for fc in team_data["players"]])
+        teams.append((team_tag, [(get_mii_footer_name(mii), mii) for mii in available_miis.values()]))
+    if is_ffa:
+        teams = [("FFA", [mii_data for _, team_miis in teams for mii_data in team_miis])]
+    return not is_ffa, teams
+
+def get_mii_footer_name(mii: Mii.Mii) -> str:
+    if mii.name_changed() or mii.lounge_name == "":
+        return UtilityFunctions.clean_for_output(mii.display_name)
+    return mii.lounge_name
+
+#Takes the result of get_mii_footer_teams. Runs on the image workers: the miis are only used to read (or write) their table pictures.
+#Returns the table (numpy image) with the miis added, or None if they couldn't be added
+def add_miis_to_table(mii_footer_teams: Tuple[bool, List[Tuple[str, List[Tuple[str, Mii.Mii]]]]], table_cv2: np.ndarray) -> np.ndarray:
     if common.MIIS_ON_TABLE_DISABLED:
-        return True
-    extension_reflect, mii_footer = get_footer_with_miis(channel_bot, table_data)
-    return add_autotable_footer(mii_footer, table_image_path=table_image_path, out_image_path=out_image_path, extension_should_reflect=extension_reflect)
+        return table_cv2
+    extension_reflect, mii_footer = get_footer_with_miis(mii_footer_teams)
+    return add_autotable_footer(mii_footer, table_cv2, extension_should_reflect=extension_reflect)
     
 
-def get_footer_with_miis(channel_bot:ChannelBot, table_data:List[Tuple[str, List[Tuple[str, Tuple[str, int]]]]]):
+def get_footer_with_miis(mii_footer_teams: Tuple[bool, List[Tuple[str, List[Tuple[str, Mii.Mii]]]]]):
+    extension_should_reflect, teams = mii_footer_teams
     team_footers = []
-    extension_should_reflect = not channel_bot.getWar().is_ffa()
-    if channel_bot.getWar().is_ffa():
-        all_miis = {}
-        for team_tag, team_data in table_data["teams"].items():
-            available_miis = channel_bot.room.get_available_miis_dict([fc for fc in team_data["players"]])
-            for mii_key, mii_value in available_miis.items():
-                all_miis[mii_key] = mii_value
-        if len(all_miis) > 0:
-            team_footers.append(("FFA", generate_footer_section_for_team(all_miis, "FFA")))
-    else:
-        for team_tag, team_data in table_data["teams"].items():
-            available_miis = channel_bot.room.get_available_miis_dict([fc for fc in team_data["players"]])
-            should_add_left_border = len(team_footers) > 0 #There's already one team footer, so add left border
-            if len(available_miis) > 0:
-                team_footers.append((team_tag, generate_footer_section_for_team(available_miis, team_tag, add_left_border=should_add_left_border)))
+    for team_tag, team_miis in teams:
+        should_add_left_border = len(team_footers) > 0 #There's already one team footer, so add left border
+        if len(team_miis) > 0:
+            team_footers.append((team_tag, generate_footer_section_for_team(team_miis, team_tag, add_left_border=should_add_left_border)))
         
     if len(team_footers) > 0:
         total_footer = np.concatenate([tf[1] for tf in team_footers], axis=1)
@@ -179,7 +293,7 @@ def get_blank_autotable_footer(height=FOOTER_HEIGHT, color=common.DEFAULT_FOOTER
     return create_numpy_image_with_color(dimensions=(height, MINIMUM_TABLE_WIDTH), color=color)
 
 
-def generate_footer_section_for_team(miis: Dict[str, Mii.Mii], team_tag="No Tag", height=FOOTER_HEIGHT, background_color=common.DEFAULT_FOOTER_COLOR, forced_mii_dimension=common.MII_SIZE_FOR_TABLE, add_left_border=False):
+def generate_footer_section_for_team(miis: List[Tuple[str, Mii.Mii]], team_tag="No Tag", height=FOOTER_HEIGHT, background_color=common.DEFAULT_FOOTER_COLOR, forced_mii_dimension=common.MII_SIZE_FOR_TABLE, add_left_border=False):
     mii_dimension = forced_mii_dimension
     mii_padding_inside = MII_PADDING_INSIDE_SECTION
     mii_padding_outside_left = MII_PADDING_SECTION_LEFT
@@ -192,7 +306,7 @@ def generate_footer_section_for_team(miis: Dict[str, Mii.Mii], team_tag="No Tag"
     blank_footer_background_array = create_numpy_image_with_color(dimensions=(height, section_width), color=background_color)
 
     #Place each mii cv2 in correct location on blank footer background array
-    for index, mii in enumerate(miis.values()):
+    for index, (_, mii) in enumerate(miis):
         mii_start_location_x = mii_padding_outside_left + (index * (mii_dimension + mii_padding_inside))
         mii_end_location_x = mii_start_location_x + mii_dimension
         mii_start_location_y = height - mii_dimension
@@ -209,39 +323,18 @@ def generate_footer_section_for_team(miis: Dict[str, Mii.Mii], team_tag="No Tag"
     pil_image = Image.fromarray(blank_footer_background_array)
     canvas_for_text = ImageDraw.Draw(pil_image)
     #Put mii names on footer, above the mii pictures
-    for index, mii in enumerate(miis.values()):
-        if mii.name_changed() or mii.lounge_name == "":
-            mii_name = UtilityFunctions.clean_for_output(mii.display_name)
-        else:
-            mii_name = mii.lounge_name
-
+    for index, (mii_name, _) in enumerate(miis):
         mii_name_start_location_x = mii_padding_outside_left + (index * (mii_dimension + mii_padding_inside))
         mii_name_end_location_x = mii_name_start_location_x + mii_dimension
         mii_name_start_location_y = MII_NAME_BASE_Y_LOCATION
         
         actual_mii_picture_width = mii_dimension + mii_padding_inside
-        mii_font_size = 20
         max_mii_name_height = MII_NAME_TEXT_MAX_HEIGHT
         should_increase_mii_name_size = any(True for letter in MII_NAME_CHAR_SET_TO_INCREASE_SIZE if letter in mii_name)
         if should_increase_mii_name_size:
             max_mii_name_height += 4
-        mii_font = ImageFont.truetype(DEFAULT_MII_NAME_FONT, mii_font_size)
-        left, top, right, bottom = mii_font.getbbox(mii_name)
-        mii_name_width = right - left
-        mii_name_height = bottom - top
-        for _ in range(MAX_FONT_ITERATIONS):
-            if mii_name_width > (actual_mii_picture_width - MII_NAME_WIDTH_PADDING) and mii_name_height <= max_mii_name_height:
-                #should_increase_mii_name_size = True
-                pass
-            if mii_name_width <= (actual_mii_picture_width - MII_NAME_WIDTH_PADDING) and mii_name_height <= max_mii_name_height:
-                break
-                 
-            # iterate until the text size is just larger than the criteria
-            mii_font_size -= 1
-            mii_font = ImageFont.truetype(DEFAULT_MII_NAME_FONT, mii_font_size)
-            left, top, right, bottom = mii_font.getbbox(mii_name)
-            mii_name_width = right - left
-            mii_name_height = bottom - top
+        mii_font_size, mii_name_width, mii_name_height = fit_font_size(DEFAULT_MII_NAME_FONT, mii_name, MII_NAME_FONT_SIZE, actual_mii_picture_width - MII_NAME_WIDTH_PADDING, max_mii_name_height, max(1, MII_NAME_FONT_SIZE - MAX_FONT_ITERATIONS))
+        mii_font = get_font(DEFAULT_MII_NAME_FONT, mii_font_size)
             
         mii_name_padding_width = mii_name_end_location_x - mii_name_start_location_x - mii_name_width
         mii_name_padding_height = MAX_MII_NAME_HEIGHT_BOX - mii_name_height 
@@ -254,24 +347,12 @@ def generate_footer_section_for_team(miis: Dict[str, Mii.Mii], team_tag="No Tag"
     
     #Put team name on footer, centered above mii names
     team_tag = UtilityFunctions.clean_for_output(team_tag)
-    team_tag_font_size = 30
     _team_tag_max_height = TEAM_TAG_TEXT_MAX_HEIGHT
     should_increase_team_tag_size = any(True for letter in TEAM_TAG_CHAR_SET_TO_INCREASE_SIZE if letter in team_tag)
     if should_increase_team_tag_size:
         _team_tag_max_height += 4
-    team_tag_font = ImageFont.truetype(DEFAULT_TEAM_TAG_FONT, team_tag_font_size)
-    left, top, right, bottom = team_tag_font.getbbox(team_tag)
-    team_tag_width = right - left
-    team_tag_height = bottom - top
-    for _ in range(MAX_FONT_ITERATIONS):
-        if team_tag_width <= (section_width - TEAM_TAG_WIDTH_PADDING) and team_tag_height <= _team_tag_max_height:
-            break
-        # iterate until the text size is just larger than the criteria
-        team_tag_font_size -= 1
-        team_tag_font = ImageFont.truetype(DEFAULT_TEAM_TAG_FONT, team_tag_font_size)
-        left, top, right, bottom = team_tag_font.getbbox(team_tag)
-        team_tag_width = right - left
-        team_tag_height = bottom - top
+    team_tag_font_size, team_tag_width, team_tag_height = fit_font_size(DEFAULT_TEAM_TAG_FONT, team_tag, TEAM_TAG_FONT_SIZE, section_width - TEAM_TAG_WIDTH_PADDING, _team_tag_max_height, max(1, TEAM_TAG_FONT_SIZE - MAX_FONT_ITERATIONS))
+    team_tag_font = get_font(DEFAULT_TEAM_TAG_FONT, team_tag_font_size)
         
     #Compute location of team name
     team_tag_padding_height = MAX_TEAM_TAG_HEIGHT_BOX - team_tag_height
@@ -291,49 +372,22 @@ def generate_footer_section_for_team(miis: Dict[str, Mii.Mii], team_tag="No Tag"
         
     return blank_footer_background_array
         
+#Takes a table (numpy image) and returns it with the autogenerated header and errors/no errors/edits header on top, or None if the headers couldn't be added
 @TimerDebuggers.timer
-def add_autotable_header(errors=True, table_image_path="TEST_TABLE.png", autogenerate_image_path=AUTOGENERATED_HEADER_PATH, errors_image_path=ERRORS_HEADER_PATH, no_errors_image_path=NO_ERRORS_HEADER_PATH, out_image_path="combined_test.png", edits=False, edits_image_path=EDITS_HEADER_PATH):
-    autogenerate_header_cv2 = cv2.imread(autogenerate_image_path)
-    autogenerate_extend = autogenerate_header_cv2[0][0]
-    table_cv2 = cv2.imread(table_image_path)
-    
-    middle_header_cv2 = None
+def add_autotable_header(table_cv2: np.ndarray, errors=True, autogenerate_image_path=AUTOGENERATED_HEADER_PATH, errors_image_path=ERRORS_HEADER_PATH, no_errors_image_path=NO_ERRORS_HEADER_PATH, edits=False, edits_image_path=EDITS_HEADER_PATH) -> np.ndarray:
     if edits:
-        middle_header_cv2 = cv2.imread(edits_image_path)
+        middle_header_path = edits_image_path
     elif errors:
-        middle_header_cv2 = cv2.imread(errors_image_path)
+        middle_header_path = errors_image_path
     else:
-        middle_header_cv2 = cv2.imread(no_errors_image_path)
-    middle_header_extend = middle_header_cv2[0][0]
-    
-    autogenerate_header_height = len(autogenerate_header_cv2)
-    autogenerate_header_width = len(autogenerate_header_cv2[0])
-    middle_header_height = len(middle_header_cv2)
-    middle_header_width = len(middle_header_cv2[0])
+        middle_header_path = no_errors_image_path
+
     table_width = len(table_cv2[0])
+    autogenerate_header_cv2 = get_extended_header_image(autogenerate_image_path, table_width)
+    if autogenerate_header_cv2 is None:
+        return None
+    middle_header_cv2 = get_extended_header_image(middle_header_path, table_width)
+    if middle_header_cv2 is None:
+        return None
     
-    add_left_autogenerate = int((table_width - autogenerate_header_width)/2)
-    add_right_autogenerate = int(table_width - (add_left_autogenerate + autogenerate_header_width))
-    
-    add_left_middle = int((table_width - middle_header_width)/2)
-    add_right_middle = int(table_width - (add_left_middle + middle_header_width))
-    
-    if add_left_autogenerate > 0 and add_right_autogenerate > 0: 
-        left_data = np.full((autogenerate_header_height, add_left_autogenerate, 3), autogenerate_extend)
-        right_data = np.full((autogenerate_header_height, add_right_autogenerate, 3), autogenerate_extend)
-        autogenerate_header_cv2 = np.concatenate((left_data, autogenerate_header_cv2, right_data), axis=1)
-    elif add_left_autogenerate < 0 or add_right_autogenerate < 0:
-        return False
-    
-    if add_left_middle > 0 and add_right_middle > 0:
-        left_data = np.full((middle_header_height, add_left_middle, 3), middle_header_extend)
-        right_data = np.full((middle_header_height, add_right_middle, 3), middle_header_extend)
-        middle_header_cv2 = np.concatenate((left_data, middle_header_cv2, right_data), axis=1)
-    
-    elif add_left_middle < 0 or add_right_middle < 0:
-        return False
-    
-    total_combined = np.concatenate((autogenerate_header_cv2, middle_header_cv2, table_cv2), axis=0)
-    cv2.imwrite(out_image_path, total_combined)
-    return True
-
+    return np.concatenate((autogenerate_header_cv2, middle_header_cv2, table_cv2), axis=0)
@@ -0,0 +1,121 @@
+'''
+Created on Oct 19, 2026
+
+@author: willg
+
+This module runs the CPU heavy image work (OpenCV and PIL) - table picture decoding, combining headers and miis with the table picture,
+encoding, and resizing and cropping mii pictures - on a small, dedicated thread pool so that it doesn't block the event loop.
+
+The image work is capped. A command that makes a table picture reserves a slot (see reserve_capacity) before it downloads anything, and keeps it
+until its last image job is done - its jobs run one after another, so each command has at most one job queued. Background jobs take a slot while
+they're queued or running. When every slot is taken, commands that need image work are rejected with TableBotExceptions.ImageQueueSaturated
+instead of queueing more work behind the jobs that are already waiting.
+'''
+import asyncio
+import contextlib
+import contextvars
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import TableBotExceptions
+
+IMAGE_WORKER_COUNT = 3
+#Maximum number of commands making table pictures plus background image jobs (waiting for a worker or running) before new table pictures are refused
+MAX_PENDING_IMAGE_JOBS = 12
+
+IMAGE_EXECUTOR = ThreadPoolExecutor(max_workers=IMAGE_WORKER_COUNT, thread_name_prefix="ImageWork")
+
+#These are only ever modified on the event loop, so they don't need a lock
+#Image jobs waiting for a worker or running
+pending_jobs = 0
+#Commands holding a slot (see reserve_capacity), and the queued jobs that aren't run in one
+reserved_slots = 0
+unreserved_jobs = 0
+#Set in the task of a command that holds a slot, so that its jobs run in that slot instead of taking another
+holds_reserved_slot = contextvars.ContextVar("holds_reserved_slot", default=False)
+stats = {"submitted": 0,
+         "completed": 0,
+         "failed": 0,
+         "rejected": 0,
+         "max_pending": 0,
+         "total_wait_time": 0.0,
+         "total_run_time": 0.0}
+
+
+def queue_depth() -> int:
+    '''Number of image jobs that are either waiting for a worker or running'''
+    return pending_jobs
+
+def is_saturated() -> bool:
+    return reserved_slots + unreserved_jobs >= MAX_PENDING_IMAGE_JOBS
+
+def ensure_capacity():
+    '''Raises ImageQueueSaturated if every image slot is taken'''
+    if is_saturated():
+        stats["rejected"] += 1
+        raise TableBotExceptions.ImageQueueSaturated(f"{reserved_slots} table pictures and {unreserved_jobs} image jobs are already queued")
+
+@contextlib.contextmanager
+def reserve_capacity():
+    '''Reserves an image slot for every image job the command runs inside this block, and releases it when the block is left.
+    Raises ImageQueueSaturated if every slot is taken. Commands enter it before doing any expensive work (such as downloading the table picture)
+    so that the user is told right away instead of after the download.'''
+    global reserved_slots
+    if holds_reserved_slot.get():
+        yield
+        return
+    ensure_capacity()
+    reserved_slots += 1
+    token = holds_reserved_slot.set(True)
+    try:
+        yield
+    finally:
+        holds_reserved_slot.reset(token)
+        reserved_slots -= 1
+
+def __timed_job(func, submitted_at, *args, **kwargs):
+    started_at = time.perf_counter()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        finished_at = time.perf_counter()
+        #These are only read for reporting, so a slightly stale total from another thread is fine
+        stats["total_wait_time"] += started_at - submitted_at
+        stats["total_run_time"] += finished_at - started_at
+
+async def run_image_job(func, *args, raise_if_saturated=True, **kwargs):
+    '''Runs func(*args, **kwargs) on the image executor and returns its result.
+    Inside reserve_capacity, the job runs in the command's slot. Otherwise it takes a slot of its own while it's queued or running, and if
+    raise_if_saturated is True and every slot is taken, ImageQueueSaturated is raised instead. Background work (such as preparing mii pictures)
+    should pass False: it still waits for a worker, but is never refused.'''
+    global pending_jobs, unreserved_jobs
+    in_reserved_slot = holds_reserved_slot.get()
+    if not in_reserved_slot:
+        if raise_if_saturated:
+            ensure_capacity()
+        unreserved_jobs += 1
+    pending_jobs += 1
+    stats["submitted"] += 1
+    stats["max_pending"] = max(stats["max_pending"], pending_jobs)
+    loop = asyncio.get_running_loop()
+    try:
+        result = await loop.run_in_executor(IMAGE_EXECUTOR, functools.partial(__timed_job, func, time.perf_counter(), *args, **kwargs))
+    except Exception:
+        stats["failed"] += 1
+        raise
+    else:
+        stats["completed"] += 1
+        return result
+    finally:
+        pending_jobs -= 1
+        if not in_reserved_slot:
+            unreserved_jobs -= 1
+
+def get_stats_str() -> str:
+    finished = stats["completed"] + stats["failed"]
+    average_wait = 0.0 if finished == 0 else stats["total_wait_time"] / finished
+    average_run = 0.0 if finished == 0 else stats["total_run_time"] / finished
+    return f"""**Image queue:** {reserved_slots + unreserved_jobs}/{MAX_PENDING_IMAGE_JOBS} slots taken ({reserved_slots} table pictures), {pending_jobs} jobs pending ({IMAGE_WORKER_COUNT} workers), max pending: {stats['max_pending']}
+Submitted: {stats['submitted']} | Completed: {stats['completed']} | Failed: {stats['failed']} | Rejected (queue full): {stats['rejected']}
+Average wait: {average_wait*1000:.1f}ms | Average run time: {average_run*1000:.1f}ms"""
@@ -0,0 +1,59 @@
+'''
+Created on Oct 19, 2026
+
+@author: willg
+
+Tests that ImageWorkers' slots limit the image work: a command holds one slot for all of its jobs, and is refused when every slot is taken.
+'''
+import asyncio
+import threading
+import unittest
+
+import ImageWorkers
+import TableBotExceptions
+
+
+class ImageSlotTests(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.release_jobs = threading.Event()
+
+    async def asyncTearDown(self):
+        self.release_jobs.set()
+
+    async def make_table_picture(self, started: asyncio.Event, job_count=3):
+        with ImageWorkers.reserve_capacity():
+            started.set()
+            for _ in range(job_count):
+                await ImageWorkers.run_image_job(self.release_jobs.wait, 10)
+
+    async def test_commands_hold_one_slot_for_all_of_their_jobs(self):
+        started_events = [asyncio.Event() for _ in range(ImageWorkers.MAX_PENDING_IMAGE_JOBS)]
+        commands = [asyncio.create_task(self.make_table_picture(started)) for started in started_events]
+        for started in started_events:
+            await started.wait()
+        self.assertEqual(ImageWorkers.reserved_slots, ImageWorkers.MAX_PENDING_IMAGE_JOBS)
+        #Every slot is taken by a command that hasn't finished its jobs, so the next command and unreserved jobs are refused
+        with self.assertRaises(TableBotExceptions.ImageQueueSaturated):
+            with ImageWorkers.reserve_capacity():
+                pass
+        with self.assertRaises(TableBotExceptions.ImageQueueSaturated):
+            await ImageWorkers.run_image_job(int)
+        self.release_jobs.set()
+        await asyncio.gather(*commands)
+        self.assertEqual((ImageWorkers.reserved_slots, ImageWorkers.unreserved_jobs, ImageWorkers.queue_depth()), (0, 0, 0))
+
+    async def test_background_jobs_take_slots_but_are_never_refused(self):
+        background_jobs = [asyncio.create_task(ImageWorkers.run_image_job(self.release_jobs.wait, 10, raise_if_saturated=False))
+                           for _ in range(ImageWorkers.MAX_PENDING_IMAGE_JOBS + 1)]
+        await asyncio.sleep(0)
+        self.assertTrue(ImageWorkers.is_saturated())
+        with self.assertRaises(TableBotExceptions.ImageQueueSaturated):
+            with ImageWorkers.reserve_capacity():
+                pass
+        self.release_jobs.set()
+        await asyncio.gather(*background_jobs)
+        self.assertFalse(ImageWorkers.is_saturated())
+
+
+if __name__ == '__main__':
+    unittest.main()
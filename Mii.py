@@ -4,7 +4,6 @@ Created on Apr 3, 2021
 @author: willg
 '''
 from datetime import date
-from kaitaistruct import KaitaiStruct, KaitaiStream, BytesIO
 from discord import Embed, File
 import UtilityFunctions
 import os as operatingsystem
@@ -13,8 +12,12 @@ import UserDataProcessing
 import numpy as np
 import common
 import humanize
+import MiiDecoder
+import MiiImageCache
 
-class Mii(KaitaiStruct):
+COUNTRY_ID_OFFSET = 88
+
+class Mii:
 
     mii_color_dict = {0:16458773, #dark red
                   1:16741914, #orange
@@ -31,17 +34,14 @@ class Mii(KaitaiStruct):
                   }
 
 
-    def __init__(self, _io, mii_data_hex_str, folder_path, file_name, FC, _parent=None, _root=None):
+    def __init__(self, mii_bytes, mii_data_hex_str, folder_path, file_name, FC):
         self.mii_data_hex_str = mii_data_hex_str
         self.file_name = file_name 
         self.folder_path = folder_path
         self.FC = FC
         self.lounge_name = UserDataProcessing.lounge_get(self.FC)
         self.cropped = False
-        self._io = KaitaiStream(BytesIO(_io))
-        self._parent = _parent
-        self._root = _root if _root else self
-        self._read()
+        self._read(mii_bytes)
         self.display_name = self.mii_name
         self.name_change = False
     
@@ -57,83 +57,15 @@ class Mii(KaitaiStruct):
     def name_changed(self):
         return self.name_change
 
-    def _read(self):
-        self.invalid = self._io.read_bits_int_be(1) != 0
-        self.gender = self._io.read_bits_int_be(1) != 0
-        self.birth_month = self._io.read_bits_int_be(4)
-        self.birth_day = self._io.read_bits_int_be(5)
-        self.favorite_color = self._io.read_bits_int_be(4)
-        self.favorite = self._io.read_bits_int_be(1) != 0
-        self._io.align_to_byte()
-        self.mii_name = self._io.read_bytes(20).decode(u"utf-16be")
+    def _read(self, mii_bytes):
+        mii = MiiDecoder.decode(mii_bytes)
+        for field in MiiDecoder.MiiRecord.__slots__:
+            setattr(self, field, getattr(mii, field))
         self.mii_name, _, _ = self.mii_name.partition('\x00')
         self.mii_name = self.mii_name.strip()
-        self.body_height = self._io.read_u1()
-        self.body_weight = self._io.read_u1()
-        self.avatar_id = [None] * (4)
-        for i in range(4):
-            self.avatar_id[i] = self._io.read_u1()
-
-        self.client_id = [None] * (4)
-        for i in range(4):
-            self.client_id[i] = self._io.read_u1()
-
-        self.face_type = self._io.read_bits_int_be(3)
-        self.face_color = self._io.read_bits_int_be(3)
-        self.facial_feature = self._io.read_bits_int_be(4)
-        self.unknown = self._io.read_bits_int_be(3)
-        self.mingle = self._io.read_bits_int_be(1) != 0
-        self.unknown_2 = self._io.read_bits_int_be(1) != 0
-        self.downloaded = self._io.read_bits_int_be(1) != 0
-        self.hair_type = self._io.read_bits_int_be(7)
-        self.hair_color = self._io.read_bits_int_be(3)
-        self.hair_flip = self._io.read_bits_int_be(1) != 0
-        self.unknown_3 = self._io.read_bits_int_be(5)
-        self.eyebrow_type = self._io.read_bits_int_be(5)
-        self.unknown_4 = self._io.read_bits_int_be(1) != 0
-        self.eyebrow_rotation = self._io.read_bits_int_be(4)
-        self.unknown_5 = self._io.read_bits_int_be(6)
-        self.eyebrow_color = self._io.read_bits_int_be(3)
-        self.eyebrow_size = self._io.read_bits_int_be(4)
-        self.eyebrow_vertical = self._io.read_bits_int_be(5)
-        self.eyebrow_horizontal = self._io.read_bits_int_be(4)
-        self.eye_type = self._io.read_bits_int_be(6)
-        self.unknown_6 = self._io.read_bits_int_be(2)
-        self.eye_rotation = self._io.read_bits_int_be(3)
-        self.eye_vertical = self._io.read_bits_int_be(5)
-        self.eye_color = self._io.read_bits_int_be(3)
-        self.unknown_7 = self._io.read_bits_int_be(1) != 0
-        self.eye_size = self._io.read_bits_int_be(3)
-        self.eye_horizontal = self._io.read_bits_int_be(4)
-        self.unknown_8 = self._io.read_bits_int_be(5)
-        self.nose_type = self._io.read_bits_int_be(4)
-        self.nose_size = self._io.read_bits_int_be(4)
-        self.nose_vertical = self._io.read_bits_int_be(5)
-        self.unknown_9 = self._io.read_bits_int_be(3)
-        self.mouth_type = self._io.read_bits_int_be(5)
-        self.mouth_color = self._io.read_bits_int_be(2)
-        self.mouth_size = self._io.read_bits_int_be(4)
-        self.mouth_vertical = self._io.read_bits_int_be(5)
-        self.glasses_type = self._io.read_bits_int_be(4)
-        self.glasses_color = self._io.read_bits_int_be(3)
-        self.unknown_10 = self._io.read_bits_int_be(1) != 0
-        self.glasses_size = self._io.read_bits_int_be(3)
-        self.glasses_vertical = self._io.read_bits_int_be(5)
-        self.facial_hair_mustache = self._io.read_bits_int_be(2)
-        self.facial_hair_beard = self._io.read_bits_int_be(2)
-        self.facial_hair_color = self._io.read_bits_int_be(3)
-        self.facial_hair_size = self._io.read_bits_int_be(4)
-        self.facial_hair_vertical = self._io.read_bits_int_be(5)
-        self.mole_enable = self._io.read_bits_int_be(1) != 0
-        self.mole_size = self._io.read_bits_int_be(4)
-        self.mole_vertical = self._io.read_bits_int_be(5)
-        self.mole_horizontal = self._io.read_bits_int_be(5)
-        self.unknown_11 = self._io.read_bits_int_be(1) != 0
-        self._io.align_to_byte()
-        self.creator_name = (self._io.read_bytes(20)).decode(u"utf-16be").replace("\x00","")
-        self.creator_name, _, _ = self.creator_name.partition('\x00')
-        self._io.read_bytes(14)
-        self.country_id = self._io.read_u1()
+        self.creator_name = self.creator_name.replace("\x00","")
+        #The country is stored in the data SAKE gives us after the mii itself
+        self.country_id = mii_bytes[COUNTRY_ID_OFFSET]
         self.country_code = COUNTRY_CODES.get(self.country_id, None)
         
     def get_mii_embed(self):
@@ -214,12 +146,16 @@ class Mii(KaitaiStruct):
         self.__remove_table_mii_picture__()
         
     def output_table_mii_to_disc(self):
+        cache_key = MiiImageCache.get_table_mii_picture_key(self.mii_data_hex_str, common.DEFAULT_FOOTER_COLOR, common.MII_SIZE_FOR_TABLE)
+        if MiiImageCache.copy_to(cache_key, self.get_mii_picture_path_for_table()):
+            return True
         if not self.main_mii_picture_exists():
             return False
         try:
             filled_mii_image = self.__fill_transparent_background_with_color__(background_color=common.DEFAULT_FOOTER_COLOR)
             resized_mii_image = self.__resize_mii_image__(mii_image=filled_mii_image, width=common.MII_SIZE_FOR_TABLE, height=common.MII_SIZE_FOR_TABLE)
             cv2.imwrite(self.get_mii_picture_path_for_table(), resized_mii_image)
+            MiiImageCache.store_file(cache_key, self.get_mii_picture_path_for_table())
             return True
         except:
             return False
@@ -0,0 +1,142 @@
+'''
+Created on Oct 19, 2026
+
+@author: willg
+
+SQLite cache of the raw mii data pulled from SAKE, keyed by FC.
+
+The mii data used to only be cached in memory, so after every restart each table had to pull the miis of all of its players from SAKE again.
+Every mii is now saved in common.MII_DATA_CACHE_DATABASE_FILE with the time it was pulled. MiiPuller decides whether a cached mii is
+recent enough to use (see MiiPuller.cache_time_expired) - miis that are too old are pulled again, but are kept so they can still be used
+when SAKE can't be reached. Miis that haven't been pulled for MII_DATA_MAX_AGE are removed by remove_old_mii_datas.
+
+The queries are small (a room has at most 12 players), but they can still wait on the disk or on db_lock, so MiiPuller, BadWolfBot and the
+image queue command run them in the default executor rather than on the event loop's thread.
+'''
+import sqlite3
+import threading
+import time
+from datetime import timedelta
+from typing import Dict, Iterable, Tuple
+
+import common
+
+MII_DATA_MAX_AGE = timedelta(days=30)
+#SQLite's default limit on the number of parameters in one query
+MAX_QUERY_PARAMETERS = 999
+#(upper bound, label) of each bucket shown in the age distribution
+AGE_BUCKETS = [(timedelta(minutes=10), "<10m"),
+               (timedelta(hours=1), "<1h"),
+               (timedelta(days=1), "<1d"),
+               (timedelta(days=7), "<7d"),
+               (None, "older")]
+
+MII_DATA_CACHE_SCHEMA = """CREATE TABLE IF NOT EXISTS Mii_Data(
+    fc TEXT PRIMARY KEY NOT NULL,
+    mii_data BLOB NOT NULL,
+    pulled_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS mii_data_pulled_at ON Mii_Data(pulled_at);"""
+
+db_lock = threading.Lock()
+db_connection = None
+stats = {"hits": 0,
+         "stale": 0,
+         "misses": 0,
+         "stores": 0,
+         "removed": 0}
+
+
+def get_connection() -> sqlite3.Connection:
+    global db_connection
+    if db_connection is None:
+        db_connection = sqlite3.connect(common.MII_DATA_CACHE_DATABASE_FILE, check_same_thread=False)
+        db_connection.execute("PRAGMA journal_mode=WAL")
+        db_connection.executescript(MII_DATA_CACHE_SCHEMA)
+    return db_connection
+
+def load():
+    with db_lock:
+        get_connection()
+
+def close():
+    global db_connection
+    with db_lock:
+        if db_connection is not None:
+            db_connection.close()
+            db_connection = None
+
+
+def get_mii_datas(fcs: Iterable[str], max_age: timedelta) -> Dict[str, Tuple[bytes, str, float]]:
+    '''Returns a dictionary of FC to (mii bytes, mii hex, time pulled) for the given FCs that are cached, no matter how old they are.
+    Miis older than max_age are only counted as stale (not as hits), since they're only used when SAKE can't be reached'''
+    fcs = list(set(fcs))
+    result = {}
+    oldest_fresh_time = time.time() - max_age.total_seconds()
+    with db_lock:
+        connection = get_connection()
+        for i in range(0, len(fcs), MAX_QUERY_PARAMETERS):
+            fc_chunk = fcs[i:i+MAX_QUERY_PARAMETERS]
+            query = f"SELECT fc, mii_data, pulled_at FROM Mii_Data WHERE fc IN ({', '.join('?' * len(fc_chunk))})"
+            for fc, mii_bytes, pulled_at in connection.execute(query, fc_chunk):
+                result[fc] = (mii_bytes, mii_bytes.hex(), pulled_at)
+        fresh_count = sum(1 for _, _, pulled_at in result.values() if pulled_at >= oldest_fresh_time)
+        stats["hits"] += fresh_count
+        stats["stale"] += len(result) - fresh_count
+        stats["misses"] += len(fcs) - len(result)
+    return result
+
+def store_mii_datas(mii_datas: Dict[str, Tuple[bytes, str]], pulled_at=None):
+    '''Saves the given FC to (mii bytes, mii hex) mii datas, which were just pulled from SAKE'''
+    if len(mii_datas) == 0:
+        return
+    if pulled_at is None:
+        pulled_at = time.time()
+    with db_lock:
+        connection = get_connection()
+        with connection:
+            connection.executemany("INSERT OR REPLACE INTO Mii_Data (fc, mii_data, pulled_at) VALUES (?, ?, ?)",
+                                   [(fc, bytes(mii_bytes), pulled_at) for fc, (mii_bytes, _) in mii_datas.items()])
+        stats["stores"] += len(mii_datas)
+
+def remove_old_mii_datas(max_age=None):
+    '''Removes the miis that haven't been pulled from SAKE for longer than max_age'''
+    if max_age is None:
+        max_age = MII_DATA_MAX_AGE
+    with db_lock:
+        connection = get_connection()
+        with connection:
+            removed = connection.execute("DELETE FROM Mii_Data WHERE pulled_at < ?", (time.time() - max_age.total_seconds(),)).rowcount
+        stats["removed"] += removed
+
+
+def get_age_distribution() -> Dict[str, int]:
+    '''Returns the number of cached miis in each age bucket'''
+    current_time = time.time()
+    case_parts = []
+    parameters = []
+    for max_age, label in AGE_BUCKETS:
+        if max_age is None:
+            case_parts.append(f"ELSE '{label}'")
+        else:
+            case_parts.append(f"WHEN pulled_at >= ? THEN '{label}'")
+            parameters.append(current_time - max_age.total_seconds())
+    query = f"SELECT CASE {' '.join(case_parts)} END AS age_bucket, COUNT(*) FROM Mii_Data GROUP BY age_bucket"
+    with db_lock:
+        bucket_counts = dict(get_connection().execute(query, parameters).fetchall())
+    return {label: bucket_counts.get(label, 0) for _, label in AGE_BUCKETS}
+
+def get_size() -> Tuple[int, int]:
+    '''Returns the number of cached miis and the size of their data in bytes'''
+    with db_lock:
+        count, data_bytes = get_connection().execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(mii_data)), 0) FROM Mii_Data").fetchone()
+    return count, data_bytes
+
+def get_stats_str() -> str:
+    count, data_bytes = get_size()
+    lookups = stats["hits"] + stats["stale"] + stats["misses"]
+    hit_rate = "n/a" if lookups == 0 else f"{stats['hits'] / lookups:.1%}"
+    age_distribution = " | ".join(f"{label}: {bucket_count}" for label, bucket_count in get_age_distribution().items())
+    return f"""**Mii data cache:** {count} miis, {data_bytes / 1024:.1f} KB
+Ages: {age_distribution}
+Hits: {stats['hits']} | Stale: {stats['stale']} | Misses: {stats['misses']} | Hit rate: {hit_rate} | Stored: {stats['stores']} | Removed: {stats['removed']}"""
@@ -0,0 +1,117 @@
+'''
+Created on Oct 19, 2026
+
+@author: willg
+
+Decodes the 74 byte Wii mii format (the same format as gen1_wii.Gen1Wii, the Kaitai Struct parser this replaces).
+
+The whole mii is unpacked with one struct call, and the bit fields are taken out of the unpacked integers with shifts and masks,
+instead of being read from the stream one bit field at a time. Field names and values are exactly the same as Gen1Wii's:
+names are decoded as-is (trailing null characters are not stripped) and single bit fields are bools.
+'''
+import struct
+from typing import Union
+
+MII_DATA_SIZE = 74
+#flags, mii name, body height, body weight, avatar id, client id, face, hair, eyebrows, eyes, nose, mouth, glasses, facial hair, mole, creator name
+MII_STRUCT = struct.Struct(">H20sBB4s4sHHIIHHHHH20s")
+
+
+class MiiRecord:
+    __slots__ = ("invalid", "gender", "birth_month", "birth_day", "favorite_color", "favorite",
+                 "mii_name", "body_height", "body_weight", "avatar_id", "client_id",
+                 "face_type", "face_color", "facial_feature", "unknown", "mingle", "unknown_2", "downloaded",
+                 "hair_type", "hair_color", "hair_flip", "unknown_3",
+                 "eyebrow_type", "unknown_4", "eyebrow_rotation", "unknown_5", "eyebrow_color", "eyebrow_size", "eyebrow_vertical", "eyebrow_horizontal",
+                 "eye_type", "unknown_6", "eye_rotation", "eye_vertical", "eye_color", "unknown_7", "eye_size", "eye_horizontal", "unknown_8",
+                 "nose_type", "nose_size", "nose_vertical", "unknown_9",
+                 "mouth_type", "mouth_color", "mouth_size", "mouth_vertical",
+                 "glasses_type", "glasses_color", "unknown_10", "glasses_size", "glasses_vertical",
+                 "facial_hair_mustache", "facial_hair_beard", "facial_hair_color", "facial_hair_size", "facial_hair_vertical",
+                 "mole_enable", "mole_size", "mole_vertical", "mole_horizontal", "unknown_11",
+                 "creator_name")
+
+    def __repr__(self):
+        return f"MiiRecord(mii_name={self.mii_name!r}, creator_name={self.creator_name!r})"
+
+
+def decode(mii_data: Union[bytes, bytearray, memoryview]) -> MiiRecord:
+    '''Decodes the first MII_DATA_SIZE bytes of the given mii data. Raises struct.error if there are fewer bytes than that.'''
+    (flags, mii_name, body_height, body_weight, avatar_id, client_id, face, hair,
+     eyebrows, eyes, nose, mouth, glasses, facial_hair, mole, creator_name) = MII_STRUCT.unpack_from(mii_data)
+
+    mii = MiiRecord()
+    mii.invalid = flags & 0x8000 != 0
+    mii.gender = flags & 0x4000 != 0
+    mii.birth_month = (flags >> 10) & 0xF
+    mii.birth_day = (flags >> 5) & 0x1F
+    mii.favorite_color = (flags >> 1) & 0xF
+    mii.favorite = flags & 0x1 != 0
+    mii.mii_name = mii_name.decode("utf-16be")
+    mii.body_height = body_height
+    mii.body_weight = body_weight
+    mii.avatar_id = list(avatar_id)
+    mii.client_id = list(client_id)
+
+    mii.face_type = face >> 13
+    mii.face_color = (face >> 10) & 0x7
+    mii.facial_feature = (face >> 6) & 0xF
+    mii.unknown = (face >> 3) & 0x7
+    mii.mingle = face & 0x4 != 0
+    mii.unknown_2 = face & 0x2 != 0
+    mii.downloaded = face & 0x1 != 0
+
+    mii.hair_type = hair >> 9
+    mii.hair_color = (hair >> 6) & 0x7
+    mii.hair_flip = hair & 0x20 != 0
+    mii.unknown_3 = hair & 0x1F
+
+    mii.eyebrow_type = eyebrows >> 27
+    mii.unknown_4 = eyebrows & 0x4000000 != 0
+    mii.eyebrow_rotation = (eyebrows >> 22) & 0xF
+    mii.unknown_5 = (eyebrows >> 16) & 0x3F
+    mii.eyebrow_color = (eyebrows >> 13) & 0x7
+    mii.eyebrow_size = (eyebrows >> 9) & 0xF
+    mii.eyebrow_vertical = (eyebrows >> 4) & 0x1F
+    mii.eyebrow_horizontal = eyebrows & 0xF
+
+    mii.eye_type = eyes >> 26
+    mii.unknown_6 = (eyes >> 24) & 0x3
+    mii.eye_rotation = (eyes >> 21) & 0x7
+    mii.eye_vertical = (eyes >> 16) & 0x1F
+    mii.eye_color = (eyes >> 13) & 0x7
+    mii.unknown_7 = eyes & 0x1000 != 0
+    mii.eye_size = (eyes >> 9) & 0x7
+    mii.eye_horizontal = (eyes >> 5) & 0xF
+    mii.unknown_8 = eyes & 0x1F
+
+    mii.nose_type = nose >> 12
+    mii.nose_size = (nose >> 8) & 0xF
+    mii.nose_vertical = (nose >> 3) & 0x1F
+    mii.unknown_9 = nose & 0x7
+
+    mii.mouth_type = mouth >> 11
+    mii.mouth_color = (mouth >> 9) & 0x3
+    mii.mouth_size = (mouth >> 5) & 0xF
+    mii.mouth_vertical = mouth & 0x1F
+
+    mii.glasses_type = glasses >> 12
+    mii.glasses_color = (glasses >> 9) & 0x7
+    mii.unknown_10 = glasses & 0x100 != 0
+    mii.glasses_size = (glasses >> 5) & 0x7
+    mii.glasses_vertical = glasses & 0x1F
+
+    mii.facial_hair_mustache = facial_hair >> 14
+    mii.facial_hair_beard = (facial_hair >> 12) & 0x3
+    mii.facial_hair_color = (facial_hair >> 9) & 0x7
+    mii.facial_hair_size = (facial_hair >> 5) & 0xF
+    mii.facial_hair_vertical = facial_hair & 0x1F
+
+    mii.mole_enable = mole & 0x8000 != 0
+    mii.mole_size = (mole >> 11) & 0xF
+    mii.mole_vertical = (mole >> 6) & 0x1F
+    mii.mole_horizontal = (mole >> 1) & 0x1F
+    mii.unknown_11 = mole & 0x1 != 0
+
+    mii.creator_name = creator_name.decode("utf-16be")
+    return mii
@@ -0,0 +1,109 @@
+'''
+Created on Oct 19, 2026
+
+@author: willg
+
+Checks that MiiDecoder gives exactly the same result as the Kaitai Struct parser it replaced (gen1_wii.Gen1Wii),
+for a set of real miis pulled from SAKE and for miis with random bit fields, and benchmarks the two.
+
+Usage: python MiiDecoderTesting.py (runs the tests) or python MiiDecoderTesting.py --benchmark [--iterations 20000]
+'''
+import argparse
+import base64
+import random
+import struct
+import sys
+import timeit
+import unittest
+
+import MiiDecoder
+from gen1_wii import Gen1Wii
+
+#Real mii data taken from a SAKE response (this is the mii plus the extra data SAKE stores after it)
+REAL_MII_DATAS_B64 = ["QBYAeQB1AGkAYQB6AHUAAABuAGUANEAlh0aSUxjNd/YgBIpBcP3g2iByDMgAYZgPcLAAiiUFAAAAAAAAAAAAAAAAAAAAAAAAAAAM3AAYuzMGz77WUk1DSgEnAAAYEF5r",
+                   "wAAARABHJgUAbQBpAGwAYQAqAAAAAEAYhUqel2gZLqAgBH5AAb0osiAvDqAQaZgwZKMAiiUEAAAAAAAAAAAAAAAAAAAAAAAAAADvgwABtqrWzpVwUk1DSgEOAAAZUGOh",
+                   "wAoAQgBCMK0w4zDzMLsw6wAAAAAAAEBAhfj/fWT2RPwgBI4AAX0EtCBwDkAAYZhPeK8AiiUEAAAAAAAAAAAAAAAAAAAAAAAAAADlkAAPYr1GzpT2Uk1DSgEDAAAenmSA",
+                   "gBYAUwAxJccAQwBvAG8AawBpAGUAAEBAheIMUTjkx8sABHxgMX0moiBsKEASSbhNAIoAioUaAAAAAAAAAAAAAAAAAAAAAAAAAAASNgAQ6JUa31/4Uk1DRQAAAAAAW1NZ",
+                   "gBYAWgAtACAAAABpAAAAAABlAGwAbEBAhyI7VDqJcHkEBIEgUX0GpAiMCGAUSXhtZooAiiUEAAAAAAAAAAAAAAAAAAAAAAAAAABBvQAeyPuQ30exUk1DUGAFAAAq6APM",
+                   "wAAAUwAgAFAAcgBvAGQAaQBnAHkAAAwQghBI6UeoWGGEJzeIMuHOMCBQDoAAeJgQhOAAiiUEAEgAYQByAGwAZQB5AAAAAAAAAACAzQACjAdyz0sZUk1DUAAAAAAAW1NZ",
+                   "wBYAQwB5AG4AdABoAGkAYQAAAAAAAFAGh0WBp2vUYSkABBnAAb0oolxsYEATSZiNeIoAiiUEAAAAAAAAAAAAAAAAAAAAAAAAAADMmAADsVga3xtSUk1DRSsEAAAMVtNS",
+                   "QA0AUgBlAG0AaQAAAAAAAAAAAAAAAAAAh3OeezqF8zogBh/XuUAooiBxDGQQeJgQYMMAiiUEAAAAAAAAAAAAAAAAAAAAAAAAAACSfwAB7PVQ3rv7Uk1DUE4CAAAlWQmI",
+                   "gAAwczD8MGEw6TDWJgUAQgAAAAAAAEBAhtDMESevV/IABEJAMb0oogiMCEAUSbiNAIoAiiUEAAAAAAAAAAAAAAAAAAAAAAAAAAB61wAWDQ42379pUk1DSgENAAAZgmND",
+                   "gBYATgBZAAAAAAAAAAAAAAAAAAAAAEBAh0aJ61kXzOcABEIAMb0IogiMCEAUSbiNAIoAiiUEAAAAAAAAAAAAAAAAAAAAAAAAAAD8kgAVRpCWzx5KUk1DUDUJAAAdAR8u",
+                   "gBYAQgBpAHQAYwBoAFMAcABpAGMAYWBAht2PZH+/Lw8ABEpAMX0GohBsBGAVQZhNAIoAiiUEAAAAAAAAAAAAAAAAAAAAAAAAAABsMQABWzQGzqVYUk1DSgEOAAAZUGOh",
+                   "gBYAWABAAAAAAAAAAAAAAAAAAAAAAH8Ah2cOYBfUFcAABH9AMb0oogiMCEAUSbiNYIQAiiUEAAAAAAAAAAAAAAAAAAAAAAAAAACOOAAMoneyzqe6Uk1DUEEPAADrWHdx"]
+REAL_MII_DATAS = [base64.b64decode(mii_data) for mii_data in REAL_MII_DATAS_B64]
+RANDOM_MII_COUNT = 5000
+#Byte ranges of the mii name and the creator name, which are kept from the real miis so they stay valid UTF-16
+MII_NAME_BYTES = slice(2, 22)
+CREATOR_NAME_BYTES = slice(54, 74)
+DEFAULT_BENCHMARK_ITERATIONS = 20000
+
+
+def get_random_mii_datas(count: int, seed=0):
+    rng = random.Random(seed)
+    mii_datas = []
+    for i in range(count):
+        real_mii_data = REAL_MII_DATAS[i % len(REAL_MII_DATAS)]
+        mii_data = bytearray(rng.getrandbits(8) for _ in range(MiiDecoder.MII_DATA_SIZE))
+        mii_data[MII_NAME_BYTES] = real_mii_data[MII_NAME_BYTES]
+        mii_data[CREATOR_NAME_BYTES] = real_mii_data[CREATOR_NAME_BYTES]
+        mii_datas.append(bytes(mii_data))
+    return mii_datas
+
+
+class MiiDecoderTests(unittest.TestCase):
+    def assert_same_as_kaitai(self, mii_data: bytes):
+        kaitai_mii = Gen1Wii.from_bytes(mii_data)
+        decoded_mii = MiiDecoder.decode(mii_data)
+        for field in MiiDecoder.MiiRecord.__slots__:
+            kaitai_value = getattr(kaitai_mii, field)
+            decoded_value = getattr(decoded_mii, field)
+            self.assertEqual(decoded_value, kaitai_value, f"{field} differs for {mii_data.hex()}")
+            self.assertIs(type(decoded_value), type(kaitai_value), f"{field} has a different type for {mii_data.hex()}")
+
+    def test_real_miis(self):
+        for mii_data in REAL_MII_DATAS:
+            self.assert_same_as_kaitai(mii_data)
+
+    def test_random_miis(self):
+        for mii_data in get_random_mii_datas(RANDOM_MII_COUNT):
+            self.assert_same_as_kaitai(mii_data)
+
+    def test_every_bit_on_its_own(self):
+        #Each bit of the bit fields is set by itself, so a wrong shift or mask shows up as exactly the field it belongs to
+        for bit in range(16):
+            self.assert_same_as_kaitai((1 << (15 - bit)).to_bytes(2, "big") + REAL_MII_DATAS[0][2:])
+        for bit in range(8 * (CREATOR_NAME_BYTES.start - 32)):
+            bit_fields = (1 << (8 * (CREATOR_NAME_BYTES.start - 32) - 1 - bit)).to_bytes(CREATOR_NAME_BYTES.start - 32, "big")
+            self.assert_same_as_kaitai(REAL_MII_DATAS[0][:32] + bit_fields + REAL_MII_DATAS[0][CREATOR_NAME_BYTES.start:])
+
+    def test_short_mii_data(self):
+        with self.assertRaises(struct.error):
+            MiiDecoder.decode(REAL_MII_DATAS[0][:MiiDecoder.MII_DATA_SIZE - 1])
+        MiiDecoder.decode(REAL_MII_DATAS[0][:MiiDecoder.MII_DATA_SIZE])
+
+
+def run_benchmark(iterations: int):
+    mii_datas = REAL_MII_DATAS + get_random_mii_datas(len(REAL_MII_DATAS) * 4)
+    def decode_all(decode):
+        for mii_data in mii_datas:
+            decode(mii_data)
+    number = max(1, iterations // len(mii_datas))
+    kaitai_time = min(timeit.repeat(lambda: decode_all(Gen1Wii.from_bytes), number=number, repeat=5))
+    decoder_time = min(timeit.repeat(lambda: decode_all(MiiDecoder.decode), number=number, repeat=5))
+    decoded = number * len(mii_datas)
+    print(f"Decoded {decoded} miis:")
+    print(f"\tKaitai (Gen1Wii): {kaitai_time:.4f}s ({kaitai_time / decoded * 1e6:.2f}us per mii)")
+    print(f"\tMiiDecoder: {decoder_time:.4f}s ({decoder_time / decoded * 1e6:.2f}us per mii)")
+    print(f"\tSpeedup: {kaitai_time / decoder_time:.1f}x")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Test or benchmark MiiDecoder against the Kaitai Struct mii parser.")
+    parser.add_argument("--benchmark", action="store_true", help="benchmark the decoders instead of running the tests")
+    parser.add_argument("--iterations", type=int, default=DEFAULT_BENCHMARK_ITERATIONS, help="number of miis to decode with each decoder")
+    args, unittest_args = parser.parse_known_args()
+    if args.benchmark:
+        run_benchmark(args.iterations)
+    else:
+        unittest.main(argv=[sys.argv[0]] + unittest_args)
@@ -0,0 +1,165 @@
+'''
+Created on Oct 19, 2026
+
+@author: willg
+
+Content-addressed cache for rendered mii pictures.
+
+A picture is stored under a hash of the raw mii data and the parameters used to render it, so a mii that hasn't changed
+is never downloaded from the rendering server or resized for the table again, no matter which FC, room or table it shows up in.
+The cached pictures live in common.MIIS_CACHE_PATH and survive restarts: when the cache is loaded, the files' modification times
+are used as their last use time. When the cache grows over MII_IMAGE_CACHE_BYTE_BUDGET (the "mii_image_cache_megabytes" property, 256 MB if it
+isn't set), the least recently used pictures are removed.
+
+Table mii pictures are prepared on the image executor, so everything in here can be called from more than one thread. The cache lock is only
+held for the bookkeeping, not while files are copied or written. Everything in here reads or writes files, so async code calls it in an executor.
+'''
+import hashlib
+import os
+import re
+import shutil
+import threading
+from collections import OrderedDict
+from typing import Union
+
+import common
+
+MII_IMAGE_CACHE_BYTE_BUDGET = common.properties.get("mii_image_cache_megabytes", 256) * 1024 * 1024
+MII_PICTURE_RENDER_TYPE = "face"
+MII_TABLE_PICTURE_RENDER_TYPE = "table"
+CACHE_FILE_EXTENSION = ".png"
+#Cache file names are sha256 hex digests - anything else in the cache folder is left over from the old FC based cache
+CACHE_FILE_NAME_REGEX = re.compile(r"^[0-9a-f]{64}\.png$")
+
+cache_lock = threading.Lock()
+#Cache key -> size of the picture in bytes, least recently used first
+cache_entries = OrderedDict()
+total_bytes = 0
+loaded = False
+stats = {"hits": 0,
+         "misses": 0,
+         "stores": 0,
+         "evictions": 0}
+
+
+def get_cache_key(mii_hex_str: Union[str, bytes], render_type: str, *render_params) -> str:
+    '''Returns the cache key for a picture of the given mii data, rendered with the given parameters'''
+    if isinstance(mii_hex_str, bytes):
+        mii_hex_str = mii_hex_str.decode("utf-8")
+    to_hash = "|".join([mii_hex_str.lower(), render_type] + [str(param) for param in render_params])
+    return hashlib.sha256(to_hash.encode("utf-8")).hexdigest()
+
+def get_mii_picture_key(mii_hex_str, picture_width) -> str:
+    return get_cache_key(mii_hex_str, MII_PICTURE_RENDER_TYPE, picture_width)
+
+def get_table_mii_picture_key(mii_hex_str, background_color, table_mii_size) -> str:
+    return get_cache_key(mii_hex_str, MII_TABLE_PICTURE_RENDER_TYPE, tuple(int(c) for c in background_color), table_mii_size)
+
+def get_cache_file_path(key: str) -> str:
+    return f"{common.MIIS_CACHE_PATH}{key}{CACHE_FILE_EXTENSION}"
+
+
+def load():
+    '''Loads the cache entries already on disk, oldest first. Leftover files that aren't cache entries are removed.'''
+    global total_bytes, loaded
+    with cache_lock:
+        if loaded:
+            return
+        cache_entries.clear()
+        total_bytes = 0
+        found = []
+        if os.path.isdir(common.MIIS_CACHE_PATH):
+            for entry in os.scandir(common.MIIS_CACHE_PATH):
+                if not entry.is_file():
+                    continue
+                if CACHE_FILE_NAME_REGEX.match(entry.name) is None:
+                    common.delete_file(entry.path)
+                    continue
+                entry_stat = entry.stat()
+                found.append((entry_stat.st_mtime, entry.name[:-len(CACHE_FILE_EXTENSION)], entry_stat.st_size))
+        for _, key, size in sorted(found):
+            cache_entries[key] = size
+            total_bytes += size
+        loaded = True
+    evict_if_needed()
+
+def __mark_used(key):
+    cache_entries.move_to_end(key)
+    try:
+        os.utime(get_cache_file_path(key))
+    except OSError:
+        pass
+
+def __remove_entry(key):
+    global total_bytes
+    total_bytes -= cache_entries.pop(key, 0)
+    common.delete_file(get_cache_file_path(key))
+
+def copy_to(key: str, destination_path: str) -> bool:
+    '''Copies the cached picture for the given key to destination_path. Returns False (a miss) if the picture isn't cached.'''
+    global total_bytes
+    if not loaded:
+        load()
+    cache_file_path = get_cache_file_path(key)
+    with cache_lock:
+        if key not in cache_entries:
+            stats["misses"] += 1
+            return False
+    try:
+        shutil.copyfile(cache_file_path, destination_path)
+    except OSError: #The file was removed from underneath us
+        with cache_lock:
+            if not os.path.exists(cache_file_path):
+                total_bytes -= cache_entries.pop(key, 0)
+            stats["misses"] += 1
+        return False
+    with cache_lock:
+        if key in cache_entries:
+            __mark_used(key)
+        stats["hits"] += 1
+    return True
+
+def store_bytes(key: str, image_bytes: bytes):
+    '''Stores the given picture under the given key'''
+    global total_bytes
+    if not loaded:
+        load()
+    cache_file_path = get_cache_file_path(key)
+    temp_file_path = f"{cache_file_path}.{threading.get_ident()}.tmp"
+    try:
+        with open(temp_file_path, "wb") as f:
+            f.write(image_bytes)
+        os.replace(temp_file_path, cache_file_path)
+    except OSError:
+        common.delete_file(temp_file_path)
+        return
+    with cache_lock:
+        total_bytes -= cache_entries.pop(key, 0)
+        cache_entries[key] = len(image_bytes)
+        total_bytes += len(image_bytes)
+        stats["stores"] += 1
+    evict_if_needed()
+
+def store_file(key: str, image_path: str):
+    try:
+        with open(image_path, "rb") as f:
+            image_bytes = f.read()
+    except OSError:
+        return
+    store_bytes(key, image_bytes)
+
+def evict_if_needed(byte_budget=None):
+    '''Removes the least recently used pictures until the cache is within the byte budget'''
+    if byte_budget is None:
+        byte_budget = MII_IMAGE_CACHE_BYTE_BUDGET
+    with cache_lock:
+        while total_bytes > byte_budget and len(cache_entries) > 0:
+            oldest_key = next(iter(cache_entries))
+            __remove_entry(oldest_key)
+            stats["evictions"] += 1
+
+def get_stats_str() -> str:
+    lookups = stats["hits"] + stats["misses"]
+    hit_rate = "n/a" if lookups == 0 else f"{stats['hits'] / lookups:.1%}"
+    return f"""**Mii picture cache:** {len(cache_entries)} pictures, {total_bytes / (1024 * 1024):.1f}/{MII_IMAGE_CACHE_BYTE_BUDGET / (1024 * 1024):.0f} MB
+Hits: {stats['hits']} | Misses: {stats['misses']} | Hit rate: {hit_rate} | Stored: {stats['stores']} | Evicted: {stats['evictions']}"""
@@ -9,15 +9,15 @@ import base64
 import binascii
 from typing import Tuple
 import Mii
+import MiiDataCache
 import miirender
 #import requests
 import common
 from datetime import timedelta, datetime
-from typing import Set, List, Dict
-import shutil
+from typing import Set, List, Dict, Union
 import os
 import asyncio
-from copy import copy
+import time
 
 #from xml.dom.minidom import parse, parseString
 import lxml.objectify
@@ -51,17 +51,22 @@ SAKE_POST_DATA ="""<?xml version="1.0" encoding="UTF-8"?>
 </SOAP-ENV:Envelope>"""
 
 #Add Content-Length: if requests doesn't already add this or if SAKE server gives issues
+#The connection is kept alive so that the mii puller's session can reuse it for the next request
 SAKE_HEADERS = {"Host":"mariokartwii.sake.gs.wiimmfi.de",
                 "User-Agent":"GameSpyHTTP/1.0",
-                "Connection":"close",
                 "Content-Type": "text/xml",
                 "SOAPAction":"http://gamespy.net/sake/SearchForRecords"}
 
-MII_CACHE = {}
-MII_PHOTO_CACHE = {}
 REQUEST_TIME_OUT_SECONDS = 5
+#FCs are looked up in batches of this size. This is an assumed limit, not a documented one - Wiimmfi doesn't publish a maximum for
+#SearchForRecords (the max parameter in SAKE_POST_DATA is just the number of pids asked for), and the bot has only ever sent one room's
+#players (at most 12) in one request, so the batches are kept small enough that one request can't run into a limit on the server's side
+MAX_SAKE_BATCH_SIZE = 100
+MAX_CONCURRENT_SAKE_REQUESTS = 2
+SAKE_REQUEST_ATTEMPTS = 3
+SAKE_RETRY_DELAY_SECONDS = 0.5
+MAX_CONCURRENT_MII_DOWNLOADS = 6
 MII_DEFAULT_CACHE_TIME = timedelta(minutes=10)
-MII_PHOTO_CACHE_TIME = timedelta(minutes=10)
 MIN_FAILURES_BEFORE_BACKOFF = 3
 BACK_OFF_SECONDS_AMOUNT = 20
 DYNAMIC_CACHER_COOLDOWN = timedelta(hours=2)
@@ -82,37 +87,8 @@ def reset_dynamic_cacher_if_needed():
         MII_DYNAMIC_CACHER[1] = 0
         MII_DYNAMIC_CACHER[2] = MII_DEFAULT_CACHE_TIME
 
-def cache_time_expired(last_access_time):
-    return (datetime.now() - last_access_time) > MII_DYNAMIC_CACHER[2]
-
-def update_mii_cache(mii_datas):
-    for fc, (mii_bytes, mii_hex_str) in mii_datas.items():
-        MII_CACHE[fc] = [(mii_bytes, mii_hex_str), datetime.now()]
-
-def photo_cache_is_expired(last_access_time):
-    return (datetime.now() - last_access_time) > MII_PHOTO_CACHE_TIME 
- 
-def has_mii_photo_cached(fc):
-    if fc not in MII_PHOTO_CACHE:
-        return False
-    if photo_cache_is_expired(MII_PHOTO_CACHE[fc]):
-        return False
-    return os.path.exists(f"{common.MIIS_CACHE_PATH}{fc}.png")
-
-def update_mii_photo_cache(fc):
-    MII_PHOTO_CACHE[fc] = datetime.now()
-        
-
-def get_unexpired_cached_mii_datas(fcs:Set[str]) -> Set[str]:
-    if MII_DYNAMIC_CACHER[1] > MAXIMUM_FAILURES:
-        return None, None
-    result = set()
-    for fc in fcs:
-        if fc in MII_CACHE:
-            if not cache_time_expired(MII_CACHE[fc][1]):
-                result.add(fc)
-
-    return result, (len(result) == len(fcs))
+def cache_time_expired(pulled_at: float):
+    return (time.time() - pulled_at) > MII_DYNAMIC_CACHER[2].total_seconds()
 
 def get_sake_post_data(player_ids):
     player_id_args = [f"ownerid={pid}" for pid in player_ids]
@@ -147,7 +123,7 @@ def parse_sake_xml_check_corrupt(sake_response):
     pid_mapping = {}
     try:
         main_value_array = sake_response["{http://schemas.xmlsoap.org/soap/envelope/}Body"]["{http://gamespy.net/sake}SearchForRecordsResponse"]["{http://gamespy.net/sake}values"]
-    except AttributeError:
+    except (AttributeError, TypeError): #TypeError: the response wasn't XML at all
         return False
     else:
         if not all(arv.tag == "{http://gamespy.net/sake}ArrayOfRecordValue" for arv in main_value_array.iterchildren()):
@@ -185,40 +161,73 @@ def format_sake_xml_response(sake_response):
         print("Malformed XML message:", repr(sake_response))
         return None
 
-mii_puller_session = aiohttp.ClientSession() 
-async def get_mii_data_for_pids(pids:Dict[int, str]) -> str:
+mii_puller_session = None
+sake_semaphore = None
+mii_download_semaphore = None
+#FC -> future for its mii data, for FCs currently being looked up on SAKE. Requests for the same FC (from different channels) share one lookup.
+pending_mii_datas = {}
+#(mii data hex, picture width) -> future for whether the picture was downloaded, for mii pictures currently being downloaded
+pending_mii_photos = {}
+
+def get_mii_puller_session() -> aiohttp.ClientSession:
     global mii_puller_session
-    try:
-        async with mii_puller_session.post(wiimmfi_sake, headers=SAKE_HEADERS, data=get_sake_post_data(pids), ssl=common.sslcontext, timeout=REQUEST_TIME_OUT_SECONDS) as data:
-            sake_response = await data.content.read()
-            sake_response = format_sake_xml_response(sake_response)
-            result_check = parse_sake_xml_check_corrupt(sake_response)
-            if result_check is False:
-                update_pulling_mii_failed()
-                return None
+    if mii_puller_session is None or mii_puller_session.closed:
+        mii_puller_session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=MAX_CONCURRENT_SAKE_REQUESTS))
+    return mii_puller_session
+
+def get_sake_semaphore() -> asyncio.Semaphore:
+    global sake_semaphore
+    if sake_semaphore is None:
+        sake_semaphore = asyncio.Semaphore(MAX_CONCURRENT_SAKE_REQUESTS)
+    return sake_semaphore
+
+def get_mii_download_semaphore() -> asyncio.Semaphore:
+    global mii_download_semaphore
+    if mii_download_semaphore is None:
+        mii_download_semaphore = asyncio.Semaphore(MAX_CONCURRENT_MII_DOWNLOADS)
+    return mii_download_semaphore
+
+async def post_sake_request(pids) -> Union[Dict[int, str], None]:
+    '''Sends one SearchForRecords request for the given pids, retrying if SAKE can't be reached or gives a bad response.
+    Returns a dictionary of pid to base64 mii data for the pids SAKE has records for, or None if every attempt failed.'''
+    for attempt in range(SAKE_REQUEST_ATTEMPTS):
+        if attempt > 0:
+            await asyncio.sleep(SAKE_RETRY_DELAY_SECONDS * attempt)
+        try:
+            async with get_sake_semaphore():
+                timeout = aiohttp.ClientTimeout(total=REQUEST_TIME_OUT_SECONDS)
+                async with get_mii_puller_session().post(wiimmfi_sake, headers=SAKE_HEADERS, data=get_sake_post_data(pids), ssl=common.sslcontext, timeout=timeout) as data:
+                    if data.status != 200:
+                        continue
+                    sake_response = await data.content.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            continue
+        result_check = parse_sake_xml_check_corrupt(format_sake_xml_response(sake_response))
+        if result_check is not False:
             return result_check
-            
-            #miidatahex = base64.b64decode(miidatab64[399:527])
-            #encode = binascii.hexlify(miidatahex)
-            
-            #if mii_data_is_corrupt(encode):
-            #    update_pulling_mii_failed()
-            #    return None
-            #return (miidatahex, str(encode)[2:-1])
-    except:
-        update_pulling_mii_failed()
-        await mii_puller_session.close()
-        mii_puller_session = aiohttp.ClientSession()
+    update_pulling_mii_failed()
+    return None
+
+async def get_mii_data_for_pids(pids:Dict[int, str]) -> Union[Dict[int, str], None]:
+    '''Looks up the given pids on SAKE in as few requests as possible. Returns a dictionary of pid to base64 mii data
+    for the pids SAKE has records for, or None if none of the requests succeeded.'''
+    pids = list(pids)
+    batches = [pids[i:i+MAX_SAKE_BATCH_SIZE] for i in range(0, len(pids), MAX_SAKE_BATCH_SIZE)]
+    batch_results = await asyncio.gather(*[post_sake_request(batch) for batch in batches])
+    if all(batch_result is None for batch_result in batch_results):
         return None
+    result = {}
+    for batch_result in batch_results:
+        if batch_result is not None:
+            result.update(batch_result)
+    return result
 
 def mii_hex_to_binary(mii_hex: str):
     return binascii.unhexlify(mii_hex)
             
 
 
-async def get_mii_data_for_fcs(fcs:Set[str]):
-    if len(fcs) == 0:
-        return {}
+async def pull_mii_data_for_fcs(fcs:List[str]):
     pids_mapping = {fc_to_pid(fc):fc for fc in fcs}
     mii_datas = await get_mii_data_for_pids(pids_mapping)
     if mii_datas is None:
@@ -231,17 +240,45 @@ async def get_mii_data_for_fcs(fcs:Set[str]):
             result[pids_mapping[pid]] = (mii_data_hex, str(temp)[2:-1])
     return result
 
+async def get_mii_data_for_fcs(fcs:Set[str]):
+    '''Returns a dictionary of FC to (mii bytes, mii hex) for the FCs that have a mii, or None if SAKE couldn't be reached.
+    FCs that are already being looked up (for another channel) aren't looked up again - their lookup is waited on instead.'''
+    if len(fcs) == 0:
+        return {}
+    loop = asyncio.get_running_loop()
+    fcs_to_pull = [fc for fc in fcs if fc not in pending_mii_datas]
+    waiting_on = {fc:pending_mii_datas[fc] for fc in fcs if fc in pending_mii_datas}
+    for fc in fcs_to_pull:
+        pending_mii_datas[fc] = loop.create_future()
+
+    #Each FC's future is given False if SAKE has no mii for it, or None if the lookup failed
+    pulled = None
+    try:
+        if len(fcs_to_pull) > 0:
+            pulled = await pull_mii_data_for_fcs(fcs_to_pull)
+    finally:
+        for fc in fcs_to_pull:
+            future = pending_mii_datas.pop(fc)
+            if not future.done():
+                future.set_result(None if pulled is None else pulled.get(fc, False))
+
+    fc_results = {fc:(None if pulled is None else pulled.get(fc, False)) for fc in fcs_to_pull}
+    for fc, future in waiting_on.items():
+        #Shielded so that this caller being cancelled doesn't cancel the lookup for everyone else waiting on it
+        fc_results[fc] = await asyncio.shield(future)
+
+    if all(mii_data is None for mii_data in fc_results.values()):
+        return None
+    return {fc:mii_data for fc, mii_data in fc_results.items() if mii_data}
+
 def get_mii_file_names(fc, message_id):
-    cache_file_name = fc + ".png"
-    real_file_name = str(message_id) + "_" + cache_file_name
-    mii_cache_folder_path = common.MIIS_CACHE_PATH
+    real_file_name = str(message_id) + "_" + fc + ".png"
     folder_path = common.MIIS_PATH
-    cache_download_path = mii_cache_folder_path + cache_file_name
     full_download_path = folder_path + real_file_name
-    return cache_download_path, full_download_path, folder_path, real_file_name
+    return full_download_path, folder_path, real_file_name
 
 async def get_one_time_mii(mii_hex_str: str, fc: str, message_id: int, picture_width=512):
-    _, full_download_path, folder_path, real_file_name = get_mii_file_names(fc, message_id)
+    full_download_path, folder_path, real_file_name = get_mii_file_names(fc, message_id)
     success = await miirender.download_mii(mii_hex_str, full_download_path, picture_width=picture_width)
     if success is None:
         return MII_DOWNLOAD_FAILURE_ERROR_MESSAGE
@@ -249,17 +286,30 @@ async def get_one_time_mii(mii_hex_str: str, fc: str, message_id: int, picture_w
         return Mii.Mii(mii_hex_to_binary(mii_hex_str), mii_hex_str, folder_path, real_file_name, fc)
 
 async def download_mii_photo(fc, mii_hex_str, message_id, picture_width=512):
-    cache_download_path, full_download_path, _, _ = get_mii_file_names(fc, message_id)
-    success = await miirender.download_mii(mii_hex_str, cache_download_path, picture_width=picture_width)
+    #Miis that have already been rendered are copied out of the mii picture cache instead of being downloaded again
+    full_download_path, _, _ = get_mii_file_names(fc, message_id)
+    photo_key = (mii_hex_str, picture_width)
+    if photo_key in pending_mii_photos:
+        #The same mii is already being downloaded (for another channel), so wait for it to land in the mii picture cache
+        if not await asyncio.shield(pending_mii_photos[photo_key]):
+            return MII_DOWNLOAD_FAILURE_ERROR_MESSAGE
+        success = await miirender.download_mii(mii_hex_str, full_download_path, picture_width=picture_width)
+    else:
+        future = asyncio.get_running_loop().create_future()
+        pending_mii_photos[photo_key] = future
+        success = None
+        try:
+            async with get_mii_download_semaphore():
+                success = await miirender.download_mii(mii_hex_str, full_download_path, picture_width=picture_width)
+        finally:
+            pending_mii_photos.pop(photo_key)
+            future.set_result(bool(success))
     if success:
-        update_mii_photo_cache(fc)
         return True
-    if success is None:
-        return MII_DOWNLOAD_FAILURE_ERROR_MESSAGE
+    return MII_DOWNLOAD_FAILURE_ERROR_MESSAGE
 
-def copy_cache_photo_and_get_mii(mii_bytes, mii_hex, fc, message_id):
-    cache_download_path, full_download_path, folder_path, real_file_name = get_mii_file_names(fc, message_id)
-    shutil.copy2(cache_download_path, full_download_path)
+def get_mii(mii_bytes, mii_hex, fc, message_id):
+    _, folder_path, real_file_name = get_mii_file_names(fc, message_id)
     return Mii.Mii(mii_bytes, mii_hex, folder_path, real_file_name, fc)
     
 async def get_miis(fcs:List[str], message_id:str, picture_width=512):
@@ -267,44 +317,35 @@ async def get_miis(fcs:List[str], message_id:str, picture_width=512):
     if len(fcs) == 0:
         return {}
     fcs = set(fcs)
+    if MII_DYNAMIC_CACHER[1] > MAXIMUM_FAILURES:
+        return NO_MII_ERROR_MESSAGE
     
-    fcs_in_cache, all_miis_cached = get_unexpired_cached_mii_datas(fcs)
-    if all_miis_cached is not None or all_miis_cached is False:
-        uncached_mii_fcs = fcs.difference(fcs_in_cache)
+    #Miis pulled recently enough are used straight from the mii data cache, and the rest are pulled from SAKE
+    loop = asyncio.get_running_loop()
+    cached_mii_datas = await loop.run_in_executor(None, MiiDataCache.get_mii_datas, fcs, MII_DYNAMIC_CACHER[2])
+    mii_photos_to_get = {fc:(mii_bytes, mii_hex_str) for fc, (mii_bytes, mii_hex_str, pulled_at) in cached_mii_datas.items() if not cache_time_expired(pulled_at)}
+    uncached_mii_fcs = fcs.difference(mii_photos_to_get)
+    if len(uncached_mii_fcs) > 0:
         mii_datas = await get_mii_data_for_fcs(uncached_mii_fcs)
         if mii_datas is None:
-            return NO_MII_ERROR_MESSAGE
-        update_mii_cache(mii_datas)
-    
-    found_fcs, _ = get_unexpired_cached_mii_datas(fcs)
-    if found_fcs is None:
-        return NO_MII_ERROR_MESSAGE
-    found_data = {fc:copy(MII_CACHE[fc]) for fc in found_fcs}
+            #SAKE couldn't be reached, so use the miis we pulled before, even though they might be out of date
+            mii_photos_to_get.update({fc:(mii_bytes, mii_hex_str) for fc, (mii_bytes, mii_hex_str, _) in cached_mii_datas.items() if fc in uncached_mii_fcs})
+        else:
+            await loop.run_in_executor(None, MiiDataCache.store_mii_datas, mii_datas)
+            mii_photos_to_get.update(mii_datas)
         
-    if len(found_data) == 0:
+    if len(mii_photos_to_get) == 0:
         return NO_MII_ERROR_MESSAGE
     
     fc_results = {}
-    need_to_download_mii_photos = {}
-    for fc, ((mii_bytes, mii_hex_str), _) in found_data.items():
-        if not has_mii_photo_cached(fc):
-            need_to_download_mii_photos[fc] = mii_bytes, mii_hex_str
-    
-    #Make Miis out of the fcs we already have cached
-    for fc in found_data:
-        if fc not in need_to_download_mii_photos:
-            fc_results[fc] = copy_cache_photo_and_get_mii(found_data[fc][0][0], found_data[fc][0][1], fc, message_id)
     
-    #Download mii photos for the ones we have missing
-    max_concurrent = 6
-    fcs_missing_miis = list(need_to_download_mii_photos)
-    missing_fc_chunks = [fcs_missing_miis[i:i+max_concurrent] for i in range(len(fcs_missing_miis))[::max_concurrent]]
-    for missing_fc_chunk in missing_fc_chunks:
-        future_to_fc = {download_mii_photo(fc, need_to_download_mii_photos[fc][1], message_id, picture_width):fc for fc in missing_fc_chunk}
-        results = await asyncio.gather(*future_to_fc)
-        for fc, mii_pull_result in zip(missing_fc_chunk, results):
-            if not isinstance(mii_pull_result, str):
-                fc_results[fc] = copy_cache_photo_and_get_mii(need_to_download_mii_photos[fc][0], need_to_download_mii_photos[fc][1], fc, message_id)
+    #Get the mii photos - the ones already in the mii picture cache are copied out of it, and the rest are downloaded
+    #(at most MAX_CONCURRENT_MII_DOWNLOADS at a time across all channels, so one slow download doesn't hold up the others)
+    fcs_to_get = list(mii_photos_to_get)
+    results = await asyncio.gather(*[download_mii_photo(fc, mii_photos_to_get[fc][1], message_id, picture_width) for fc in fcs_to_get])
+    for fc, mii_pull_result in zip(fcs_to_get, results):
+        if not isinstance(mii_pull_result, str):
+            fc_results[fc] = get_mii(mii_photos_to_get[fc][0], mii_photos_to_get[fc][1], fc, message_id)
    
     return fc_results
 
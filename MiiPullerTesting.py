@@ -0,0 +1,161 @@
+'''
+Created on Oct 19, 2026
+
+@author: willg
+
+Tests MiiPuller's SAKE lookups against a fake SAKE server running locally.
+'''
+import asyncio
+import re
+import time
+import unittest
+
+from aiohttp import web
+
+import MiiPuller
+
+#Real mii data taken from a SAKE response
+TEST_MII_DATA = "QBYAeQB1AGkAYQB6AHUAAABuAGUANEAlh0aSUxjNd/YgBIpBcP3g2iByDMgAYZgPcLAAiiUFAAAAAAAAAAAAAAAAAAAAAAAAAAAM3AAYuzMGz77WUk1DSgEnAAAYEF5r"
+
+SAKE_RESPONSE_START = '''<?xml version="1.0"?><soap:Envelope xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xmlns:xsd="http://www.w3.org/2001/XMLSchema" xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/"><soap:Body><SearchForRecordsResponse xmlns="http://gamespy.net/sake"><SearchForRecordsResult>Success</SearchForRecordsResult><values>'''
+SAKE_RECORD = '''<ArrayOfRecordValue><RecordValue><binaryDataValue><value>{}</value></binaryDataValue></RecordValue><RecordValue><intValue><value>{}</value></intValue></RecordValue></ArrayOfRecordValue>'''
+SAKE_RESPONSE_END = '''</values></SearchForRecordsResponse></soap:Body></soap:Envelope>'''
+
+TEST_FCS = [f"0000-0000-{i:04}" for i in range(1, 13)]
+
+
+class FakeSakeServer:
+    '''Answers SearchForRecords requests with TEST_MII_DATA for every requested pid it knows about'''
+    def __init__(self):
+        self.known_pids = {MiiPuller.fc_to_pid(fc) for fc in TEST_FCS}
+        self.requests = []
+        self.failures_left = 0
+        self.malformed_left = 0
+        #Requests that ask for any of these pids always fail
+        self.failing_pids = set()
+        self.delays = []
+        self.runner = None
+        self.url = None
+
+    async def handle(self, request: web.Request):
+        body = await request.text()
+        pids = [int(pid) for pid in re.findall(r"ownerid=(\d+)", body)]
+        self.requests.append(pids)
+        if len(self.delays) > 0:
+            await asyncio.sleep(self.delays.pop(0))
+        if self.failures_left > 0 or not self.failing_pids.isdisjoint(pids):
+            self.failures_left = max(0, self.failures_left - 1)
+            return web.Response(status=500, text="Internal Server Error")
+        if self.malformed_left > 0:
+            self.malformed_left -= 1
+            return web.Response(text="<soap:Envelope", content_type="text/xml")
+        records = "".join(SAKE_RECORD.format(TEST_MII_DATA, pid) for pid in pids if pid in self.known_pids)
+        return web.Response(text=SAKE_RESPONSE_START + records + SAKE_RESPONSE_END, content_type="text/xml")
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/SakeStorageServer/StorageServer.asmx", self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}/SakeStorageServer/StorageServer.asmx"
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+
+class MiiPullerSakeTests(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.saved_settings = (MiiPuller.wiimmfi_sake, MiiPuller.MAX_SAKE_BATCH_SIZE, MiiPuller.REQUEST_TIME_OUT_SECONDS, MiiPuller.SAKE_RETRY_DELAY_SECONDS)
+        self.server = FakeSakeServer()
+        await self.server.start()
+        MiiPuller.wiimmfi_sake = self.server.url
+        MiiPuller.SAKE_RETRY_DELAY_SECONDS = 0
+        #Every test runs in its own event loop, so nothing bound to a previous loop can be reused
+        MiiPuller.mii_puller_session = None
+        MiiPuller.sake_semaphore = None
+        MiiPuller.mii_download_semaphore = None
+        MiiPuller.pending_mii_datas.clear()
+
+    async def asyncTearDown(self):
+        if MiiPuller.mii_puller_session is not None:
+            await MiiPuller.mii_puller_session.close()
+        MiiPuller.mii_puller_session = None
+        await self.server.stop()
+        MiiPuller.wiimmfi_sake, MiiPuller.MAX_SAKE_BATCH_SIZE, MiiPuller.REQUEST_TIME_OUT_SECONDS, MiiPuller.SAKE_RETRY_DELAY_SECONDS = self.saved_settings
+
+    async def test_gets_mii_data(self):
+        result = await MiiPuller.get_mii_data_for_fcs(set(TEST_FCS[:3]))
+        self.assertEqual(set(result), set(TEST_FCS[:3]))
+        mii_bytes, mii_hex = result[TEST_FCS[0]]
+        self.assertEqual(mii_bytes.hex(), mii_hex)
+        self.assertEqual(len(self.server.requests), 1)
+
+    async def test_partial_results(self):
+        #SAKE only gives records for the pids that have one; the others just don't have a mii
+        unknown_fc = "0000-0001-0000"
+        result = await MiiPuller.get_mii_data_for_fcs({TEST_FCS[0], unknown_fc})
+        self.assertEqual(set(result), {TEST_FCS[0]})
+
+    async def test_one_request_for_a_full_room(self):
+        await MiiPuller.get_mii_data_for_fcs(set(TEST_FCS))
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(len(self.server.requests[0]), len(TEST_FCS))
+
+    async def test_batches_are_split_at_max_batch_size(self):
+        MiiPuller.MAX_SAKE_BATCH_SIZE = 5
+        result = await MiiPuller.get_mii_data_for_fcs(set(TEST_FCS))
+        self.assertEqual(set(result), set(TEST_FCS))
+        self.assertEqual(sorted(len(pids) for pids in self.server.requests), [2, 5, 5])
+
+    async def test_concurrent_requests_are_coalesced(self):
+        self.server.delays = [0.2]
+        first, second = await asyncio.gather(MiiPuller.get_mii_data_for_fcs(set(TEST_FCS[:4])),
+                                             MiiPuller.get_mii_data_for_fcs(set(TEST_FCS[2:6])))
+        self.assertEqual(set(first), set(TEST_FCS[:4]))
+        self.assertEqual(set(second), set(TEST_FCS[2:6]))
+        #The second caller only asks SAKE for the FCs the first caller isn't already looking up
+        requested_pids = sorted(pid for pids in self.server.requests for pid in pids)
+        self.assertEqual(requested_pids, sorted(MiiPuller.fc_to_pid(fc) for fc in TEST_FCS[:6]))
+        self.assertEqual(len(MiiPuller.pending_mii_datas), 0)
+
+    async def test_retries_server_errors(self):
+        self.server.failures_left = MiiPuller.SAKE_REQUEST_ATTEMPTS - 1
+        result = await MiiPuller.get_mii_data_for_fcs({TEST_FCS[0]})
+        self.assertEqual(set(result), {TEST_FCS[0]})
+        self.assertEqual(len(self.server.requests), MiiPuller.SAKE_REQUEST_ATTEMPTS)
+
+    async def test_retries_malformed_responses(self):
+        self.server.malformed_left = 1
+        result = await MiiPuller.get_mii_data_for_fcs({TEST_FCS[0]})
+        self.assertEqual(set(result), {TEST_FCS[0]})
+        self.assertEqual(len(self.server.requests), 2)
+
+    async def test_gives_up_after_all_attempts(self):
+        self.server.failures_left = MiiPuller.SAKE_REQUEST_ATTEMPTS
+        result = await MiiPuller.get_mii_data_for_fcs({TEST_FCS[0]})
+        self.assertIsNone(result)
+        self.assertEqual(len(self.server.requests), MiiPuller.SAKE_REQUEST_ATTEMPTS)
+
+    async def test_timed_out_request_is_retried(self):
+        MiiPuller.REQUEST_TIME_OUT_SECONDS = 0.3
+        self.server.delays = [2]
+        t0 = time.perf_counter()
+        result = await MiiPuller.get_mii_data_for_fcs({TEST_FCS[0]})
+        self.assertEqual(set(result), {TEST_FCS[0]})
+        self.assertLess(time.perf_counter() - t0, 1.5)
+        self.assertEqual(len(self.server.requests), 2)
+
+    async def test_failed_batch_does_not_fail_other_batches(self):
+        MiiPuller.MAX_SAKE_BATCH_SIZE = 6
+        self.server.failing_pids = {MiiPuller.fc_to_pid(TEST_FCS[0])}
+        #Batches are made in the order the pids are given, so the failing pid is only in the first batch
+        result = await MiiPuller.get_mii_data_for_pids([MiiPuller.fc_to_pid(fc) for fc in TEST_FCS])
+        self.assertEqual(set(result), {MiiPuller.fc_to_pid(fc) for fc in TEST_FCS[6:]})
+        self.assertEqual(len(self.server.requests), MiiPuller.SAKE_REQUEST_ATTEMPTS + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -18,6 +18,7 @@ import TagAIShell
 from copy import copy, deepcopy
 from UtilityFunctions import isint, isfloat
 import Mii
+import ImageWorkers
 from typing import TYPE_CHECKING, List, Any, Dict, Union, Tuple
 import TimerDebuggers
 
@@ -716,7 +717,7 @@ class Room(object):
                     for fc, mii_pull_result in result.items():
                         if not isinstance(mii_pull_result, (str, type(None))):
                             self.get_miis()[fc] = mii_pull_result
-                            mii_pull_result.output_table_mii_to_disc()
+                            await ImageWorkers.run_image_job(mii_pull_result.output_table_mii_to_disc, raise_if_saturated=False)
                             mii_pull_result.__remove_main_mii_picture__()
     
             for mii in self.get_miis().values():
@@ -3,16 +3,23 @@ Created on Aug 4, 2020
 
 @author: willg
 '''
+import asyncio
 import fnmatch
+import functools
+import glob
 import re
 import json
 import os
 import re
+import sqlite3
+import zipfile
 from datetime import datetime
+from typing import List
 import humanize
 from pathlib import Path
 import shutil
 import common
+from data_tracking import ArchivePartitions
 
 TOTAL_CODE_LINES = None
 
@@ -84,7 +91,95 @@ def log_user(user_id):
         meta["user_ids"].append(user_id)
 
 
-def backup_files(to_back_up=common.FILES_TO_BACKUP):
+#SQLite databases are backed up with SQLite's online backup API, since copying the file while the bot is writing to it can copy a torn database
+DATABASES_TO_BACKUP = {common.ROOM_DATA_TRACKING_DATABASE_FILE, common.USER_DATA_DATABASE_FILE}
+DATABASE_BACKUP_EXTENSION = ".zip"
+#Backups keep all of their files for this many days
+BACKUP_FULL_DAYS = 7
+#After that, only the backups from the 1st of the month keep their data files (the newest this many of them), the rest only keep the full command logs
+MAX_MONTHLY_BACKUPS = 12
+#What is removed from a backup once it's no longer kept in full
+PRUNED_BACKUP_PATHS = [common.DATA_PATH, common.SERVER_SETTINGS_PATH, common.MESSAGE_LOGGING_FILE, common.ERROR_LOGS_FILE]
+
+
+def get_backup_file_name(backup_path, file_name, extension=""):
+    #Files that are backed up more than once in a day (the bot was restarted) get a number
+    backup_file_name = f"{backup_path}{file_name}{extension}"
+    for i in range(50):
+        if not os.path.exists(backup_file_name):
+            break
+        backup_file_name = f"{backup_path}{file_name}_{i}{extension}"
+    return backup_file_name
+
+def verify_database(database_file) -> List[str]:
+    '''Returns the result of PRAGMA integrity_check for the database - ["ok"] if it isn't corrupted'''
+    connection = sqlite3.connect(f"file:{database_file}?mode=ro", uri=True)
+    try:
+        return [message for (message,) in connection.execute("PRAGMA integrity_check;")]
+    finally:
+        connection.close()
+
+def compress_file(file_name, zip_file_name, archive_name):
+    #Written to a temporary file first, so a backup that was interrupted is never mistaken for a complete one
+    temp_zip_file_name = zip_file_name + ".tmp"
+    with zipfile.ZipFile(temp_zip_file_name, "w", compression=zipfile.ZIP_DEFLATED) as zip_file:
+        zip_file.write(file_name, arcname=archive_name)
+    os.replace(temp_zip_file_name, zip_file_name)
+
+def backup_database(database_file, backup_file):
+    '''Copies the database with SQLite's online backup API, checks the copy's integrity and compresses it into backup_file (a zip file).
+    Raises sqlite3.DatabaseError if the copy is corrupted.'''
+    copy_file_name = backup_file + ".db.tmp"
+    source = sqlite3.connect(database_file)
+    destination = sqlite3.connect(copy_file_name)
+    try:
+        #Copied in one step: the database is in WAL mode, so reading all of it at once doesn't block the bot's writes,
+        #and a backup done in several steps starts over whenever the bot writes between two of them
+        source.backup(destination)
+        #The copy doesn't need the WAL file that the live database uses, so the backup is one file
+        destination.execute("PRAGMA journal_mode=DELETE;")
+    finally:
+        destination.close()
+        source.close()
+    try:
+        integrity_check = verify_database(copy_file_name)
+        if integrity_check != ["ok"]:
+            raise sqlite3.DatabaseError(f"Backup of {database_file} failed integrity check: {'; '.join(integrity_check[:10])}")
+        compress_file(copy_file_name, backup_file, os.path.basename(database_file))
+    finally:
+        os.remove(copy_file_name)
+
+def restore_database_backup(backup_file, restored_database_file) -> str:
+    '''Extracts a database backup made by backup_database to restored_database_file and checks its integrity.
+    Raises sqlite3.DatabaseError if the restored database is corrupted, in which case restored_database_file isn't written.'''
+    temp_database_file = restored_database_file + ".tmp"
+    with zipfile.ZipFile(backup_file) as zip_file:
+        archive_name, = zip_file.namelist()
+        with zip_file.open(archive_name) as backed_up_database, open(temp_database_file, "wb") as restored_database:
+            shutil.copyfileobj(backed_up_database, restored_database)
+    try:
+        integrity_check = verify_database(temp_database_file)
+        if integrity_check != ["ok"]:
+            raise sqlite3.DatabaseError(f"Restored backup {backup_file} failed integrity check: {'; '.join(integrity_check[:10])}")
+    except sqlite3.DatabaseError:
+        os.remove(temp_database_file)
+        raise
+    os.replace(temp_database_file, restored_database_file)
+    return restored_database_file
+
+def backup_files_blocking(to_back_up, todays_backup_path, databases=DATABASES_TO_BACKUP):
+    for file_name in to_back_up:
+        try:
+            common.check_create(file_name)
+            if file_name in databases:
+                backup_database(file_name, get_backup_file_name(todays_backup_path, file_name, DATABASE_BACKUP_EXTENSION))
+            else:
+                shutil.copy2(file_name, get_backup_file_name(todays_backup_path, file_name))
+        except Exception as e:
+            print(e)
+
+async def backup_files(to_back_up=common.FILES_TO_BACKUP):
+    '''Backs up the files to today's backup folder. The files are copied (and the databases backed up and compressed) in a background thread, so the bot keeps running.'''
     Path(backup_folder).mkdir(parents=True, exist_ok=True)
     todays_backup_path = backup_folder + str(datetime.date(datetime.now())) + "/"
     Path(todays_backup_path).mkdir(parents=True, exist_ok=True)
@@ -93,68 +188,90 @@ def backup_files(to_back_up=common.FILES_TO_BACKUP):
     for local_dir in common.ALL_PATHS:
         Path(f"{todays_backup_path}{local_dir}").mkdir(parents=True, exist_ok=True)
     
-    for file_name in to_back_up:
+    to_back_up = set(to_back_up)
+    #The full message log is moved (instead of copied) into the backup and started over, before anything else can be logged to it
+    if common.FULL_MESSAGE_LOGGING_FILE in to_back_up:
+        to_back_up.remove(common.FULL_MESSAGE_LOGGING_FILE)
         try:
-            common.check_create(file_name)
-            
-            temp_file_n = file_name
-            if os.path.exists(todays_backup_path + temp_file_n):
-                # don't backup the database more than once, otherwise server will run out of disk
-
-                #To the above comment, we'll lose the current day's data on Ctrl+C if we don't ^
-                #if file_name == common.ROOM_DATA_TRACKING_DATABASE_FILE:
-                #    continue
-
-                for i in range(50):
-                    temp_file_n = file_name + "_" + str(i) 
-                    if not os.path.exists(todays_backup_path + temp_file_n):
-                        break
-            shutil.copy2(file_name, todays_backup_path + temp_file_n)
+            common.check_create(common.FULL_MESSAGE_LOGGING_FILE)
+            shutil.move(common.FULL_MESSAGE_LOGGING_FILE, get_backup_file_name(todays_backup_path, common.FULL_MESSAGE_LOGGING_FILE))
         except Exception as e:
             print(e)
-        else:
-            if file_name == common.FULL_MESSAGE_LOGGING_FILE:
-                os.remove(common.FULL_MESSAGE_LOGGING_FILE)   
-                common.check_create(common.FULL_MESSAGE_LOGGING_FILE)
-
-
-async def prune_backups():
-    print(f"{str(datetime.now())}: Pruning backups...")
+        common.check_create(common.FULL_MESSAGE_LOGGING_FILE)
+
+    #The room tracking database's monthly archives (see data_tracking/ArchivePartitions.py) are backed up with it
+    databases = set(DATABASES_TO_BACKUP)
+    if common.ROOM_DATA_TRACKING_DATABASE_FILE in to_back_up:
+        archive_files = ArchivePartitions.get_archive_files(common.ROOM_DATA_TRACKING_DATABASE_FILE)
+        if len(archive_files) > 0:
+            Path(todays_backup_path + ArchivePartitions.get_archive_folder(common.ROOM_DATA_TRACKING_DATABASE_FILE)).mkdir(parents=True, exist_ok=True)
+        to_back_up.update(archive_files)
+        databases.update(archive_files)
+
+    await asyncio.get_running_loop().run_in_executor(None, functools.partial(backup_files_blocking, to_back_up, todays_backup_path, databases))
+
+
+def unzip_legacy_backup(path):
+    '''Backup folders used to be zipped whole, with the backup's full path inside of the zip file'''
+    new_path = path.replace(".zip", "")
+    with zipfile.ZipFile(path) as zip_file:
+        zip_file.extractall(new_path)
+    os.remove(path)
+    for nested_path in glob.glob(f"{new_path}/*/*/*"):
+        shutil.move(nested_path, new_path)
+    shutil.rmtree(f"{new_path}/backups", ignore_errors=True)
+    return new_path
+
+def compress_database_backups(path):
+    '''Compresses the database backups that were copied uncompressed, before backups used backup_database'''
+    for database_file in DATABASES_TO_BACKUP:
+        for backup_file in glob.glob(f"{path}/{glob.escape(database_file)}*"):
+            if not backup_file.endswith(DATABASE_BACKUP_EXTENSION) and not backup_file.endswith(".tmp"):
+                print("Compressing", backup_file)
+                compress_file(backup_file, backup_file + DATABASE_BACKUP_EXTENSION, os.path.basename(database_file))
+                os.remove(backup_file)
+
+def remove_backup_data(path):
+    for pruned_path in PRUNED_BACKUP_PATHS:
+        full_path = f"{path}/{pruned_path}"
+        if os.path.isdir(full_path):
+            shutil.rmtree(full_path)
+        elif os.path.isfile(full_path):
+            os.remove(full_path)
+
+def prune_backups_blocking(today=None):
+    '''Rotates the backups by age and count: backups keep all of their files for BACKUP_FULL_DAYS days, then only the newest MAX_MONTHLY_BACKUPS
+    backups from the 1st of the month keep their data files. The full command logs are always kept.'''
+    if today is None:
+        today = datetime.date(datetime.now())
+    backup_dates = {}
     for folder in os.listdir(backup_folder):
         try:
-            # Fix previously zipped files
             path = backup_folder + folder
-            if ".zip" in path:
+            if folder.endswith(".zip"):
                 print("Unzipping", path)
-                new_path = path.replace(".zip","")
-                await common.run_command_async(f'unzip {path} -d {new_path}')
-                await common.run_command_async(f'rm {path}')
-                os.system(f'mv {new_path}/*/*/* {new_path}/')
-                await common.run_command_async(f'rm -rf {new_path}/backups')
-                path = new_path
-
-            # create_time = datetime.strptime(re.sub(r"_(\d+)$", "", folder.replace(".zip", "")),'%Y-%m-%d').date()
-            create_time = datetime.strptime(folder.replace(".zip", ""),'%Y-%m-%d').date()
-            delta = datetime.date(datetime.now()) - create_time
-
-            if delta.days > 7 and create_time.day != 1:
-                if os.path.exists(path+"/tablebot_data"):
+                path = unzip_legacy_backup(path)
+            backup_dates[path] = datetime.strptime(folder.replace(".zip", ""), '%Y-%m-%d').date()
+        except Exception as e:
+            print(f"{str(datetime.now())}: Pruning backups has exception: {e}")
+
+    old_monthly_backups = sorted((create_date for create_date in backup_dates.values() if create_date.day == 1 and (today - create_date).days > BACKUP_FULL_DAYS), reverse=True)
+    kept_monthly_backups = set(old_monthly_backups[:MAX_MONTHLY_BACKUPS])
+    for path, create_date in backup_dates.items():
+        try:
+            age = (today - create_date).days
+            if age > BACKUP_FULL_DAYS and create_date not in kept_monthly_backups:
+                if os.path.exists(f"{path}/{common.DATA_PATH}"):
                     print("Deleting", path)
-                    shutil.rmtree(path+"/tablebot_data")
-                    shutil.rmtree(path + "/discord_server_settings")
-                    await common.run_command_async(f'rm {path}/logging/messages_logging.txt')
-                    await common.run_command_async(f'rm {path}/logging/error_logs.txt')
-            elif delta.days >= 1:
-                db_path = path+"/tablebot_data/room_data_tracking.db"
-                db_path_zip = db_path + ".zip"
-
-                if not os.path.exists(db_path_zip) and os.path.exists(db_path):
-                    print("Zipping", db_path)
-                    await common.run_command_async(f'zip -r {db_path_zip} {db_path}')
-                    await common.run_command_async(f'rm -rf {db_path}')
+                remove_backup_data(path)
+            elif age >= 1:
+                compress_database_backups(path)
         except Exception as e:
             print(f"{str(datetime.now())}: Pruning backups has exception: {e}")
-            pass
+
+async def prune_backups():
+    print(f"{str(datetime.now())}: Pruning backups...")
+    await asyncio.get_running_loop().run_in_executor(None, prune_backups_blocking)
     print(f"{str(datetime.now())}: Pruning backups complete data")
     
 def get_commands_from_txt(to_find, needle_function, log_file, limit=None):
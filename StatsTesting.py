@@ -0,0 +1,184 @@
+'''
+Created on Oct 19, 2026
+
+@author: willg
+
+Tests Stats' backups: database backups are restored and checked against the database they were made from (including while it's being written to),
+corrupted backups are rejected, and old backups are rotated by age and count.
+'''
+import os
+import sqlite3
+import tempfile
+import threading
+import unittest
+from datetime import date, timedelta
+from unittest import mock
+
+import Stats
+import common
+from data_tracking import ArchivePartitions
+
+ROWS_PER_WRITE = 50
+
+
+def create_database(database_file, row_count=2000):
+    connection = sqlite3.connect(database_file, isolation_level=None)
+    connection.execute("PRAGMA journal_mode=WAL;")
+    connection.execute("CREATE TABLE Rows(row_id INTEGER PRIMARY KEY, data TEXT NOT NULL)")
+    #Updated in the same transaction as every write to Rows, so a torn copy has a total that doesn't match its rows
+    connection.execute("CREATE TABLE Total(row_count INT NOT NULL)")
+    connection.execute("INSERT INTO Total VALUES (0)")
+    write_rows(connection, row_count)
+    return connection
+
+def write_rows(connection, row_count):
+    connection.execute("BEGIN IMMEDIATE")
+    connection.executemany("INSERT INTO Rows (data) VALUES (?)", [(os.urandom(64).hex(),) for _ in range(row_count)])
+    connection.execute("UPDATE Total SET row_count = row_count + ?", (row_count,))
+    connection.execute("COMMIT")
+
+def get_rows(database_file):
+    connection = sqlite3.connect(database_file)
+    try:
+        return connection.execute("SELECT * FROM Rows ORDER BY row_id").fetchall(), connection.execute("SELECT row_count FROM Total").fetchone()[0]
+    finally:
+        connection.close()
+
+
+class DatabaseBackupTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_folder = tempfile.TemporaryDirectory()
+        self.database_file = os.path.join(self.temp_folder.name, "live.db")
+        self.backup_file = os.path.join(self.temp_folder.name, "live.db.zip")
+        self.restored_file = os.path.join(self.temp_folder.name, "restored.db")
+        self.connection = create_database(self.database_file)
+
+    def tearDown(self):
+        self.connection.close()
+        self.temp_folder.cleanup()
+
+    def test_restored_backup_matches_database(self):
+        Stats.backup_database(self.database_file, self.backup_file)
+        Stats.restore_database_backup(self.backup_file, self.restored_file)
+        self.assertEqual(Stats.verify_database(self.restored_file), ["ok"])
+        self.assertEqual(get_rows(self.restored_file), get_rows(self.database_file))
+        #The temporary copy isn't left behind
+        self.assertEqual(sorted(os.listdir(self.temp_folder.name)), ["live.db", "live.db-shm", "live.db-wal", "live.db.zip", "restored.db"])
+
+    def test_backup_while_database_is_written(self):
+        stop_writing = threading.Event()
+        def keep_writing():
+            connection = sqlite3.connect(self.database_file, isolation_level=None, check_same_thread=False)
+            while not stop_writing.is_set():
+                write_rows(connection, ROWS_PER_WRITE)
+            connection.close()
+        writer = threading.Thread(target=keep_writing)
+        writer.start()
+        try:
+            Stats.backup_database(self.database_file, self.backup_file)
+        finally:
+            stop_writing.set()
+            writer.join()
+        Stats.restore_database_backup(self.backup_file, self.restored_file)
+        rows, row_count = get_rows(self.restored_file)
+        self.assertEqual(len(rows), row_count)
+
+    def test_corrupted_backup_is_rejected(self):
+        Stats.backup_database(self.database_file, self.backup_file)
+        Stats.restore_database_backup(self.backup_file, self.restored_file)
+        with open(self.restored_file, "r+b") as restored_database:
+            #Overwrites the middle of the Rows table's pages, past the database header and the schema
+            restored_database.seek(os.path.getsize(self.restored_file) // 2)
+            restored_database.write(b"\xff" * 4096)
+        corrupted_backup_file = os.path.join(self.temp_folder.name, "corrupted.db.zip")
+        Stats.compress_file(self.restored_file, corrupted_backup_file, "live.db")
+        corrupted_restore_file = os.path.join(self.temp_folder.name, "corrupted_restore.db")
+        with self.assertRaises(sqlite3.DatabaseError):
+            Stats.restore_database_backup(corrupted_backup_file, corrupted_restore_file)
+        self.assertFalse(os.path.exists(corrupted_restore_file))
+        self.assertFalse(os.path.exists(corrupted_restore_file + ".tmp"))
+
+
+class BackupFilesTests(unittest.IsolatedAsyncioTestCase):
+    '''backup_files and prune_backups on a copy of the bot's folder layout'''
+    async def asyncSetUp(self):
+        self.temp_folder = tempfile.TemporaryDirectory()
+        self.original_folder = os.getcwd()
+        os.chdir(self.temp_folder.name)
+        for path in common.ALL_PATHS:
+            os.makedirs(path, exist_ok=True)
+        self.backup_folder_patch = mock.patch.object(Stats, "backup_folder", "backups/")
+        self.backup_folder_patch.start()
+
+    async def asyncTearDown(self):
+        self.backup_folder_patch.stop()
+        os.chdir(self.original_folder)
+        self.temp_folder.cleanup()
+
+    async def test_backup_files(self):
+        create_database(common.ROOM_DATA_TRACKING_DATABASE_FILE).close()
+        with open(common.ERROR_LOGS_FILE, "w", encoding="utf-8") as f:
+            f.write("error")
+        with open(common.FULL_MESSAGE_LOGGING_FILE, "w", encoding="utf-8") as f:
+            f.write("command")
+        to_back_up = {common.ROOM_DATA_TRACKING_DATABASE_FILE, common.ERROR_LOGS_FILE, common.FULL_MESSAGE_LOGGING_FILE}
+        await Stats.backup_files(to_back_up)
+        await Stats.backup_files(to_back_up)
+
+        todays_backup_path = f"backups/{date.today()}/"
+        for backup_file in (f"{common.ROOM_DATA_TRACKING_DATABASE_FILE}.zip", f"{common.ROOM_DATA_TRACKING_DATABASE_FILE}_0.zip"):
+            Stats.restore_database_backup(todays_backup_path + backup_file, "restored.db")
+            self.assertEqual(get_rows("restored.db"), get_rows(common.ROOM_DATA_TRACKING_DATABASE_FILE))
+        with open(todays_backup_path + common.ERROR_LOGS_FILE, encoding="utf-8") as f:
+            self.assertEqual(f.read(), "error")
+        #The full message log is moved into the first backup and started over
+        with open(todays_backup_path + common.FULL_MESSAGE_LOGGING_FILE, encoding="utf-8") as f:
+            self.assertEqual(f.read(), "command")
+        self.assertEqual(os.path.getsize(common.FULL_MESSAGE_LOGGING_FILE), 0)
+
+    async def test_backup_files_includes_archives(self):
+        create_database(common.ROOM_DATA_TRACKING_DATABASE_FILE).close()
+        archive_file = ArchivePartitions.create_archive(common.ROOM_DATA_TRACKING_DATABASE_FILE, "2026-01")
+        await Stats.backup_files({common.ROOM_DATA_TRACKING_DATABASE_FILE})
+        Stats.restore_database_backup(f"backups/{date.today()}/{archive_file}.zip", "restored.db")
+        self.assertEqual(Stats.verify_database("restored.db"), ["ok"])
+
+    def create_backup(self, backup_date: date, compressed=True):
+        backup_path = f"backups/{backup_date}/"
+        for path in common.ALL_PATHS:
+            os.makedirs(backup_path + path, exist_ok=True)
+        database_backup_file = backup_path + common.ROOM_DATA_TRACKING_DATABASE_FILE
+        create_database(database_backup_file, row_count=10).close()
+        if compressed:
+            Stats.compress_file(database_backup_file, database_backup_file + ".zip", "room_data_tracking.db")
+            os.remove(database_backup_file)
+        for log_file in (common.ERROR_LOGS_FILE, common.FULL_MESSAGE_LOGGING_FILE):
+            with open(backup_path + log_file, "w", encoding="utf-8") as f:
+                f.write("log")
+        return backup_path
+
+    def test_prune_backups_rotates_by_age_and_count(self):
+        today = date(2026, 10, 19)
+        daily_backups = [self.create_backup(today - timedelta(days=days_ago)) for days_ago in range(1, 15)]
+        monthly_backups = [self.create_backup(date(2026 - months // 12, 12 - months % 12, 1)) for months in range(2, 2 + Stats.MAX_MONTHLY_BACKUPS + 3)]
+        Stats.prune_backups_blocking(today)
+
+        for backup_path in daily_backups[:Stats.BACKUP_FULL_DAYS] + monthly_backups[:Stats.MAX_MONTHLY_BACKUPS]:
+            self.assertTrue(os.path.exists(backup_path + common.ROOM_DATA_TRACKING_DATABASE_FILE + ".zip"), backup_path)
+        for backup_path in daily_backups[Stats.BACKUP_FULL_DAYS:] + monthly_backups[Stats.MAX_MONTHLY_BACKUPS:]:
+            self.assertFalse(os.path.exists(backup_path + common.DATA_PATH), backup_path)
+            self.assertFalse(os.path.exists(backup_path + common.ERROR_LOGS_FILE), backup_path)
+            #The full command logs are kept for ?allcommands
+            self.assertTrue(os.path.exists(backup_path + common.FULL_MESSAGE_LOGGING_FILE), backup_path)
+
+    def test_prune_backups_compresses_old_database_copies(self):
+        backup_path = self.create_backup(date.today() - timedelta(days=2), compressed=False)
+        Stats.prune_backups_blocking()
+        database_backup_file = backup_path + common.ROOM_DATA_TRACKING_DATABASE_FILE
+        self.assertFalse(os.path.exists(database_backup_file))
+        Stats.restore_database_backup(database_backup_file + ".zip", "restored.db")
+        self.assertEqual(len(get_rows("restored.db")[0]), 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -108,4 +108,7 @@ class LorenziSiteFailure(Exception):
     pass
 
 class BackupPictureGeneratorFailed(LorenziSiteFailure):
-    pass
\ No newline at end of file
+    pass
+
+class ImageQueueSaturated(Exception):
+    pass
@@ -0,0 +1,83 @@
+'''
+Created on Oct 19, 2026
+
+@author: willg
+
+In-memory cache of the table pictures downloaded from Lorenzi's website.
+
+Tablers often ?wp again before anything has changed, which used to send the same table text to Lorenzi's website and download the
+same picture again. The downloaded PNG bytes are cached under a hash of the full Lorenzi URL, which holds the exact table text along
+with the table's style and graph options, so any change to the table is a different entry. Entries expire after TABLE_PICTURE_CACHE_SECONDS
+(the "table_picture_cache_seconds" property, 5 minutes if it isn't set), and the least recently used entries are dropped when the cache holds more
+than MAX_CACHED_TABLE_PICTURES pictures ("max_cached_table_pictures", 200) or MAX_CACHED_TABLE_PICTURE_BYTES bytes ("table_picture_cache_megabytes", 64 MB).
+'''
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Union
+
+import common
+
+TABLE_PICTURE_CACHE_SECONDS = common.properties.get("table_picture_cache_seconds", 300)
+MAX_CACHED_TABLE_PICTURES = common.properties.get("max_cached_table_pictures", 200)
+MAX_CACHED_TABLE_PICTURE_BYTES = common.properties.get("table_picture_cache_megabytes", 64) * 1024 * 1024
+
+#Cache key -> (time stored, PNG bytes), least recently used first
+cached_pictures = OrderedDict()
+total_bytes = 0
+stats = {"hits": 0,
+         "misses": 0,
+         "expired": 0,
+         "evictions": 0}
+
+
+def get_cache_key(image_url: str) -> str:
+    return hashlib.sha256(image_url.encode("utf-8")).hexdigest()
+
+def __remove(key):
+    global total_bytes
+    _, image_bytes = cached_pictures.pop(key)
+    total_bytes -= len(image_bytes)
+
+def get(image_url: str) -> Union[bytes, None]:
+    '''Returns the cached picture bytes for the given Lorenzi URL, or None if it isn't cached (or has expired)'''
+    key = get_cache_key(image_url)
+    if key not in cached_pictures:
+        stats["misses"] += 1
+        return None
+    time_stored, image_bytes = cached_pictures[key]
+    if time.monotonic() - time_stored > TABLE_PICTURE_CACHE_SECONDS:
+        __remove(key)
+        stats["expired"] += 1
+        stats["misses"] += 1
+        return None
+    cached_pictures.move_to_end(key)
+    stats["hits"] += 1
+    return image_bytes
+
+def store(image_url: str, image_bytes: bytes):
+    global total_bytes
+    if not image_bytes or len(image_bytes) > MAX_CACHED_TABLE_PICTURE_BYTES:
+        return
+    remove_expired()
+    key = get_cache_key(image_url)
+    if key in cached_pictures:
+        __remove(key)
+    cached_pictures[key] = (time.monotonic(), image_bytes)
+    total_bytes += len(image_bytes)
+    while len(cached_pictures) > MAX_CACHED_TABLE_PICTURES or total_bytes > MAX_CACHED_TABLE_PICTURE_BYTES:
+        __remove(next(iter(cached_pictures)))
+        stats["evictions"] += 1
+
+def remove_expired():
+    current_time = time.monotonic()
+    for key, (time_stored, _) in list(cached_pictures.items()):
+        if current_time - time_stored > TABLE_PICTURE_CACHE_SECONDS:
+            __remove(key)
+            stats["expired"] += 1
+
+def get_stats_str() -> str:
+    lookups = stats["hits"] + stats["misses"]
+    hit_rate = "n/a" if lookups == 0 else f"{stats['hits'] / lookups:.1%}"
+    return f"""**Table picture cache:** {len(cached_pictures)}/{MAX_CACHED_TABLE_PICTURES} pictures, {total_bytes / (1024 * 1024):.1f}/{MAX_CACHED_TABLE_PICTURE_BYTES / (1024 * 1024):.0f} MB, {TABLE_PICTURE_CACHE_SECONDS}s TTL
+Hits: {stats['hits']} | Misses: {stats['misses']} | Hit rate: {hit_rate} | Expired: {stats['expired']} | Evicted: {stats['evictions']}"""
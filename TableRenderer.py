@@ -0,0 +1,157 @@
+'''
+Created on Oct 19, 2026
+
+@author: willg
+
+Draws the team/player score table directly with PIL. This is the backup table picture generator for when Lorenzi's website
+can't give us a table picture.
+
+The layout follows the full table HTML (api/html/full_table_builder.html) in the orange style (api/css/full_scores_base.css and
+api/css/full_scores_orange.css), which is what the backup generator used to screenshot with headless Chrome:
+a header row with the format, races played and date, then one row per team with the team name, the team's players
+(name, GP scores, total) and the team's total. Verdana isn't shipped with the bot, so the text uses the bot's own font.
+'''
+import datetime
+from typing import Dict, List, Tuple
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+import ImageCombine
+import common
+
+#Same size the HTML table was screenshotted at
+TABLE_WIDTH = 980
+TABLE_HEIGHT = 580
+
+BACKGROUND_COLOR = (189, 53, 0) #bd3500
+TEXT_COLOR = (255, 255, 255)
+BORDER_COLOR = (0, 0, 0)
+TABLE_FONT = f"{common.FONT_PATH}Roboto-Medium.ttf"
+
+#grid-template-rows: 8fr 92fr
+HEADER_HEIGHT_FRACTION = 8 / 100
+HEADER_FONT_SIZE = 30
+MIDDLE_DOT_FONT_SIZE = 25
+MIDDLE_DOT_MARGIN = 15
+HEADER_BORDER_WIDTH = 5
+
+#Team row: team name, players, team total
+TEAM_COLUMN_FRACTIONS = (1.5, 3, 1)
+TEAM_FONT_SIZE = 35
+TEAM_BORDER_WIDTH = 5
+#Player row: player name, GP scores, player total
+PLAYER_COLUMN_FRACTIONS = (3, 3, 2)
+PLAYER_FONT_SIZE = 25
+PLAYER_BORDER_WIDTH = 4
+CELL_BORDER_WIDTH = 2
+#Names that don't fit are shrunk, but never below this size (fitty's minSize)
+MIN_FONT_SIZE = 12
+TEXT_WIDTH_PADDING = 6
+
+
+def split_by_fractions(start: int, length: int, fractions) -> List[Tuple[int, int]]:
+    '''Splits the range [start, start+length) into consecutive (start, end) pieces sized by the given fractions, like CSS fr units'''
+    total = sum(fractions)
+    pieces = []
+    used = 0
+    for index, fraction in enumerate(fractions):
+        piece_end = length if index == len(fractions) - 1 else round(length * (used + fraction) / total)
+        pieces.append((start + round(length * used / total), start + piece_end))
+        used += fraction
+    return pieces
+
+def draw_centered_text(draw: ImageDraw.ImageDraw, text: str, box: Tuple[int, int, int, int], max_font_size: int):
+    left, top, right, bottom = box
+    if len(text) == 0 or right - left <= 0 or bottom - top <= 0:
+        return
+    font_size, _, _ = ImageCombine.fit_font_size(TABLE_FONT, text, max_font_size, right - left - TEXT_WIDTH_PADDING, bottom - top, MIN_FONT_SIZE)
+    draw.text(((left + right) / 2, (top + bottom) / 2), text, fill=TEXT_COLOR, font=ImageCombine.get_font(TABLE_FONT, font_size), anchor="mm")
+
+def draw_vertical_border(draw: ImageDraw.ImageDraw, x: int, top: int, bottom: int, width: int):
+    draw.rectangle((x, top, x + width - 1, bottom - 1), fill=BORDER_COLOR)
+
+def draw_horizontal_border(draw: ImageDraw.ImageDraw, y: int, left: int, right: int, width: int):
+    draw.rectangle((left, y, right - 1, y + width - 1), fill=BORDER_COLOR)
+
+
+def draw_header(draw: ImageDraw.ImageDraw, table_sorted_data: Dict, header_height: int):
+    header_parts = [table_sorted_data["format"], f'{table_sorted_data["races_played"]} races', str(datetime.date.today())]
+
+    header_font = ImageCombine.get_font(TABLE_FONT, HEADER_FONT_SIZE)
+    dot_font = ImageCombine.get_font(TABLE_FONT, MIDDLE_DOT_FONT_SIZE)
+    dot_width = ImageCombine.get_text_size(TABLE_FONT, MIDDLE_DOT_FONT_SIZE, '•')[0] + 2 * MIDDLE_DOT_MARGIN
+    part_widths = [ImageCombine.get_text_size(TABLE_FONT, HEADER_FONT_SIZE, part)[0] for part in header_parts]
+    total_width = sum(part_widths) + dot_width * (len(header_parts) - 1)
+
+    text_y = (header_height - HEADER_BORDER_WIDTH) / 2
+    x = (TABLE_WIDTH - total_width) / 2
+    for index, (part, part_width) in enumerate(zip(header_parts, part_widths)):
+        if index > 0:
+            draw.text((x + dot_width / 2, text_y), '•', fill=TEXT_COLOR, font=dot_font, anchor="mm")
+            x += dot_width
+        draw.text((x, text_y), part, fill=TEXT_COLOR, font=header_font, anchor="lm")
+        x += part_width
+    draw_horizontal_border(draw, header_height - HEADER_BORDER_WIDTH, 0, TABLE_WIDTH, HEADER_BORDER_WIDTH)
+
+def draw_player(draw: ImageDraw.ImageDraw, player_data: Dict, left: int, top: int, right: int, bottom: int):
+    (name_left, name_right), (scores_left, scores_right), (total_left, total_right) = split_by_fractions(left, right - left, PLAYER_COLUMN_FRACTIONS)
+    draw_centered_text(draw, player_data["table_name"], (name_left, top, name_right - CELL_BORDER_WIDTH, bottom), PLAYER_FONT_SIZE)
+    draw_vertical_border(draw, name_right - CELL_BORDER_WIDTH, top, bottom, CELL_BORDER_WIDTH)
+
+    gp_scores = player_data["gp_scores"]
+    if len(gp_scores) > 0:
+        for gp_num, (score_left, score_right) in enumerate(split_by_fractions(scores_left, scores_right - scores_left, [1] * len(gp_scores))):
+            if gp_num > 0:
+                draw_vertical_border(draw, score_left, top, bottom, CELL_BORDER_WIDTH)
+                score_left += CELL_BORDER_WIDTH
+            draw_centered_text(draw, str(sum(gp_scores[gp_num])), (score_left, top, score_right, bottom), PLAYER_FONT_SIZE)
+
+    draw_vertical_border(draw, total_left, top, bottom, CELL_BORDER_WIDTH)
+    draw_centered_text(draw, str(player_data["total_score"]), (total_left + CELL_BORDER_WIDTH, top, total_right, bottom), PLAYER_FONT_SIZE)
+
+def draw_team(draw: ImageDraw.ImageDraw, team_tag: str, team_data: Dict, team_players: List[Dict], top: int, bottom: int):
+    (name_left, name_right), (players_left, players_right), (score_left, score_right) = split_by_fractions(0, TABLE_WIDTH, TEAM_COLUMN_FRACTIONS)
+    draw_centered_text(draw, team_tag, (name_left, top, name_right - TEAM_BORDER_WIDTH, bottom), TEAM_FONT_SIZE)
+    draw_vertical_border(draw, name_right - TEAM_BORDER_WIDTH, top, bottom, TEAM_BORDER_WIDTH)
+    draw_vertical_border(draw, score_left, top, bottom, TEAM_BORDER_WIDTH)
+    draw_centered_text(draw, str(team_data["total_score"]), (score_left + TEAM_BORDER_WIDTH, top, score_right, bottom), TEAM_FONT_SIZE)
+
+    if len(team_players) == 0:
+        return
+    for player_num, (player_top, player_bottom) in enumerate(split_by_fractions(top, bottom - top, [1] * len(team_players))):
+        if player_num < len(team_players) - 1:
+            draw_horizontal_border(draw, player_bottom - PLAYER_BORDER_WIDTH, players_left, players_right, PLAYER_BORDER_WIDTH)
+            player_bottom -= PLAYER_BORDER_WIDTH
+        draw_player(draw, team_players[player_num], players_left, player_top, players_right, player_bottom)
+
+def render_table(table_sorted_data: Dict, include_races_played=True) -> Image.Image:
+    '''Returns a picture of the table. table_sorted_data is what is returned by ScoreKeeper.get_war_table_DCS'''
+    image = Image.new("RGB", (TABLE_WIDTH, TABLE_HEIGHT), BACKGROUND_COLOR)
+    draw = ImageDraw.Draw(image)
+
+    scores_top = 0
+    if include_races_played:
+        scores_top = round(TABLE_HEIGHT * HEADER_HEIGHT_FRACTION)
+        draw_header(draw, table_sorted_data, scores_top)
+
+    teams = []
+    for team_tag, team_data in table_sorted_data["teams"].items():
+        if table_sorted_data["format"] == "FFA":
+            team_tag = "FFA"
+        teams.append((team_tag, team_data, [p for p in team_data["players"].values() if not p["subbed_out"]]))
+    if len(teams) == 0:
+        return image
+
+    #Teams with more players get taller rows, the same way the HTML grid gives them more room
+    team_heights = [max(1, len(team_players)) for _, _, team_players in teams]
+    for team_num, (team_top, team_bottom) in enumerate(split_by_fractions(scores_top, TABLE_HEIGHT - scores_top, team_heights)):
+        if team_num > 0:
+            draw_horizontal_border(draw, team_top, 0, TABLE_WIDTH, TEAM_BORDER_WIDTH)
+            team_top += TEAM_BORDER_WIDTH
+        draw_team(draw, *teams[team_num], team_top, team_bottom)
+    return image
+
+def render_table_cv2(table_sorted_data: Dict, include_races_played=True) -> np.ndarray:
+    '''Returns a picture of the table as a BGR numpy array, the same as ImageCombine.decode_image gives for a downloaded table picture'''
+    return np.array(render_table(table_sorted_data, include_races_played))[:, :, ::-1].copy()
@@ -0,0 +1,146 @@
+'''
+Created on Oct 19, 2026
+
+Compares the native PIL table renderer (TableRenderer) against the HTML table it replaced as the backup table picture generator.
+
+Every saved room in testing_rooms is loaded into a table (as an FFA, and as a 2v2 with the tag AI's teams when the room
+has an even number of players). Each table is drawn by TableRenderer and screenshotted from api_data_builder's full table HTML
+with headless Chrome (html2image). The two pictures are compared at a reduced scale, so that the different fonts
+(the HTML uses Verdana) only count for a little, while a misplaced row, column or border counts for a lot.
+
+The run fails (exits with a non-zero status) if, for any table, more than the allowed fraction of pixels differ by more than the
+pixel tolerance. Pictures of failed comparisons are written to the output folder.
+
+Usage: python TableRendererComparison.py [--output-folder temp/table_renderer_comparison/] [--max-different-pixels 0.1] [--pixel-tolerance 48]
+'''
+import argparse
+import codecs
+import os
+import sys
+import time
+from typing import Dict, List, Tuple
+
+import cv2
+import numpy as np
+from bs4 import BeautifulSoup
+from html2image import Html2Image
+
+#UserDataProcessing is imported before Room, like the bot does, since Room -> Player -> UserDataProcessing -> DataTracker imports Player again
+import UserDataProcessing
+import Room
+import ScoreKeeper as SK
+import TableBot
+import TableRenderer
+import TagAIShell
+import War
+import WiimmfiParser
+import WiimmfiSiteFunctions
+from api import api_data_builder
+
+DEFAULT_OUTPUT_FOLDER = "temp/table_renderer_comparison/"
+#A pixel counts as different when any of its channels differs by more than this (after scaling down)
+DEFAULT_PIXEL_TOLERANCE = 48
+#Fraction of pixels that are allowed to be different
+DEFAULT_MAX_DIFFERENT_PIXELS = 0.10
+COMPARISON_SCALE = 0.25
+FIXTURE_ROOM_ID = "r0000000"
+
+
+def get_fixture_races(room_file_name):
+    with codecs.open(room_file_name, "r", "utf-8") as fp:
+        html = WiimmfiSiteFunctions.fix_cloudflare_email(fp.read())
+    return WiimmfiParser.RoomPageParser(BeautifulSoup(html, "html.parser")).get_room_races()
+
+def build_fixture_table(races, war_format: str) -> Dict:
+    '''Loads the races into a table with the given format and returns the table's sorted data, as ?wp would'''
+    channel_bot = TableBot.ChannelBot(server_id=0, channel_id=0)
+    room = Room.Room(channel_bot, FIXTURE_ROOM_ID, races, 0, 0, "")
+    players = list(room.get_fc_to_name_dict(1, 12).items())
+    players_per_team = 1 if war_format == "ffa" else int(war_format[0])
+    war = War.War(war_format, min(len(players), 12) // players_per_team, 0)
+    channel_bot.setWar(war)
+    channel_bot.setRoom(room)
+    if war.is_ffa():
+        war.setTeams({fc: str(team_number) for team_number, (fc, _) in enumerate(players)})
+    else:
+        war.set_temp_team_tags(TagAIShell.determineTags(players, war.playersPerTeam))
+        war.setTeams(war.getConvertedTempTeams())
+    _, table_sorted_data = SK.get_war_table_DCS(channel_bot, use_lounge_otherwise_mii=False, use_miis=True, lounge_replace=False)
+    return table_sorted_data
+
+def load_fixture_tables() -> List[Tuple[str, Dict]]:
+    tables = []
+    for description, room_file_name in WiimmfiSiteFunctions.special_test_cases.values():
+        if not os.path.exists(room_file_name):
+            continue
+        try:
+            races = get_fixture_races(room_file_name)
+            if len(races) == 0:
+                continue
+            tables.append((f"{room_file_name}@ffa", build_fixture_table(races, "ffa")))
+            number_of_players = len({placement.get_fc() for race in races[:12] for placement in race.getPlacements()})
+            if number_of_players % 2 == 0:
+                tables.append((f"{room_file_name}@2v2", build_fixture_table(races, "2v2")))
+        except Exception as e:
+            print(f"Could not build a table for '{room_file_name}' ({description}): {e}")
+    return tables
+
+
+def render_html_table(hti: Html2Image, table_sorted_data: Dict, file_name: str) -> np.ndarray:
+    table_html = api_data_builder.build_full_table_html(table_sorted_data, style="orange", relative_path_ok=False)
+    css_files = [os.path.abspath(f"{api_data_builder.API_DATA_PATH}{api_data_builder.FULL_TABLE_STYLE_FILE}"),
+                 os.path.abspath(f"{api_data_builder.API_DATA_PATH}{api_data_builder.FULL_TABLE_STYLES['orange']}")]
+    hti.screenshot(html_str=table_html, css_file=css_files, save_as=file_name)
+    return cv2.imread(os.path.join(hti.output_path, file_name), cv2.IMREAD_COLOR)
+
+def compare_pictures(native_cv2: np.ndarray, html_cv2: np.ndarray, pixel_tolerance: int) -> float:
+    '''Returns the fraction of pixels that differ by more than pixel_tolerance once both pictures are scaled down'''
+    size = (int(TableRenderer.TABLE_WIDTH * COMPARISON_SCALE), int(TableRenderer.TABLE_HEIGHT * COMPARISON_SCALE))
+    native_small = cv2.resize(native_cv2, size, interpolation=cv2.INTER_AREA).astype(np.int16)
+    html_small = cv2.resize(html_cv2, size, interpolation=cv2.INTER_AREA).astype(np.int16)
+    different = np.any(np.abs(native_small - html_small) > pixel_tolerance, axis=-1)
+    return float(np.count_nonzero(different)) / different.size
+
+def run_comparison(tables: List[Tuple[str, Dict]], output_folder: str, pixel_tolerance: int, max_different_pixels: float) -> List[str]:
+    os.makedirs(output_folder, exist_ok=True)
+    hti = Html2Image(size=(TableRenderer.TABLE_WIDTH, TableRenderer.TABLE_HEIGHT), output_path=output_folder,
+                     custom_flags=['--no-sandbox', '--default-background-color=00000000', '--hide-scrollbars'])
+    failures = []
+    native_time = html_time = 0.0
+    for index, (source, table_sorted_data) in enumerate(tables):
+        t0 = time.perf_counter()
+        native_cv2 = TableRenderer.render_table_cv2(table_sorted_data)
+        native_time += time.perf_counter() - t0
+        t0 = time.perf_counter()
+        html_cv2 = render_html_table(hti, table_sorted_data, f"{index}_html.png")
+        html_time += time.perf_counter() - t0
+
+        different_pixels = compare_pictures(native_cv2, html_cv2, pixel_tolerance)
+        print(f"\t{source}: {different_pixels:.2%} of pixels differ")
+        if different_pixels > max_different_pixels:
+            cv2.imwrite(os.path.join(output_folder, f"{index}_native.png"), native_cv2)
+            failures.append(f"{source}: {different_pixels:.2%} of pixels differ (allowed {max_different_pixels:.2%}) - see {index}_native.png and {index}_html.png")
+        else:
+            os.remove(os.path.join(output_folder, f"{index}_html.png"))
+
+    if len(tables) > 0:
+        print(f"Average render time: native {native_time / len(tables):.4f}s | HTML {html_time / len(tables):.4f}s")
+    return failures
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Compare the native table renderer against the HTML table over the saved rooms.")
+    parser.add_argument("--output-folder", default=DEFAULT_OUTPUT_FOLDER, help="where to write the pictures of failed comparisons")
+    parser.add_argument("--pixel-tolerance", type=int, default=DEFAULT_PIXEL_TOLERANCE, help="per channel difference (0-255) above which a pixel counts as different")
+    parser.add_argument("--max-different-pixels", type=float, default=DEFAULT_MAX_DIFFERENT_PIXELS, help="allowed fraction of different pixels per table")
+    args = parser.parse_args(argv)
+
+    TagAIShell.initialize()
+    tables = load_fixture_tables()
+    print(f"Comparing {len(tables)} tables:")
+    failures = run_comparison(tables, args.output_folder, args.pixel_tolerance, args.max_different_pixels)
+    for failure in failures:
+        print(f"MISMATCH: {failure}")
+    return 1 if len(failures) > 0 else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,199 @@
+'''
+Created on Oct 19, 2026
+
+Benchmark and regression harness for the tag AIs.
+
+Every roster recorded in TagAIShell's AI_data.pkl, along with the rosters in the saved rooms in testing_rooms, is replayed through
+both the alpha AI (TagAI_BadWolf.getTagsSmart) and the beta AI (TagAI_Andrew.get_teams_smart, through TagAIShell).
+The harness records p50/p95/max latency for each AI, how often the two AIs agree, and how often each AI still agrees with
+the result it gave when the roster was recorded. Results are written as JSON so they can be tracked over time.
+
+If a baseline results file is given, the run fails (exits with a non-zero status) when either AI's p95 or max latency
+has regressed past the baseline by more than the allowed tolerance.
+
+Usage: python TagAIBenchmark.py [--output results.json] [--baseline old_results.json] [--tolerance 0.25] [--max-p95 0.5]
+'''
+import argparse
+import codecs
+import json
+import math
+import os
+import sys
+import time
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+from bs4 import BeautifulSoup
+
+import TagAIShell
+import TagAI_BadWolf
+import WiimmfiParser
+import WiimmfiSiteFunctions
+
+DEFAULT_RESULTS_FILE = "tag_ai_benchmark.json"
+DEFAULT_TOLERANCE = 0.25
+#Latency regressions smaller than this (in seconds) are ignored, since they're just timer noise on very fast rosters
+LATENCY_NOISE_FLOOR = 0.002
+#The saved rooms don't record a format, so their rosters are replayed for every team format that divides the number of players evenly
+FIXTURE_PLAYERS_PER_TEAM = [2, 3, 4, 5, 6]
+#?sw only looks at the first 3 GPs to get the players in the room
+FIXTURE_RACES_TO_USE = 12
+
+#Each roster is (source, fc_players, players_per_team, recorded alpha teams, recorded beta teams)
+Roster = Tuple[str, List[Tuple[str, str]], int, Dict, Dict]
+
+
+def load_recorded_rosters() -> List[Roster]:
+    if len(TagAIShell.AI_Results) == 0:
+        TagAIShell.load_pkl_list(TagAIShell.AI_Results, TagAIShell.AI_Results_file_name)
+    rosters = []
+    for index, (fc_players, alpha_AI_data, beta_AI_data) in enumerate(TagAIShell.AI_Results):
+        players_per_team = alpha_AI_data[2] if alpha_AI_data[2] is not None else beta_AI_data[2]
+        if players_per_team is None:
+            continue
+        rosters.append((f"{TagAIShell.AI_Results_file_name}#{index}", list(fc_players), players_per_team, alpha_AI_data[0], beta_AI_data[0]))
+    return rosters
+
+def get_fixture_players(room_file_name) -> List[Tuple[str, str]]:
+    with codecs.open(room_file_name, "r", "utf-8") as fp:
+        html = WiimmfiSiteFunctions.fix_cloudflare_email(fp.read())
+    races = WiimmfiParser.RoomPageParser(BeautifulSoup(html, "html.parser")).get_room_races()
+    fc_names = {}
+    for race in races[:FIXTURE_RACES_TO_USE]:
+        for placement in race.getPlacements():
+            fc, name = placement.get_fc_and_name()
+            fc_names[fc] = name
+    return list(fc_names.items())
+
+def load_fixture_rosters() -> List[Roster]:
+    rosters = []
+    for description, room_file_name in WiimmfiSiteFunctions.special_test_cases.values():
+        if not os.path.exists(room_file_name):
+            continue
+        try:
+            fc_players = get_fixture_players(room_file_name)
+        except Exception as e:
+            print(f"Could not extract players from '{room_file_name}' ({description}): {e}")
+            continue
+        for players_per_team in FIXTURE_PLAYERS_PER_TEAM:
+            if len(fc_players) >= players_per_team * 2 and len(fc_players) % players_per_team == 0:
+                rosters.append((f"{room_file_name}@{players_per_team}", fc_players, players_per_team, None, None))
+    return rosters
+
+
+def percentile(sorted_values: List[float], percent: float) -> float:
+    if len(sorted_values) == 0:
+        return 0.0
+    rank = max(0, math.ceil(percent / 100 * len(sorted_values)) - 1)
+    return sorted_values[rank]
+
+def summarize_latencies(latencies: List[float]) -> Dict[str, float]:
+    latencies = sorted(latencies)
+    return {"count": len(latencies),
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "max": latencies[-1] if len(latencies) > 0 else 0.0,
+            "mean": sum(latencies) / len(latencies) if len(latencies) > 0 else 0.0}
+
+def agreement_rate(agreed: int, total: int):
+    return None if total == 0 else agreed / total
+
+def run_benchmark(rosters: List[Roster], iterations=1) -> Dict:
+    alpha_latencies = []
+    beta_latencies = []
+    AIs_agreed = 0
+    alpha_matches_recorded = alpha_recorded_total = 0
+    beta_matches_recorded = beta_recorded_total = 0
+    slowest = []
+
+    for source, fc_players, players_per_team, recorded_alpha, recorded_beta in rosters:
+        for _ in range(iterations):
+            t0 = time.perf_counter()
+            alpha_teams = TagAI_BadWolf.getTagsSmart(fc_players, players_per_team)
+            alpha_time = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            _, beta_teams = TagAIShell.get_beta_AI_results(fc_players, players_per_team)
+            beta_time = time.perf_counter() - t0
+            alpha_latencies.append(alpha_time)
+            beta_latencies.append(beta_time)
+        slowest.append((max(alpha_time, beta_time), source, alpha_time, beta_time))
+
+        alpha_teams = TagAIShell.format_into_comparable(alpha_teams)
+        beta_teams = TagAIShell.format_into_comparable(beta_teams)
+        if alpha_teams == beta_teams:
+            AIs_agreed += 1
+        if recorded_alpha is not None:
+            alpha_recorded_total += 1
+            alpha_matches_recorded += TagAIShell.format_into_comparable(recorded_alpha) == alpha_teams
+        if recorded_beta is not None:
+            beta_recorded_total += 1
+            beta_matches_recorded += TagAIShell.format_into_comparable(recorded_beta) == beta_teams
+
+    slowest.sort(reverse=True)
+    return {"created": datetime.now().isoformat(timespec="seconds"),
+            "rosters": len(rosters),
+            "iterations": iterations,
+            "alpha": {"latency": summarize_latencies(alpha_latencies),
+                      "matches_recorded": agreement_rate(alpha_matches_recorded, alpha_recorded_total)},
+            "beta": {"latency": summarize_latencies(beta_latencies),
+                     "matches_recorded": agreement_rate(beta_matches_recorded, beta_recorded_total)},
+            "AI_agreement": agreement_rate(AIs_agreed, len(rosters)),
+            "slowest_rosters": [{"source": source, "alpha": alpha_time, "beta": beta_time} for _, source, alpha_time, beta_time in slowest[:5]]}
+
+
+def find_regressions(results: Dict, baseline: Dict, tolerance=DEFAULT_TOLERANCE, max_p95=None) -> List[str]:
+    regressions = []
+    for AI_name in ("alpha", "beta"):
+        latency = results[AI_name]["latency"]
+        if max_p95 is not None and latency["p95"] > max_p95:
+            regressions.append(f"{AI_name} AI p95 latency {latency['p95']:.5f}s is above the {max_p95}s threshold")
+        if baseline is None:
+            continue
+        old_latency = baseline[AI_name]["latency"]
+        for stat in ("p95", "max"):
+            allowed = old_latency[stat] * (1 + tolerance) + LATENCY_NOISE_FLOOR
+            if latency[stat] > allowed:
+                regressions.append(f"{AI_name} AI {stat} latency regressed: {latency[stat]:.5f}s (baseline {old_latency[stat]:.5f}s, allowed {allowed:.5f}s)")
+    return regressions
+
+def print_results(results: Dict):
+    print(f"Tag AI benchmark over {results['rosters']} rosters ({results['iterations']} iteration(s) each):")
+    for AI_name in ("alpha", "beta"):
+        latency = results[AI_name]["latency"]
+        matches_recorded = results[AI_name]["matches_recorded"]
+        matches_str = "n/a" if matches_recorded is None else f"{matches_recorded:.1%}"
+        print(f"\t{AI_name:<5} AI: p50 {latency['p50']:.5f}s | p95 {latency['p95']:.5f}s | max {latency['max']:.5f}s | matches recorded results: {matches_str}")
+    AI_agreement = results["AI_agreement"]
+    print(f"\tAIs agreed: {'n/a' if AI_agreement is None else f'{AI_agreement:.1%}'}")
+    for slow in results["slowest_rosters"]:
+        print(f"\tSlow roster: {slow['source']} (alpha {slow['alpha']:.5f}s, beta {slow['beta']:.5f}s)")
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the tag AIs over recorded rosters and saved rooms.")
+    parser.add_argument("--output", default=DEFAULT_RESULTS_FILE, help="where to write the JSON results")
+    parser.add_argument("--baseline", default=None, help="JSON results of a previous run to check for latency regressions against")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="allowed fractional latency increase over the baseline")
+    parser.add_argument("--max-p95", type=float, default=None, help="fail if either AI's p95 latency (seconds) is above this")
+    parser.add_argument("--iterations", type=int, default=1, help="number of times to solve each roster")
+    args = parser.parse_args(argv)
+
+    TagAIShell.initialize()
+    rosters = load_recorded_rosters() + load_fixture_rosters()
+    results = run_benchmark(rosters, args.iterations)
+    print_results(results)
+
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    regressions = find_regressions(results, baseline, args.tolerance, args.max_p95)
+    results["regressions"] = regressions
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=4)
+
+    for regression in regressions:
+        print(f"REGRESSION: {regression}")
+    return 1 if len(regressions) > 0 else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -15,6 +15,9 @@ import time
 import os
 import dill
 import common
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from copy import copy
 
 USE_BETA_AI = True
@@ -34,6 +37,10 @@ beta_AI = TagAI_Andrew.get_teams_smart
 AI_Results_file_name = "AI_data.pkl"
 AI_Results = []
 EMPTY_AI_DATA = [None, None, None]
+
+#The AIs are CPU bound and can take seconds for difficult rooms, so they run on this executor rather than on the event loop
+#The alpha AI stops itself at its own deadline (see TagAI_BadWolf.MAX_SOLVING_TIME), so a thread here is never tied up indefinitely
+TAG_AI_EXECUTOR = ThreadPoolExecutor(max_workers=2, thread_name_prefix="TagAI")
             
 def load_pkl_list(list_obj, file_name):
     if os.path.exists(file_name):
@@ -131,6 +138,11 @@ def determineTags(players, playersPerTeam=None, give_beta_ai_format=True):
         return beta_team_results
     else:
         return alpha_team_results
+
+async def determineTagsAsync(players, playersPerTeam=None, give_beta_ai_format=True):
+    """Runs determineTags on the tag AI executor so other channels aren't blocked while the AIs are solving"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(TAG_AI_EXECUTOR, functools.partial(determineTags, players, playersPerTeam, give_beta_ai_format))
         
     
 def initialize():
@@ -217,9 +229,33 @@ def view_AI_results():
     print(f"Beta  AIs average time for solving: {round((total_beta_ai_time_taken/total_beta_ai_results), 5)}s")
     print(f"Alpha AIs longest time for solving: {round(max(data[1][1] for data in AI_Results), 5)}s")
     print(f"Beta  AIs longest time for solving: {round(max(data[2][1] for data in AI_Results), 5)}s")
+
+def benchmark_alpha_AI(max_time=TagAI_BadWolf.MAX_SOLVING_TIME):
+    #Replays every recorded roster through the alpha AI and reports its worst-case latency
+    latencies = []
+    for stored_fc_players, alpha_AI_data, beta_AI_data in AI_Results:
+        players_per_team = alpha_AI_data[2] if alpha_AI_data[2] is not None else beta_AI_data[2]
+        if players_per_team is None:
+            continue
+        t0 = time.perf_counter()
+        TagAI_BadWolf.getTagsSmart(stored_fc_players, players_per_team, max_time)
+        latencies.append((time.perf_counter() - t0, players_per_team, stored_fc_players))
+    
+    if len(latencies) == 0:
+        print("No recorded rosters to benchmark the alpha AI with.")
+        return
+    latencies.sort(key=lambda l: l[0], reverse=True)
+    worst_time, worst_players_per_team, worst_fc_players = latencies[0]
+    print(f"Alpha AI benchmark over {len(latencies)} recorded rosters:")
+    print(f"\tAverage time for solving: {round(sum(l[0] for l in latencies)/len(latencies), 5)}s")
+    print(f"\tWorst-case time for solving: {round(worst_time, 5)}s (players per team: {worst_players_per_team})")
+    print(f"\tWorst-case roster: {[player for _, player in worst_fc_players]}")
+    if worst_time >= max_time:
+        print(f"\tWarning: the worst-case roster hit the {max_time}s deadline, so the alpha AI gave an alphabetical solution")
             
 if __name__ == '__main__':
     initialize()
     GIVE_BETA_AI_TEAM_FORMAT = True
     rerun_AIs_for_all(GIVE_BETA_AI_TEAM_FORMAT)
-    view_AI_results()
\ No newline at end of file
+    view_AI_results()
+    benchmark_alpha_AI()
\ No newline at end of file
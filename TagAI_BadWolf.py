@@ -4,15 +4,17 @@ Created on Sep 23, 2020
 @author: willg
 '''
 from typing import List, Set, Dict, Tuple
-from copy import copy
 from datetime import datetime, timedelta
 from collections import defaultdict
+from functools import lru_cache
 import time
 
 VALID_CHARS = "/\\*^+abcdefghijklmnopqrstuvwxyz\u03A9\u038F" + "abcdefghijklmnopqrstuvwxyz0123456789".upper()
 UNICODE_MAPPINGS_TO_ALPHA = {"@":"A", "\u00A7":"S", "$":"S", "\u00A2":"c", "\u00A5":"Y", "\u20AC":"E", "\u00A3":"E", "\u00E0":"a", "\u00E1":"a", "\u00E2":"a", "\u00E4":"a", "\u00E5":"a", "\u00E6":"ae", "\u00E3":"a", "\u00E7":"c", "\u00E8":"e", "\u00E9":"e", "\u00EA":"e", "\u00EB":"e", "\u00EC":"i", "\u00ED":"i", "\u00EE":"i", "\u00EF":"i", "\u00F1":"n", "\u00F2":"o", "\u00F3":"o", "\u00F4":"o", "\u00F6":"o", "\u0153":"oe", "\u00F8":"o", "\u00F5":"o", "\u00DF":"B", "\u00F9":"u", "\u00FA":"u", "\u00FB":"u", "\u00FC":"u", "\u00FD":"y", "\u00FF":"y", "\u00C0":"A", "\u00C1":"A", "\u00C2":"A", "\u00C4":"A", "\u00C5":"A", "\u00C6":"AE", "\u00C3":"A", "\u00C7":"C", "\u00C8":"E", "\u00C9":"E", "\u00CA":"E", "\u00CB":"E", "\u00CC":"I", "\u00CD":"I", "\u00CE":"I", "\u00CF":"I", "\u00D1":"N", "\u00D2":"O", "\u00D3":"O", "\u00D4":"O", "\u00D6":"O", "\u0152":"OE", "\u00D8":"O", "\u00D5":"O", "\u00D9":"U", "\u00DA":"U", "\u00DB":"U", "\u00DC":"U", "\u00DD":"Y", "\u0178":"Y", "\u03B1":"a", "\u03B2":"B", "\u03B3":"y", "\u03B4":"o", "\u03B5":"e", "\u03B6":"Z", "\u03B7":"n", "\u03B8":"O", "\u03B9":"i", "\u03BA":"k", "\u03BB":"A", "\u03BC":"u", "\u03BD":"v", "\u03BE":"E", "\u03BF":"o", "\u03C0":"r", "\u03C1":"p", "\u03C3":"o", "\u03C4":"t", "\u03C5":"u", "\u03C6":"O", "\u03C7":"X", "\u03C8":"w", "\u03C9":"W", "\u0391":"A", "\u0392":"B", "\u0393":"r", "\u0394":"A", "\u0395":"E", "\u0396":"Z", "\u0397":"H", "\u0398":"O", "\u0399":"I", "\u039A":"K", "\u039B":"A", "\u039C":"M", "\u039D":"N", "\u039E":"E", "\u039F":"O", "\u03A0":"N", "\u03A1":"P", "\u03A3":"E", "\u03A4":"T", "\u03A5":"Y", "\u03A6":"O", "\u03A7":"X", "\u03A8":"w", "\u0386":"A", "\u0388":"E", "\u0389":"H", "\u038A":"I", "\u038C":"O", "\u038E":"Y", "\u0390":"i", "\u03AA":"I", "\u03AB":"Y", "\u03AC":"a", "\u03AD":"E", "\u03AE":"n", "\u03AF":"i", "\u03B0":"u", "\u03C2":"c", "\u03CA":"i", "\u03CB":"u", "\u03CC":"o", "\u03CD":"u", "\u03CE":"w", "\u2122":"TM", "\u1D49":"e", "\u00A9":"C", "\u00AE":"R", "\u00BA":"o", "\u00AA":"a", "\u266D":"b"}
 #other_players_context is simple a list of other players names
 REMOVE_IF_START_WITH = "/\\*^+"
+#Maximum number of seconds the overlap solver is allowed to spend on a single room
+MAX_SOLVING_TIME = 5
 import BaseTagAI
 
 #Returns 2 values. The first is the ranking value used by sorting methods, the 2nd is the tag itself
@@ -23,6 +25,8 @@ import BaseTagAI
 #the tie breaker goes to actual tag, and so lambda would be a distinctly different "ranking" than A if there were actually 2 teams (lambda and A)
 
 
+#Every name is broken into all of its prefixes and suffixes, and the solver compares those many times, so cache the values
+@lru_cache(maxsize=8192)
 def _get_tag_value(tag):
     while len(tag) > 0:
         if tag[0] in REMOVE_IF_START_WITH:
@@ -172,19 +176,7 @@ def count_tags_at_front(solution):
                 count += 1
     return count
 
-def __choose_best_solution(solutions: List[Dict[Tuple[str, str, int], Set[Tuple[str,str]]]]) -> Dict[Tuple[str, str, int], Set[Tuple[str,str]]]:
-    
-    proccessing_solution_start_time = time.perf_counter()
-    did_cut_off = False
-    notified = False
-    def should_cut_off(max_time=5):
-        is_beyond_time = (time.perf_counter() - proccessing_solution_start_time) > max_time
-        if is_beyond_time and not notified:
-            print("is beyond time in choosing best solution")
-            notified = True
-        return 
-    
-
+def __choose_best_solution(solutions: List[Dict[Tuple[str, str, int], Set[Tuple[str,str]]]], deadline:float=None) -> Dict[Tuple[str, str, int], Set[Tuple[str,str]]]:
     if len(solutions) == 0: #There were no solutions
         return None
     
@@ -193,17 +185,14 @@ def __choose_best_solution(solutions: List[Dict[Tuple[str, str, int], Set[Tuple[
     #if len(solutions) == 1: #There was only one solution, so return it
     #    return solutions[0]
     else:
-        number_of_teams = len(solutions[0])
         #TODO: Do something smart
         eliminate = set()
         for sol_1_index, solution_1 in enumerate(solutions):
+            if _is_past_deadline(deadline):
+                return None
             
             for sol_2_index, solution_2 in enumerate(solutions):
                 if sol_2_index != sol_1_index:
-                    did_cut_off = should_cut_off()
-                    if did_cut_off:
-                        return None
-                    
                     for (tag_1_val, _, _), player_set_1 in solution_1.items():
                         for (tag_2_val, _, _), player_set_2 in solution_2.items():
                             if tag_1_val != tag_2_val:
@@ -224,8 +213,7 @@ def __choose_best_solution(solutions: List[Dict[Tuple[str, str, int], Set[Tuple[
             index_with_most = 0
             index_with_most_count = -1
             for ind, sol in enumerate(solutions):
-                did_cut_off = should_cut_off()
-                if did_cut_off:
+                if _is_past_deadline(deadline):
                     return None
                 tag_at_front_count = count_tags_at_front(sol) #count
                 if tag_at_front_count > index_with_most_count:
@@ -234,10 +222,14 @@ def __choose_best_solution(solutions: List[Dict[Tuple[str, str, int], Set[Tuple[
             return solutions[index_with_most]
         else:
             return None
+
+
+def _is_past_deadline(deadline:float) -> bool:
+    return deadline is not None and time.perf_counter() > deadline
         
             
                 
-def __clean_by_overlap(all_possible_counts: Dict[Tuple[str, str], List[Tuple[str, str, int]]], playersPerTeam:int):       
+def __clean_by_overlap(all_possible_counts: Dict[Tuple[str, str], List[Tuple[str, str, int]]], playersPerTeam:int, deadline:float=None):       
     #if there exists a combination of players and tags such that no player is on both teams, this combination is most likely correct
     #At this point, hopefully, all players will have at least one possible tag - if they don't, we'll handle that in the calling function after this runs
     #The important thing at this point is to eliminate any tags that create an impossible scenario, such as player 1 being on both tag Ap and tag Pw
@@ -262,103 +254,100 @@ def __clean_by_overlap(all_possible_counts: Dict[Tuple[str, str], List[Tuple[str
                         players_on_more_than_one_team.add(p_1)
    
     #Each player can only appear once, and each tag must have the same or more players per team as numPlayersPerTeam
-    def is_possible_solution(tags_possibilities:List[Tuple[Tuple[str, str, int], Set[Tuple[str,str]]]], allPlayers:List[Tuple[str, str]], playersPerTeam:int):
-        #check if the solution set has the same players as the original player set
-        #if it doesn't, it clearly can't be a valid solution
-        solution_players = set()
-        for tags_players in tags_possibilities.values():
-            solution_players.update(tags_players)
-        if allPlayers != solution_players:
-            return False
-        possible_solution = True
-        for player in allPlayers:
-            instanceCount = 0
-            for (tag, players) in tags_possibilities.items():
-                if len(players) != playersPerTeam:
-                        return False
-                if player in players:
-                    instanceCount += 1
-                    if instanceCount >= 2:
-                        return False
-        return possible_solution
-                    
-            #we have the correct number of teams, now we need to check if each team has the right number of players
+    def is_possible_solution(tags_possibilities:Dict[Tuple[str, str, int], Set[Tuple[str,str]]]):
+        #every tag must have exactly playersPerTeam players, and the tags must cover each player exactly once
+        player_count = 0
+        for players in tags_possibilities.values():
+            if len(players) != playersPerTeam:
+                return False
+            player_count += len(players)
+        return player_count == len(all_players) and set().union(*tags_possibilities.values()) == all_players
     
     def copy_solution(tags_possibilities:Dict[Tuple[str, str, int], Set[Tuple[str,str]]]) -> Dict[Tuple[str, str, int], Set[Tuple[str,str]]]:
-        solution_copy = {}
-        for tag, players in tags_possibilities.items():
-            players_copy = set()
-            for fc, player in players:
-                players_copy.add( (copy(fc), copy(player)))
-            solution_copy[( copy(tag[0]), copy(tag[1]), copy(tag[2]) )] = players_copy
-        return solution_copy
-    
-    max_time_solving = 5
-    tag_recur_start = time.perf_counter()
-    notified = False
-    def beyond_time():
-        is_beyond_time = (time.perf_counter() - tag_recur_start) > max_time_solving
-        if is_beyond_time and not notified:
-            print("is beyond time")
-            notified = True
-        return is_beyond_time
-    
-    
-    def all_possible_solutions_recurrsion(duplicates:List[Tuple[str, str]], tags_possibilities:List[Tuple[str, Set[Tuple[str,str]]]], allPlayers:List[Tuple[str, str]], possible_solutions:List[Tuple[str, Set[Tuple[str,str]]]], playersPerTeam:int):
-        if beyond_time():
-            
-            return
+        #tags and players are tuples of strings, which are immutable, so only the sets need copying
+        return {tag:set(players) for tag, players in tags_possibilities.items()}
+    
+    #Branch and bound: returns True if no solution can exist anywhere below the current state
+    #Players are only ever removed from tags when they are a duplicate that hasn't been decided yet, and tags are only ever removed when they have too few players
+    #So if a player isn't on any tag anymore, or a tag has more than playersPerTeam players that can't be removed from it, nothing below this state will ever be a solution
+    def cannot_be_solved(tags_possibilities:Dict[Tuple[str, str, int], Set[Tuple[str,str]]], undecided_players:Set[Tuple[str, str]]):
+        if set().union(*tags_possibilities.values()) != all_players:
+            return True
+        for players in tags_possibilities.values():
+            if len(players) > playersPerTeam and len(players - undecided_players) > playersPerTeam:
+                return True
+        return False
+    
+    #The search decides duplicates in a fixed order, so the number of undecided duplicates and the current tags fully describe a subproblem
+    #Different orders of decisions frequently arrive at the same subproblem (especially once tags get removed for having too few players), and those subproblems only produce solutions we already have
+    def state_key(tags_possibilities:Dict[Tuple[str, str, int], Set[Tuple[str,str]]], undecided_count:int):
+        return undecided_count, frozenset((tag, frozenset(players)) for tag, players in tags_possibilities.items())
+    
+    
+    #Iterative depth first search. The tags dictionary is modified in place going down, and each frame on the stack knows how to undo its change when coming back up.
+    #Each frame is [duplicate player being decided, the tags that player could be on, index of the next tag to try, the undo information for the tag currently being tried]
+    def search_solutions(duplicates:List[Tuple[str, str]], tags_possibilities:Dict[Tuple[str, str, int], Set[Tuple[str,str]]]) -> List[Dict[Tuple[str, str, int], Set[Tuple[str,str]]]]:
+        possible_solutions = []
+        seen_states = set()
+        stack = []
         
-        if is_possible_solution(tags_possibilities, allPlayers, playersPerTeam):
-            possible_solutions.append(copy_solution(tags_possibilities))
-                
-        if len(duplicates) == 0:
-            return
-        
-        this_duplicate = duplicates.pop()
-        
-        duplicate_tags = []
-        for tag, players in tags_possibilities.items():
-            if this_duplicate in players:
-                duplicate_tags.append(tag)
+        def enter_state():
+            key = state_key(tags_possibilities, len(duplicates))
+            if key in seen_states:
+                return
+            seen_states.add(key)
+            
+            if is_possible_solution(tags_possibilities):
+                possible_solutions.append(copy_solution(tags_possibilities))
+                #A valid solution has no players on more than one tag, so going further down would only find this exact solution again
+                return
+            if len(duplicates) == 0 or cannot_be_solved(tags_possibilities, set(duplicates)):
+                return
+            
+            this_duplicate = duplicates.pop()
+            duplicate_tags = [tag for tag, players in tags_possibilities.items() if this_duplicate in players]
+            stack.append([this_duplicate, duplicate_tags, 0, None])
         
-        for i in duplicate_tags:
-            remove_these = []
-            for j in duplicate_tags:
-                if i != j:
-                    remove_these.append(j)
+        enter_state()
+        while len(stack) > 0:
+            if _is_past_deadline(deadline):
+                return None
+            frame = stack[-1]
+            this_duplicate, duplicate_tags, next_tag_index, undo = frame
+            
+            #Coming back up from the state below this one, so put back what we removed to get there
+            if undo is not None:
+                remove_these, not_enough_players = undo
+                tags_possibilities.update(not_enough_players)
+                for x in remove_these:
+                    tags_possibilities[x].add(this_duplicate)
+                frame[3] = None
             
+            if next_tag_index == len(duplicate_tags):
+                stack.pop()
+                duplicates.append(this_duplicate)
+                continue
+            frame[2] += 1
+            
+            #Put the duplicate player on this tag only
+            chosen_tag = duplicate_tags[next_tag_index]
+            remove_these = [tag for tag in duplicate_tags if tag != chosen_tag]
             for x in remove_these:
                 tags_possibilities[x].remove(this_duplicate)
-                
-            #Remove empty tags before checking for solution (so the function works)
-            #alpha beta pruning as well
-            #don't even go down the path if there's a tag with less players per team than the format has
-            not_enough_players = {}
-            for tag, players in tags_possibilities.items():
-                if players is None or len(players) < playersPerTeam:
-                    not_enough_players[tag] = players
-            for tag in not_enough_players:
-                del(tags_possibilities[tag])
             
-            all_possible_solutions_recurrsion(duplicates, tags_possibilities, allPlayers, possible_solutions, playersPerTeam)
-            if beyond_time():
-                return
-            
-            #Coming back up from the recursion, need to add those empty tags back in case we're putting players in them
-            tags_possibilities.update(not_enough_players)
+            #Remove tags with fewer players than the format has, we don't even go down that path
+            not_enough_players = {tag:players for tag, players in tags_possibilities.items() if players is None or len(players) < playersPerTeam}
+            for tag in not_enough_players:
+                del tags_possibilities[tag]
             
-            for x in remove_these: #coming back up from the recursion, need to put them back in
-                tags_possibilities[x].add(this_duplicate)
-        duplicates.append(this_duplicate)
-        return
+            frame[3] = (remove_these, not_enough_players)
+            enter_state()
+        
+        return possible_solutions
     
     dups = list(players_on_more_than_one_team)
     all_players = set(all_possible_counts.keys())
-    all_possible_solutions = []
-    all_possible_solutions_recurrsion(dups, tag_players, all_players, all_possible_solutions, playersPerTeam)
-    if beyond_time():
-        return None
+    all_possible_solutions = search_solutions(dups, tag_players)
     if all_possible_solutions is None or len(all_possible_solutions) == 0:
         return None
     
@@ -366,7 +355,7 @@ def __clean_by_overlap(all_possible_counts: Dict[Tuple[str, str], List[Tuple[str
     #    print("Possible solution #" + str(number))
     #    print(solution)
     #print(all_possible_solutions)
-    best_solution = __choose_best_solution(all_possible_solutions)
+    best_solution = __choose_best_solution(all_possible_solutions, deadline)
     if best_solution is None:
         return None
     players_tags = {}
@@ -384,6 +373,7 @@ def __clean_by_overlap(all_possible_counts: Dict[Tuple[str, str], List[Tuple[str
     
 
 
+
 def __choose_and_cleanup(counts: Dict[Tuple[str, str], List[Tuple[str, str, int]]]) -> Dict[Tuple[str, str], Tuple[str, str]]:
     fc_player_tags = {}
     
@@ -419,9 +409,11 @@ def __majorityTagCorrection(counts: Dict[Tuple[str, str], List[Tuple[str, str]]]
             counts[fc_player] = (tag[0], replacement_tags[tag[0]])
     return counts
 
-def getTagsSmart(fc_players:List[Tuple[str, str]], playersPerTeam:int) -> Dict[Tuple[str, str], Tuple[str, str]]:
+def getTagsSmart(fc_players:List[Tuple[str, str]], playersPerTeam:int, max_time:float=MAX_SOLVING_TIME) -> Dict[Tuple[str, str], Tuple[str, str]]:
     #import time
     #startTime = time.perf_counter_ns() 
+    #The solver checks this deadline as it goes and gives up (falling back to alphabetical tags) once it passes, so callers running this in an executor always get their thread back
+    deadline = None if max_time is None else time.perf_counter() + max_time
     if playersPerTeam <= 1:
         return BaseTagAI.get_ffa_teams(fc_players)
             
@@ -433,7 +425,7 @@ def getTagsSmart(fc_players:List[Tuple[str, str]], playersPerTeam:int) -> Dict[T
     
     __clean(tag_counts)
     __clean_by_num_players(tag_counts, playersPerTeam)
-    temp = __clean_by_overlap(tag_counts, playersPerTeam)
+    temp = __clean_by_overlap(tag_counts, playersPerTeam, deadline)
     
 
     if temp is None or len(temp) == 0:
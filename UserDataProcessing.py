@@ -5,30 +5,33 @@ Created on Jul 25, 2020
 '''
 #DN = Discord Name
 import asyncio
-import os
-from collections import defaultdict
+import sqlite3
 from typing import Dict, Tuple, Union
 import common
 from datetime import datetime, timedelta
 
 from data_tracking import DataTracker
+import UserDataStore
 import UtilityFunctions as UF
 
 seperator = "="
 
 
-fc_discord_id_file_is_open = False
-discordId_lounges_file_is_open = False
-discordId_flags_file_is_open = False
+#These are read through from UserDataStore's SQLite database (see UserDataStore.ReadThroughTable), and are changed with the functions below
+fc_discordId = UserDataStore.ReadThroughTable(UserDataStore.get_fc_discord_id, UserDataStore.get_all_fc_discord_ids,
+                                             lambda: UserDataStore.count_keys("FC_Discord_ID", "fc")) # Contains friend codes mapped to a Tuple[associated discord id, datetime that the friend code was last used]
+discordId_fc = UserDataStore.ReadThroughTable(UserDataStore.get_discord_id_fcs, UserDataStore.get_all_discord_id_fcs,
+                                             lambda: UserDataStore.count_keys("FC_Discord_ID", "discord_id")) # Contains discord ids mapped to a List[List[associated friend code, datetime that the friend code was last used]], most recently used first
 
-fc_discordId = {} # Contains friend codes mapped to a Tuple[associated discord id, datetime that the friend code was last used]
-discordId_fc = {} # Contains discord ids codes mapped to a Tuple[associated friend code, datetime that the friend code was last used]
+discordId_lounges = UserDataStore.ReadThroughTable(UserDataStore.get_lounge_name, UserDataStore.get_all_lounge_names,
+                                                  lambda: UserDataStore.count_keys("Discord_ID_Lounge", "discord_id"))  # Contains discord IDs mapped to the correct capitalization and spacing of their Lounge name
+lounges_discordId = UserDataStore.ReadThroughTable(UserDataStore.get_discord_id_by_lookup_name, UserDataStore.get_all_lookup_names,
+                                                  lambda: UserDataStore.count_keys("Discord_ID_Lounge", "lookup_name"))  # Contains a lookup version of someone's Lounge name mapped to their discord ID
 
-discordId_lounges = {}  # Contains discord IDs mapped to the correct capitalization and spacing of their Lounge name
-lounges_discordId = {}  # Contains a lookup version of someone's Lounge name mapped to their discord ID
-
-discordId_flags = {}  # Contains discord IDs mapped to the the flag code for that user
-blacklisted_users = {}
+discordId_flags = UserDataStore.ReadThroughTable(UserDataStore.get_flag, UserDataStore.get_all_flags,
+                                                lambda: UserDataStore.count_keys("Discord_ID_Flag", "discord_id"))  # Contains discord IDs mapped to the the flag code for that user
+blacklisted_users = UserDataStore.ReadThroughTable(UserDataStore.get_blacklist_reason, UserDataStore.get_all_blacklisted_users,
+                                                  lambda: UserDataStore.count_keys("Blacklisted_User", "discord_id"))
 
 valid_flag_codes = set()
 
@@ -77,29 +80,11 @@ def read_Blacklisted_file(filename=common.BLACKLISTED_USERS_FILE):
     return temp
 
 def add_Blacklisted_user(discord_id, reason):
-    global blacklisted_users
     discord_id = str(discord_id)
-    if discord_id in blacklisted_users:
-        del blacklisted_users[discord_id]
-        
-        temp_file_name = f"{common.BLACKLISTED_USERS_FILE}_temp"
-        with open(temp_file_name, "w", encoding="utf-8", errors="replace") as temp_out, open(common.BLACKLISTED_USERS_FILE, "r", encoding="utf-8", errors="replace") as original:
-            for line in original:
-                if line.strip("\n").split(seperator)[0] != discord_id:
-                    temp_out.write(line)
-        
-            if reason not in ["unban", "remove", "unblacklist", ""]:
-                temp_out.write(discord_id + seperator + reason + "\n")
-                blacklisted_users[discord_id] = reason
-                    
-        os.remove(common.BLACKLISTED_USERS_FILE)
-        os.rename(temp_file_name, common.BLACKLISTED_USERS_FILE)
-    else:
-        if reason not in ["unban", "remove", "unblacklist", ""]:
-            with open(common.BLACKLISTED_USERS_FILE, "a", encoding="utf-8", errors="replace") as f:
-                f.write(str(discord_id) + seperator + reason + "\n")
-                blacklisted_users[discord_id] = reason
-    
+    if reason in ["unban", "remove", "unblacklist", ""]:
+        reason = None
+    UserDataStore.set_blacklist_reason(discord_id, reason)
+    blacklisted_users.set_cached(discord_id, blacklisted_users.MISSING if reason is None else reason)
     return True
 
    
@@ -113,38 +98,12 @@ def read_DiscordID_Flags_file(filename=common.DISCORD_ID_FLAGS_FILE):
     return temp
 
 def add_flag(discord_id, flag):
-    global discordId_flags_file_is_open
-    
     discord_id = str(discord_id)
-    if discordId_flags_file_is_open:
-        return False
-    else:
-        discordId_flags_file_is_open = True
-        
-        #If their discord ID already has a flag.... go remove their flag, then add it
-        if discord_id in discordId_flags:
-            del discordId_flags[discord_id]
-            
-            temp_file_name = f"{common.DISCORD_ID_FLAGS_FILE}_temp"
-            with open(temp_file_name, "w", encoding="utf-8", errors="replace") as temp_out, open(common.DISCORD_ID_FLAGS_FILE, "r", encoding="utf-8", errors="replace") as original:
-                for line in original:
-                    if line.strip("\n").split(seperator)[0] != discord_id:
-                        temp_out.write(line)
-            
-                if flag not in ["none", ""]:
-                    temp_out.write(discord_id + seperator + flag + "\n")
-                    discordId_flags[discord_id] = flag
-                        
-            os.remove(common.DISCORD_ID_FLAGS_FILE)
-            os.rename(temp_file_name, common.DISCORD_ID_FLAGS_FILE)
-        else:
-            if flag not in ["none", ""]:
-                with open(common.DISCORD_ID_FLAGS_FILE, "a", encoding="utf-8", errors="replace") as f:
-                    f.write(str(discord_id) + seperator + flag + "\n")
-                    discordId_flags[discord_id] = flag
-        
-        discordId_flags_file_is_open = False
-        return True
+    if flag in ["none", ""]:
+        flag = None
+    UserDataStore.set_flag(discord_id, flag)
+    discordId_flags.set_cached(discord_id, discordId_flags.MISSING if flag is None else flag)
+    return True
 
 def get_flag_for_fc(fc):
     return get_flag(get_discord_id_from_fc(fc))
@@ -152,37 +111,25 @@ def get_flag_for_fc(fc):
 def get_flag(discord_id):
     if discord_id is None or discord_id == "":
         return None
-    discord_id = str(discord_id)
-    if discord_id in discordId_flags:
-        return discordId_flags[discord_id]
-    return None
+    return discordId_flags.get(str(discord_id))
     
 
+#The text files are only read once, to copy them into UserDataStore (see initialize)
 def read_DiscordID_Lounges_file(filename=common.DISCORD_ID_LOUNGES_FILE):
+    '''Returns the discord IDs mapped to (lounge name, lookup version of the lounge name)'''
     common.check_create(filename)
     did_lounges = {}
-    lounges_did = {}
-    counter = 1
     with open(filename, "r", encoding="utf-8", errors="replace" ) as f:
         for line in f:
-            counter += 1
             DID, lounge_name = line.split(seperator)
-            did_lounges[DID] = lounge_name.strip()
-
-            lounge_name = process_lounge_name(lounge_name)
-            if lounge_name in lounges_did:
-                if get_last_used_fc_time(DID) > get_last_used_fc_time(lounges_did[lounge_name]):
-                    lounges_did[lounge_name] = DID
-            else:
-                lounges_did[lounge_name] = DID
+            did_lounges[DID] = (lounge_name.strip(), process_lounge_name(lounge_name))
 
-    return did_lounges, lounges_did
+    return did_lounges
 
 
 def read_FC_DiscordID_file(filename=common.FC_DISCORD_ID_FILE):
     common.check_create(filename)
     fc_did = {}
-    did_fc = defaultdict(list)
     counter = 0
     with open(filename,"r",encoding="utf-8",errors="replace") as f:
         for line in f:
@@ -195,58 +142,23 @@ def read_FC_DiscordID_file(filename=common.FC_DISCORD_ID_FILE):
             else:
                 counter += 1
             fc_did[FC] = (DID.strip(),last_used)
-            did_fc[DID].append([FC,last_used])
 
-    return fc_did,did_fc
+    return fc_did
  
 def non_async_dump_data():
-    global fc_discord_id_file_is_open
-    global discordId_lounges_file_is_open
-    global fc_discordId
-    global discordId_lounges
-    
-    if fc_discord_id_file_is_open or discordId_lounges_file_is_open:
+    #Every change is already committed to UserDataStore when it's made, so this only moves them out of its write-ahead log
+    try:
+        UserDataStore.checkpoint()
+    except sqlite3.Error as e:
+        print(e)
         return False
-    else:
-        fc_discord_id_file_is_open = True
-        discordId_lounges_file_is_open = True
-        common.check_create(common.FC_DISCORD_ID_FILE)
-        common.check_create(common.DISCORD_ID_LOUNGES_FILE)
-
-        
-        #Next, let's add all of the fc and lounge names to the file and dictionary
-        temp_file_name = f"{common.DISCORD_ID_LOUNGES_FILE}_temp"
-        with open(temp_file_name, "w", encoding="utf-8", errors="replace") as temp_out, open(common.DISCORD_ID_LOUNGES_FILE, "r", encoding="utf-8", errors="replace") as original:
-            for discord_id, lounge_name in discordId_lounges.items():
-                temp_out.write(discord_id + seperator + lounge_name + "\n")
-                
-
-        os.remove(common.DISCORD_ID_LOUNGES_FILE)
-        os.rename(temp_file_name, common.DISCORD_ID_LOUNGES_FILE)
-        
-        
-        temp_file_name = f"{common.FC_DISCORD_ID_FILE}_temp"
-        with open(temp_file_name, "w", encoding="utf-8", errors="replace") as temp_out, open(common.FC_DISCORD_ID_FILE, "r", encoding="utf-8", errors="replace") as original:
-            for fc, (discord_id, last_used) in fc_discordId.items():
-                temp_out.write(fc + seperator + discord_id + seperator + str(last_used) + "\n")
-        
-        os.remove(common.FC_DISCORD_ID_FILE)
-        os.rename(temp_file_name, common.FC_DISCORD_ID_FILE)
-        
-        fc_discord_id_file_is_open = False
-        discordId_lounges_file_is_open = False
-        return True
+    return True
     
 async def dump_data():
     return non_async_dump_data()
 
 def get_lounge(discord_id):
-    discord_id = str(discord_id)
-    global discordId_lounges
-    
-    if discord_id in discordId_lounges:
-        return discordId_lounges[discord_id]
-    return None
+    return discordId_lounges.get(str(discord_id))
 
 def get_discord_id_from_fc(fc: Union[str, None]) -> Union[str, None]:
     if fc is None or fc not in fc_discordId:
@@ -258,15 +170,10 @@ def get_all_fcs(discord_id, include_time=False):
     if discord_id is None:
         return []
         
-    discord_id = str(discord_id)
-    if discord_id not in discordId_fc:
-        return []
-
-    fcs = discordId_fc[discord_id]
-    fcs.sort(key=lambda d:d[1], reverse=True)
+    fcs = discordId_fc.get(str(discord_id), [])
 
     if include_time:
-        return [data for data in fcs]
+        return [list(data) for data in fcs]
     else:
         return [data[0] for data in fcs]
 
@@ -280,10 +187,7 @@ def get_DiscordID_By_LoungeName(lounge_name:str):
     if lounge_name is None:
         return ''
 
-    lounge_name = process_lounge_name(lounge_name)
-    if lounge_name not in lounges_discordId:
-        return ''
-    return lounges_discordId[lounge_name]
+    return lounges_discordId.get(process_lounge_name(lounge_name), '')
 
 def getFCsByLoungeName(lounge_name:str):
     if lounge_name is None:
@@ -294,25 +198,22 @@ def getFCsByLoungeName(lounge_name:str):
     return get_all_fcs(did)
 
 def addIDsLounges(to_add: Dict[str,str]):
-    global discordId_lounges
-    discordId_lounges.update(to_add)
+    UserDataStore.store_lounge_names({DID: (lounge_name, process_lounge_name(lounge_name)) for DID, lounge_name in to_add.items()})
 
     for DID, lounge_name in to_add.items():
-        lounges_discordId[process_lounge_name(lounge_name)] = DID
+        discordId_lounges.set_cached(DID, lounge_name)
+        lounges_discordId.set_cached(process_lounge_name(lounge_name), DID)
 
 def addFCsIDs(to_add: Dict[str,Tuple[str,datetime]]):
-    global fc_discordId
-    fc_discordId.update(to_add)
+    #The discord ids that had these FCs before, whose FC lists change too
+    changed_dids = {fc_discordId[fc][0] for fc in to_add if fc in fc_discordId}
+    UserDataStore.store_fc_discord_ids(to_add)
 
     for fc, pair in to_add.items():
-        did, time = pair
-
-        for pair in discordId_fc[did]:
-            if pair[0] == fc:
-                pair[1] = time
-
-        if fc not in [x[0] for x in discordId_fc[did]]:
-            discordId_fc[did].append([fc,time])
+        fc_discordId.set_cached(fc, pair)
+        changed_dids.add(pair[0])
+    for did in changed_dids:
+        discordId_fc.invalidate(did)
 
     asyncio.create_task(DataTracker.add_player_fcs(to_add))
     
@@ -331,24 +232,18 @@ def read_valid_flags_file(filename=common.FLAG_CODES_FILE):
     return flag_codes
     
 def initialize():
-    global discordId_flags
-    global discordId_lounges
-    global lounges_discordId
-    global fc_discordId
-    global discordId_fc
-    global valid_flag_codes
-    global blacklisted_users
-
-    discordId_flags.clear()
-    discordId_flags.update(read_DiscordID_Flags_file())
+    UserDataStore.load()
+    #The first time the store is opened, the text files the user data used to be kept in are copied into it
+    if not UserDataStore.is_migrated():
+        print(f"{datetime.now()}: Copying user data text files into {common.USER_DATA_DATABASE_FILE}...")
+        UserDataStore.migrate(read_FC_DiscordID_file(), read_DiscordID_Lounges_file(), read_DiscordID_Flags_file(), read_Blacklisted_file())
+        print(f"{datetime.now()}: Finished copying user data text files.")
 
-    fc_discordId, discordId_fc = read_FC_DiscordID_file()
-    discordId_lounges, lounges_discordId = read_DiscordID_Lounges_file()
+    for table in (fc_discordId, discordId_fc, discordId_lounges, lounges_discordId, discordId_flags, blacklisted_users):
+        table.clear_cache()
 
     # valid_flag_codes.clear()
     # valid_flag_codes.update(get_valid_flags())
-    blacklisted_users.clear()
-    blacklisted_users.update(read_Blacklisted_file())
     
 #2021-04-03 20:29:45.779373
 def convert_datetime_str(datetime_str:str):
@@ -0,0 +1,276 @@
+'''
+Created on Oct 19, 2026
+
+@author: willg
+
+SQLite store of UserDataProcessing's user data: FC to discord id links, lounge names, flags and blacklisted users.
+
+They used to be kept in flat text files that were reparsed line by line on startup, and fully rewritten every time they were saved. They're now
+rows in common.USER_DATA_DATABASE_FILE, and every change is written (and committed) as it's made. The database is opened in WAL mode with
+synchronous=NORMAL: a crash can't leave the store half written, and a commit doesn't wait for an fsync, so writes stay cheap enough to make on the
+event loop's thread. A power loss (but not the bot crashing) can lose the changes made since the last checkpoint.
+
+The text files are copied into the database once, the first time it's opened (see UserDataProcessing.initialize). They're left where they are.
+The database is only opened by load - until then, lookups find nothing and writes raise, so scripts that never load the store don't create a database.
+
+The mappings are read through ReadThroughTable, which caches the rows it has looked up, so only the users the bot actually sees are kept in memory.
+The queries are point lookups on primary keys and indexes, so they are run directly on the event loop's thread.
+'''
+import sqlite3
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+from datetime import datetime
+from typing import Callable, Dict, List, Tuple, Union
+
+import common
+
+#The schema version saved in user_version once the text files have been copied into the store
+MIGRATED_USER_VERSION = 1
+#Each ReadThroughTable keeps at most this many looked up keys (the least recently used are dropped first)
+MAX_CACHED_KEYS = 50000
+LAST_USED_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+USER_DATA_SCHEMA = """CREATE TABLE IF NOT EXISTS FC_Discord_ID(
+    fc TEXT PRIMARY KEY NOT NULL,
+    discord_id TEXT NOT NULL,
+    last_used TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS FC_Discord_ID_discord_id ON FC_Discord_ID(discord_id, last_used);
+CREATE TABLE IF NOT EXISTS Discord_ID_Lounge(
+    discord_id TEXT PRIMARY KEY NOT NULL,
+    lounge_name TEXT NOT NULL,
+    lookup_name TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS Discord_ID_Lounge_lookup_name ON Discord_ID_Lounge(lookup_name);
+CREATE TABLE IF NOT EXISTS Discord_ID_Flag(
+    discord_id TEXT PRIMARY KEY NOT NULL,
+    flag TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS Blacklisted_User(
+    discord_id TEXT PRIMARY KEY NOT NULL,
+    reason TEXT NOT NULL
+) WITHOUT ROWID;"""
+
+#When more than one discord id has the same lounge name, the one whose FCs were used most recently gets the name
+DISCORD_ID_BY_LOOKUP_NAME_QUERY = """SELECT Discord_ID_Lounge.discord_id
+FROM Discord_ID_Lounge LEFT JOIN FC_Discord_ID ON FC_Discord_ID.discord_id = Discord_ID_Lounge.discord_id
+WHERE lookup_name = ?
+GROUP BY Discord_ID_Lounge.discord_id
+ORDER BY MAX(FC_Discord_ID.last_used) IS NULL, MAX(FC_Discord_ID.last_used) DESC
+LIMIT 1"""
+#The same choice for every lookup name at once
+ALL_LOOKUP_NAMES_QUERY = """SELECT lookup_name, discord_id FROM (
+    SELECT lookup_name, Discord_ID_Lounge.discord_id,
+    ROW_NUMBER() OVER (PARTITION BY lookup_name ORDER BY MAX(FC_Discord_ID.last_used) IS NULL, MAX(FC_Discord_ID.last_used) DESC) AS name_rank
+    FROM Discord_ID_Lounge LEFT JOIN FC_Discord_ID ON FC_Discord_ID.discord_id = Discord_ID_Lounge.discord_id
+    GROUP BY Discord_ID_Lounge.discord_id
+) WHERE name_rank = 1"""
+
+db_lock = threading.Lock()
+db_connection = None
+
+
+class ReadThroughTable(Mapping):
+    '''A read-only mapping over one of the store's tables. Lookups are answered from an LRU cache of the keys that were already looked up
+    (including the keys that aren't in the table), and the table is only queried on a miss. Iterating over it or taking its length reads
+    the whole table, and doesn't fill the cache.
+
+    The cache isn't updated by the store's write functions, so whoever writes a key must also call set_cached or invalidate.'''
+    MISSING = object()
+
+    def __init__(self, load_one: Callable, load_all: Callable, count: Callable, max_cached=MAX_CACHED_KEYS):
+        self.load_one = load_one
+        self.load_all = load_all
+        self.count = count
+        self.max_cached = max_cached
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get_cached(self, key):
+        if key in self.cache:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        self.misses += 1
+        value = self.load_one(key)
+        self.set_cached(key, self.MISSING if value is None else value)
+        return self.MISSING if value is None else value
+
+    def set_cached(self, key, value):
+        self.cache[key] = value
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.max_cached:
+            self.cache.popitem(last=False)
+
+    def invalidate(self, key):
+        self.cache.pop(key, None)
+
+    def clear_cache(self):
+        self.cache.clear()
+
+    def __getitem__(self, key):
+        value = self.get_cached(key)
+        if value is self.MISSING:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.get_cached(key) is not self.MISSING
+
+    def __iter__(self):
+        return iter([key for key, _ in self.load_all()])
+
+    def __len__(self):
+        return self.count()
+
+    def items(self):
+        return self.load_all()
+
+    def values(self):
+        return [value for _, value in self.load_all()]
+
+
+def get_connection() -> sqlite3.Connection:
+    if db_connection is None:
+        raise RuntimeError("The user data store hasn't been loaded (see UserDataProcessing.initialize)")
+    return db_connection
+
+def is_loaded() -> bool:
+    return db_connection is not None
+
+def load():
+    global db_connection
+    with db_lock:
+        if db_connection is None:
+            db_connection = sqlite3.connect(common.USER_DATA_DATABASE_FILE, check_same_thread=False)
+            db_connection.execute("PRAGMA journal_mode=WAL")
+            db_connection.execute("PRAGMA synchronous=NORMAL")
+            db_connection.executescript(USER_DATA_SCHEMA)
+
+def close():
+    global db_connection
+    with db_lock:
+        if db_connection is not None:
+            db_connection.close()
+            db_connection = None
+
+def checkpoint():
+    '''Copies the committed changes from the write-ahead log into the database file'''
+    with db_lock:
+        if is_loaded():
+            get_connection().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+def fetch_all(query: str, args=()) -> List[Tuple]:
+    with db_lock:
+        if not is_loaded():
+            return []
+        return get_connection().execute(query, args).fetchall()
+
+def fetch_value(query: str, args=()):
+    rows = fetch_all(query, args)
+    return None if len(rows) == 0 else rows[0][0]
+
+def write(query: str, rows: List[Tuple]):
+    with db_lock:
+        connection = get_connection()
+        with connection:
+            connection.executemany(query, rows)
+
+def to_last_used_str(last_used: datetime) -> str:
+    return last_used.strftime(LAST_USED_FORMAT)
+
+def from_last_used_str(last_used: str) -> datetime:
+    return datetime.strptime(last_used, LAST_USED_FORMAT)
+
+
+def is_migrated() -> bool:
+    with db_lock:
+        return get_connection().execute("PRAGMA user_version").fetchone()[0] >= MIGRATED_USER_VERSION
+
+def migrate(fc_discord_ids: Dict[str, Tuple[str, datetime]], discord_id_lounges: Dict[str, Tuple[str, str]], discord_id_flags: Dict[str, str], blacklisted_users: Dict[str, str]):
+    '''Copies the user data read from the text files into the store, in one transaction: if the bot stops part way through,
+    nothing is copied and it's done again on the next start'''
+    with db_lock:
+        connection = get_connection()
+        with connection:
+            connection.executemany("INSERT OR REPLACE INTO FC_Discord_ID VALUES (?, ?, ?)",
+                                   [(fc, discord_id, to_last_used_str(last_used)) for fc, (discord_id, last_used) in fc_discord_ids.items()])
+            connection.executemany("INSERT OR REPLACE INTO Discord_ID_Lounge VALUES (?, ?, ?)",
+                                   [(discord_id, lounge_name, lookup_name) for discord_id, (lounge_name, lookup_name) in discord_id_lounges.items()])
+            connection.executemany("INSERT OR REPLACE INTO Discord_ID_Flag VALUES (?, ?)", discord_id_flags.items())
+            connection.executemany("INSERT OR REPLACE INTO Blacklisted_User VALUES (?, ?)", blacklisted_users.items())
+            connection.execute(f"PRAGMA user_version = {MIGRATED_USER_VERSION}")
+
+
+def get_fc_discord_id(fc: str) -> Union[Tuple[str, datetime], None]:
+    rows = fetch_all("SELECT discord_id, last_used FROM FC_Discord_ID WHERE fc = ?", (fc,))
+    return None if len(rows) == 0 else (rows[0][0], from_last_used_str(rows[0][1]))
+
+def get_all_fc_discord_ids() -> List[Tuple[str, Tuple[str, datetime]]]:
+    return [(fc, (discord_id, from_last_used_str(last_used))) for fc, discord_id, last_used in fetch_all("SELECT fc, discord_id, last_used FROM FC_Discord_ID")]
+
+def get_discord_id_fcs(discord_id: str) -> Union[List[List], None]:
+    '''Returns the [FC, last used] of the discord id's FCs, most recently used first'''
+    rows = fetch_all("SELECT fc, last_used FROM FC_Discord_ID WHERE discord_id = ? ORDER BY last_used DESC", (discord_id,))
+    return None if len(rows) == 0 else [[fc, from_last_used_str(last_used)] for fc, last_used in rows]
+
+def get_all_discord_id_fcs() -> List[Tuple[str, List[List]]]:
+    discord_id_fcs = {}
+    for fc, (discord_id, last_used) in sorted(get_all_fc_discord_ids(), key=lambda row: row[1][1], reverse=True):
+        discord_id_fcs.setdefault(discord_id, []).append([fc, last_used])
+    return list(discord_id_fcs.items())
+
+def store_fc_discord_ids(fc_discord_ids: Dict[str, Tuple[str, datetime]]):
+    write("INSERT OR REPLACE INTO FC_Discord_ID VALUES (?, ?, ?)",
+          [(fc, discord_id, to_last_used_str(last_used)) for fc, (discord_id, last_used) in fc_discord_ids.items()])
+
+
+def get_lounge_name(discord_id: str) -> Union[str, None]:
+    return fetch_value("SELECT lounge_name FROM Discord_ID_Lounge WHERE discord_id = ?", (discord_id,))
+
+def get_all_lounge_names() -> List[Tuple[str, str]]:
+    return fetch_all("SELECT discord_id, lounge_name FROM Discord_ID_Lounge")
+
+def get_discord_id_by_lookup_name(lookup_name: str) -> Union[str, None]:
+    return fetch_value(DISCORD_ID_BY_LOOKUP_NAME_QUERY, (lookup_name,))
+
+def get_all_lookup_names() -> List[Tuple[str, str]]:
+    return fetch_all(ALL_LOOKUP_NAMES_QUERY)
+
+def store_lounge_names(discord_id_lounges: Dict[str, Tuple[str, str]]):
+    '''Saves the given discord id to (lounge name, lookup name) lounge names'''
+    write("INSERT OR REPLACE INTO Discord_ID_Lounge VALUES (?, ?, ?)",
+          [(discord_id, lounge_name, lookup_name) for discord_id, (lounge_name, lookup_name) in discord_id_lounges.items()])
+
+
+def get_flag(discord_id: str) -> Union[str, None]:
+    return fetch_value("SELECT flag FROM Discord_ID_Flag WHERE discord_id = ?", (discord_id,))
+
+def get_all_flags() -> List[Tuple[str, str]]:
+    return fetch_all("SELECT discord_id, flag FROM Discord_ID_Flag")
+
+def set_flag(discord_id: str, flag: Union[str, None]):
+    if flag is None:
+        write("DELETE FROM Discord_ID_Flag WHERE discord_id = ?", [(discord_id,)])
+    else:
+        write("INSERT OR REPLACE INTO Discord_ID_Flag VALUES (?, ?)", [(discord_id, flag)])
+
+
+def get_blacklist_reason(discord_id: str) -> Union[str, None]:
+    return fetch_value("SELECT reason FROM Blacklisted_User WHERE discord_id = ?", (discord_id,))
+
+def get_all_blacklisted_users() -> List[Tuple[str, str]]:
+    return fetch_all("SELECT discord_id, reason FROM Blacklisted_User")
+
+def set_blacklist_reason(discord_id: str, reason: Union[str, None]):
+    if reason is None:
+        write("DELETE FROM Blacklisted_User WHERE discord_id = ?", [(discord_id,)])
+    else:
+        write("INSERT OR REPLACE INTO Blacklisted_User VALUES (?, ?)", [(discord_id, reason)])
+
+
+def count_keys(table_name: str, key_column: str) -> int:
+    return fetch_value(f"SELECT COUNT(DISTINCT {key_column}) FROM {table_name}") or 0
@@ -0,0 +1,149 @@
+'''
+Created on Oct 19, 2026
+
+@author: willg
+
+Tests UserDataStore through UserDataProcessing: the user data text files are copied into the store once, changes are written to the store
+as they're made (and not to the text files), and lookups are cached.
+'''
+import os
+import sqlite3
+import tempfile
+import unittest
+from datetime import datetime
+from unittest import mock
+
+import UserDataProcessing
+import UserDataStore
+import common
+
+FC_DISCORD_ID_LINES = ["0000-0000-0001=100=2021-04-03 20:29:45.779373\n",
+                       "0000-0000-0002=100=2021-05-03 20:29:45\n",
+                       "0000-0000-0003=200=2021-04-01 00:00:00.000001\n",
+                       "0000-0000-0004=300\n"]
+DISCORD_ID_LOUNGE_LINES = ["100=Bad Wolf\n",
+                           "200=bad wolf\n",
+                           "300=Someone Else\n"]
+
+
+class UserDataStoreTests(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.temp_folder = tempfile.TemporaryDirectory()
+        self.original_folder = os.getcwd()
+        os.chdir(self.temp_folder.name)
+        os.makedirs(common.DATA_PATH)
+        self.write_lines(common.FC_DISCORD_ID_FILE, FC_DISCORD_ID_LINES)
+        self.write_lines(common.DISCORD_ID_LOUNGES_FILE, DISCORD_ID_LOUNGE_LINES)
+        self.write_lines(common.DISCORD_ID_FLAGS_FILE, ["100=gb\n"])
+        self.write_lines(common.BLACKLISTED_USERS_FILE, ["400=spam\n"])
+        self.add_player_fcs_patch = mock.patch.object(UserDataProcessing.DataTracker, "add_player_fcs", mock.AsyncMock())
+        self.add_player_fcs_patch.start()
+        UserDataProcessing.initialize()
+
+    async def asyncTearDown(self):
+        UserDataStore.close()
+        self.add_player_fcs_patch.stop()
+        os.chdir(self.original_folder)
+        self.temp_folder.cleanup()
+
+    def write_lines(self, file_name, lines):
+        with open(file_name, "w", encoding="utf-8") as f:
+            f.writelines(lines)
+
+    def reopen(self):
+        '''Closes the store and clears the caches, so everything is read from the database again'''
+        UserDataStore.close()
+        UserDataProcessing.initialize()
+
+    def test_text_files_are_copied(self):
+        self.assertEqual(UserDataProcessing.get_all_fcs("100"), ["0000-0000-0002", "0000-0000-0001"])
+        self.assertEqual(UserDataProcessing.fc_discordId["0000-0000-0001"], ("100", datetime(2021, 4, 3, 20, 29, 45, 779373)))
+        #FCs without a last used time get one before DEFAULT_LAST_USED_DATE
+        self.assertEqual(UserDataProcessing.fc_discordId["0000-0000-0004"], ("300", UserDataProcessing.DEFAULT_LAST_USED_DATE))
+        self.assertEqual(UserDataProcessing.lounge_get("0000-0000-0003"), "bad wolf")
+        #Both 100 and 200 have the lounge name "badwolf", and 100's FCs were used last
+        self.assertEqual(UserDataProcessing.get_DiscordID_By_LoungeName("BadWolf"), "100")
+        self.assertEqual(UserDataProcessing.getFCsByLoungeName("someone else"), ["0000-0000-0004"])
+        self.assertEqual(UserDataProcessing.get_flag_for_fc("0000-0000-0001"), "gb")
+        self.assertEqual(UserDataProcessing.blacklisted_users["400"], "spam")
+        self.assertNotIn("100", UserDataProcessing.blacklisted_users)
+        self.assertEqual(len(UserDataProcessing.fc_discordId), 4)
+        self.assertEqual(dict(UserDataProcessing.lounges_discordId.items()), {"badwolf": "100", "someoneelse": "300"})
+
+    def test_text_files_are_only_copied_once(self):
+        self.write_lines(common.DISCORD_ID_FLAGS_FILE, ["100=us\n", "200=fr\n"])
+        self.reopen()
+        self.assertEqual(UserDataProcessing.get_flag("100"), "gb")
+        self.assertIsNone(UserDataProcessing.get_flag("200"))
+
+    async def test_changes_are_saved_to_the_store(self):
+        UserDataProcessing.add_flag(100, "us")
+        UserDataProcessing.add_flag("300", "fr")
+        UserDataProcessing.add_Blacklisted_user("400", "unblacklist")
+        UserDataProcessing.add_Blacklisted_user(500, "abuse")
+        last_used = datetime(2022, 1, 1, 12, 0, 0)
+        UserDataProcessing.smartUpdate({"200": "Bad Wolf 2"}, {"0000-0000-0001": ("200", last_used), "0000-0000-0005": ("600", last_used)})
+        self.assertEqual(UserDataProcessing.get_all_fcs("100"), ["0000-0000-0002"])
+        UserDataProcessing.DataTracker.add_player_fcs.assert_called_once()
+
+        for _ in range(2):
+            self.assertEqual(UserDataProcessing.get_flag("100"), "us")
+            self.assertEqual(UserDataProcessing.get_flag("300"), "fr")
+            self.assertNotIn("400", UserDataProcessing.blacklisted_users)
+            self.assertEqual(UserDataProcessing.blacklisted_users["500"], "abuse")
+            self.assertEqual(UserDataProcessing.get_all_fcs("200", include_time=True), [["0000-0000-0001", last_used], ["0000-0000-0003", datetime(2021, 4, 1, 0, 0, 0, 1)]])
+            self.assertEqual(UserDataProcessing.get_all_fcs("100"), ["0000-0000-0002"])
+            self.assertEqual(UserDataProcessing.lounge_get("0000-0000-0005"), "")
+            self.assertEqual(UserDataProcessing.get_lounge("200"), "Bad Wolf 2")
+            self.reopen()
+        #The text files aren't written to anymore
+        with open(common.DISCORD_ID_FLAGS_FILE, encoding="utf-8") as f:
+            self.assertEqual(f.read(), "100=gb\n")
+        self.assertTrue(UserDataProcessing.non_async_dump_data())
+
+    def test_lookups_are_cached(self):
+        self.assertEqual(UserDataProcessing.lounge_get("0000-0000-0001"), "Bad Wolf")
+        self.assertNotIn("100", UserDataProcessing.blacklisted_users)
+        #Keys that were already looked up, including keys that aren't in the store, don't read the database again
+        with mock.patch.object(UserDataStore, "get_connection", side_effect=AssertionError("database read")):
+            self.assertEqual(UserDataProcessing.lounge_get("0000-0000-0001"), "Bad Wolf")
+            self.assertNotIn("100", UserDataProcessing.blacklisted_users)
+        self.assertGreater(UserDataProcessing.fc_discordId.hits, 0)
+
+        table = UserDataStore.ReadThroughTable(UserDataStore.get_flag, UserDataStore.get_all_flags, None, max_cached=2)
+        for discord_id in ("100", "200", "300"):
+            table.get(discord_id)
+        self.assertEqual(list(table.cache), ["200", "300"])
+
+    def test_store_is_only_opened_by_load(self):
+        UserDataStore.close()
+        UserDataProcessing.initialize()
+        UserDataStore.close()
+        os.remove(common.USER_DATA_DATABASE_FILE)
+        for table in (UserDataProcessing.fc_discordId, UserDataProcessing.discordId_lounges):
+            table.clear_cache()
+        #Lookups before the store is loaded find nothing, and don't create the database
+        self.assertEqual(UserDataProcessing.lounge_get("0000-0000-0001"), "")
+        self.assertEqual(len(UserDataProcessing.fc_discordId), 0)
+        with self.assertRaises(RuntimeError):
+            UserDataProcessing.add_flag("100", "us")
+        self.assertFalse(os.path.exists(common.USER_DATA_DATABASE_FILE))
+
+    def test_failed_copy_is_retried(self):
+        UserDataStore.close()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(common.USER_DATA_DATABASE_FILE + suffix):
+                os.remove(common.USER_DATA_DATABASE_FILE + suffix)
+        UserDataStore.load()
+        #A row the store rejects part way through the copy
+        with self.assertRaises(sqlite3.IntegrityError):
+            UserDataStore.migrate(UserDataProcessing.read_FC_DiscordID_file(), {}, {"100": None}, {})
+        self.assertFalse(UserDataStore.is_migrated())
+        self.assertEqual(len(UserDataProcessing.fc_discordId), 0)
+        self.reopen()
+        self.assertTrue(UserDataStore.is_migrated())
+        self.assertEqual(len(UserDataProcessing.fc_discordId), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
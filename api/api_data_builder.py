@@ -7,9 +7,6 @@ import re
 
 import UtilityFunctions
 from api import api_common
-from html2image import Html2Image
-
-hti = Html2Image(size=(980, 580), custom_flags=['--no-sandbox', '--default-background-color=00000000', '--hide-scrollbars'])
 
 API_DATA_PATH = "api/"
 HTML_DATA_PATH = "html/"
@@ -524,15 +521,3 @@ def build_info_page_html(table_id: int):
 def get_picture_page_html():
     with codecs.open(f"{API_DATA_PATH}{TABLE_PICTURE_HTML_FILE}", "r", "utf-8") as fp:
         return str(BeautifulSoup(fp.read(), "html.parser"))
-
-
-def generate_table_picture(table_sorted_data, table_image_path: str):
-    table_html = build_full_table_html(table_sorted_data, style="orange", relative_path_ok=False)
-    s = "/".join(table_image_path.split("/")[:-1])
-    hti.output_path = s
-    file_name = table_image_path.split("/")[-1]
-    try:
-        hti.screenshot(html_str=table_html, css_file=[os.path.abspath(f"{API_DATA_PATH}{FULL_TABLE_STYLE_FILE}"), os.path.abspath(f"{API_DATA_PATH}{FULL_TABLE_STYLES['orange']}")], save_as=file_name)
-    except:
-        return False
-    return True
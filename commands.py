@@ -11,6 +11,11 @@ import WiimmfiSiteFunctions
 import Room
 import ServerFunctions
 import ImageCombine
+import TableRenderer
+import TablePictureCache
+import ImageWorkers
+import MiiDataCache
+import MiiImageCache
 import War
 import TagAIShell
 import ScoreKeeper as SK
@@ -27,16 +32,15 @@ import common
 import api.api_common
 import Components
 from data_tracking import DataTracker
+from data_tracking import StatsResultCache
 import SmartTypes
 import TimerDebuggers
 import api.api_common as api_common
 import api.api_channelbot_interface as cb_interface
-from api import api_data_builder
 import Stats
 
 #Other library imports, other people codes
 import asyncio
-import random
 import math
 import time
 from tabulate import tabulate
@@ -142,17 +146,51 @@ def lower_args(args: List[str]) -> List[str]:
     '''Takes a list of strings and returns a list with those strings in lower case form'''
     return [arg.lower() for arg in args]
 
-async def download_table_picture(message, table_sorted_data: Dict, image_url: str, table_image_path: str):
-    image_download_success = await common.download_image(image_url, table_image_path)
-    if image_download_success:
+async def download_table_picture(message, table_sorted_data: Dict, image_url: str):
+    '''Downloads the table picture (unless the same table was downloaded recently) and returns it decoded as a numpy image.
+    If the download fails, the table picture is drawn by the backup generator instead.'''
+    table_png = TablePictureCache.get(image_url)
+    downloaded = table_png is None
+    if downloaded:
+        table_png = await common.download_image_bytes(image_url)
+    table_cv2 = await ImageWorkers.run_image_job(ImageCombine.decode_image, table_png)
+    if table_cv2 is not None:
+        if downloaded:
+            TablePictureCache.store(image_url, table_png)
         Stats.add_lorenzi_picture_count()
-    else:
-        await message.channel.send("Could not download table picture. Using backup table picture generation.")
-        image_download_success = api_data_builder.generate_table_picture(table_sorted_data, table_image_path)
-        if image_download_success:
-            Stats.add_local_picture_count()
-        else:
-            raise TableBotExceptions.BackupPictureGeneratorFailed("Back up table generator failed. Shouldn't happen.")
+        return table_cv2
+
+    await message.channel.send("Could not download table picture. Using backup table picture generation.")
+    try:
+        table_cv2 = await ImageWorkers.run_image_job(TableRenderer.render_table_cv2, table_sorted_data)
+    except Exception:
+        common.log_traceback(traceback)
+        table_cv2 = None
+    if table_cv2 is None:
+        raise TableBotExceptions.BackupPictureGeneratorFailed("Back up table generator failed. Shouldn't happen.")
+    Stats.add_local_picture_count()
+    return table_cv2
+
+async def create_table_picture(message, this_bot: TableBot.ChannelBot, table_sorted_data: Dict, image_url: str, add_header_and_miis=True):
+    '''Downloads the table picture, adds the autotable header and the miis to it (unless add_header_and_miis is False) and encodes it.
+    Returns the picture as a numpy image and as PNG bytes, or (None, None) if the header or the miis couldn't be added.
+    An image slot is reserved for all of the picture's jobs, so ImageQueueSaturated is raised before anything is downloaded if the image queue is full.'''
+    with ImageWorkers.reserve_capacity():
+        table_cv2 = await download_table_picture(message, table_sorted_data, image_url)
+        if add_header_and_miis:
+            #did the room have *any* errors? Regardless of ignoring any type of error
+            war_had_errors = len(this_bot.getWar().get_all_war_errors_players(this_bot.getRoom(), False)) > 0
+            tableWasEdited = len(this_bot.getWar().manualEdits) > 0 or len(this_bot.getRoom().dc_on_or_before) > 0 or \
+                                len(this_bot.getRoom().forcedRoomSize) > 0 or this_bot.getRoom().had_positions_changed() or \
+                                len(this_bot.getRoom().get_removed_races_string()) > 0 or this_bot.getRoom().had_subs() or \
+                                this_bot.getRoom().race_order_changed() or this_bot.getRoom().has_merged()
+            table_cv2 = await ImageWorkers.run_image_job(ImageCombine.add_autotable_header, table_cv2, errors=war_had_errors, edits=tableWasEdited)
+            if table_cv2 is not None and this_bot.getWar().displayMiis:
+                mii_footer_teams = ImageCombine.get_mii_footer_teams(this_bot, table_sorted_data)
+                table_cv2 = await ImageWorkers.run_image_job(ImageCombine.add_miis_to_table, mii_footer_teams, table_cv2)
+            if table_cv2 is None:
+                return None, None
+        return table_cv2, await ImageWorkers.run_image_job(ImageCombine.encode_image, table_cv2)
 
 
 """============== Bot Owner only commands ================"""
@@ -237,6 +275,24 @@ class BotOwnerCommands:
         await message.channel.send(command_output)
 
 
+    @staticmethod
+    async def image_queue_command(message: discord.Message):
+        BotOwnerCommands.is_bot_owner_check(message.author, "cannot show image queue stats")
+        #The mii data cache's stats scan its whole table, so they're read in the executor like its other queries
+        mii_data_cache_stats = await asyncio.get_running_loop().run_in_executor(None, MiiDataCache.get_stats_str)
+        await message.channel.send(ImageWorkers.get_stats_str() + "\n\n" + MiiImageCache.get_stats_str() + "\n\n" + mii_data_cache_stats + "\n\n" + TablePictureCache.get_stats_str())
+
+    @staticmethod
+    async def database_queue_command(message: discord.Message):
+        BotOwnerCommands.is_bot_owner_check(message.author, "cannot show database write queue stats")
+        await message.channel.send(DataTracker.get_write_queue_stats_str())
+
+    @staticmethod
+    async def database_cache_command(message: discord.Message):
+        BotOwnerCommands.is_bot_owner_check(message.author, "cannot show stats result cache stats")
+        await message.channel.send(StatsResultCache.get_stats_str())
+
+
     @staticmethod
     async def garbage_collect_command(message: discord.Message):
         BotOwnerCommands.is_bot_owner_check(message.author, "cannot garbage collect")
@@ -1020,17 +1076,12 @@ class OtherCommands:
         #Update cooldown
         common.client.mii_cooldowns[message.author.id] = time.monotonic()
 
-        mii_hexes = await DataTracker.DataRetriever.get_mii_hexes(fcs)
-        if len(mii_hexes) == 0:
+        #A unique mii is selected randomly with equal probability, and then one of the races it was used in (races tabled by multiple events are only counted once).
+        #The player's races are sampled as they're read, so players with huge histories aren't loaded all at once
+        selected_data = await DataTracker.DataRetriever.get_random_previous_mii(fcs)
+        if selected_data is None:
             await message.channel.send(f"**I couldn't find any previous miis for {descriptive}.** I only have miis going back to November 2021. If {descriptive} {'have' if descriptive=='you' else 'has'} played after November 2021, please report it as a bug so we can look into it.")
             return
-        #First, to select a unique mii randomly with equal probability, we'll create a set of all of their mii hexes
-        unique_mii_hexes = {x[-1] for x in mii_hexes}
-        selected_mii_hex = random.choice(list(unique_mii_hexes))
-        #We might get back multiple races with the same mii (because multiple events tabled the same race), so filter those out and filter the mii hexes too
-        matching_races = {data[1]:data for data in mii_hexes if data[-1] == selected_mii_hex}
-        selected_race = random.choice(list(matching_races))
-        selected_data = matching_races[selected_race]
         #Obtain mii picture for the selected mii
         _, _, match_time, is_ct, fc, mii_hex = selected_data
         mii = await MiiPuller.get_one_time_mii(mii_hex, fc, message.id)
@@ -1286,72 +1337,57 @@ class LoungeCommands:
             url_table_text = urllib.parse.quote(newTableText)
             image_url = common.base_url_lorenzi + url_table_text
             table_image_path = str(message.id) + ".png"
-            try:
-                await download_table_picture(message, table_sorted_data, image_url, table_image_path)
-
-                if using_table_bot_table:
-                    war_had_errors = len(this_bot.getWar().get_all_war_errors_players(this_bot.getRoom(), False)) > 0
-                    tableWasEdited = len(this_bot.getWar().manualEdits) > 0 or len(this_bot.getRoom().dc_on_or_before) > 0 or len(this_bot.getRoom().forcedRoomSize) > 0 or \
-                                        this_bot.getRoom().had_positions_changed() or len(this_bot.getRoom().get_removed_races_string()) > 0 or this_bot.getRoom().had_subs() or \
-                                        this_bot.getRoom().race_order_changed() or this_bot.getRoom().has_merged()
-                    header_combine_success = ImageCombine.add_autotable_header(errors=war_had_errors, table_image_path=table_image_path, out_image_path=table_image_path, edits=tableWasEdited)
-                    footer_combine_success = True
-
-                    if header_combine_success and this_bot.getWar().displayMiis:
-                        footer_combine_success = ImageCombine.add_miis_to_table(this_bot, table_sorted_data, table_image_path=table_image_path, out_image_path=table_image_path)
-                    if not header_combine_success or not footer_combine_success:
-                        await common.safe_delete(delete_me)
-                        await message.channel.send("Internal server error when combining images. Sorry, please notify BadWolf immediately.")
-                        return
+            table_cv2, table_png = await create_table_picture(message, this_bot, table_sorted_data, image_url, add_header_and_miis=using_table_bot_table)
+            if table_cv2 is None:
+                await common.safe_delete(delete_me)
+                await message.channel.send("Internal server error when combining images. Sorry, please notify BadWolf immediately.")
+                return
+            ImageCombine.debug_dump(table_cv2, table_image_path)
+            updater_channel = client.get_channel(updater_channel_id)
+            preview_link += urllib.parse.quote(json_data)
 
-                updater_channel = client.get_channel(updater_channel_id)
-                preview_link += urllib.parse.quote(json_data)
 
+            embed = discord.Embed(
+                                title = "",
+                                description=f"[Click to preview this update]({preview_link})",
+                                colour = discord.Colour.dark_red()
+                            )
+            file = discord.File(ImageCombine.get_discord_file_bytes(table_png), filename=table_image_path)
+            lounge_server_updates.add_counter()
+            id_to_submit = lounge_server_updates.get_counter()
+            embed.add_field(name='Submission ID', value=str(id_to_submit))
+            embed.add_field(name="Tier", value=tier_number)
+            embed.add_field(name="Races Played", value=races_played)
+            summary_channel = client.get_channel(summary_channel_id)
+            embed.add_field(name="Approving to", value=(summary_channel.mention if summary_channel is not None else "Can't find channel"))
+            embed.add_field(name='Submitted from', value=message.channel.mention)
+            embed.add_field(name='Submitted by', value=message.author.mention)
+            embed.add_field(name='Discord ID', value=str(message.author.id))
+            embed.set_image(url="attachment://" + table_image_path)
+            embed.set_author(name="Updater Automation", icon_url="https://64.media.tumblr.com/b0df9696b2c8388dba41ad9724db69a4/tumblr_mh1nebDwp31rsjd4ho1_500.jpg")
+
+            sent_message = await updater_channel.send(file=file, embed=embed)
+            lounge_server_updates.add_report(id_to_submit, sent_message, summary_channel_id, json_data)
+
+            other_matching_submission_id = lounge_server_updates.submission_id_of_last_matching_json(id_to_submit)
+            if other_matching_submission_id is not None:
+                await updater_channel.send(f"**Warning:** This submission ({id_to_submit}) matches a previous submission, which has the id {other_matching_submission_id}. It is extremely unlikely this is by chance. Investigate before approving/denying.")
+
+
+            file = discord.File(ImageCombine.get_discord_file_bytes(table_png), filename=table_image_path)
+            embed = discord.Embed(
+                                title=f"Successfully submitted to {type_text} Reporters and {type_text} Updaters",
+                                description=f"[Click to preview this update]({preview_link})",
+                                colour=discord.Colour.green()
+                            )
+            embed.add_field(name='Submission ID', value=str(id_to_submit))
+            embed.add_field(name='Races Played', value=str(races_played))
+            embed.set_image(url="attachment://" + table_image_path)
+            embed.set_author(name="Updater Automation", icon_url="https://64.media.tumblr.com/b0df9696b2c8388dba41ad9724db69a4/tumblr_mh1nebDwp31rsjd4ho1_500.jpg")
+            embed.set_footer(text="Note: the actual update may look different than this preview if the Updaters need to first update previous mogis. If the link is too long, just hit the enter key.")
 
-                embed = discord.Embed(
-                                    title = "",
-                                    description=f"[Click to preview this update]({preview_link})",
-                                    colour = discord.Colour.dark_red()
-                                )
-                file = discord.File(table_image_path)
-                lounge_server_updates.add_counter()
-                id_to_submit = lounge_server_updates.get_counter()
-                embed.add_field(name='Submission ID', value=str(id_to_submit))
-                embed.add_field(name="Tier", value=tier_number)
-                embed.add_field(name="Races Played", value=races_played)
-                summary_channel = client.get_channel(summary_channel_id)
-                embed.add_field(name="Approving to", value=(summary_channel.mention if summary_channel is not None else "Can't find channel"))
-                embed.add_field(name='Submitted from', value=message.channel.mention)
-                embed.add_field(name='Submitted by', value=message.author.mention)
-                embed.add_field(name='Discord ID', value=str(message.author.id))
-                embed.set_image(url="attachment://" + table_image_path)
-                embed.set_author(name="Updater Automation", icon_url="https://64.media.tumblr.com/b0df9696b2c8388dba41ad9724db69a4/tumblr_mh1nebDwp31rsjd4ho1_500.jpg")
-
-                sent_message = await updater_channel.send(file=file, embed=embed)
-                lounge_server_updates.add_report(id_to_submit, sent_message, summary_channel_id, json_data)
-
-                other_matching_submission_id = lounge_server_updates.submission_id_of_last_matching_json(id_to_submit)
-                if other_matching_submission_id is not None:
-                    await updater_channel.send(f"**Warning:** This submission ({id_to_submit}) matches a previous submission, which has the id {other_matching_submission_id}. It is extremely unlikely this is by chance. Investigate before approving/denying.")
-
-
-                file = discord.File(table_image_path)
-                embed = discord.Embed(
-                                    title=f"Successfully submitted to {type_text} Reporters and {type_text} Updaters",
-                                    description=f"[Click to preview this update]({preview_link})",
-                                    colour=discord.Colour.green()
-                                )
-                embed.add_field(name='Submission ID', value=str(id_to_submit))
-                embed.add_field(name='Races Played', value=str(races_played))
-                embed.set_image(url="attachment://" + table_image_path)
-                embed.set_author(name="Updater Automation", icon_url="https://64.media.tumblr.com/b0df9696b2c8388dba41ad9724db69a4/tumblr_mh1nebDwp31rsjd4ho1_500.jpg")
-                embed.set_footer(text="Note: the actual update may look different than this preview if the Updaters need to first update previous mogis. If the link is too long, just hit the enter key.")
-
-                this_bot.has_been_lounge_submitted = True
-                await message.channel.send(file=file, embed=embed)
-            finally:
-                if os.path.exists(table_image_path):
-                    os.remove(table_image_path)
+            this_bot.has_been_lounge_submitted = True
+            await message.channel.send(file=file, embed=embed)
         lounge_server_updates.update_user_cooldown(message.author)
         await common.safe_delete(delete_me)
         await this_bot.clear_last_wp_button()
@@ -2217,7 +2253,7 @@ class TablingCommands:
         this_bot.getRoom().setSetupUser(author_id,  message.author.display_name)
         if this_bot.getWar() is not None:
             players = list(this_bot.getRoom().get_fc_to_name_dict(1, numgps*4).items())
-            tags_player_fcs = TagAIShell.determineTags(players, this_bot.getWar().playersPerTeam)
+            tags_player_fcs = await TagAIShell.determineTagsAsync(players, this_bot.getWar().playersPerTeam)
             this_bot.getWar().set_temp_team_tags(tags_player_fcs)
 
             if not this_bot.getWar().is_ffa():
@@ -2603,104 +2639,90 @@ class TablingCommands:
         temp_path = './temp/'
         table_image = f"{message.id}_picture.png"
         table_image_path=temp_path+table_image
-        try:
-            await download_table_picture(message, table_sorted_data, image_url, table_image_path)
-            #did the room have *any* errors? Regardless of ignoring any type of error
-            war_had_errors = len(this_bot.getWar().get_all_war_errors_players(this_bot.getRoom(), False)) > 0
-            tableWasEdited = len(this_bot.getWar().manualEdits) > 0 or len(this_bot.getRoom().dc_on_or_before) > 0 or \
-                                len(this_bot.getRoom().forcedRoomSize) > 0 or this_bot.getRoom().had_positions_changed() or \
-                                len(this_bot.getRoom().get_removed_races_string()) > 0 or this_bot.getRoom().had_subs() or \
-                                this_bot.getRoom().race_order_changed() or this_bot.getRoom().has_merged()
-            header_combine_success = ImageCombine.add_autotable_header(errors=war_had_errors, table_image_path=table_image_path, out_image_path=table_image_path, edits=tableWasEdited)
-            footer_combine_success = True
-            lorenzi_edit_link = common.base_url_edit_table_lorenzi + display_url_table_text
-            full_lorenzi_edit_link = "[Edit this table on Lorenzi's website]({0})"
-
-            if header_combine_success and this_bot.getWar().displayMiis:
-                footer_combine_success = ImageCombine.add_miis_to_table(this_bot, table_sorted_data, table_image_path=table_image_path, out_image_path=table_image_path)
+        table_cv2, table_png = await create_table_picture(message, this_bot, table_sorted_data, image_url)
+        lorenzi_edit_link = common.base_url_edit_table_lorenzi + display_url_table_text
+        full_lorenzi_edit_link = "[Edit this table on Lorenzi's website]({0})"
            
-            if not header_combine_success or not footer_combine_success:
-                await common.safe_delete(message3)
-                await message.channel.send("Internal server error when combining images. Sorry, please notify BadWolf immediately.")
-            else:
-                full_lorenzi_edit_link = full_lorenzi_edit_link.format(lorenzi_edit_link)
-                embed = discord.Embed(
-                    title = "",
-                    description = full_lorenzi_edit_link,
-                    colour = discord.Colour.dark_blue()
-                )
-
-                file = discord.File(table_image_path, filename=table_image)
-                numRaces = 0
-                if this_bot.getRoom() is not None and this_bot.getRoom().races is not None:
-                    numRaces = min((len(this_bot.getRoom().races), this_bot.getRoom().getNumberOfGPS()*4))
-                if up_to is not None:
-                    numRaces = up_to
-                
-                embed_title = this_bot.getWar().getWarName(numRaces)
-                embed.set_author(name=embed_title, icon_url="https://64.media.tumblr.com/b0df9696b2c8388dba41ad9724db69a4/tumblr_mh1nebDwp31rsjd4ho1_500.jpg")
-                embed.set_image(url="attachment://" + table_image)
+        if table_cv2 is None:
+            await common.safe_delete(message3)
+            await message.channel.send("Internal server error when combining images. Sorry, please notify BadWolf immediately.")
+        else:
+            full_lorenzi_edit_link = full_lorenzi_edit_link.format(lorenzi_edit_link)
+            embed = discord.Embed(
+                title = "",
+                description = full_lorenzi_edit_link,
+                colour = discord.Colour.dark_blue()
+            )
+
+            ImageCombine.debug_dump(table_cv2, table_image)
+            file = discord.File(ImageCombine.get_discord_file_bytes(table_png), filename=table_image)
+            numRaces = 0
+            if this_bot.getRoom() is not None and this_bot.getRoom().races is not None:
+                numRaces = min((len(this_bot.getRoom().races), this_bot.getRoom().getNumberOfGPS()*4))
+            if up_to is not None:
+                numRaces = up_to
+            
+            embed_title = this_bot.getWar().getWarName(numRaces)
+            embed.set_author(name=embed_title, icon_url="https://64.media.tumblr.com/b0df9696b2c8388dba41ad9724db69a4/tumblr_mh1nebDwp31rsjd4ho1_500.jpg")
+            embed.set_image(url="attachment://" + table_image)
+            
+            init_string, footer_string, error_types = this_bot.getWar().get_war_errors_string_2(this_bot.getRoom(), this_bot.get_all_resolved_errors(), lounge_replace, up_to_race=up_to)
+            full_string = init_string+footer_string
+            error_message = "(Too many errors - cannot show previous errors. Full list in file.)\n..."
+            init_error_message = "...\n"
+            error_file = False
+            footer_max = min(6000-len(embed_title+full_lorenzi_edit_link), 2048) 
+            if len(full_string) >= footer_max:
+                error_file = True
+                cutoff = -(len(footer_string)+1) if (c:=(footer_max-len(init_string+error_message)))<=0 else c
+                init_cutoff = footer_max-len(error_message) 
+                edited_init_string = init_string[:init_cutoff-len(init_error_message)] + init_error_message if init_cutoff < len(init_string) else init_string
+
+                full_string = edited_init_string + error_message + footer_string[-cutoff:]
+
+            embed.set_footer(text=full_string)
+            
+            @TimerDebuggers.timer_coroutine
+            async def pic_view_func(this_bot:ChannelBot, server_prefix, is_lounge_server):
+                pic_view = Components.PictureView(this_bot, server_prefix, is_lounge_server)
+
+                # Lounge submission button
+                if not this_bot.has_been_lounge_submitted and len(this_bot.room.races) == (this_bot.war.numberOfGPs*4) and is_lounge_server:
+                    type, tier = common.get_channel_type_and_tier(this_bot.channel_id, this_bot.room.races)
+                    if type and tier:
+                        pic_view.add_item(Components.SubmitButton(this_bot, type, tier, len(this_bot.room.races)))
+
+                await pic_view.send(message, file=file, embed=embed)
+                TableBot.last_wp_button[this_bot.channel_id] = pic_view
+                if len(pic_view.message.embeds) == 1: #The embeds were sent successfully
+                    this_bot.get_war().set_discord_picture_url(pic_view.message.embeds[0].image.url)     
                 
-                init_string, footer_string, error_types = this_bot.getWar().get_war_errors_string_2(this_bot.getRoom(), this_bot.get_all_resolved_errors(), lounge_replace, up_to_race=up_to)
-                full_string = init_string+footer_string
-                error_message = "(Too many errors - cannot show previous errors. Full list in file.)\n..."
-                init_error_message = "...\n"
-                error_file = False
-                footer_max = min(6000-len(embed_title+full_lorenzi_edit_link), 2048) 
-                if len(full_string) >= footer_max:
-                    error_file = True
-                    cutoff = -(len(footer_string)+1) if (c:=(footer_max-len(init_string+error_message)))<=0 else c
-                    init_cutoff = footer_max-len(error_message) 
-                    edited_init_string = init_string[:init_cutoff-len(init_error_message)] + init_error_message if init_cutoff < len(init_string) else init_string
-
-                    full_string = edited_init_string + error_message + footer_string[-cutoff:]
-
-                embed.set_footer(text=full_string)
+            await pic_view_func(this_bot, server_prefix, is_lounge_server)
+
+            if error_file:
+                error_file_path = f'{message.id}_full_errors.txt'
+                error_file = common.create_temp_file(error_file_path, init_string+footer_string, dir=temp_path)
+                try:
+                    os.remove(temp_path+error_file_path)
+                except Exception:
+                    pass
                 
-                @TimerDebuggers.timer_coroutine
-                async def pic_view_func(this_bot:ChannelBot, server_prefix, is_lounge_server):
-                    pic_view = Components.PictureView(this_bot, server_prefix, is_lounge_server)
+                await message.channel.send(file=discord.File(fp=error_file, filename=error_file_path))
 
-                    # Lounge submission button
-                    if not this_bot.has_been_lounge_submitted and len(this_bot.room.races) == (this_bot.war.numberOfGPs*4) and is_lounge_server:
-                        type, tier = common.get_channel_type_and_tier(this_bot.channel_id, this_bot.room.races)
-                        if type and tier:
-                            pic_view.add_item(Components.SubmitButton(this_bot, type, tier, len(this_bot.room.races)))
+            if error_types and len(error_types)>0:
+                # don't display large time suggestions if it's a 5v5 war
+                if this_bot.war.is_5v5():
+                    error_types = [e for e in error_types if e['type'] != 'large_time']
 
-                    await pic_view.send(message, file=file, embed=embed)
-                    TableBot.last_wp_button[this_bot.channel_id] = pic_view
-                    if len(pic_view.message.embeds) == 1: #The embeds were sent successfully
-                        this_bot.get_war().set_discord_picture_url(pic_view.message.embeds[0].image.url)     
-                    
-                await pic_view_func(this_bot, server_prefix, is_lounge_server)
-
-                if error_file:
-                    error_file_path = f'{message.id}_full_errors.txt'
-                    error_file = common.create_temp_file(error_file_path, init_string+footer_string, dir=temp_path)
-                    try:
-                        os.remove(temp_path+error_file_path)
-                    except Exception:
-                        pass
-                    
-                    await message.channel.send(file=discord.File(fp=error_file, filename=error_file_path))
-
-                if error_types and len(error_types)>0:
-                    # don't display large time suggestions if it's a 5v5 war
-                    if this_bot.war.is_5v5():
-                        error_types = [e for e in error_types if e['type'] != 'large_time']
-
-                    if len(error_types) != 0:
-                        sug_view = Components.SuggestionView(error_types, this_bot, server_prefix, is_lounge_server)
-                        await sug_view.send(message)
-
-                await common.safe_delete(message3)
-
-                if should_send_notification and common.current_notification != "":
-                    await message.channel.send(common.current_notification.replace("{SERVER_PREFIX}", server_prefix))
-                    
-        finally:
-            if os.path.exists(table_image_path):
-                os.remove(table_image_path)
+                if len(error_types) != 0:
+                    sug_view = Components.SuggestionView(error_types, this_bot, server_prefix, is_lounge_server)
+                    await sug_view.send(message)
+
+            await common.safe_delete(message3)
+
+            if should_send_notification and common.current_notification != "":
+                await message.channel.send(common.current_notification.replace("{SERVER_PREFIX}", server_prefix))
+                
 
     @staticmethod
     async def table_text_command(message:discord.Message, this_bot:ChannelBot, args: List[str], server_prefix:str, is_lounge_server:bool):
@@ -17,7 +17,7 @@ import ssl
 import certifi
 import dill
 import TimerDebuggers
-from typing import TYPE_CHECKING, Dict, List, Literal
+from typing import TYPE_CHECKING, Dict, List, Literal, Union
 
 # I don't know the exact details because I'm not extremely familiar with how SSL certification actually works, but
 # this was necessary at one point because a main SSL certificate list expired a while ago,
@@ -189,7 +189,14 @@ DATA_TRACKING_PATH = "data_tracking/"
 ROOM_DATA_TRACKING_DATABASE_FILE = f"{DATA_PATH}room_data_tracking.db"
 ROOM_DATA_POPULATE_TIER_TABLE_SQL = f"{DATA_TRACKING_PATH}channel_tiers_addition.sql"
 ROOM_DATA_TRACKING_DATABASE_CREATION_SQL = f"{DATA_TRACKING_PATH}room_tracking_db_setup.sql"
+ROOM_DATA_TRACKING_ARCHIVE_CREATION_SQL = f"{DATA_TRACKING_PATH}room_tracking_archive_setup.sql"
 ROOM_DATA_TRACKING_DATABASE_MAINTENANCE_SQL = f"{DATA_TRACKING_PATH}database_maintenance.sql"
+ROOM_DATA_TRACKING_QUERY_INDEXES_SQL = f"{DATA_TRACKING_PATH}migrations/query_indexes.sql"
+ROOM_DATA_TRACKING_STATS_AGGREGATES_SQL = f"{DATA_TRACKING_PATH}migrations/stats_aggregates.sql"
+ROOM_DATA_TRACKING_SCHEMA_VERSIONS_SQL = f"{DATA_TRACKING_PATH}migrations/schema_versions.sql"
+ROOM_DATA_TRACKING_HEAD_TO_HEAD_SQL = f"{DATA_TRACKING_PATH}migrations/head_to_head.sql"
+MII_DATA_CACHE_DATABASE_FILE = f"{DATA_PATH}mii_data_cache.db"
+USER_DATA_DATABASE_FILE = f"{DATA_PATH}user_data.db"
 
 LOUNGE_ID_COUNTER_FILE = f"{DATA_PATH}lounge_counter.pkl"
 LOUNGE_TABLE_UPDATES_FILE = f"{DATA_PATH}lounge_table_update_ids.pkl"
@@ -245,19 +252,16 @@ FILES_TO_BACKUP = {ERROR_LOGS_FILE,
                    DEFAULT_TABLE_THEME_FILE_NAME,
                    DEFAULT_GRAPH_FILE,
                    DEFAULT_MII_FILE,
-                   BLACKLISTED_USERS_FILE,
                    BLACKLISTED_WORDS_FILE,
                    BOT_ADMINS_FILE,
                    CTGP_REGION_FILE,
-                   FC_DISCORD_ID_FILE,
-                   DISCORD_ID_FLAGS_FILE,
-                   DISCORD_ID_LOUNGES_FILE,
                    LOUNGE_ID_COUNTER_FILE,
                    LOUNGE_TABLE_UPDATES_FILE,
                    TABLE_BOT_PKL_FILE,
                    VR_IS_ON_FILE,
                    SHA_TRACK_NAMES_FILE,
                    ROOM_DATA_TRACKING_DATABASE_FILE,
+                   USER_DATA_DATABASE_FILE,
                    JSON_META_FILE
                    }
 
@@ -541,7 +545,8 @@ def log_text(text, logging_type=MESSAGE_LOGGING_TYPE):
 image_downloader_session = None
 
 @TimerDebuggers.timer_coroutine
-async def download_image(image_url, image_path):
+async def download_image_bytes(image_url) -> Union[bytes, None]:
+    """Downloads the image at the given URL and returns its bytes, or None if the download failed"""
     global image_downloader_session
     if not image_downloader_session:
         image_downloader_session = aiohttp.ClientSession()
@@ -549,13 +554,19 @@ async def download_image(image_url, image_path):
     try:
         async with image_downloader_session.get(image_url, ssl=sslcontext) as resp:
             if resp.status == 200:
-                with open(image_path, mode='wb+') as f:
-                    f.write(await resp.read())
-                    return True
+                return await resp.read()
     except Exception as e:
         await image_downloader_session.close()
         image_downloader_session = aiohttp.ClientSession()
-    return False
+    return None
+
+async def download_image(image_url, image_path):
+    image_bytes = await download_image_bytes(image_url)
+    if image_bytes is None:
+        return False
+    with open(image_path, mode='wb+') as f:
+        f.write(image_bytes)
+    return True
 
 
 async def safe_send_missing_permissions(message:discord.Message, delete_after=None):
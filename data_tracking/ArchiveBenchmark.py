@@ -0,0 +1,129 @@
+'''
+Created on Oct 19, 2026
+
+@author: willg
+
+Benchmarks the DataRetriever queries that read races (?popular's get_tracks_played_count and get_mii_hexes) on a synthetic room tracking
+database (see QueryPlanBenchmark), before and after it's split into monthly archives (see ArchivePartitions).
+
+On the split database, each query is run the way DataRetriever runs it: on the live database and on the archives of the months in its date range,
+with the results merged. The results are checked against the unsplit database's, and the time to split the database is reported too.
+
+Run from the bot's folder: python -m data_tracking.ArchiveBenchmark [--placements 2000000] [--database-folder temp/] [--keep-months 3] [--output results.json]
+'''
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import statistics
+import sys
+import time
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+import common
+from data_tracking import ArchivePartitions
+from data_tracking import QueryPlanBenchmark
+from data_tracking import Data_Tracker_SQL_Query_Builder as QB
+
+DEFAULT_DATABASE_FOLDER = "temp/"
+DEFAULT_PLACEMENTS = 2000000
+DEFAULT_REPEAT = 5
+DAY_RANGES = (7, 30, 90, None)
+
+
+def get_benchmark_queries(seeded: Dict) -> List[Tuple[str, str, List, int, object]]:
+    '''Returns (description, sql, parameters, days, merge) for each query, built the same way DataRetriever builds them'''
+    SQB = QB.SQL_Search_Query_Builder
+    queries = []
+    for tier in (None, seeded["tier"]):
+        for days in DAY_RANGES:
+            queries.append((f"get_tracks_played_count(is_ct=False, tier={tier}, in_last_days={days})",
+                            *SQB.get_tracks_played_query(False, tier, days), days, ArchivePartitions.merge_tracks_played))
+    queries.append(("get_mii_hexes(player)", *SQB.get_fc_mii_hexes_query(seeded["player_fcs"]), None, ArchivePartitions.merge_mii_hexes))
+    return queries
+
+def run_partitioned(database_file: str, connection: sqlite3.Connection, sql: str, parameters, days, merge) -> List[Tuple]:
+    '''Runs the query the way DataTracker.execute_read_partitioned does, without the thread pool'''
+    months = ArchivePartitions.get_months_in_window(ArchivePartitions.get_archived_months(database_file), days)
+    partition_results = [connection.execute(sql, parameters).fetchall()]
+    if len(months) > 0:
+        partition_results.append(ArchivePartitions.execute_on_archives(database_file, months, sql, parameters))
+    return merge(partition_results)
+
+def time_function(function, repeat: int) -> Tuple[float, List[Tuple]]:
+    timings = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        rows = function()
+        timings.append(time.perf_counter() - t0)
+    return statistics.median(timings), rows
+
+def get_database_size(database_file: str) -> int:
+    return sum(os.path.getsize(database_file + suffix) for suffix in ("", "-wal") if os.path.exists(database_file + suffix))
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Compare the race queries on a synthetic room tracking database before and after it's split into monthly archives.")
+    parser.add_argument("--database-folder", default=DEFAULT_DATABASE_FOLDER, help="where to create the synthetic databases (they are overwritten)")
+    parser.add_argument("--placements", type=int, default=DEFAULT_PLACEMENTS, help="number of placements to seed the database with")
+    parser.add_argument("--keep-months", type=int, default=ArchivePartitions.ARCHIVE_AFTER_MONTHS, help="months kept in the live database")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="number of times each query is timed")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="JSON file to write the results to")
+    args = parser.parse_args(argv)
+
+    unsplit_database_file = os.path.join(args.database_folder, "archive_benchmark_unsplit.db")
+    split_database_file = os.path.join(args.database_folder, "archive_benchmark_split.db")
+    connection = QueryPlanBenchmark.create_database(unsplit_database_file)
+    t0 = time.perf_counter()
+    seeded = QueryPlanBenchmark.seed_database(connection, args.placements, args.seed)
+    connection.executescript(common.read_sql_file(common.ROOM_DATA_TRACKING_QUERY_INDEXES_SQL))
+    connection.executescript(common.read_sql_file(common.ROOM_DATA_TRACKING_STATS_AGGREGATES_SQL))
+    connection.execute("PRAGMA journal_mode=WAL;")
+    connection.close()
+    print(f"Seeded {seeded['placements']} placements in {time.perf_counter() - t0:.1f}s")
+
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(split_database_file + suffix):
+            os.remove(split_database_file + suffix)
+    shutil.rmtree(ArchivePartitions.get_archive_folder(split_database_file), ignore_errors=True)
+    shutil.copyfile(unsplit_database_file, split_database_file)
+    t0 = time.perf_counter()
+    months = ArchivePartitions.get_months_to_archive(split_database_file, args.keep_months)
+    for month in months:
+        ArchivePartitions.archive_month(split_database_file, month)
+    split_seconds = time.perf_counter() - t0
+    connection = sqlite3.connect(split_database_file, isolation_level=None)
+    connection.execute("VACUUM")
+    connection.close()
+    archives_size = sum(os.path.getsize(archive_file) for archive_file in ArchivePartitions.get_archive_files(split_database_file))
+    print(f"Split {len(months)} months into archives in {split_seconds:.1f}s: live database {get_database_size(unsplit_database_file) / 2**20:.0f} MiB -> "
+          f"{get_database_size(split_database_file) / 2**20:.0f} MiB, archives {archives_size / 2**20:.0f} MiB")
+
+    results = {"placements": seeded["placements"], "time": str(datetime.now()), "archived_months": len(months), "split_seconds": split_seconds, "queries": {}}
+    unsplit_connection = sqlite3.connect(unsplit_database_file)
+    split_connection = sqlite3.connect(split_database_file)
+    for connection in (unsplit_connection, split_connection):
+        connection.execute("ANALYZE")
+    print("\n===== Race queries: unsplit -> split =====")
+    mismatches = 0
+    for description, sql, parameters, days, merge in get_benchmark_queries(seeded):
+        unsplit_seconds, expected = time_function(lambda: unsplit_connection.execute(sql, parameters).fetchall(), args.repeat)
+        split_seconds, rows = time_function(lambda: run_partitioned(split_database_file, split_connection, sql, parameters, days, merge), args.repeat)
+        matches = rows == expected
+        mismatches += not matches
+        results["queries"][description] = {"unsplit_seconds": unsplit_seconds, "split_seconds": split_seconds, "results_match": matches}
+        print(f"{description}: {unsplit_seconds*1000:.1f}ms -> {split_seconds*1000:.1f}ms ({unsplit_seconds / max(split_seconds, 1e-9):.1f}x)"
+              f"{'' if matches else ' RESULTS DIFFERENT'}")
+    unsplit_connection.close()
+    split_connection.close()
+
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    return 0 if mismatches == 0 else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,300 @@
+'''
+Created on Oct 19, 2026
+
+@author: willg
+
+Monthly archive databases for the room tracking database.
+
+The races of months older than ARCHIVE_AFTER_MONTHS (with their placements and Event_Races rows) are moved out of the live database into
+one database for each month, in a folder next to it (see get_archive_folder). The bot's database maintenance job archives each month once it's
+old enough (see DataTracker.archive_old_months), and this module's main splits an existing database the same way.
+
+An archive is queried through a connection opened on the archive, with the live database attached. SQLite looks up a table that isn't
+qualified with a schema in the connection's own database first and then in the attached ones, so Race, Place and Event_Races are the archive's
+and every other table (Track, Tier, Event, Event_FCs, ...) is the live database's. So the same query can be run on the live database or on
+any archive, and a query over a range of days only has to be run on the archives of the months in that range (see get_months_in_window).
+Every race of a day is in the same database, so the stats aggregates' (track, is_ct, day) buckets can be recomputed from one database.
+
+The events (Event, Event_FCs, Event_Structure) are small next to their races, and stay in the live database, along with Player_Track_Stats
+and Head_To_Head, which still have the archived months' rows - the stats commands never read the archives.
+
+Run from the bot's folder: python -m data_tracking.ArchivePartitions [--database tablebot_data/room_data_tracking.db] [--keep-months 3] [--dry-run]
+'''
+import argparse
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+import common
+from data_tracking import Data_Tracker_SQL_Query_Builder as QB
+
+#The current month and this many months before it stay in the live database
+ARCHIVE_AFTER_MONTHS = 3
+#Races moved in each transaction, so the bot's writes never wait long for the archiving
+ARCHIVE_CHUNK_RACES = 2000
+ARCHIVE_BUSY_TIMEOUT_SECONDS = 10
+ARCHIVE_FILE_PATTERN = re.compile(r"^(\d{4}-\d{2})\.db$")
+#Found next to this module rather than from the working directory, since archives are also created by scripts and tests that run from elsewhere
+ARCHIVE_CREATION_SQL_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.path.basename(common.ROOM_DATA_TRACKING_ARCHIVE_CREATION_SQL))
+#The live database is attached to archive connections under this name
+LIVE_DATABASE_SCHEMA = "tracking"
+#Idle read-only archive connections, for each (database file, month). The connections are opened with check_same_thread=False, since they're used on
+#whichever thread runs execute_on_archives, but only one thread uses a connection at a time.
+idle_archive_connections = {}
+archive_connections_lock = threading.Lock()
+#The race tables and their columns, in the order they're copied - they're deleted from the live database in the opposite order, because of the foreign keys
+ARCHIVED_TABLES = (("Race", QB.RACE_TABLE_NAMES), ("Place", QB.PLACE_TABLE_NAMES), ("Event_Races", QB.EVENT_RACES_TABLE_NAMES))
+
+
+def get_archive_folder(database_file: str) -> str:
+    database_name = os.path.splitext(os.path.basename(database_file))[0]
+    return os.path.join(os.path.dirname(database_file), f"{database_name}_archives")
+
+def get_archive_file(database_file: str, month: str) -> str:
+    return os.path.join(get_archive_folder(database_file), f"{month}.db")
+
+def get_archived_months(database_file: str) -> List[str]:
+    '''The months (as "YYYY-MM") that have an archive, oldest first'''
+    archive_folder = get_archive_folder(database_file)
+    if not os.path.isdir(archive_folder):
+        return []
+    months = [ARCHIVE_FILE_PATTERN.match(file_name) for file_name in os.listdir(archive_folder)]
+    return sorted(month.group(1) for month in months if month is not None)
+
+def get_archive_files(database_file: str) -> List[str]:
+    return [get_archive_file(database_file, month) for month in get_archived_months(database_file)]
+
+def get_database_file(connection: sqlite3.Connection) -> str:
+    '''The file of the connection's main database'''
+    for _, name, database_file in connection.execute("PRAGMA database_list"):
+        if name == "main":
+            return database_file
+
+def add_months(month: str, months: int) -> str:
+    year, month_num = map(int, month.split("-"))
+    month_index = year * 12 + month_num - 1 + months
+    return f"{month_index // 12:04}-{month_index % 12 + 1:02}"
+
+def get_archive_cutoff_month(keep_months=ARCHIVE_AFTER_MONTHS, today: date=None) -> str:
+    '''The oldest month that stays in the live database'''
+    today = datetime.now(timezone.utc).date() if today is None else today
+    return add_months(today.strftime("%Y-%m"), -(keep_months - 1))
+
+def get_months_in_window(archived_months: Iterable[str], days=None, today: date=None) -> List[str]:
+    '''The archived months that can have races from the last days days (all of them when days is None).
+    The stats queries compare time_added to date('now', '-x days'), which is in UTC, so a day more is included in case time_added isn't.'''
+    if days is None:
+        return list(archived_months)
+    today = datetime.now(timezone.utc).date() if today is None else today
+    window_start_month = (today - timedelta(days=days + 1)).strftime("%Y-%m")
+    return [month for month in archived_months if month >= window_start_month]
+
+def get_months_to_archive(database_file: str, keep_months=ARCHIVE_AFTER_MONTHS, today: date=None) -> List[str]:
+    '''The months before the cutoff that still have races in the live database, oldest first'''
+    connection = sqlite3.connect(f"file:{database_file}?mode=ro", uri=True)
+    try:
+        cutoff = f"{get_archive_cutoff_month(keep_months, today)}-01"
+        months = []
+        #Seeks the time_added index from one month to the next, instead of reading every old race
+        month = connection.execute("SELECT substr(MIN(time_added), 1, 7) FROM Race WHERE time_added < ?", (cutoff,)).fetchone()[0]
+        while month is not None:
+            months.append(month)
+            month = connection.execute("SELECT substr(MIN(time_added), 1, 7) FROM Race WHERE time_added >= ? AND time_added < ?",
+                                       (f"{add_months(month, 1)}-01", cutoff)).fetchone()[0]
+        return months
+    finally:
+        connection.close()
+
+def create_archive(database_file: str, month: str) -> str:
+    archive_file = get_archive_file(database_file, month)
+    os.makedirs(os.path.dirname(archive_file), exist_ok=True)
+    connection = sqlite3.connect(archive_file, isolation_level=None)
+    try:
+        connection.executescript(common.read_sql_file(ARCHIVE_CREATION_SQL_FILE))
+    finally:
+        connection.close()
+    return archive_file
+
+def archive_races_chunk(database_file: str, month: str, chunk_size=ARCHIVE_CHUNK_RACES) -> int:
+    '''Moves up to chunk_size of the month's races from the live database into the month's archive. Returns how many were moved (0 once the month is done).
+    The races are copied into the archive and committed before they're deleted from the live database, so if this is interrupted, the races are in both
+    (never in neither) until it's run again.'''
+    archive_file = create_archive(database_file, month)
+    connection = sqlite3.connect(database_file, isolation_level=None, timeout=ARCHIVE_BUSY_TIMEOUT_SECONDS)
+    try:
+        connection.execute("PRAGMA foreign_keys = ON;")
+        connection.execute("ATTACH DATABASE ? AS archive", (archive_file,))
+        connection.execute("BEGIN IMMEDIATE")
+        race_ids = [race_id for (race_id,) in connection.execute("SELECT race_id FROM main.Race WHERE time_added >= ? AND time_added < ? LIMIT ?",
+                                                                 (f"{month}-01", f"{add_months(month, 1)}-01", chunk_size))]
+        if len(race_ids) == 0:
+            connection.execute("COMMIT")
+            #The month is done, so its archive won't change anymore - its statistics are gathered once for the query planner
+            connection.execute("ANALYZE archive;")
+            return 0
+        race_ids_arg = QB.build_json_list_arg(race_ids)
+        for table, column_names in ARCHIVED_TABLES:
+            columns = QB.build_data_names(column_names)
+            connection.execute(f"INSERT OR IGNORE INTO archive.{table} {columns} SELECT {', '.join(column_names)} FROM main.{table} WHERE race_id IN {QB.build_sql_json_list()}",
+                               (race_ids_arg,))
+        connection.execute("COMMIT")
+        connection.execute("BEGIN IMMEDIATE")
+        for table, _ in reversed(ARCHIVED_TABLES):
+            connection.execute(f"DELETE FROM main.{table} WHERE race_id IN {QB.build_sql_json_list()}", (race_ids_arg,))
+        connection.execute("COMMIT")
+        return len(race_ids)
+    finally:
+        connection.close()
+
+def archive_month(database_file: str, month: str, chunk_size=ARCHIVE_CHUNK_RACES) -> int:
+    '''Moves all of the month's races into its archive. Returns how many were moved.'''
+    moved = 0
+    while True:
+        chunk_moved = archive_races_chunk(database_file, month, chunk_size)
+        if chunk_moved == 0:
+            return moved
+        moved += chunk_moved
+
+def connect_archive(database_file: str, month: str) -> sqlite3.Connection:
+    '''A read-only connection to the month's archive, with the live database attached (read-only) for the tables that aren't archived'''
+    connection = sqlite3.connect(f"file:{get_archive_file(database_file, month)}?mode=ro", uri=True, isolation_level=None, timeout=ARCHIVE_BUSY_TIMEOUT_SECONDS,
+                                 check_same_thread=False)
+    connection.execute(f"ATTACH DATABASE ? AS {LIVE_DATABASE_SCHEMA}", (f"file:{database_file}?mode=ro",))
+    return connection
+
+def get_archive_connection(database_file: str, month: str) -> sqlite3.Connection:
+    '''An idle connection to the month's archive, or a new one if there isn't one. Opening a connection (and attaching the live database)
+    costs more than most of the queries, so connections are given back with put_archive_connection and kept open.'''
+    with archive_connections_lock:
+        idle_connections = idle_archive_connections.get((database_file, month))
+        if idle_connections:
+            return idle_connections.pop()
+    return connect_archive(database_file, month)
+
+def put_archive_connection(database_file: str, month: str, connection: sqlite3.Connection):
+    with archive_connections_lock:
+        idle_archive_connections.setdefault((database_file, month), []).append(connection)
+
+def close_archive_connections():
+    with archive_connections_lock:
+        for idle_connections in idle_archive_connections.values():
+            for connection in idle_connections:
+                connection.close()
+        idle_archive_connections.clear()
+
+def execute_on_archives(database_file: str, months: Iterable[str], query: str, args=(), dirty_buckets: List[Tuple]=None) -> List[Tuple]:
+    '''Runs the query on each of the months' archives and returns all of their rows. Can be run on any thread.
+    If dirty_buckets is given, the buckets of each month are put into the archive connection's temp.Stats_Dirty_Buckets first,
+    for QB.build_stats_aggregates_query(dirty_buckets_only=True).'''
+    rows = []
+    for month in months:
+        connection = get_archive_connection(database_file, month)
+        try:
+            if dirty_buckets is not None:
+                connection.execute(QB.create_stats_dirty_buckets_script())
+                connection.executemany("INSERT OR IGNORE INTO temp.Stats_Dirty_Buckets VALUES (?, ?, ?)",
+                                       [bucket for bucket in dirty_buckets if bucket[2].startswith(month)])
+            rows.extend(connection.execute(query, args).fetchall())
+            if dirty_buckets is not None:
+                connection.execute("DELETE FROM temp.Stats_Dirty_Buckets")
+        except BaseException:
+            connection.close()
+            raise
+        put_archive_connection(database_file, month, connection)
+    return rows
+
+def iterate_archive_batches(database_file: str, month: str, query: str, args, batch_size: int) -> Iterator[List[Tuple]]:
+    '''Yields the query's rows on the month's archive, batch_size rows at a time. The batches can be fetched from any thread, one at a time.'''
+    connection = get_archive_connection(database_file, month)
+    try:
+        cursor = connection.execute(query, args)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if len(rows) == 0:
+                break
+            yield rows
+        cursor.close()
+    except BaseException:
+        #Including GeneratorExit, when the rows aren't all read - the cursor's statement would still be running on the connection
+        connection.close()
+        raise
+    put_archive_connection(database_file, month, connection)
+
+def get_archived_dirty_buckets(database_file: str, dirty_buckets: Iterable[Tuple]) -> List[Tuple]:
+    '''The (fixed_track_name, is_ct, day) buckets whose races are in an archive'''
+    archived_months = set(get_archived_months(database_file))
+    return [bucket for bucket in dirty_buckets if bucket[2][:7] in archived_months]
+
+def rename_tracks(database_file: str, track_names: Dict[str, str]) -> Dict[str, List[str]]:
+    '''Renames the archived races of each old track name to its new name (for DataTracker.fix_shas).
+    Returns the days with archived races that were renamed, for each old track name.'''
+    renamed_days = defaultdict(list)
+    for archive_file in get_archive_files(database_file):
+        connection = sqlite3.connect(archive_file, isolation_level=None, timeout=ARCHIVE_BUSY_TIMEOUT_SECONDS)
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            for old_track_name, new_track_name in track_names.items():
+                renamed_days[old_track_name].extend(day for (day,) in connection.execute("SELECT DISTINCT date(time_added) FROM Race WHERE track_name = ?", (old_track_name,)))
+                connection.execute("UPDATE Race SET track_name = ? WHERE track_name = ?", (new_track_name, old_track_name))
+            connection.execute("COMMIT")
+        finally:
+            connection.close()
+    return dict(renamed_days)
+
+def merge_tracks_played(partition_results: List[List[Tuple]]) -> List[Tuple]:
+    '''Adds together the (track_name, fixed_track_name, times_played) rows of get_tracks_played_query from each database, in the query's order'''
+    if len(partition_results) == 1:
+        return partition_results[0]
+    tracks = {}
+    for rows in partition_results:
+        for track_name, fixed_track_name, times_played in rows:
+            if fixed_track_name in tracks:
+                times_played += tracks[fixed_track_name][2]
+                track_name = tracks[fixed_track_name][0]
+            tracks[fixed_track_name] = (track_name, fixed_track_name, times_played)
+    return sorted(tracks.values(), key=lambda row: (-row[2], row[0]))
+
+def merge_mii_hexes(partition_results: List[List[Tuple]]) -> List[Tuple]:
+    '''Keeps the row with the first race of each event from get_fc_mii_hexes_query's results of each database (an event's races can be
+    in two databases if they were on both sides of the end of a month), ordered by event id'''
+    if len(partition_results) == 1:
+        return partition_results[0]
+    events = {}
+    for rows in partition_results:
+        for row in rows:
+            if row[0] not in events or row[1] < events[row[0]][1]:
+                events[row[0]] = row
+    return [events[event_id] for event_id in sorted(events)]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Move the races of old months out of the room tracking database into monthly archive databases.")
+    parser.add_argument("--database", default=common.ROOM_DATA_TRACKING_DATABASE_FILE)
+    parser.add_argument("--keep-months", type=int, default=ARCHIVE_AFTER_MONTHS, help="the current month and this many months before it stay in the live database")
+    parser.add_argument("--chunk-races", type=int, default=ARCHIVE_CHUNK_RACES, help="races moved in each transaction")
+    parser.add_argument("--dry-run", action="store_true", help="only list the months that would be archived")
+    args = parser.parse_args(argv)
+
+    months = get_months_to_archive(args.database, args.keep_months)
+    if len(months) == 0:
+        print(f"There are no races from before {get_archive_cutoff_month(args.keep_months)} to archive.")
+        return 0
+    print(f"Months to archive into {get_archive_folder(args.database)}: {', '.join(months)}")
+    if args.dry_run:
+        return 0
+    for month in months:
+        t0 = time.perf_counter()
+        moved = archive_month(args.database, month, args.chunk_races)
+        print(f"{month}: moved {moved} races in {time.perf_counter() - t0:.1f}s")
+    #The archived races' pages are free pages now, which the bot's maintenance job vacuums away (see DataTracker.database_maintenance)
+    print("Done. The live database keeps its size until it's vacuumed.")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -7,11 +7,14 @@ This module helps track and store data from Wiimmfi.
 
 '''
 import asyncio
+import hashlib
 import json
 import os
+import random
 import time
 import traceback
-from collections import defaultdict
+from collections import defaultdict, namedtuple, OrderedDict
+from contextlib import asynccontextmanager
 from copy import deepcopy
 from itertools import chain
 from typing import List, Dict, Tuple, Set
@@ -26,6 +29,8 @@ import UserDataProcessing
 import UtilityFunctions
 import common
 from data_tracking import Data_Tracker_SQL_Query_Builder as QB
+from data_tracking import ArchivePartitions
+from data_tracking import StatsResultCache
 import TimerDebuggers
 
 DEBUGGING_DATA_TRACKER = False
@@ -57,20 +62,70 @@ class ConnectionWrapper():
         cursor = await self.con.executescript(*args)
         return await cursor.fetchall()
 
+    async def execute_count(self, *args):
+        '''For statements that don't return rows: returns the number of rows the statement changed'''
+        cursor = await self.con.execute(*args)
+        return cursor.rowcount
+
+    async def executemany_count(self, *args):
+        cursor = await self.con.executemany(*args)
+        return cursor.rowcount
+
     def __getattr__(self, attr):
         return self.con.__getattribute__(attr)
 
+#Held for the whole of a write transaction, so another update's statements can't end up in the middle of it
+db_write_lock = None
+
+def get_db_write_lock() -> asyncio.Lock:
+    global db_write_lock
+    if db_write_lock is None:
+        db_write_lock = asyncio.Lock()
+    return db_write_lock
+
+@asynccontextmanager
+async def write_transaction():
+    '''Everything written in the with block is written in one transaction, which is rolled back completely if anything in the block raises'''
+    async with get_db_write_lock():
+        await db_connection.execute("BEGIN IMMEDIATE;")
+        try:
+            yield
+        except BaseException:
+            await db_connection.execute("ROLLBACK;")
+            raise
+        await db_connection.execute("COMMIT;")
+
+async def insert_rows(build_script, rows:List[Tuple]) -> int:
+    '''Inserts the given rows using multi-row INSERT statements built by build_script, with as many rows in each statement as SQLite's parameter limit allows.
+    The statements that are full are all run by one executemany. Returns the number of rows inserted.'''
+    if len(rows) == 0:
+        return 0
+    rows_per_statement = QB.get_rows_per_statement(len(rows[0]))
+    full_statements_end = len(rows) - (len(rows) % rows_per_statement)
+    inserted = 0
+    if full_statements_end > 0:
+        statements_args = [list(chain.from_iterable(rows[i:i+rows_per_statement])) for i in range(0, full_statements_end, rows_per_statement)]
+        inserted += await db_connection.executemany_count(build_script(rows[:rows_per_statement]), statements_args)
+    if full_statements_end < len(rows):
+        remaining_rows = rows[full_statements_end:]
+        inserted += await db_connection.execute_count(build_script(remaining_rows), list(chain.from_iterable(remaining_rows)))
+    return inserted
+
 class DataRetriever(object):
     #TODO: Finish method
     @staticmethod
     async def get_tracks_played_count(is_ct=False, tier=None, in_last_days=None):
-        tracks_query = QB.SQL_Search_Query_Builder.get_tracks_played_query(is_ct, tier, in_last_days)
-        return await db_connection.execute(tracks_query)
+        tracks_query, args = QB.SQL_Search_Query_Builder.get_tracks_played_query(is_ct, tier, in_last_days)
+        async def run_tracks_query():
+            return ArchivePartitions.merge_tracks_played(await execute_read_partitioned(tracks_query, args, in_last_days))
+        return await StatsResultCache.get_cached("tracks_played", (bool(is_ct), tier, in_last_days), run_tracks_query, tier=tier)
 
     @staticmethod
     async def get_best_tracks(fcs, is_ct=False, tier=None, in_last_days=None, sort_asc=False, min_count = 1):
-        tracks_query = QB.SQL_Search_Query_Builder.get_best_tracks(fcs, is_ct, tier, in_last_days, min_count)
-        result = await db_connection.execute(tracks_query)
+        fcs = sorted(set(fcs))
+        tracks_query, args = QB.SQL_Search_Query_Builder.get_best_tracks_aggregated(fcs, is_ct, tier, in_last_days, min_count)
+        result = await StatsResultCache.get_cached("best_tracks", (tuple(fcs), bool(is_ct), tier, in_last_days, min_count),
+                                                   lambda: execute_read(tracks_query, args), tier=tier, fcs=fcs)
         if sort_asc:
             return list(reversed(result))
         return result
@@ -78,27 +133,51 @@ class DataRetriever(object):
     @staticmethod
     async def get_top_players(track, tier=None, in_last_days=None, min_count=1):
         #await db_connection.execute("WITH RECURSIVE cnt(x) AS (SELECT 1 UNION ALL SELECT x+1 FROM cnt lIMIT 20000000) SELECT avg(x) FROM cnt;")
-        tracks_query = QB.SQL_Search_Query_Builder.get_top_players_query(tier, in_last_days, min_count)
-        return await db_connection.execute(tracks_query, [track])
+        tracks_query, args = QB.SQL_Search_Query_Builder.get_top_players_aggregated_query(track, tier, in_last_days, min_count)
+        return await StatsResultCache.get_cached("top_players", (track, tier, in_last_days, min_count),
+                                                 lambda: execute_read(tracks_query, args), tier=tier, track=track)
 
     @staticmethod
     @TimerDebuggers.timer_coroutine
     async def get_record(player_did, opponent_did, days, is_ct=False):
-        record_query = QB.SQL_Search_Query_Builder.get_record_query(player_did, opponent_did, days, is_ct=is_ct)
-        return await db_connection.execute(record_query)
+        record_query, args = QB.SQL_Search_Query_Builder.get_record_aggregated_query(player_did, opponent_did, days, is_ct=is_ct)
+        #The record only changes when one of the players' fcs plays, and the fcs are only looked up when the record isn't cached
+        players_fcs = []
+        async def run_record_query():
+            async with read_connection() as connection:
+                players_fcs.extend(fc for (fc,) in await connection.execute(QB.get_record_players_fcs_query(), [player_did, opponent_did]))
+                return await connection.execute(record_query, args)
+        return await StatsResultCache.get_cached("record", (player_did, opponent_did, days, bool(is_ct)), run_record_query, fcs=players_fcs)
 
     @staticmethod
     async def get_track_list():
-        return await db_connection.execute("SELECT track_name, url, fixed_track_name, is_ct, track_name_lookup "
-                                           "FROM Track")
+        return await execute_read("SELECT track_name, url, fixed_track_name, is_ct, track_name_lookup "
+                                  "FROM Track")
 
     @staticmethod
     async def get_mii_hexes(fcs: List[str]):
         """Returns the event id, first race id in the event, first match time of the event, fc,
         and mii hex of the mii used in the event for each that one of the given fcs was in.
         IMPORTANT NUANCED INFORMATION: See get_fc_mii_hexes_query for returned data in special cases"""
-        mii_hex_query = QB.SQL_Search_Query_Builder.get_fc_mii_hexes_query(fcs)
-        return await db_connection.execute(mii_hex_query, fcs)
+        mii_hex_query, args = QB.SQL_Search_Query_Builder.get_fc_mii_hexes_query(fcs)
+        return ArchivePartitions.merge_mii_hexes(await execute_read_partitioned(mii_hex_query, args))
+
+    @staticmethod
+    async def get_random_previous_mii(fcs: List[str], rng=random):
+        """Picks one of the miis the fcs were in events with (each mii equally likely), then one of the races the mii was in (each race equally likely).
+        Returns the race's row, the same as get_mii_hexes's rows, or None if there aren't any.
+        The rows are sampled as they're streamed (reservoir sampling), so only one row is kept for each mii, no matter how many events the player was in."""
+        mii_races_query, args = QB.SQL_Search_Query_Builder.get_fc_mii_races_query(fcs)
+        #mii hex: [number of races with the mii so far, the sampled race's row]
+        mii_samples = {}
+        async for row in iterate_read_partitioned(mii_races_query, args):
+            mii_sample = mii_samples.setdefault(row[-1], [0, None])
+            mii_sample[0] += 1
+            if rng.randrange(mii_sample[0]) == 0:
+                mii_sample[1] = row
+        if len(mii_samples) == 0:
+            return None
+        return mii_samples[rng.choice(sorted(mii_samples))][1]
     
 
 class ChannelBotSQLDataValidator(object):
@@ -368,8 +447,12 @@ class ChannelBotSQLDataValidator(object):
         pass
 
 class RoomTrackerSQL(object):
-    def __init__(self, channel_bot):
+    def __init__(self, channel_bot, races=None, mii_races=None):
+        '''races are the races (and their tracks, players and placements) to write, all of the room's races by default.
+        mii_races are the races whose placements' mii_hex's should be updated, races by default.'''
         self.channel_bot = channel_bot
+        self.races = channel_bot.getRoom().races if races is None else races
+        self.mii_races = self.races if mii_races is None else mii_races
         self.data_validator = ChannelBotSQLDataValidator()
             
     
@@ -435,116 +518,80 @@ class RoomTrackerSQL(object):
     
         
     async def insert_missing_placements_into_database(self):
-        '''Inserts placements in self.channel_bot's races are not yet in the database's Place table.
+        '''Inserts placements in self.races that are not yet in the database's Place table.
         May raise SQLDataBad, SQLTypeWrong, SQLFormatWrong
-        Returns a list of the inserted placements (as 2-tuples: race_id, fc) upon success. (An empty list is returned if no placements were inserted.)'''
+        Returns the number of placements inserted.'''
         
-        race_id_fc_placements = {(race.get_race_id(), placement.getPlayer().get_FC()):placement for race in self.channel_bot.getRoom().races for placement in race.getPlacements()}
+        race_id_fc_placements = {(race.get_race_id(), placement.getPlayer().get_FC()):placement for race in self.races for placement in race.getPlacements()}
         if len(race_id_fc_placements) == 0:
-            return []
+            return 0
         
         self.data_validator.validate_placement_data(race_id_fc_placements)
         all_data = [self.get_placement_as_sql_place_tuple(race_id, p) for (race_id, _), p in race_id_fc_placements.items()]
-        insert_ignore_script = QB.build_insert_missing_placement_script(all_data)
-        values_args = list(chain.from_iterable(all_data))
-        
-        return await db_connection.execute(insert_ignore_script, values_args)
+        return await insert_rows(QB.build_insert_missing_placement_script, all_data)
     
     async def insert_missing_players_into_database(self):
-        '''Inserts players in all of the races in self.channel_bot.races that are not yet in the database's Player table.
+        '''Inserts players in all of the races in self.races that are not yet in the database's Player table.
         May raise SQLDataBad, SQLTypeWrong, SQLFormatWrong
-        Returns a list of the inserted player's fcs (as 1-tuples) upon success. (An empty list is returned if no players were inserted.)'''
-        unique_room_players = [placement.getPlayer() for placement in self.channel_bot.getRoom().getFCPlacements().values()]
+        Returns the number of players inserted.'''
+        unique_room_players = list({placement.getPlayer().get_FC():placement.getPlayer() for race in self.races for placement in race.getPlacements()}.values())
         if len(unique_room_players) == 0:
-            return []
+            return 0
         
         self.data_validator.validate_player_data(unique_room_players)
             
         all_data = [self.get_player_as_sql_player_tuple(p) for p in unique_room_players]
-        insert_ignore_script = QB.build_insert_missing_players_script(all_data)
-        values_args = list(chain.from_iterable(all_data))
-        return await db_connection.execute(insert_ignore_script, values_args)
+        return await insert_rows(QB.build_insert_missing_players_script, all_data)
     
     async def insert_missing_races_into_database(self):
-        '''Inserts races in self.channel_bot.races are not yet in the database's Race table.
+        '''Inserts races in self.races that are not yet in the database's Race table.
         May raise SQLDataBad, SQLTypeWrong, SQLFormatWrong
-        Returns a list of the inserted race's race_id's (as 1-tuples) upon success. (An empty list is returned if no races were inserted.)'''
-        unique_races = {race.get_race_id():race for race in self.channel_bot.getRoom().races}.values()
+        Returns the number of races inserted.'''
+        unique_races = {race.get_race_id():race for race in self.races}.values()
         if len(unique_races) == 0:
-            return []
+            return 0
         
         self.data_validator.validate_races_data(unique_races)
         all_data = [self.get_race_as_sql_tuple(r) for r in unique_races]
-        insert_ignore_script = QB.build_insert_missing_races_script(all_data)
-        values_args = list(chain.from_iterable(all_data))
-        return await db_connection.execute(insert_ignore_script, values_args)
+        return await insert_rows(QB.build_insert_missing_races_script, all_data)
     
     async def insert_missing_tracks_into_database(self):
-        '''Inserts tracks in self.channel_bot's races are not yet in the database's Track table.
+        '''Inserts tracks in self.races that are not yet in the database's Track table.
         May raise SQLDataBad, SQLTypeWrong, SQLFormatWrong
-        Returns the a list of the inserted track names (as 1-tuples) upon success. (An empty list is returned if no tracks were inserted.)'''
-        races_unique_track_names = {race.get_track_name():race for race in self.channel_bot.getRoom().races}.values()
+        Returns the number of tracks inserted.'''
+        races_unique_track_names = {race.get_track_name():race for race in self.races}.values()
         if len(races_unique_track_names) == 0:
-            return []
+            return 0
         
         self.data_validator.validate_tracks_data(races_unique_track_names)
         all_data = [self.get_race_as_sql_track_tuple(r) for r in races_unique_track_names]
-        insert_ignore_script = QB.build_insert_missing_tracks_script(all_data)
-        values_args = list(chain.from_iterable(all_data))
-        
-        return await db_connection.execute(insert_ignore_script, values_args)
+        return await insert_rows(QB.build_insert_missing_tracks_script, all_data)
     
-    async def get_matching_placements_with_missing_hex(self, update_mii_args):
-        '''Given a list of 3-tuples (where the tuple is (race_id, fc, _)), returns existing a list of (race_id, fcs) tuples in Place table whose mii_hex is null.
-        May raise SQLDataBad, SQLTypeWrong, SQLFormatWrong'''
-        missing_mii_data = [(data[0], data[1], None) for data in update_mii_args]
-        if len(missing_mii_data) == 0:
-            return []
-        missing_mii_hexes_statement = QB.get_existing_race_fcs_in_Place_table_with_null_mii_hex(missing_mii_data)
-        values_args = list(chain.from_iterable(missing_mii_data))
-        return await db_connection.execute(missing_mii_hexes_statement, values_args)
-    
-    async def get_matching_event_fcs_with_missing_hex(self, update_mii_args):
-        '''Given a list of 3-tuples (where the tuple is (event_id, fc, _)), returns existing a list of (event_id, fcs) tuples in Event_FCs table whose mii_hex is null.
-        May raise SQLDataBad, SQLTypeWrong, SQLFormatWrong'''
-        missing_mii_data = [(data[0], data[1], None) for data in update_mii_args]
-        if len(missing_mii_data) == 0:
-            return []
-        missing_mii_hexes_statement = QB.get_existing_event_fcs_in_with_null_mii_hex(missing_mii_data)
-        values_args = list(chain.from_iterable(missing_mii_data))
-        return await db_connection.execute(missing_mii_hexes_statement, values_args)
-        
     async def update_database_place_miis(self):
-        '''Updates the mii_hex for placements in Place table for placements in self.channel_bot.race's placements who have a mii_hex if that mii_hex in the Place table is null.
+        '''Updates the mii_hex for placements in Place table for placements in self.mii_races who have a mii_hex if that mii_hex in the Place table is null.
         May raise SQLDataBad, SQLTypeWrong, SQLFormatWrong
-        Returns the a list of the race_id, fc (as 2-tuples) of the placements whose mii_hex's were updated. (An empty list is returned if nothing was updated.)'''
-        have_miis_for_placements = {(race.get_race_id(), placement.getPlayer().get_FC()):placement for race in self.channel_bot.getRoom().races for placement in race.getPlacements() if placement.getPlayer().get_mii_hex() is not None}
+        Returns the number of placements whose mii_hex was updated.'''
+        have_miis_for_placements = {(race.get_race_id(), placement.getPlayer().get_FC()):placement for race in self.mii_races for placement in race.getPlacements() if placement.getPlayer().get_mii_hex() is not None}
         if len(have_miis_for_placements) == 0:
-            return []
+            return 0
         
         self.data_validator.validate_placement_mii_hex_update(have_miis_for_placements)
         
+        #The update only changes placements whose mii_hex is null, so its row count is the number of placements that were missing their mii
         update_mii_script = QB.update_mii_hex_script()
         update_mii_args = [(placement.getPlayer().get_mii_hex(), race_id, fc) for (race_id, fc), placement in have_miis_for_placements.items()]
-        
-        found_race_id_fcs_with_null_miis = await self.get_matching_placements_with_missing_hex(update_mii_args)
-
-        await db_connection.executemany(update_mii_script, update_mii_args)
-        return found_race_id_fcs_with_null_miis
+        return await db_connection.executemany_count(update_mii_script, update_mii_args)
     
     
     async def insert_missing_event_ids_race_ids(self):
-        '''Inserts (event_id, race_id) in for each race in self.channel_bot's races that are not yet in the database's Event_Races table.
+        '''Inserts (event_id, race_id) in for each race in self.races that are not yet in the database's Event_Races table.
         May raise SQLDataBad, SQLTypeWrong, SQLFormatWrong
-        Returns the a list of the inserted event_ids, race_ids (as 2-tuples) upon success. (An empty list is returned if nothing was inserted.)'''
-        event_id_race_ids = {(self.channel_bot.room.get_event_id(), race.get_race_id()) for race in self.channel_bot.getRoom().races} #Note this is a set of tuples, not a dict
+        Returns the number of (event_id, race_id)'s inserted.'''
+        event_id_race_ids = {(self.channel_bot.room.get_event_id(), race.get_race_id()) for race in self.races} #Note this is a set of tuples, not a dict
         if len(event_id_race_ids) < 1:
-            return []
+            return 0
         self.data_validator.validate_event_id_race_ids(event_id_race_ids)
-        
-        insert_ignore_script = QB.build_missing_event_ids_race_ids_script(event_id_race_ids)
-        values_args = list(chain.from_iterable((event_id, race_id) for event_id, race_id in event_id_race_ids))
-        return await db_connection.execute(insert_ignore_script, values_args)
+        return await insert_rows(QB.build_missing_event_ids_race_ids_script, list(event_id_race_ids))
 
     def get_event_as_upsert_sql_place_tuple(self, channel_bot):
         '''Converts a given table bot a tuple that is ready to be inserted into the Event SQL table'''
@@ -574,44 +621,34 @@ class RoomTrackerSQL(object):
     async def add_event_id(self):
         '''Inserts event_id for self.channel_bot int Event_ID table.
         May raise SQLDataBad, SQLTypeWrong, SQLFormatWrong
-        Returns a list of the inserted event_id (as a 1-tuple) upon success. (An empty list is returned if nothing was inserted.)'''
+        Returns the number of event_id's inserted (0 or 1).'''
         self.data_validator.event_id_validation(self.channel_bot.room.get_event_id())
-        event_sql_args = [(self.channel_bot.room.get_event_id(),)]
-        if len(event_sql_args) < 1:
-            return []
-        
-        upsert_script = QB.build_missing_event_id_table_script(event_sql_args)
-        return await db_connection.execute(upsert_script, event_sql_args[0])
+        return await insert_rows(QB.build_missing_event_id_table_script, [(self.channel_bot.room.get_event_id(),)])
     
     async def insert_missing_event_fcs_and_miis(self):
         '''Inserts event_id, fcs in self.channel_bot's races are not yet in the database's Event_FCS table.
         May raise SQLDataBad, SQLTypeWrong, SQLFormatWrong
-        Returns a list of the inserted placements (as 2-tuples: race_id, fc) upon success. (An empty list is returned if no placements were inserted.)'''
+        Returns the number of (event_id, fc)'s inserted.'''
         event_id_fcs = list({(self.channel_bot.room.get_event_id(), fc, None) for fc in self.channel_bot.getRoom().getFCs()})
         if len(event_id_fcs) == 0:
-            return []
+            return 0
         
         self.data_validator.validate_event_fc_data(event_id_fcs)
-        insert_ignore_script = QB.build_missing_event_fcs_table_script(event_id_fcs)
-        values_args = list(chain.from_iterable(event_id_fcs))
-        return await db_connection.execute(insert_ignore_script, values_args)
+        return await insert_rows(QB.build_missing_event_fcs_table_script, event_id_fcs)
     
     async def update_missing_miis_in_event_fcs(self):
         '''Updates the mii_hex for fcs for the event in Event_FCs table if the mii is null in Event_FCs and if we have a non-null mii
         May raise SQLDataBad, SQLTypeWrong, SQLFormatWrong
-        Returns the a list of the event_id, fc (as 2-tuples) of the fcs in the event whose mii_hex's were updated. (An empty list is returned if nothing was updated.)'''
+        Returns the number of fcs in the event whose mii_hex was updated.'''
         have_miis_for_event = list({(self.channel_bot.room.get_event_id(), fc, mii.mii_data_hex_str) for fc, mii in self.channel_bot.room.get_miis().items()})
         if len(have_miis_for_event) == 0:
-            return []
+            return 0
         
         self.data_validator.validate_event_mii_hex_update(have_miis_for_event)
         
         update_mii_script = QB.update_mii_hex_script_event_fcs()
         update_mii_args = [(mii_hex, event_id, fc) for (event_id, fc, mii_hex) in have_miis_for_event]
-
-        found_event_id_fcs_with_null_miis = await self.get_matching_event_fcs_with_missing_hex(have_miis_for_event)
-        await db_connection.executemany(update_mii_script, update_mii_args)
-        return found_event_id_fcs_with_null_miis
+        return await db_connection.executemany_count(update_mii_script, update_mii_args)
     
     def get_event_structure_tuple(self):
         return (self.channel_bot.room.get_event_id(),
@@ -645,24 +682,79 @@ class RoomTrackerSQL(object):
         #values_args = list(chain.from_iterable(upsert_script))
         return await db_connection.execute(upsert_script, event_structure_tuple)
     
+#High-water marks: what has been written for each event, so an update only has to validate and write the races added since the last one.
+#They're only kept in memory - after a restart (or once an event's mark is evicted), the event's next update writes all of its races again.
+EventHighWaterMark = namedtuple("EventHighWaterMark", ["race_count", "last_race_id", "structure_hash", "placement_mii_count"])
+MAX_EVENT_HIGH_WATER_MARKS = 5000
+event_high_water_marks = OrderedDict() #event id: EventHighWaterMark, least recently written first
+
+def count_placement_miis(races) -> int:
+    return sum(1 for race in races for placement in race.getPlacements() if placement.getPlayer().get_mii_hex() is not None)
+
+def get_races_to_write(event_id, races, structure_hash, placement_mii_count) -> Tuple[List, List]:
+    '''Returns the races that need to be written for the event, and the races whose placements' miis need to be written.
+    All of the races are written if nothing has been written for the event yet, or if the event's structure changed (subs, merged rooms, removed races, edits...)
+    since it was last written. Otherwise, only the races after the last written race are, along with the last written race, in case it was still changing when it was written.'''
+    mark = event_high_water_marks.get(event_id)
+    if (mark is None
+        or mark.structure_hash != structure_hash
+        or len(races) < mark.race_count
+        or (mark.race_count > 0 and races[mark.race_count-1].get_race_id() != mark.last_race_id)):
+        return races, races
+    new_races = races[max(mark.race_count-1, 0):]
+    #Miis are pulled in the background, so placements in races that have already been written can get their miis later
+    mii_races = races if placement_mii_count != mark.placement_mii_count else new_races
+    return new_races, mii_races
+
+def set_high_water_mark(event_id, races, structure_hash, placement_mii_count):
+    event_high_water_marks[event_id] = EventHighWaterMark(len(races), races[-1].get_race_id() if len(races) > 0 else None, structure_hash, placement_mii_count)
+    event_high_water_marks.move_to_end(event_id)
+    while len(event_high_water_marks) > MAX_EVENT_HIGH_WATER_MARKS:
+        event_high_water_marks.popitem(last=False)
+
 class RoomTracker(object):
         
     @staticmethod
     async def add_everything_to_database(channel_bot):
-        sql_helper = RoomTrackerSQL(channel_bot)
-        added_players = await sql_helper.insert_missing_players_into_database()
-        added_tracks = await sql_helper.insert_missing_tracks_into_database()
-        added_races = await sql_helper.insert_missing_races_into_database()
-        added_placements = await sql_helper.insert_missing_placements_into_database()
-        added_miis = await sql_helper.update_database_place_miis()
-        added_event_id = await sql_helper.add_event_id()
-        added_event_ids_race_ids = await sql_helper.insert_missing_event_ids_race_ids()
-        added_event_ids = await sql_helper.insert_missing_event(was_real_update=(len(added_event_ids_race_ids) > 0))
-        added_event_fcs = await sql_helper.insert_missing_event_fcs_and_miis()
-        added_event_fcs_miis = await sql_helper.update_missing_miis_in_event_fcs()
-        event_structure_data_dump_event_id = await sql_helper.dump_event_structure_data()
+        event_id = channel_bot.getRoom().get_event_id()
+        all_races = channel_bot.getRoom().races
+        structure_hash = hash(RoomTrackerSQL(channel_bot).get_event_structure_tuple())
+        placement_mii_count = count_placement_miis(all_races)
+        races, mii_races = get_races_to_write(event_id, all_races, structure_hash, placement_mii_count)
+        is_full_write = races is all_races
+        write_queue_stats["full_writes" if is_full_write else "delta_writes"] += 1
+        write_queue_stats["races_skipped"] += len(all_races) - len(races)
+
+        sql_helper = RoomTrackerSQL(channel_bot, races, mii_races)
+        #The whole update is one transaction, so it's written to disk once (instead of once for every statement) and nothing is written if any part of it fails
+        async with write_transaction():
+            event_stats_state = await db_connection.execute(QB.get_event_stats_state_query(), [event_id])
+            added_players = await sql_helper.insert_missing_players_into_database()
+            added_tracks = await sql_helper.insert_missing_tracks_into_database()
+            added_races = await sql_helper.insert_missing_races_into_database()
+            added_placements = await sql_helper.insert_missing_placements_into_database()
+            added_miis = await sql_helper.update_database_place_miis()
+            added_event_id = await sql_helper.add_event_id()
+            added_event_ids_race_ids = await sql_helper.insert_missing_event_ids_race_ids()
+            added_event_ids = await sql_helper.insert_missing_event(was_real_update=(added_event_ids_race_ids > 0))
+            added_event_fcs = await sql_helper.insert_missing_event_fcs_and_miis()
+            added_event_fcs_miis = await sql_helper.update_missing_miis_in_event_fcs()
+            event_structure_data_dump_event_id = await sql_helper.dump_event_structure_data() if is_full_write else []
+            #If the event's channel or whether it's counted by the stats commands changed, all of its races need to be recounted, not just the new ones
+            new_event_stats_state = await db_connection.execute(QB.get_event_stats_state_query(), [event_id])
+            await mark_stats_aggregates_dirty(event_id, [race.get_race_id() for race in races], all_event_races=(is_full_write or event_stats_state != new_event_stats_state))
+            written_tracks = [track for (track,) in await db_connection.execute(QB.get_dirty_tracks_query())]
+            #The tiers of the event's channel, before and after this update
+            channel_ids = [channel_id for (channel_id, _) in event_stats_state + new_event_stats_state]
+            written_tiers = [tier for (tier,) in await db_connection.execute(QB.get_channels_tiers_query(), [QB.build_json_list_arg(channel_ids)])]
+            await refresh_stats_aggregates()
+        #Only moved once the transaction has been committed, so after a failed write, the next update writes everything since the last successful one
+        set_high_water_mark(event_id, all_races, structure_hash, placement_mii_count)
+        if len(written_tracks) > 0:
+            StatsResultCache.invalidate(written_tiers, written_tracks, channel_bot.getRoom().getFCs())
 
         if DEBUGGING_SQL:
+            print(f"{'Full' if is_full_write else 'Delta'} write: {len(races)}/{len(all_races)} races")
             print(f"Added players: {added_players}")
             print(f"Added tracks: {added_tracks}")
             print(f"Added races: {added_races}")
@@ -678,14 +770,121 @@ class RoomTracker(object):
     @staticmethod
     @TimerDebuggers.timer_coroutine
     async def add_data(channel_bot):
+        '''Queues the channel bot's room to be written to the database by the write queue's writer task. Never waits for the database.'''
         if channel_bot.is_table_loaded():
             #Make a deep copy to avoid asyncio switching current task to a tabler command and modifying our data in the middle of us validating it or adding it
             deepcopied_channel_bot = deepcopy(channel_bot)
             if deepcopied_channel_bot.is_table_loaded(): #This check might seem unnecessary, but we'll leave it in case we convert things to asyncio that aren't currently asynchronous (making it necessary)
-                try:
-                    await RoomTracker.add_everything_to_database(deepcopied_channel_bot)
-                except:
-                    common.log_traceback(traceback)
+                queue_update(deepcopied_channel_bot)
+
+
+#Write-behind queue: tabling commands queue their room with RoomTracker.add_data and move on, and a single writer task writes the queued rooms to the database.
+#Every update contains the whole room, so if a room is updated again before its previous update is written, the newer update replaces the older one.
+#Maximum number of rooms waiting to be written. When it's full, new rooms are dropped (and counted) - they're written with their next update, since it contains the whole room.
+MAX_QUEUED_UPDATES = 500
+#How long on_exit waits for the queued updates to be written before closing the database anyway
+FLUSH_TIMEOUT_SECONDS = 30
+
+write_queue = None #asyncio.Queue of the keys (event id's) of the rooms waiting to be written
+queued_updates = {} #event id: (most recent deep copied channel bot for that room, time its oldest unwritten update was queued)
+writer_task = None
+write_queue_stats = {"queued": 0,
+                     "coalesced": 0,
+                     "dropped": 0,
+                     "written": 0,
+                     "failed": 0,
+                     "full_writes": 0,
+                     "delta_writes": 0,
+                     "races_skipped": 0,
+                     "max_depth": 0,
+                     "last_lag": 0.0,
+                     "max_lag": 0.0,
+                     "total_lag": 0.0}
+
+def get_write_queue() -> asyncio.Queue:
+    global write_queue
+    if write_queue is None:
+        write_queue = asyncio.Queue(maxsize=MAX_QUEUED_UPDATES)
+    return write_queue
+
+def queue_update(channel_bot):
+    '''Queues the (already deep copied) channel bot's room to be written. If the room is already waiting to be written, its queued update is replaced with this one.'''
+    update_key = channel_bot.getRoom().get_event_id()
+    if update_key in queued_updates:
+        _, queued_at = queued_updates[update_key]
+        queued_updates[update_key] = (channel_bot, queued_at)
+        write_queue_stats["coalesced"] += 1
+        return
+    try:
+        get_write_queue().put_nowait(update_key)
+    except asyncio.QueueFull:
+        write_queue_stats["dropped"] += 1
+        return
+    queued_updates[update_key] = (channel_bot, time.monotonic())
+    write_queue_stats["queued"] += 1
+    write_queue_stats["max_depth"] = max(write_queue_stats["max_depth"], get_write_queue().qsize())
+
+async def write_queued_updates():
+    '''The writer task: writes queued rooms to the database, one at a time, until it's cancelled'''
+    queue = get_write_queue()
+    while True:
+        update_key = await queue.get()
+        try:
+            channel_bot, queued_at = queued_updates.pop(update_key)
+            try:
+                await RoomTracker.add_everything_to_database(channel_bot)
+            except:
+                write_queue_stats["failed"] += 1
+                common.log_traceback(traceback)
+            else:
+                write_queue_stats["written"] += 1
+            lag = time.monotonic() - queued_at
+            write_queue_stats["last_lag"] = lag
+            write_queue_stats["max_lag"] = max(write_queue_stats["max_lag"], lag)
+            write_queue_stats["total_lag"] += lag
+        finally:
+            queue.task_done()
+
+def start_writer():
+    global writer_task
+    if writer_task is None or writer_task.done():
+        writer_task = asyncio.create_task(write_queued_updates())
+
+async def flush_write_queue(timeout=FLUSH_TIMEOUT_SECONDS) -> bool:
+    '''Waits for every queued room to be written, then stops the writer task. Returns False if they weren't all written within timeout seconds.'''
+    global writer_task
+    flushed = True
+    if writer_task is not None and not writer_task.done():
+        try:
+            await asyncio.wait_for(get_write_queue().join(), timeout)
+        except asyncio.TimeoutError:
+            flushed = False
+        writer_task.cancel()
+        try:
+            await writer_task
+        except asyncio.CancelledError:
+            pass
+    writer_task = None
+    return flushed
+
+def write_queue_depth() -> int:
+    return len(queued_updates)
+
+def get_oldest_queued_update_age() -> float:
+    '''Number of seconds the oldest unwritten update has been waiting, 0 if nothing is queued'''
+    if len(queued_updates) == 0:
+        return 0.0
+    return time.monotonic() - min(queued_at for _, queued_at in queued_updates.values())
+
+def get_write_queue_stats_str() -> str:
+    finished = write_queue_stats["written"] + write_queue_stats["failed"]
+    average_lag = 0.0 if finished == 0 else write_queue_stats["total_lag"] / finished
+    writer_status = "running" if writer_task is not None and not writer_task.done() else "stopped"
+    return f"""**Room tracking write queue:** {write_queue_depth()}/{MAX_QUEUED_UPDATES} rooms queued (writer {writer_status}), max queued: {write_queue_stats['max_depth']}, oldest waiting: {get_oldest_queued_update_age():.1f}s
+Queued: {write_queue_stats['queued']} | Coalesced: {write_queue_stats['coalesced']} | Dropped (queue full): {write_queue_stats['dropped']} | Written: {write_queue_stats['written']} | Failed: {write_queue_stats['failed']}
+Full writes: {write_queue_stats['full_writes']} | Delta writes: {write_queue_stats['delta_writes']} | Races skipped: {write_queue_stats['races_skipped']} | Events with high-water marks: {len(event_high_water_marks)}
+Lag: last {write_queue_stats['last_lag']*1000:.1f}ms | average {average_lag*1000:.1f}ms | max {write_queue_stats['max_lag']*1000:.1f}ms
+Read connections: {0 if read_connection_pool is None else read_connection_pool.qsize()}/{len(read_connections)} idle | Reads: {read_pool_stats['reads']} | Reads that waited for a connection: {read_pool_stats['waited']}"""
 
 def load_room_data():
     if not os.path.exists(common.ROOM_DATA_TRACKING_DATABASE_FILE):
@@ -698,11 +897,124 @@ def load_room_data():
             print("Warning: Failed to create database")
             raise
 
+#Rows fetched at a time by the streaming reads (iterate_read), so a query over a player's whole history never has all of its rows in memory at once
+STREAM_BATCH_SIZE = 500
+
+#The search queries' SQL only depends on which filters are used, so they're prepared once and then reused from the connection's statement cache.
+#The default (128) is shared with the INSERT statements, whose last chunk is a different statement for each number of rows.
+STATEMENT_CACHE_SIZE = 256
+
+#How long a connection waits for another connection's lock before it gives up with "database is locked".
+#In WAL mode, reads never wait for the writer (or the writer for reads), so this is only reached when something outside of the bot is writing to the database,
+#or a checkpoint is being run. A write that gives up is counted as failed by the write queue, and the room is written with its next update.
+BUSY_TIMEOUT_SECONDS = 10
+#Read-only connections for the DataRetriever queries. Each aiosqlite connection runs its queries on its own thread, so this many stats queries can run at once,
+#while the writer connection (db_connection) keeps writing rooms.
+READ_CONNECTION_POOL_SIZE = 3
+
+read_connection_pool = None #asyncio.Queue of the idle read-only connections
+read_connections = []
+read_pool_stats = {"reads": 0,
+                   "waited": 0}
+
+async def connect(read_only=False) -> ConnectionWrapper:
+    if read_only:
+        database_uri = f"file:{common.ROOM_DATA_TRACKING_DATABASE_FILE}?mode=ro"
+        connection = await aiosqlite.connect(database_uri, uri=True, isolation_level=None, timeout=BUSY_TIMEOUT_SECONDS, cached_statements=STATEMENT_CACHE_SIZE)
+    else:
+        connection = await aiosqlite.connect(common.ROOM_DATA_TRACKING_DATABASE_FILE, isolation_level=None, timeout=BUSY_TIMEOUT_SECONDS, cached_statements=STATEMENT_CACHE_SIZE)
+    return ConnectionWrapper(connection)
+
 async def start_database():
     global db_connection
     print(f"{datetime.now()}: Starting database...")
-    db_connection = ConnectionWrapper(await aiosqlite.connect(common.ROOM_DATA_TRACKING_DATABASE_FILE,isolation_level=None))
+    db_connection = await connect()
+    #WAL lets the read-only connections read while the writer connection writes. The journal mode is saved in the database file, so this only changes it the first time.
+    await db_connection.execute("PRAGMA journal_mode=WAL;")
+    #In WAL mode, NORMAL only syncs at checkpoints. A power loss can lose the last few room updates, but never corrupts the database, and the rooms are written again with their next update.
+    await db_connection.execute("PRAGMA synchronous=NORMAL;")
     print(f"{datetime.now()}: Started database successfully.")
+
+async def execute_read(*args):
+    '''Runs a query that only reads on one of the read-only connections'''
+    async with read_connection() as connection:
+        return await connection.execute(*args)
+
+async def execute_on_archives(months, query, args=(), dirty_buckets=None) -> List[Tuple]:
+    '''Runs a query on the archives of the given months (see ArchivePartitions), on a background thread'''
+    if len(months) == 0:
+        return []
+    return await asyncio.get_running_loop().run_in_executor(None, ArchivePartitions.execute_on_archives, common.ROOM_DATA_TRACKING_DATABASE_FILE,
+                                                            months, query, args, dirty_buckets)
+
+async def execute_read_partitioned(query, args, in_last_days=None) -> List[List[Tuple]]:
+    '''Runs a query that reads races on the live database and on the archives of the months in the last in_last_days days (every archive if it's None).
+    Returns the results of each database that has races in that range, to be merged by the caller.'''
+    archived_months = ArchivePartitions.get_months_in_window(ArchivePartitions.get_archived_months(common.ROOM_DATA_TRACKING_DATABASE_FILE), in_last_days)
+    if len(archived_months) == 0:
+        return [await execute_read(query, args)]
+    live_rows, archived_rows = await asyncio.gather(execute_read(query, args), execute_on_archives(archived_months, query, args))
+    return [live_rows, archived_rows]
+
+async def iterate_read(query, args=(), batch_size=STREAM_BATCH_SIZE):
+    '''Streams the rows of a query that only reads, batch_size rows at a time, on one of the read-only connections.
+    The connection is lent out until the rows have all been read, so the caller should read them all (and only do quick work on each one).'''
+    async with read_connection() as connection:
+        cursor = await connection.con.execute(query, args)
+        try:
+            while True:
+                rows = await cursor.fetchmany(batch_size)
+                if len(rows) == 0:
+                    break
+                for row in rows:
+                    yield row
+        finally:
+            await cursor.close()
+
+async def iterate_read_partitioned(query, args, in_last_days=None, batch_size=STREAM_BATCH_SIZE):
+    '''Streams the rows of a query that reads races on the live database, and then on each of the archives in the last in_last_days days
+    (see execute_read_partitioned), batch_size rows at a time. The rows of each database are streamed one after the other, without being merged.'''
+    async for row in iterate_read(query, args, batch_size):
+        yield row
+    loop = asyncio.get_running_loop()
+    database_file = common.ROOM_DATA_TRACKING_DATABASE_FILE
+    for month in ArchivePartitions.get_months_in_window(ArchivePartitions.get_archived_months(database_file), in_last_days):
+        batches = ArchivePartitions.iterate_archive_batches(database_file, month, query, args, batch_size)
+        while (rows := await loop.run_in_executor(None, next, batches, None)) is not None:
+            for row in rows:
+                yield row
+
+async def start_read_connection_pool(pool_size=READ_CONNECTION_POOL_SIZE):
+    '''Opens the read-only connections. Until this is called (and after close_read_connection_pool), reads use the writer connection.'''
+    global read_connection_pool
+    read_connection_pool = asyncio.Queue()
+    for _ in range(pool_size):
+        connection = await connect(read_only=True)
+        read_connections.append(connection)
+        read_connection_pool.put_nowait(connection)
+
+async def close_read_connection_pool():
+    global read_connection_pool
+    read_connection_pool = None
+    for connection in read_connections:
+        await connection.close()
+    read_connections.clear()
+
+@asynccontextmanager
+async def read_connection():
+    '''Lends out an idle read-only connection for the with block, waiting for one if they're all in use'''
+    read_pool_stats["reads"] += 1
+    pool = read_connection_pool
+    if pool is None:
+        yield db_connection
+        return
+    if pool.empty():
+        read_pool_stats["waited"] += 1
+    connection = await pool.get()
+    try:
+        yield connection
+    finally:
+        pool.put_nowait(connection)
     
 async def populate_tier_table():
     print(f"{datetime.now()}: Populating tier table...")
@@ -722,26 +1034,37 @@ async def populate_score_matrix_table():
     await db_connection.executemany("INSERT INTO Score_Matrix VALUES (?, ?, ?)", rows)
     print(f"{datetime.now()}: Finished populating score matrix table.")
 
-async def populate_player_fcs_table():
-    rows = []
+def get_player_fcs_version(fc_map) -> str:
+    '''A hash of the fc: discord id links, which is saved in Schema_Versions when Player_FCs is synced with them'''
+    fc_hash = hashlib.sha1()
+    for fc in sorted(fc_map):
+        fc_hash.update(f"{fc}:{fc_map[fc][0]}\n".encode())
+    return fc_hash.hexdigest()
 
-    fc_map = UserDataProcessing.fc_discordId
-    existing_count = (await db_connection.execute("SELECT count(*) FROM Player_FCs;"))[0][0]
+async def populate_player_fcs_table():
+    '''Syncs Player_FCs with UserDataProcessing's fc links. Nothing is read or written if the links haven't changed since the last sync,
+    and otherwise only the links that were added, changed or removed are written.'''
+    #One read of all of the links, instead of a lookup for each FC
+    fc_map = dict(UserDataProcessing.fc_discordId.items())
+    if len(fc_map) == 0:
+        print("Not changing FC table")
+        return
 
-    if len(fc_map) == 0 or len(fc_map) == existing_count:
+    player_fcs_version = get_player_fcs_version(fc_map)
+    if await get_schema_version("player_fcs") == player_fcs_version:
         print("Not changing FC table")
         return
 
     start = time.time()
-    print(f'Populating FC table in database...')
-
-    for fc in fc_map:
-        discord_id = fc_map[fc][0]
-        rows.append((fc, discord_id))
-
-    await db_connection.execute("DELETE FROM Player_FCs;")
-    await db_connection.executemany("insert into Player_FCs values (?, ?)", rows)
-    print(f'FC table population finished in {time.time()-start} seconds')
+    print(f'Syncing FC table in database...')
+    existing_links = {fc: str(discord_id) for fc, discord_id in await db_connection.execute("SELECT fc, discord_id FROM Player_FCs;")}
+    changed_rows = [(fc, discord_id) for fc, (discord_id, _) in fc_map.items() if existing_links.get(fc) != str(discord_id)]
+    removed_rows = [(fc,) for fc in existing_links if fc not in fc_map]
+    async with write_transaction():
+        await db_connection.executemany("INSERT OR REPLACE INTO Player_FCs VALUES (?, ?)", changed_rows)
+        await db_connection.executemany("DELETE FROM Player_FCs WHERE fc = ?", removed_rows)
+        await set_schema_version("player_fcs", player_fcs_version)
+    print(f'FC table sync finished in {time.time()-start} seconds: {len(changed_rows)} links added or changed, {len(removed_rows)} removed')
 
 async def add_player_fcs(fc_map):
     rows = []
@@ -749,29 +1072,172 @@ async def add_player_fcs(fc_map):
         discord_id = fc_map[fc][0]
         rows.append((fc, discord_id))
 
-    await db_connection.executemany("INSERT OR REPLACE INTO Player_FCs VALUES(?, ?)", rows)
+    async with write_transaction():
+        await db_connection.executemany("INSERT OR REPLACE INTO Player_FCs VALUES(?, ?)", rows)
+
+#The migration script and current version of each migration. Increase a migration's version when its script is changed, so it's run again on databases that have the old version.
+MIGRATION_VERSIONS = {"query_indexes": (common.ROOM_DATA_TRACKING_QUERY_INDEXES_SQL, 1),
+                      "stats_aggregates": (common.ROOM_DATA_TRACKING_STATS_AGGREGATES_SQL, 1),
+                      "head_to_head": (common.ROOM_DATA_TRACKING_HEAD_TO_HEAD_SQL, 1)}
+#VACUUM rewrites the whole database (and blocks writes while it does), so the maintenance job only runs it when at least this much of the database is free pages
+VACUUM_FREE_PAGE_RATIO = 0.2
+
+async def create_schema_versions():
+    await db_connection.executescript(common.read_sql_file(common.ROOM_DATA_TRACKING_SCHEMA_VERSIONS_SQL))
+
+async def get_schema_version(name):
+    version = await db_connection.execute(QB.get_schema_version_query(), [name])
+    return version[0][0] if len(version) > 0 else None
+
+async def set_schema_version(name, version):
+    await db_connection.execute(QB.set_schema_version_script(), [name, str(version)])
+
+async def run_migration(name, after_script=None) -> bool:
+    '''Runs the migration script if the database doesn't have its current version yet. Returns whether it was run.
+    after_script is awaited after the script, before the version is saved, so if it fails, the whole migration is run again the next time.'''
+    migration_file, version = MIGRATION_VERSIONS[name]
+    if await get_schema_version(name) == str(version):
+        return False
+    print(f"{datetime.now()}: Running migration {name} (version {version})...")
+    await db_connection.executescript(common.read_sql_file(migration_file))
+    if after_script is not None:
+        await after_script()
+    await set_schema_version(name, version)
+    print(f"{datetime.now()}: Finished running migration {name}.")
+    return True
+
+async def create_query_indexes():
+    await run_migration("query_indexes")
+
+async def rebuild_head_to_head():
+    '''Recomputes all of Head_To_Head from Place/Race, in the live database and the archives'''
+    async with write_transaction():
+        for statement in QB.build_rebuild_head_to_head_statements():
+            await db_connection.execute(statement)
+        for month in ArchivePartitions.get_archived_months(common.ROOM_DATA_TRACKING_DATABASE_FILE):
+            await db_connection.executemany(QB.insert_head_to_head_rows_script(), await execute_on_archives([month], QB.build_head_to_head_query()))
+
+async def create_head_to_head():
+    #The table is only filled when it's created - after that, the Place_Head_To_Head trigger keeps it up to date as placements are inserted
+    await run_migration("head_to_head", after_script=rebuild_head_to_head)
 
 async def ensure_foreign_keys_on():
     await db_connection.executescript("""PRAGMA foreign_keys = ON;""")
     
-async def database_maintenance():
+async def get_free_page_ratio() -> float:
+    page_count = (await db_connection.execute("PRAGMA page_count;"))[0][0]
+    free_page_count = (await db_connection.execute("PRAGMA freelist_count;"))[0][0]
+    return 0.0 if page_count == 0 else free_page_count / page_count
+
+async def database_maintenance(force_vacuum=False) -> bool:
+    '''Run by the bot's scheduled maintenance job. Vacuums the database only if enough of it is free pages (or force_vacuum is True). Returns whether it was vacuumed.'''
     maintenance_script = common.read_sql_file(common.ROOM_DATA_TRACKING_DATABASE_MAINTENANCE_SQL)
     await db_connection.executescript(maintenance_script)
+    #Archiving frees the archived races' pages in the live database, so it's done before deciding whether to vacuum
+    await archive_old_months()
+    #Only analyzes the tables whose query plans could have changed since the last time, so it's quick
+    await db_connection.execute("PRAGMA optimize;")
+    free_page_ratio = await get_free_page_ratio()
+    if not force_vacuum and free_page_ratio < VACUUM_FREE_PAGE_RATIO:
+        print(f"{datetime.now()}: Not vacuuming, {free_page_ratio:.1%} of the database is free pages")
+        return False
+    print(f"{datetime.now()}: Vacuuming, {free_page_ratio:.1%} of the database is free pages...")
+    await vacuum()
+    print(f"{datetime.now()}: Done vacuuming.")
+    return True
+
+async def archive_old_months(keep_months=ArchivePartitions.ARCHIVE_AFTER_MONTHS) -> List[str]:
+    '''Moves the races of the months before the last keep_months months into their month's archive (see ArchivePartitions). Returns the months archived.'''
+    loop = asyncio.get_running_loop()
+    database_file = common.ROOM_DATA_TRACKING_DATABASE_FILE
+    months = await loop.run_in_executor(None, ArchivePartitions.get_months_to_archive, database_file, keep_months)
+    for month in months:
+        print(f"{datetime.now()}: Archiving the races of {month}...")
+        moved = 0
+        while True:
+            #Each chunk is its own transaction on another connection, and holding the write lock keeps the write queue's transactions from waiting on it
+            async with get_db_write_lock():
+                chunk_moved = await loop.run_in_executor(None, ArchivePartitions.archive_races_chunk, database_file, month)
+            if chunk_moved == 0:
+                break
+            moved += chunk_moved
+        print(f"{datetime.now()}: Archived {moved} races from {month}.")
+    return months
 
 async def vacuum():
-    await db_connection.executescript("VACUUM;")
+    #VACUUM can't be run inside of a transaction, but holding the write lock keeps the write queue's transactions out while it runs
+    async with get_db_write_lock():
+        await db_connection.executescript("VACUUM;")
+
+async def create_stats_aggregates():
+    await run_migration("stats_aggregates")
+    await db_connection.execute(QB.create_stats_dirty_buckets_script())
+
+async def rebuild_stats_aggregates():
+    '''Recomputes all of Player_Track_Stats from Place/Race, in the live database and the archives'''
+    async with write_transaction():
+        for statement in QB.build_rebuild_stats_aggregates_statements():
+            await db_connection.execute(statement)
+        for month in ArchivePartitions.get_archived_months(common.ROOM_DATA_TRACKING_DATABASE_FILE):
+            await db_connection.executemany(QB.insert_stats_aggregates_rows_script(),
+                                            await execute_on_archives([month], QB.build_stats_aggregates_query(dirty_buckets_only=False)))
+        tier_signature = (await db_connection.execute(QB.get_tier_signature_query()))[0][0]
+        await db_connection.execute(QB.set_stats_aggregates_info_script(), ["tier_signature", tier_signature])
+    StatsResultCache.clear()
+
+async def refresh_stats_aggregates():
+    '''Recomputes the Player_Track_Stats rows of the (track, is_ct, day)'s that have been marked as dirty. Should be run inside of a write transaction.'''
+    archived_buckets = []
+    if len(ArchivePartitions.get_archived_months(common.ROOM_DATA_TRACKING_DATABASE_FILE)) > 0:
+        archived_buckets = ArchivePartitions.get_archived_dirty_buckets(common.ROOM_DATA_TRACKING_DATABASE_FILE,
+                                                                        await db_connection.execute(QB.get_dirty_buckets_query()))
+    for statement in QB.build_refresh_stats_aggregates_statements():
+        await db_connection.execute(statement)
+    #Only fix_shas marks archived days as dirty, the rooms that are written are always recent
+    if len(archived_buckets) > 0:
+        archived_months = sorted({day[:7] for _, _, day in archived_buckets})
+        await db_connection.executemany(QB.insert_stats_aggregates_rows_script(),
+                                        await execute_on_archives(archived_months, QB.build_stats_aggregates_query(dirty_buckets_only=True), (), archived_buckets))
+
+async def mark_stats_aggregates_dirty(event_id, race_ids, all_event_races=False):
+    '''Marks the (track, is_ct, day)'s of the given races as dirty, or of every race in the event if all_event_races is True'''
+    if all_event_races:
+        await db_connection.execute(QB.mark_event_races_dirty_script(), [event_id])
+    elif len(race_ids) > 0:
+        await db_connection.execute(QB.mark_races_dirty_script(), [QB.build_json_list_arg(race_ids)])
+
+async def update_stats_aggregates():
+    '''Brings the stats aggregates up to date on startup: they're rebuilt if they've never been built or if the tiers have changed since they were built,
+    otherwise only the rows changed by fix_shas are recomputed'''
+    print(f"{datetime.now()}: Updating stats aggregates...")
+    tier_signature = (await db_connection.execute(QB.get_tier_signature_query()))[0][0]
+    built_tier_signature = await db_connection.execute(QB.get_stats_aggregates_info_query(), ["tier_signature"])
+    if len(built_tier_signature) == 0 or built_tier_signature[0][0] != tier_signature:
+        print(f"{datetime.now()}: Rebuilding stats aggregates...")
+        await rebuild_stats_aggregates()
+    else:
+        async with write_transaction():
+            await refresh_stats_aggregates()
+    print(f"{datetime.now()}: Finished updating stats aggregates.")
 
 async def fix_shas(shas:Dict):
-    print(f"{datetime.now()}: Fixing shas...")
-    for sha, track_name in shas.items():
-        no_author_name = Race.remove_author_and_version_from_name(track_name)
-        lookup = Race.get_track_name_lookup(no_author_name)
-        script =     f"""
-            INSERT OR IGNORE INTO Track VALUES("{track_name}", "No Track Page", "{no_author_name}", 1, "{lookup}");
-            UPDATE Race SET track_name = "{track_name}" WHERE Race.track_name = "{sha}";
-            DELETE FROM Track WHERE track.track_name = "{sha}";
-        """
-        await db_connection.executescript(script)
+    '''Renames the races whose track is one of the given shas. Only the shas that are still in the Track table are fixed (a fixed sha's Track row is deleted),
+    so after the first time, this is one lookup.'''
+    unfixed_shas = [sha for (sha,) in await db_connection.execute(QB.get_unfixed_shas_query(), [QB.build_json_list_arg(shas)])]
+    if len(unfixed_shas) == 0:
+        return
+    print(f"{datetime.now()}: Fixing {len(unfixed_shas)} shas...")
+    #The archives are renamed first: if the bot stops before the transaction below commits, the shas are still in the Track table, so they're fixed again next time
+    archived_days = await asyncio.get_running_loop().run_in_executor(None, ArchivePartitions.rename_tracks, common.ROOM_DATA_TRACKING_DATABASE_FILE,
+                                                                     {sha: shas[sha] for sha in unfixed_shas})
+    async with write_transaction():
+        for sha in unfixed_shas:
+            track_name = shas[sha]
+            no_author_name = Race.remove_author_and_version_from_name(track_name)
+            lookup = Race.get_track_name_lookup(no_author_name)
+            for statement, args in QB.build_fix_sha_statements(sha, track_name, no_author_name, lookup, archived_days.get(sha)):
+                await db_connection.execute(statement, args)
+    StatsResultCache.clear()
     print(f"{datetime.now()}: Finished fixing shas.")
 
 async def initialize():
@@ -779,23 +1245,33 @@ async def initialize():
     load_room_data()
     await start_database()
     await ensure_foreign_keys_on()
+    #The migrations are only run when their version changes, so this is quick after the first time
+    await create_schema_versions()
+    await create_query_indexes()
+    #The trigger that keeps Head_To_Head up to date looks up the other placements of the race with the query indexes
+    await create_head_to_head()
     await populate_tier_table()
     await populate_score_matrix_table()
     await populate_player_fcs_table()
+    #fix_shas marks the stats aggregates that it changes as dirty, so they need to exist first
+    await create_stats_aggregates()
     # Race.initialize needs to be called first
     await fix_shas(Race.sha_track_name_mappings)
-
-    if common.is_prod or common.is_beta:
-        print(f"{datetime.now()}: Vacuuming...")
-        await vacuum()
-        print(f"{datetime.now()}: Done vacuuming.")
+    await update_stats_aggregates()
+    #The database is no longer vacuumed on startup, the bot's database maintenance job vacuums it when it needs it (see database_maintenance)
+    await start_read_connection_pool()
     print(f"{datetime.now()}: Database initialization finished")
+    start_writer()
 
 def save_data():
     pass
 
 async def on_exit():
     save_data()
+    if not await flush_write_queue():
+        print(f"Warning: {write_queue_depth()} queued room updates were not written to the database before it was closed.")
+    await close_read_connection_pool()
+    ArchivePartitions.close_archive_connections()
     await db_connection.close()
     print("Database fully closed.")
 
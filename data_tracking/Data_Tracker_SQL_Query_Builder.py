@@ -2,6 +2,7 @@
 Created on Oct 29, 2021
 @author: willg
 '''
+import json
 from typing import List
 
 PLAYER_TABLE_NAMES = ["fc", "pid", "player_url"]
@@ -15,6 +16,28 @@ EVENT_ID_TABLE_NAMES = ["event_id"]
 EVENT_TABLE_NAMES = ["event_id", "channel_id", "time_added", "last_updated", "number_of_updates", "region", "set_up_user_discord_id", "set_up_user_display_name", "player_setup_amount"]
 EVENT_STRUCTURE_TABLE_NAMES = ["event_id", "name_changes", "removed_races", "placement_history", "forced_room_size", "player_penalties", "team_penalties", "disconnections_on_results", "sub_ins", "teams", "rxx_list", "edits", "ignore_large_times", "missing_player_points", "event_name", "number_of_gps", "player_setup_amount", "number_of_teams", "players_per_team"]
 
+#SQLite's default limit on the number of ? parameters in one statement (for SQLite versions before 3.32.0)
+MAX_SQL_VARIABLES = 999
+
+def get_rows_per_statement(values_per_row):
+    '''Returns how many rows with the given number of values fit into one multi-row INSERT statement without going over MAX_SQL_VARIABLES'''
+    return max(1, MAX_SQL_VARIABLES // values_per_row)
+
+def build_sql_json_list():
+    '''A list bound as one parameter (see build_json_list_arg), for "x IN {build_sql_json_list()}".
+    Unlike a (?, ?, ...) list, the statement is the same for any number of values, so it can be reused from the statement cache, and it never goes over MAX_SQL_VARIABLES.'''
+    return "(SELECT value FROM json_each(?))"
+
+def build_json_list_arg(values):
+    return json.dumps(list(values))
+
+def get_is_ct_arg(is_ct):
+    return 1 if is_ct else 0
+
+def get_days_arg(days):
+    #The date modifier for date('now', ?)
+    return f"-{days} days"
+
 def get_existing_race_fcs_in_Place_table(race_id_fcs):
     return f"""SELECT {PLACE_TABLE_NAMES[0]}, {PLACE_TABLE_NAMES[1]}
 FROM Place
@@ -103,23 +126,19 @@ VALUES{build_sql_args_list(PLACE_TABLE_NAMES)}"""
 
 def build_insert_missing_races_script(races):
         return f"""INSERT OR IGNORE INTO Race {build_data_names(RACE_TABLE_NAMES)}
-VALUES{build_race_sql_args_list_comma_separated(races)}
-RETURNING {RACE_TABLE_NAMES[0]};"""
+VALUES{build_race_sql_args_list_comma_separated(races)};"""
 
 def build_insert_missing_placement_script(placements):
     return f"""INSERT OR IGNORE INTO Place {build_data_names(PLACE_TABLE_NAMES)}
-VALUES{build_sql_args_list_comma_separated(placements)}
-RETURNING {PLACE_TABLE_NAMES[0]}, {PLACE_TABLE_NAMES[1]};"""
+VALUES{build_sql_args_list_comma_separated(placements)};"""
 
 def build_insert_missing_players_script(players):
     return f"""INSERT OR IGNORE INTO Player {build_data_names(PLAYER_TABLE_NAMES)}
-VALUES{build_sql_args_list_comma_separated(players)}
-RETURNING {PLAYER_TABLE_NAMES[0]};"""
+VALUES{build_sql_args_list_comma_separated(players)};"""
 
 def build_insert_missing_tracks_script(track_infos):
     return f"""INSERT OR IGNORE INTO Track {build_data_names(TRACK_TABLE_NAMES)}
-VALUES{build_sql_args_list_comma_separated(track_infos)}
-RETURNING {TRACK_TABLE_NAMES[0]};"""
+VALUES{build_sql_args_list_comma_separated(track_infos)};"""
     
 def surround_script_begin_commit(script):
     return f"""BEGIN;
@@ -128,18 +147,15 @@ COMMIT;"""
 
 def build_missing_event_ids_race_ids_script(event_id_race_ids):
     return f"""INSERT OR IGNORE INTO Event_Races {build_data_names(EVENT_RACES_TABLE_NAMES)}
-VALUES{build_sql_args_list_comma_separated(event_id_race_ids)}
-RETURNING *;"""
+VALUES{build_sql_args_list_comma_separated(event_id_race_ids)};"""
 
 def build_missing_event_id_table_script(event_ids):
     return f"""INSERT OR IGNORE INTO Event_ID {build_data_names(EVENT_ID_TABLE_NAMES)}
-VALUES{build_sql_args_list_comma_separated(event_ids)}
-RETURNING *;"""
+VALUES{build_sql_args_list_comma_separated(event_ids)};"""
 
 def build_missing_event_fcs_table_script(event_fcs):
     return f"""INSERT OR IGNORE INTO Event_FCs {build_data_names(EVENT_FCS_TABLE_NAMES)}
-VALUES{build_sql_args_list_comma_separated(event_fcs)}
-RETURNING *;"""
+VALUES{build_sql_args_list_comma_separated(event_fcs)};"""
 
 
 def build_event_upsert_script(was_real_update):
@@ -162,10 +178,182 @@ ON CONFLICT ({EVENT_STRUCTURE_TABLE_NAMES[0]}) DO
 UPDATE SET {build_excluded_list(EVENT_STRUCTURE_TABLE_NAMES[1:])}
 RETURNING {EVENT_STRUCTURE_TABLE_NAMES[0]}"""
 
+
+#Player_Track_Stats.tier for the rows that count every tier together
+ANY_TIER = -1
+
+def get_stats_eligible_event_filter():
+    '''The events whose races the stats commands count (the same filter get_best_tracks and get_top_players_query use)'''
+    return f"""Event.player_setup_amount = 12
+                {SQL_Search_Query_Builder.get_event_valid_filter()}"""
+
+def build_stats_aggregates_query(dirty_buckets_only):
+    '''Computes the Player_Track_Stats rows from Place/Race: all of them, or only the rows for the (track, is_ct, day)'s in temp.Stats_Dirty_Buckets'''
+    if dirty_buckets_only:
+        bucket_races = """SELECT Race.race_id, Race.num_players, Track.fixed_track_name, Track.is_ct, date(Race.time_added) AS day
+        FROM temp.Stats_Dirty_Buckets AS Dirty
+            JOIN Track ON Track.fixed_track_name = Dirty.fixed_track_name AND Track.is_ct = Dirty.is_ct
+            JOIN Race ON Race.track_name = Track.track_name AND Race.time_added >= Dirty.day AND Race.time_added < date(Dirty.day, '+1 day')
+        WHERE Race.track_name != ''"""
+    else:
+        bucket_races = """SELECT Race.race_id, Race.num_players, Track.fixed_track_name, Track.is_ct, date(Race.time_added) AS day
+        FROM Race JOIN Track ON Race.track_name = Track.track_name
+        WHERE Race.track_name != ''"""
+    return f"""WITH Bucket_Races AS (
+        {bucket_races}
+    ),
+    Eligible_Race_Tiers AS (
+        SELECT DISTINCT Event_Races.race_id, Tier.tier
+        FROM Event_Races
+            JOIN Event ON Event_Races.event_id = Event.event_id
+            JOIN Tier ON Event.channel_id = Tier.channel_id
+        WHERE Event_Races.race_id IN (SELECT race_id FROM Bucket_Races)
+            AND {get_stats_eligible_event_filter()}
+    ),
+    Race_Tiers AS (
+        SELECT race_id, tier FROM Eligible_Race_Tiers
+        UNION
+        SELECT race_id, {ANY_TIER} FROM Eligible_Race_Tiers
+    )
+    SELECT Place.fc, Bucket_Races.fixed_track_name, Bucket_Races.is_ct, Race_Tiers.tier, Bucket_Races.day,
+        COUNT(*), SUM(Score_Matrix.pts), SUM(Place.place), MIN(Place.time)
+    FROM Bucket_Races
+        JOIN Race_Tiers ON Bucket_Races.race_id = Race_Tiers.race_id
+        JOIN Place ON Bucket_Races.race_id = Place.race_id
+        JOIN Score_Matrix ON (Place.place = Score_Matrix.place AND Bucket_Races.num_players = Score_Matrix.size)
+    WHERE Place.time < 6 * 60
+    GROUP BY Place.fc, Bucket_Races.fixed_track_name, Bucket_Races.is_ct, Race_Tiers.tier, Bucket_Races.day"""
+
+def create_stats_dirty_buckets_script():
+    '''The (track, is_ct, day)'s whose Player_Track_Stats rows are out of date. Temp tables only live as long as the connection, so this is run every time the database is started.'''
+    return """CREATE TEMP TABLE IF NOT EXISTS Stats_Dirty_Buckets(
+    fixed_track_name TEXT NOT NULL,
+    is_ct TINYINT(1) NOT NULL,
+    day TEXT NOT NULL,
+    PRIMARY KEY(fixed_track_name, is_ct, day)
+);"""
+
+#These are lists of statements (instead of scripts) since they're run inside of a transaction, and executescript commits any open transaction first
+def build_rebuild_stats_aggregates_statements():
+    return ["DELETE FROM Player_Track_Stats;",
+            f"""INSERT INTO Player_Track_Stats
+{build_stats_aggregates_query(dirty_buckets_only=False)};""",
+            "DELETE FROM temp.Stats_Dirty_Buckets;"]
+
+def build_refresh_stats_aggregates_statements():
+    return ["""DELETE FROM Player_Track_Stats
+WHERE (fixed_track_name, is_ct, day) IN (SELECT fixed_track_name, is_ct, day FROM temp.Stats_Dirty_Buckets);""",
+            f"""INSERT INTO Player_Track_Stats
+{build_stats_aggregates_query(dirty_buckets_only=True)};""",
+            "DELETE FROM temp.Stats_Dirty_Buckets;"]
+
+def mark_races_dirty_script():
+    '''The race ids are one parameter, see build_json_list_arg'''
+    return f"""INSERT OR IGNORE INTO temp.Stats_Dirty_Buckets (fixed_track_name, is_ct, day)
+SELECT DISTINCT Track.fixed_track_name, Track.is_ct, date(Race.time_added)
+FROM Race JOIN Track ON Race.track_name = Track.track_name
+WHERE Race.race_id IN {build_sql_json_list()};"""
+
+def mark_sha_races_dirty_script():
+    '''Marks the days of the races whose track is the given sha as dirty, for both the sha's track and the track it's being renamed to.
+    The parameters are the sha, the track name and the sha again.'''
+    return """INSERT OR IGNORE INTO temp.Stats_Dirty_Buckets (fixed_track_name, is_ct, day)
+SELECT DISTINCT Track.fixed_track_name, Track.is_ct, date(Race.time_added)
+FROM Race JOIN Track ON Track.track_name IN (?, ?)
+WHERE Race.track_name = ?;"""
+
+def mark_track_days_dirty_script():
+    '''Marks the given days as dirty for both of the given tracks. The parameters are the days (see build_json_list_arg) and the two track names.'''
+    return f"""INSERT OR IGNORE INTO temp.Stats_Dirty_Buckets (fixed_track_name, is_ct, day)
+SELECT DISTINCT Track.fixed_track_name, Track.is_ct, Days.value
+FROM Track, json_each(?) AS Days
+WHERE Track.track_name IN (?, ?);"""
+
+def build_fix_sha_statements(sha, track_name, no_author_name, lookup, archived_days=None):
+    '''Renames the races of a track that was stored under its sha to the track's name. Returns (statement, args) for each statement.
+    archived_days are the days of the sha's races in the archives (which are renamed separately, see ArchivePartitions.rename_tracks), so they're marked as dirty too.'''
+    statements = [("INSERT OR IGNORE INTO Track VALUES(?, 'No Track Page', ?, 1, ?);", [track_name, no_author_name, lookup]),
+                  (mark_sha_races_dirty_script(), [sha, track_name, sha])]
+    if archived_days:
+        statements.append((mark_track_days_dirty_script(), [build_json_list_arg(archived_days), sha, track_name]))
+    statements.extend([("UPDATE Race SET track_name = ? WHERE Race.track_name = ?;", [track_name, sha]),
+                       ("DELETE FROM Track WHERE Track.track_name = ?;", [sha])])
+    return statements
+
+def mark_event_races_dirty_script():
+    return """INSERT OR IGNORE INTO temp.Stats_Dirty_Buckets (fixed_track_name, is_ct, day)
+SELECT DISTINCT Track.fixed_track_name, Track.is_ct, date(Race.time_added)
+FROM Event_Races
+    JOIN Race ON Event_Races.race_id = Race.race_id
+    JOIN Track ON Race.track_name = Track.track_name
+WHERE Event_Races.event_id = ?;"""
+
+def get_event_stats_state_query():
+    '''The things about an event that decide whether (and in which tier) its races are counted by the stats commands'''
+    return f"""SELECT Event.channel_id, ({get_stats_eligible_event_filter()}) AS is_eligible
+FROM Event
+WHERE Event.event_id = ?;"""
+
+def get_stats_aggregates_info_query():
+    return "SELECT value FROM Stats_Aggregates_Info WHERE name = ?;"
+
+def set_stats_aggregates_info_script():
+    return "INSERT OR REPLACE INTO Stats_Aggregates_Info (name, value) VALUES (?, ?);"
+
+def get_record_players_fcs_query():
+    return "SELECT fc FROM Player_FCs WHERE discord_id IN (?, ?);"
+
+def get_channels_tiers_query():
+    return f"SELECT DISTINCT tier FROM Tier WHERE channel_id IN {build_sql_json_list()};"
+
+def get_dirty_tracks_query():
+    return "SELECT DISTINCT fixed_track_name FROM temp.Stats_Dirty_Buckets;"
+
+def get_dirty_buckets_query():
+    return "SELECT fixed_track_name, is_ct, day FROM temp.Stats_Dirty_Buckets;"
+
+#For the rows computed from the archives (see ArchivePartitions) on another connection. A day's races are all in one database, so these never replace a row
+#computed from another database - unless archiving a month was interrupted with some races in both, where failing would stop the bot from starting.
+def insert_stats_aggregates_rows_script():
+    return "INSERT OR REPLACE INTO Player_Track_Stats VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);"
+
+def insert_head_to_head_rows_script():
+    return "INSERT OR REPLACE INTO Head_To_Head VALUES (?, ?, ?, ?, ?, ?);"
+
+def get_schema_version_query():
+    return "SELECT version FROM Schema_Versions WHERE name = ?;"
+
+def set_schema_version_script():
+    return "INSERT OR REPLACE INTO Schema_Versions (name, version, updated_at) VALUES (?, ?, strftime('%Y-%m-%d %H:%M:%f', 'now'));"
+
+def get_unfixed_shas_query():
+    '''The given shas that are still in the Track table, which means races with them as their track haven't been renamed yet'''
+    return f"SELECT track_name FROM Track WHERE track_name IN {build_sql_json_list()};"
+
+def get_tier_signature_query():
+    return """SELECT group_concat(channel_id || ':' || tier, ',') FROM (SELECT channel_id, tier FROM Tier ORDER BY channel_id);"""
+
+def build_head_to_head_query():
+    '''Computes all of the Head_To_Head rows from Place/Race (the Place_Head_To_Head trigger adds to them as placements are inserted)'''
+    return """SELECT Player.fc, Opponent.fc, Track.is_ct, date(Race.time_added), COUNT(*), COUNT(CASE WHEN Player.place < Opponent.place THEN 1 END)
+    FROM Place AS Player
+        JOIN Place AS Opponent ON Player.race_id = Opponent.race_id AND Player.fc != Opponent.fc
+        JOIN Race ON Player.race_id = Race.race_id
+        JOIN Track ON Race.track_name = Track.track_name
+    WHERE Player.time < 6 * 60 AND Opponent.time < 6 * 60
+    GROUP BY Player.fc, Opponent.fc, Track.is_ct, date(Race.time_added)"""
+
+def build_rebuild_head_to_head_statements():
+    return ["DELETE FROM Head_To_Head;",
+            f"""INSERT INTO Head_To_Head
+{build_head_to_head_query()};"""]
+
     
 
 
 class SQL_Search_Query_Builder(object):
+    '''Every query is returned with its arguments, as (query, args). The values are always bound as parameters, so the query's SQL only depends
+    on which filters are used - not on the values - and the connection's statement cache can reuse the prepared statement.'''
     @staticmethod
     def get_sql_tier_filter(tier, is_ct):
         return f"""Race.race_id in (SELECT DISTINCT Race.race_id
@@ -177,16 +365,16 @@ class SQL_Search_Query_Builder(object):
                                     JOIN Race USING(race_id)
                                     JOIN Track USING(track_name)
                                 WHERE
-                                Tier.tier = {tier} /*Only get events with the desired tier*/
-                                AND Tier.is_ct = {1 if is_ct else 0}
-                                AND Track.is_ct = {1 if is_ct else 0}
+                                Tier.tier = ? /*Only get events with the desired tier*/
+                                AND Tier.is_ct = ?
+                                AND Track.is_ct = ?
                                 {SQL_Search_Query_Builder.get_event_valid_filter()}
                                 )
-)"""
+)""", [tier, get_is_ct_arg(is_ct), get_is_ct_arg(is_ct)]
 
     @staticmethod
     def get_sql_days_filter(days):
-        return f"Race.time_added > date('now','-{days} days')"
+        return "Race.time_added > date('now', ?)", [get_days_arg(days)]
 
     @staticmethod
     def get_event_valid_filter():
@@ -198,12 +386,17 @@ class SQL_Search_Query_Builder(object):
 
     @staticmethod
     def get_tracks_played_query(is_ct, tier, last_x_days):
+        args = [get_is_ct_arg(is_ct)]
         tier_filter_clause = ""
         days_filter_clause = ""
         if tier is not None:
-            tier_filter_clause = "AND " + SQL_Search_Query_Builder.get_sql_tier_filter(tier, is_ct)
+            tier_filter, tier_args = SQL_Search_Query_Builder.get_sql_tier_filter(tier, is_ct)
+            tier_filter_clause = "AND " + tier_filter
+            args.extend(tier_args)
         if last_x_days is not None:
-            days_filter_clause = "AND " + SQL_Search_Query_Builder.get_sql_days_filter(last_x_days)
+            days_filter, days_args = SQL_Search_Query_Builder.get_sql_days_filter(last_x_days)
+            days_filter_clause = "AND " + days_filter
+            args.extend(days_args)
             
         return f"""SELECT
         Race.track_name,
@@ -212,17 +405,28 @@ class SQL_Search_Query_Builder(object):
     FROM
         Race LEFT JOIN Track ON Race.track_name = Track.track_name
     WHERE
-        Track.is_ct = {1 if is_ct else 0}
-        AND Race.region = "priv"
+        Track.is_ct = ?
+        AND Race.region = 'priv'
         {tier_filter_clause}
         {days_filter_clause}
     GROUP BY
         Track.fixed_track_name
     ORDER BY
-        3 DESC, 1 ASC;"""
+        3 DESC, 1 ASC;""", args
 
     @staticmethod
     def get_best_tracks(fcs, is_ct, tier, last_x_days, min_count):
+        args = [get_is_ct_arg(is_ct), build_json_list_arg(fcs)]
+        days_filter_clause = ""
+        if last_x_days is not None:
+            days_filter, days_args = SQL_Search_Query_Builder.get_sql_days_filter(last_x_days)
+            days_filter_clause = "AND " + days_filter
+            args.extend(days_args)
+
+        tier_filter = ""
+        if tier is not None:
+            tier_filter = "AND tier = ?"
+            args.append(tier)
         tier_filter_clause = f"""
         AND Place.race_id IN (
             SELECT race_id
@@ -231,17 +435,11 @@ class SQL_Search_Query_Builder(object):
                      JOIN Tier ON Event.channel_id = Tier.channel_id
                 
                 WHERE Event.player_setup_amount = 12
-                {f"AND tier = {tier}" if (tier is not None) else ""}
+                {tier_filter}
                 {SQL_Search_Query_Builder.get_event_valid_filter()}
         )
         """
-
-        days_filter_clause = ""
-        if last_x_days is not None:
-            days_filter_clause = "AND " + SQL_Search_Query_Builder.get_sql_days_filter(last_x_days)
-
-        #fcs = ['1509-2420-6937']
-        fc_filter = '(' + ','.join([f'\'{fc}\'' for fc in fcs]) + ')'
+        args.append(min_count)
 
         return f"""
             SELECT Track.fixed_track_name,
@@ -254,25 +452,30 @@ class SQL_Search_Query_Builder(object):
                      JOIN Score_Matrix
                           ON (Place.place = Score_Matrix.place AND num_players = Score_Matrix.size)
                      JOIN Track ON Race.track_name = Track.track_name
-            WHERE Track.is_ct = {1 if is_ct else 0}
+            WHERE Track.is_ct = ?
                 AND Race.track_name != ''
-                AND Place.fc in {fc_filter}
+                AND Place.fc in {build_sql_json_list()}
                 AND time < 6 * 60
                 {days_filter_clause}
                 {tier_filter_clause}
             GROUP BY Track.fixed_track_name
-            HAVING COUNT(*) >= {min_count}
+            HAVING COUNT(*) >= ?
             ORDER BY avg_pts DESC
-        """
+        """, args
 
     @staticmethod
-    def get_top_players_query(tier, last_x_days, min_count):
+    def get_top_players_query(track, tier, last_x_days, min_count):
+        args = [track]
         tier_filter_clause = ""
         days_filter_clause = ""
         if tier is not None:
-            tier_filter_clause = f"AND tier = {tier}"
+            tier_filter_clause = "AND tier = ?"
+            args.append(tier)
         if last_x_days is not None:
-            days_filter_clause = "AND " + SQL_Search_Query_Builder.get_sql_days_filter(last_x_days)
+            days_filter, days_args = SQL_Search_Query_Builder.get_sql_days_filter(last_x_days)
+            days_filter_clause = "AND " + days_filter
+            args.extend(days_args)
+        args.append(min_count)
 
         return f"""
         SELECT
@@ -305,10 +508,75 @@ class SQL_Search_Query_Builder(object):
         {days_filter_clause}
         GROUP BY discord_id
         
-        HAVING COUNT(*) >= {min_count}
+        HAVING COUNT(*) >= ?
         ORDER BY avg_pts DESC
         LIMIT 100
-        """
+        """, args
+
+    @staticmethod
+    def get_aggregated_days_filter(days):
+        #Player_Track_Stats.day is date(Race.time_added), so this counts the same races as get_sql_days_filter
+        return "Player_Track_Stats.day >= date('now', ?)", [get_days_arg(days)]
+
+    @staticmethod
+    def get_best_tracks_aggregated(fcs, is_ct, tier, last_x_days, min_count):
+        """Same results as get_best_tracks, read from Player_Track_Stats"""
+        args = [build_json_list_arg(fcs), get_is_ct_arg(is_ct), tier if tier is not None else ANY_TIER]
+        days_filter_clause = ""
+        if last_x_days is not None:
+            days_filter, days_args = SQL_Search_Query_Builder.get_aggregated_days_filter(last_x_days)
+            days_filter_clause = "AND " + days_filter
+            args.extend(days_args)
+        args.append(min_count)
+
+        return f"""
+            SELECT fixed_track_name,
+                   SUM(pts_sum) * 1.0 / SUM(race_count) AS avg_pts,
+                   SUM(place_sum) * 1.0 / SUM(race_count) AS avg_place,
+                   MIN(best_time) AS avg_delta,
+                   SUM(race_count) AS count
+            FROM Player_Track_Stats
+            WHERE fc IN {build_sql_json_list()}
+                AND is_ct = ?
+                AND tier = ?
+                {days_filter_clause}
+            GROUP BY fixed_track_name
+            HAVING SUM(race_count) >= ?
+            ORDER BY avg_pts DESC
+        """, args
+
+    @staticmethod
+    def get_top_players_aggregated_query(track, tier, last_x_days, min_count):
+        """Same results as get_top_players_query, read from Player_Track_Stats"""
+        args = [track, tier if tier is not None else ANY_TIER]
+        days_filter_clause = ""
+        if last_x_days is not None:
+            days_filter, days_args = SQL_Search_Query_Builder.get_aggregated_days_filter(last_x_days)
+            days_filter_clause = "AND " + days_filter
+            args.extend(days_args)
+        args.append(min_count)
+
+        #Each fc's rows are added up before they're joined to Player_FCs, so there's only one Player_FCs lookup per fc instead of one per row
+        return f"""
+        SELECT
+               discord_id,
+               SUM(pts_sum) * 1.0 / SUM(race_count) AS avg_pts,
+               SUM(place_sum) * 1.0 / SUM(race_count) AS avg_place,
+               MIN(best_time) AS avg_delta,
+               SUM(race_count) AS count
+        FROM (SELECT fc, SUM(race_count) AS race_count, SUM(pts_sum) AS pts_sum, SUM(place_sum) AS place_sum, MIN(best_time) AS best_time
+              FROM Player_Track_Stats
+              WHERE fixed_track_name = ?
+                  AND tier = ?
+                  {days_filter_clause}
+              GROUP BY fc) AS Track_FC_Stats
+                 JOIN Player_FCs ON Track_FC_Stats.fc = Player_FCs.fc
+        GROUP BY discord_id
+
+        HAVING SUM(race_count) >= ?
+        ORDER BY avg_pts DESC
+        LIMIT 100
+        """, args
 
     @staticmethod
     def get_fc_mii_hexes_query(fcs: List[str]):
@@ -324,25 +592,45 @@ class SQL_Search_Query_Builder(object):
             GROUP BY Event_Races.event_id
             ORDER BY Event_Races.event_id) x
         ON Event_FCs.event_id = x.event_id
-        WHERE mii_hex IS NOT NULL AND (fc = "4086-2278-0250" OR fc = "1079-7432-6162")
+        WHERE mii_hex IS NOT NULL AND fc IN (SELECT value FROM json_each('["4086-2278-0250", "1079-7432-6162"]'))
         ORDER BY Event_FCs.event_id;
         """
 
+        return f"""{SQL_Search_Query_Builder.get_fc_event_miis_select()}
+        ORDER BY Event_Races.event_id;""", [build_json_list_arg(fcs)]
+
+    @staticmethod
+    def get_fc_event_miis_select():
+        #The first race of each event that one of the fcs (the only parameter) was in, with their mii
         return f"""
         SELECT Event_Races.event_id, MIN(Race.race_id) as race_id, Race.match_time, Track.is_ct, x.fc, x.mii_hex
         FROM Event_Races INNER JOIN 
                 (SELECT Event_FCs.event_id, fc, mii_hex
                 FROM Event_FCs
-                WHERE mii_hex IS NOT NULL AND fc IN {build_sql_args_list(fcs)}) x ON x.event_id = Event_Races.event_id
+                WHERE mii_hex IS NOT NULL AND fc IN {build_sql_json_list()}) x ON x.event_id = Event_Races.event_id
             INNER JOIN Race ON Event_Races.race_id = Race.race_id
             INNER JOIN Track ON Race.track_name = Track.track_name
-        GROUP BY Event_Races.event_id
-        ORDER BY Event_Races.event_id;"""
+        GROUP BY Event_Races.event_id"""
+
+    @staticmethod
+    def get_fc_mii_races_query(fcs: List[str]):
+        """The rows of get_fc_mii_hexes_query, with each race only once for each mii (a race tabled in more than one event is in its rows once for each event),
+        in no particular order. For DataRetriever.get_random_previous_mii, which samples the rows as they're streamed.
+        When the races of an event are on both sides of the end of a month that has been archived, the event's first race in each database is returned."""
+        return f"""SELECT MIN(event_id), race_id, match_time, is_ct, fc, mii_hex
+        FROM ({SQL_Search_Query_Builder.get_fc_event_miis_select()})
+        GROUP BY race_id, mii_hex;""", [build_json_list_arg(fcs)]
         
 
     @staticmethod
     def get_player_races(did, days, is_ct):
-        days_filter_clause = f"AND Race.time_added > date('now','-{days} days')" if (days is not None) else ""
+        args = [get_is_ct_arg(is_ct)]
+        days_filter_clause = ""
+        if days is not None:
+            days_filter, days_args = SQL_Search_Query_Builder.get_sql_days_filter(days)
+            days_filter_clause = "AND " + days_filter
+            args.extend(days_args)
+        args.append(did)
 
         return f"""
         SELECT Place.race_id, Place.place
@@ -350,20 +638,40 @@ class SQL_Search_Query_Builder(object):
             JOIN Race USING (race_id)
             JOIN Track USING (track_name)
         WHERE time < 6 * 60
-            AND Track.is_ct = {1 if is_ct else 0}
+            AND Track.is_ct = ?
             {days_filter_clause}
             AND Place.fc IN (
                 SELECT fc
                 FROM Player_FCs
-                WHERE discord_id = {did}
+                WHERE discord_id = ?
             )
-        """
+        """, args
 
     @staticmethod
     def get_record_query(player_did, opponent_did, days, is_ct):
+        player_races, player_args = SQL_Search_Query_Builder.get_player_races(player_did, days, is_ct)
+        opponent_races, opponent_args = SQL_Search_Query_Builder.get_player_races(opponent_did, days, is_ct)
         return f"""
         SELECT COUNT(*), COUNT(CASE WHEN a.place < b.place THEN 1 END) as wins
-        FROM ({SQL_Search_Query_Builder.get_player_races(player_did, days, is_ct)}) as a 
-            JOIN ({SQL_Search_Query_Builder.get_player_races(opponent_did, days, is_ct)}) as b 
+        FROM ({player_races}) as a 
+            JOIN ({opponent_races}) as b 
             ON a.race_id = b.race_id
-        """
+        """, player_args + opponent_args
+
+    @staticmethod
+    def get_record_aggregated_query(player_did, opponent_did, days, is_ct):
+        """Same results as get_record_query, read from Head_To_Head: one primary key lookup for each pair of the players' fcs"""
+        args = [player_did, opponent_did, get_is_ct_arg(is_ct)]
+        days_filter_clause = ""
+        if days is not None:
+            #Head_To_Head.day is date(Race.time_added), so this counts the same races as get_sql_days_filter
+            days_filter_clause = "AND Head_To_Head.day >= date('now', ?)"
+            args.append(get_days_arg(days))
+        return f"""
+        SELECT COALESCE(SUM(race_count), 0), COALESCE(SUM(win_count), 0) as wins
+        FROM Head_To_Head
+        WHERE fc IN (SELECT fc FROM Player_FCs WHERE discord_id = ?)
+            AND opponent_fc IN (SELECT fc FROM Player_FCs WHERE discord_id = ?)
+            AND is_ct = ?
+            {days_filter_clause}
+        """, args
@@ -0,0 +1,402 @@
+'''
+Created on Oct 19, 2026
+
+@author: willg
+
+Tests for the parameterized queries in Data_Tracker_SQL_Query_Builder.
+
+Every query builder is run against a small synthetic room tracking database (see QueryPlanBenchmark.seed_database), and its results are
+compared to the results of the query the builder used to build, when the values were put into the SQL itself. Those queries are kept
+below, as they were, so the two can be compared.
+
+Run from the bot's folder: python -m unittest data_tracking.QueryBuilderTesting
+'''
+import itertools
+import os
+import tempfile
+import unittest
+
+import common
+from data_tracking import QueryPlanBenchmark
+from data_tracking import StatsAggregatesCheck
+from data_tracking.Data_Tracker_SQL_Query_Builder import *
+
+SQB = SQL_Search_Query_Builder
+TOP_PLAYERS_LIMIT = 100
+
+
+#The queries as they were before they were parameterized
+
+def legacy_build_mark_races_dirty_script(race_ids):
+    return f"""INSERT OR IGNORE INTO temp.Stats_Dirty_Buckets (fixed_track_name, is_ct, day)
+SELECT DISTINCT Track.fixed_track_name, Track.is_ct, date(Race.time_added)
+FROM Race JOIN Track ON Race.track_name = Track.track_name
+WHERE Race.race_id IN {build_sql_args_list(race_ids)};"""
+
+def legacy_build_mark_sha_races_dirty_script(sha, track_name):
+    '''Marks the days of the races whose track is the given sha as dirty, for both the sha's track and the track it's being renamed to'''
+    return f"""INSERT OR IGNORE INTO temp.Stats_Dirty_Buckets (fixed_track_name, is_ct, day)
+SELECT DISTINCT Track.fixed_track_name, Track.is_ct, date(Race.time_added)
+FROM Race JOIN Track ON Track.track_name IN ("{sha}", "{track_name}")
+WHERE Race.track_name = "{sha}";"""
+
+class Legacy_SQL_Search_Query_Builder(object):
+    @staticmethod
+    def get_sql_tier_filter(tier, is_ct):
+        return f"""Race.race_id in (SELECT DISTINCT Race.race_id
+                FROM Race
+                WHERE Race.rxx in (
+                                SELECT DISTINCT Race.rxx
+                                FROM Tier JOIN Event USING(channel_id) /*Immediately discard events without a tier*/
+                                    JOIN Event_Races USING(event_id) /*All events with a tier allowed, allow duplicate events*/
+                                    JOIN Race USING(race_id)
+                                    JOIN Track USING(track_name)
+                                WHERE
+                                Tier.tier = {tier} /*Only get events with the desired tier*/
+                                AND Tier.is_ct = {1 if is_ct else 0}
+                                AND Track.is_ct = {1 if is_ct else 0}
+                                {Legacy_SQL_Search_Query_Builder.get_event_valid_filter()}
+                                )
+)"""
+
+    @staticmethod
+    def get_sql_days_filter(days):
+        return f"Race.time_added > date('now','-{days} days')"
+
+    @staticmethod
+    def get_event_valid_filter():
+        return """
+            AND ROUND((JULIANDAY(Event.last_updated) - JULIANDAY(Event.time_added)) * 86400) > 600 /*10 minutes is 600 seconds*/
+            AND Event.number_of_updates > 2 /*Events should have at least 3 room updates, otherwise the table was likely not created during the event*/
+            AND Event.region = 'priv'
+            """
+
+    @staticmethod
+    def get_tracks_played_query(is_ct, tier, last_x_days):
+        tier_filter_clause = ""
+        days_filter_clause = ""
+        if tier is not None:
+            tier_filter_clause = "AND " + Legacy_SQL_Search_Query_Builder.get_sql_tier_filter(tier, is_ct)
+        if last_x_days is not None:
+            days_filter_clause = "AND " + Legacy_SQL_Search_Query_Builder.get_sql_days_filter(last_x_days)
+            
+        return f"""SELECT
+        Race.track_name,
+        Track.fixed_track_name,
+        COUNT(Race.race_id) as times_played
+    FROM
+        Race LEFT JOIN Track ON Race.track_name = Track.track_name
+    WHERE
+        Track.is_ct = {1 if is_ct else 0}
+        AND Race.region = "priv"
+        {tier_filter_clause}
+        {days_filter_clause}
+    GROUP BY
+        Track.fixed_track_name
+    ORDER BY
+        3 DESC, 1 ASC;"""
+
+    @staticmethod
+    def get_best_tracks(fcs, is_ct, tier, last_x_days, min_count):
+        tier_filter_clause = f"""
+        AND Place.race_id IN (
+            SELECT race_id
+            FROM Event_Races
+                     JOIN Event ON Event_Races.event_id = Event.event_id
+                     JOIN Tier ON Event.channel_id = Tier.channel_id
+                
+                WHERE Event.player_setup_amount = 12
+                {f"AND tier = {tier}" if (tier is not None) else ""}
+                {Legacy_SQL_Search_Query_Builder.get_event_valid_filter()}
+        )
+        """
+
+        days_filter_clause = ""
+        if last_x_days is not None:
+            days_filter_clause = "AND " + Legacy_SQL_Search_Query_Builder.get_sql_days_filter(last_x_days)
+
+        #fcs = ['1509-2420-6937']
+        fc_filter = '(' + ','.join([f'\'{fc}\'' for fc in fcs]) + ')'
+
+        return f"""
+            SELECT Track.fixed_track_name,
+                   AVG(pts)         AS avg_pts,
+                   AVG(Place.place) AS avg_place,
+                   MIN(time) AS avg_delta,
+                   COUNT(*)         AS count
+            FROM Place
+                     JOIN Race ON Place.race_id = Race.race_id
+                     JOIN Score_Matrix
+                          ON (Place.place = Score_Matrix.place AND num_players = Score_Matrix.size)
+                     JOIN Track ON Race.track_name = Track.track_name
+            WHERE Track.is_ct = {1 if is_ct else 0}
+                AND Race.track_name != ''
+                AND Place.fc in {fc_filter}
+                AND time < 6 * 60
+                {days_filter_clause}
+                {tier_filter_clause}
+            GROUP BY Track.fixed_track_name
+            HAVING COUNT(*) >= {min_count}
+            ORDER BY avg_pts DESC
+        """
+
+    @staticmethod
+    def get_top_players_query(tier, last_x_days, min_count):
+        tier_filter_clause = ""
+        days_filter_clause = ""
+        if tier is not None:
+            tier_filter_clause = f"AND tier = {tier}"
+        if last_x_days is not None:
+            days_filter_clause = "AND " + Legacy_SQL_Search_Query_Builder.get_sql_days_filter(last_x_days)
+
+        return f"""
+        SELECT
+               discord_id,
+               AVG(pts)         AS avg_pts,
+               AVG(Place.place) AS avg_place,
+               MIN(time) AS avg_delta,
+               COUNT(*) AS count
+        FROM Place
+                 JOIN Race ON Place.race_id = Race.race_id
+                 JOIN Score_Matrix
+                      ON (Place.place = Score_Matrix.place AND num_players = Score_Matrix.size)
+                 JOIN Player_FCs ON Place.fc = Player_FCs.fc
+                 
+        WHERE Place.race_id IN (
+            SELECT Race.race_id
+            FROM Race
+                    JOIN Event_Races ER ON Race.race_id = ER.race_id
+                    JOIN Event ON ER.event_id = Event.event_id
+                    JOIN Tier ON Event.channel_id = Tier.channel_id
+                    JOIN Track ON Race.track_name = Track.track_name
+        
+            WHERE Event.player_setup_amount = 12
+                AND Track.fixed_track_name = ?
+                {tier_filter_clause}
+                {Legacy_SQL_Search_Query_Builder.get_event_valid_filter()}
+        )
+            AND time < 6 * 60
+            
+        {days_filter_clause}
+        GROUP BY discord_id
+        
+        HAVING COUNT(*) >= {min_count}
+        ORDER BY avg_pts DESC
+        LIMIT 100
+        """
+
+    @staticmethod
+    def get_aggregated_days_filter(days):
+        #Player_Track_Stats.day is date(Race.time_added), so this counts the same races as get_sql_days_filter
+        return f"Player_Track_Stats.day >= date('now','-{days} days')"
+
+    @staticmethod
+    def get_best_tracks_aggregated(fcs, is_ct, tier, last_x_days, min_count):
+        """Same results as get_best_tracks, read from Player_Track_Stats. The fcs are parameters."""
+        days_filter_clause = ""
+        if last_x_days is not None:
+            days_filter_clause = "AND " + Legacy_SQL_Search_Query_Builder.get_aggregated_days_filter(last_x_days)
+
+        return f"""
+            SELECT fixed_track_name,
+                   SUM(pts_sum) * 1.0 / SUM(race_count) AS avg_pts,
+                   SUM(place_sum) * 1.0 / SUM(race_count) AS avg_place,
+                   MIN(best_time) AS avg_delta,
+                   SUM(race_count) AS count
+            FROM Player_Track_Stats
+            WHERE fc IN {build_sql_args_list(fcs)}
+                AND is_ct = {1 if is_ct else 0}
+                AND tier = {tier if tier is not None else ANY_TIER}
+                {days_filter_clause}
+            GROUP BY fixed_track_name
+            HAVING SUM(race_count) >= {min_count}
+            ORDER BY avg_pts DESC
+        """
+
+    @staticmethod
+    def get_top_players_aggregated_query(tier, last_x_days, min_count):
+        """Same results as get_top_players_query, read from Player_Track_Stats. The track's fixed name is the only parameter."""
+        days_filter_clause = ""
+        if last_x_days is not None:
+            days_filter_clause = "AND " + Legacy_SQL_Search_Query_Builder.get_aggregated_days_filter(last_x_days)
+
+        #Each fc's rows are added up before they're joined to Player_FCs, so there's only one Player_FCs lookup per fc instead of one per row
+        return f"""
+        SELECT
+               discord_id,
+               SUM(pts_sum) * 1.0 / SUM(race_count) AS avg_pts,
+               SUM(place_sum) * 1.0 / SUM(race_count) AS avg_place,
+               MIN(best_time) AS avg_delta,
+               SUM(race_count) AS count
+        FROM (SELECT fc, SUM(race_count) AS race_count, SUM(pts_sum) AS pts_sum, SUM(place_sum) AS place_sum, MIN(best_time) AS best_time
+              FROM Player_Track_Stats
+              WHERE fixed_track_name = ?
+                  AND tier = {tier if tier is not None else ANY_TIER}
+                  {days_filter_clause}
+              GROUP BY fc) AS Track_FC_Stats
+                 JOIN Player_FCs ON Track_FC_Stats.fc = Player_FCs.fc
+        GROUP BY discord_id
+
+        HAVING SUM(race_count) >= {min_count}
+        ORDER BY avg_pts DESC
+        LIMIT 100
+        """
+
+    @staticmethod
+    def get_fc_mii_hexes_query(fcs: List[str]):
+
+        return f"""
+        SELECT Event_Races.event_id, MIN(Race.race_id) as race_id, Race.match_time, Track.is_ct, x.fc, x.mii_hex
+        FROM Event_Races INNER JOIN 
+                (SELECT Event_FCs.event_id, fc, mii_hex
+                FROM Event_FCs
+                WHERE mii_hex IS NOT NULL AND fc IN {build_sql_args_list(fcs)}) x ON x.event_id = Event_Races.event_id
+            INNER JOIN Race ON Event_Races.race_id = Race.race_id
+            INNER JOIN Track ON Race.track_name = Track.track_name
+        GROUP BY Event_Races.event_id
+        ORDER BY Event_Races.event_id;"""
+        
+
+    @staticmethod
+    def get_player_races(did, days, is_ct):
+        days_filter_clause = f"AND Race.time_added > date('now','-{days} days')" if (days is not None) else ""
+
+        return f"""
+        SELECT Place.race_id, Place.place
+        FROM Place
+            JOIN Race USING (race_id)
+            JOIN Track USING (track_name)
+        WHERE time < 6 * 60
+            AND Track.is_ct = {1 if is_ct else 0}
+            {days_filter_clause}
+            AND Place.fc IN (
+                SELECT fc
+                FROM Player_FCs
+                WHERE discord_id = {did}
+            )
+        """
+
+    @staticmethod
+    def get_record_query(player_did, opponent_did, days, is_ct):
+        return f"""
+        SELECT COUNT(*), COUNT(CASE WHEN a.place < b.place THEN 1 END) as wins
+        FROM ({Legacy_SQL_Search_Query_Builder.get_player_races(player_did, days, is_ct)}) as a 
+            JOIN ({Legacy_SQL_Search_Query_Builder.get_player_races(opponent_did, days, is_ct)}) as b 
+            ON a.race_id = b.race_id
+        """
+
+
+def sort_rows(rows):
+    #Rows with the same average can come back in any order
+    return sorted(rows, key=repr)
+
+class ParameterizedQueryTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.temp_folder = tempfile.TemporaryDirectory()
+        cls.connection = QueryPlanBenchmark.create_database(os.path.join(cls.temp_folder.name, "query_builder.db"))
+        cls.seeded = QueryPlanBenchmark.seed_database(cls.connection, 30000)
+        cls.connection.executescript(common.read_sql_file(common.ROOM_DATA_TRACKING_STATS_AGGREGATES_SQL))
+        cls.connection.execute(create_stats_dirty_buckets_script())
+        StatsAggregatesCheck.rebuild_stats_aggregates(cls.connection)
+        cls.tiers = [None, cls.seeded["tier"], cls.connection.execute("SELECT tier FROM Tier WHERE is_ct = 1 LIMIT 1").fetchone()[0]]
+        cls.tracks = [cls.seeded["rt_track"], "CT Track 0"]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.connection.close()
+        cls.temp_folder.cleanup()
+
+    def assert_same_results(self, query_and_args, legacy_query, legacy_args=()):
+        rows = self.connection.execute(*query_and_args).fetchall()
+        expected = self.connection.execute(legacy_query, legacy_args).fetchall()
+        if len(expected) >= TOP_PLAYERS_LIMIT:
+            #When the LIMIT cuts off players with the same average, which of them are included can differ, but the averages can't
+            self.assertEqual(sorted(row[1] for row in rows), sorted(row[1] for row in expected))
+        else:
+            self.assertEqual(sort_rows(rows), sort_rows(expected))
+
+    def get_dirty_buckets(self, statement, args):
+        self.connection.execute("DELETE FROM temp.Stats_Dirty_Buckets")
+        self.connection.execute(statement, args)
+        dirty_buckets = self.connection.execute("SELECT * FROM temp.Stats_Dirty_Buckets ORDER BY 1, 2, 3").fetchall()
+        self.connection.execute("DELETE FROM temp.Stats_Dirty_Buckets")
+        return dirty_buckets
+
+    def test_tracks_played(self):
+        for is_ct, tier, days in itertools.product((False, True), self.tiers, (None, 30)):
+            with self.subTest(is_ct=is_ct, tier=tier, days=days):
+                self.assert_same_results(SQB.get_tracks_played_query(is_ct, tier, days),
+                                         Legacy_SQL_Search_Query_Builder.get_tracks_played_query(is_ct, tier, days))
+
+    def test_best_tracks(self):
+        fcs = self.seeded["player_fcs"]
+        for is_ct, tier, days, min_count in itertools.product((False, True), self.tiers, (None, 30), (1, 5)):
+            with self.subTest(is_ct=is_ct, tier=tier, days=days, min_count=min_count):
+                self.assert_same_results(SQB.get_best_tracks(fcs, is_ct, tier, days, min_count),
+                                         Legacy_SQL_Search_Query_Builder.get_best_tracks(fcs, is_ct, tier, days, min_count))
+                self.assert_same_results(SQB.get_best_tracks_aggregated(fcs, is_ct, tier, days, min_count),
+                                         Legacy_SQL_Search_Query_Builder.get_best_tracks_aggregated(fcs, is_ct, tier, days, min_count), fcs)
+
+    def test_top_players(self):
+        for track, tier, days, min_count in itertools.product(self.tracks, self.tiers, (None, 30), (1, 5)):
+            with self.subTest(track=track, tier=tier, days=days, min_count=min_count):
+                self.assert_same_results(SQB.get_top_players_query(track, tier, days, min_count),
+                                         Legacy_SQL_Search_Query_Builder.get_top_players_query(tier, days, min_count), [track])
+                self.assert_same_results(SQB.get_top_players_aggregated_query(track, tier, days, min_count),
+                                         Legacy_SQL_Search_Query_Builder.get_top_players_aggregated_query(tier, days, min_count), [track])
+
+    def test_record(self):
+        player_did, opponent_did = self.seeded["player_discord_id"], self.seeded["opponent_discord_id"]
+        for is_ct, days in itertools.product((False, True), (None, 30)):
+            with self.subTest(is_ct=is_ct, days=days):
+                self.assert_same_results(SQB.get_record_query(player_did, opponent_did, days, is_ct),
+                                         Legacy_SQL_Search_Query_Builder.get_record_query(player_did, opponent_did, days, is_ct))
+
+    def test_mii_hexes(self):
+        fcs = self.seeded["player_fcs"]
+        self.assert_same_results(SQB.get_fc_mii_hexes_query(fcs), Legacy_SQL_Search_Query_Builder.get_fc_mii_hexes_query(fcs), fcs)
+
+    def test_mark_races_dirty(self):
+        race_ids = [race_id for (race_id,) in self.connection.execute("SELECT race_id FROM Race ORDER BY race_id LIMIT 50")]
+        self.assertEqual(self.get_dirty_buckets(mark_races_dirty_script(), [build_json_list_arg(race_ids)]),
+                         self.get_dirty_buckets(legacy_build_mark_races_dirty_script(race_ids), race_ids))
+
+    def test_mark_sha_races_dirty(self):
+        track_name = self.seeded["rt_track"]
+        self.assertEqual(self.get_dirty_buckets(mark_sha_races_dirty_script(), [track_name, "CT Track 0", track_name]),
+                         self.get_dirty_buckets(legacy_build_mark_sha_races_dirty_script(track_name, "CT Track 0"), []))
+
+    def test_fix_sha(self):
+        #A track name with quotes in it, which used to break the script
+        sha, track_name = "0123456789abcdef0123456789abcdef01234567", 'Luigi\'s "Circuit" (Author) v1.0'
+        race_id = self.connection.execute("SELECT MAX(race_id) FROM Race").fetchone()[0]
+        self.connection.execute("BEGIN")
+        self.connection.execute("INSERT INTO Track VALUES (?, 'No Track Page', ?, 1, ?)", [sha, sha, sha])
+        self.connection.execute("UPDATE Race SET track_name = ? WHERE race_id = ?", [sha, race_id])
+        for statement, args in build_fix_sha_statements(sha, track_name, 'Luigi\'s "Circuit"', 'luigiscircuit'):
+            self.connection.execute(statement, args)
+        self.assertEqual(self.connection.execute("SELECT track_name FROM Race WHERE race_id = ?", [race_id]).fetchone()[0], track_name)
+        self.assertEqual(self.connection.execute("SELECT COUNT(*) FROM Track WHERE track_name = ?", [sha]).fetchone()[0], 0)
+        self.assertIn(('Luigi\'s "Circuit"', 1), self.connection.execute("SELECT fixed_track_name, is_ct FROM temp.Stats_Dirty_Buckets").fetchall())
+        self.connection.execute("ROLLBACK")
+        self.connection.execute("DELETE FROM temp.Stats_Dirty_Buckets")
+
+    def test_sql_does_not_depend_on_values(self):
+        #So the prepared statement is reused from the statement cache
+        self.assertEqual(SQB.get_best_tracks(["0000-0000-0001"], False, 1, 30, 1)[0], SQB.get_best_tracks(["0000-0000-0002", "0000-0000-0003"], False, 5, 7, 5)[0])
+        self.assertEqual(SQB.get_best_tracks_aggregated(["0000-0000-0001"], False, 1, 30, 1)[0], SQB.get_best_tracks_aggregated(["0000-0000-0002", "0000-0000-0003"], True, 5, 7, 5)[0])
+        self.assertEqual(SQB.get_top_players_query("Track A", 1, 30, 1)[0], SQB.get_top_players_query("Track B", 5, 7, 5)[0])
+        self.assertEqual(SQB.get_top_players_aggregated_query("Track A", None, None, 1)[0], SQB.get_top_players_aggregated_query("Track B", None, None, 5)[0])
+        self.assertEqual(SQB.get_tracks_played_query(False, 1, 30)[0], SQB.get_tracks_played_query(True, 5, 7)[0])
+        self.assertEqual(SQB.get_record_query(1, 2, 30, False)[0], SQB.get_record_query(3, 4, 7, True)[0])
+        self.assertEqual(SQB.get_fc_mii_hexes_query(["0000-0000-0001"])[0], SQB.get_fc_mii_hexes_query(["0000-0000-0002", "0000-0000-0003"])[0])
+
+    def test_more_fcs_than_sql_variables(self):
+        fcs = self.seeded["player_fcs"] + [QueryPlanBenchmark.get_fc(999000000 + i) for i in range(MAX_SQL_VARIABLES + 1)]
+        self.assert_same_results(SQB.get_best_tracks_aggregated(fcs, False, None, None, 1),
+                                 *SQB.get_best_tracks_aggregated(self.seeded["player_fcs"], False, None, None, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,231 @@
+'''
+Created on Oct 19, 2026
+
+@author: willg
+
+Benchmarks the DataRetriever queries on a synthetic room tracking database.
+
+A database with the room tracking schema is seeded with random (but realistically shaped) data: events of 12 players
+playing 12 races each, in tiered and untiered channels, spread over the last year. Each DataRetriever query is then run against it,
+and its EXPLAIN QUERY PLAN and timing are reported. With --compare, the queries are run before and after the query index migration
+(data_tracking/migrations/query_indexes.sql) so the two can be compared.
+
+Run from the bot's folder: python -m data_tracking.QueryPlanBenchmark [--placements 2000000] [--database temp/query_plan_benchmark.db] [--compare] [--output results.json]
+'''
+import argparse
+import json
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+
+import common
+from data_tracking import Data_Tracker_SQL_Query_Builder as QB
+
+DEFAULT_DATABASE_FILE = "temp/query_plan_benchmark.db"
+DEFAULT_PLACEMENTS = 2000000
+DEFAULT_REPEAT = 5
+
+PLAYERS_PER_RACE = 12
+RACES_PER_EVENT = 12
+RT_TRACK_COUNT = 32
+CT_TRACK_COUNT = 218
+CT_EVENT_CHANCE = 0.3
+TIERED_EVENT_CHANCE = 0.7
+PRIV_RACE_CHANCE = 0.9
+#One player for every this many placements, so players have a realistic number of races each
+PLACEMENTS_PER_PLAYER = 100
+LINKED_FC_CHANCE = 0.8
+DAYS_OF_HISTORY = 365
+INSERT_CHUNK_SIZE = 10000
+
+
+def get_fc(player_num: int) -> str:
+    digits = f"{player_num:012}"
+    return f"{digits[:4]}-{digits[4:8]}-{digits[8:]}"
+
+def get_timestamp(moment: datetime) -> str:
+    return moment.strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+
+def insert_in_chunks(connection: sqlite3.Connection, sql: str, rows):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= INSERT_CHUNK_SIZE:
+            connection.executemany(sql, chunk)
+            chunk.clear()
+    if len(chunk) > 0:
+        connection.executemany(sql, chunk)
+
+
+def create_database(database_file: str):
+    if os.path.exists(database_file):
+        os.remove(database_file)
+    database_folder = os.path.dirname(database_file)
+    if database_folder:
+        os.makedirs(database_folder, exist_ok=True)
+    connection = sqlite3.connect(database_file, isolation_level=None)
+    connection.executescript(common.read_sql_file(common.ROOM_DATA_TRACKING_DATABASE_CREATION_SQL))
+    connection.executescript(common.read_sql_file(common.ROOM_DATA_POPULATE_TIER_TABLE_SQL))
+    connection.executemany("INSERT INTO Score_Matrix VALUES (?, ?, ?)",
+                           [(room_size+1, place+1, common.scoreMatrix[room_size][place]) for room_size in range(12) for place in range(12)])
+    return connection
+
+def seed_database(connection: sqlite3.Connection, placement_count: int, seed=0) -> Dict:
+    '''Fills the database with random events. Returns information about the seeded data that the queries use as their arguments.'''
+    rng = random.Random(seed)
+    event_count = max(1, placement_count // (PLAYERS_PER_RACE * RACES_PER_EVENT))
+    player_count = max(PLAYERS_PER_RACE * 2, placement_count // PLACEMENTS_PER_PLAYER)
+    fcs = [get_fc(player_num) for player_num in range(player_count)]
+    rt_tracks = [(f"RT Track {i}", f"RT Track {i}", 0) for i in range(RT_TRACK_COUNT)]
+    ct_tracks = [(f"CT Track {i} (Author) v1.{i}", f"CT Track {i}", 1) for i in range(CT_TRACK_COUNT)]
+    tiers = connection.execute("SELECT channel_id, is_ct FROM Tier").fetchall()
+    rt_channels = [channel_id for channel_id, is_ct in tiers if not is_ct]
+    ct_channels = [channel_id for channel_id, is_ct in tiers if is_ct]
+    start_time = datetime.now() - timedelta(days=DAYS_OF_HISTORY)
+
+    connection.execute("BEGIN")
+    insert_in_chunks(connection, "INSERT INTO Track VALUES (?, ?, ?, ?, ?)",
+                     ((track_name, "No Track Page", fixed_name, is_ct, fixed_name.lower()) for track_name, fixed_name, is_ct in rt_tracks + ct_tracks))
+    insert_in_chunks(connection, "INSERT INTO Player VALUES (?, ?, ?)",
+                     ((fc, player_num, f"https://wiimmfi.de/stats/mkwx/list/p{player_num}") for player_num, fc in enumerate(fcs)))
+    #Some players have more than one FC linked to their discord account
+    insert_in_chunks(connection, "INSERT INTO Player_FCs VALUES (?, ?)",
+                     ((fc, 100000000000000000 + player_num // 2) for player_num, fc in enumerate(fcs) if rng.random() < LINKED_FC_CHANCE))
+
+    race_id = 0
+    for event_num in range(event_count):
+        event_id = 900000000000000000 + event_num
+        event_time = start_time + timedelta(days=DAYS_OF_HISTORY * event_num / event_count)
+        is_ct = rng.random() < CT_EVENT_CHANCE
+        if rng.random() < TIERED_EVENT_CHANCE:
+            channel_id = rng.choice(ct_channels if is_ct else rt_channels)
+        else:
+            channel_id = rng.randrange(10**17, 10**18)
+        event_fcs = rng.sample(fcs, PLAYERS_PER_RACE)
+        connection.execute("INSERT INTO Event_ID VALUES (?)", (event_id,))
+        connection.execute("INSERT INTO Event VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                           (event_id, channel_id, get_timestamp(event_time), get_timestamp(event_time + timedelta(minutes=40)),
+                            RACES_PER_EVENT, "priv", None, None, PLAYERS_PER_RACE))
+        connection.executemany("INSERT INTO Event_FCs VALUES (?, ?, ?)",
+                               [(event_id, fc, f"{rng.getrandbits(74*8):0148x}") for fc in event_fcs])
+
+        races = []
+        placements = []
+        for race_num in range(RACES_PER_EVENT):
+            race_time = event_time + timedelta(minutes=3 * race_num)
+            track_name, _, _ = rng.choice(ct_tracks if is_ct else rt_tracks)
+            region = "priv" if rng.random() < PRIV_RACE_CHANCE else "eu"
+            races.append((race_id, f"r{race_id:07}", get_timestamp(race_time), race_time.strftime("%Y-%m-%d %H:%M:%S"), race_num + 1, "AB12",
+                          track_name, "Private Room", "150cc", region, 1, PLAYERS_PER_RACE, 100.0, 130.0, 115.0))
+            for place, fc in enumerate(rng.sample(event_fcs, PLAYERS_PER_RACE), 1):
+                placements.append((race_id, fc, f"Player {fc}", place, 100 + place * 2.5 + rng.random(), 0.0, "ok", place, "priv",
+                                   0.0, "player", 5000, None, None, None, None, None, 1))
+            race_id += 1
+        connection.executemany("INSERT INTO Race VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", races)
+        connection.executemany("INSERT INTO Place VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", placements)
+        connection.executemany("INSERT INTO Event_Races VALUES (?, ?)", [(event_id, race[0]) for race in races])
+    connection.execute("COMMIT")
+
+    #A player and an opponent who both have discord accounts linked, for the record queries
+    (player_discord_id,), (opponent_discord_id,) = connection.execute("SELECT DISTINCT discord_id FROM Player_FCs ORDER BY discord_id LIMIT 2 OFFSET 5").fetchall()
+    return {"placements": race_id * PLAYERS_PER_RACE,
+            "player_discord_id": player_discord_id,
+            "opponent_discord_id": opponent_discord_id,
+            "player_fcs": [fc for (fc,) in connection.execute("SELECT fc FROM Player_FCs WHERE discord_id = ?", (player_discord_id,))],
+            "rt_track": rt_tracks[0][1],
+            "tier": connection.execute("SELECT tier FROM Tier WHERE is_ct = 0 LIMIT 1").fetchone()[0]}
+
+
+def get_benchmark_queries(seeded: Dict) -> List[Tuple[str, str, List]]:
+    '''Returns (description, sql, parameters) for each DataRetriever query, built the same way DataRetriever builds them'''
+    SQB = QB.SQL_Search_Query_Builder
+    tier = seeded["tier"]
+    return [("get_tracks_played_count(is_ct=False)", *SQB.get_tracks_played_query(False, None, None)),
+            (f"get_tracks_played_count(is_ct=False, tier={tier})", *SQB.get_tracks_played_query(False, tier, None)),
+            ("get_tracks_played_count(is_ct=False, in_last_days=30)", *SQB.get_tracks_played_query(False, None, 30)),
+            ("get_best_tracks(player)", *SQB.get_best_tracks(seeded["player_fcs"], False, None, None, 1)),
+            (f"get_best_tracks(player, tier={tier}, in_last_days=30)", *SQB.get_best_tracks(seeded["player_fcs"], False, tier, 30, 1)),
+            ("get_top_players(track)", *SQB.get_top_players_query(seeded["rt_track"], None, None, 1)),
+            (f"get_top_players(track, tier={tier}, in_last_days=30)", *SQB.get_top_players_query(seeded["rt_track"], tier, 30, 1)),
+            ("get_record(player, opponent)", *SQB.get_record_query(seeded["player_discord_id"], seeded["opponent_discord_id"], None, False)),
+            ("get_record(player, opponent, days=30)", *SQB.get_record_query(seeded["player_discord_id"], seeded["opponent_discord_id"], 30, False)),
+            ("get_track_list()", "SELECT track_name, url, fixed_track_name, is_ct, track_name_lookup FROM Track", []),
+            ("get_mii_hexes(player)", *SQB.get_fc_mii_hexes_query(seeded["player_fcs"]))]
+
+def get_query_plan(connection: sqlite3.Connection, sql: str, parameters) -> List[str]:
+    '''Returns the lines of the query plan, indented the same way the sqlite3 shell shows them'''
+    depths = {0: -1}
+    lines = []
+    for node_id, parent_id, _, detail in connection.execute(f"EXPLAIN QUERY PLAN {sql}", parameters):
+        depths[node_id] = depths.get(parent_id, -1) + 1
+        lines.append(f"{'   ' * depths[node_id]}{detail}")
+    return lines
+
+def time_query(connection: sqlite3.Connection, sql: str, parameters, repeat: int) -> Tuple[float, int]:
+    '''Returns the median time to run the query and fetch all of its rows, and the number of rows'''
+    timings = []
+    row_count = 0
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        row_count = len(connection.execute(sql, parameters).fetchall())
+        timings.append(time.perf_counter() - t0)
+    return statistics.median(timings), row_count
+
+def run_queries(connection: sqlite3.Connection, queries, repeat: int, label: str) -> Dict:
+    results = {}
+    print(f"\n===== {label} =====")
+    for description, sql, parameters in queries:
+        plan = get_query_plan(connection, sql, parameters)
+        median_time, row_count = time_query(connection, sql, parameters, repeat)
+        results[description] = {"median_seconds": median_time, "rows": row_count, "plan": plan}
+        print(f"\n{description}: {median_time*1000:.1f}ms median ({row_count} rows)")
+        for line in plan:
+            print(f"\t{line}")
+    return results
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Report the query plan and timing of each DataRetriever query on a synthetic room tracking database.")
+    parser.add_argument("--database", default=DEFAULT_DATABASE_FILE, help="where to create the synthetic database (it is overwritten)")
+    parser.add_argument("--placements", type=int, default=DEFAULT_PLACEMENTS, help="number of placements to seed the database with")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="number of times each query is timed")
+    parser.add_argument("--compare", action="store_true", help="also run the queries before the query indexes are created")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="JSON file to write the results to")
+    args = parser.parse_args(argv)
+
+    connection = create_database(args.database)
+    t0 = time.perf_counter()
+    seeded = seed_database(connection, args.placements, args.seed)
+    print(f"Seeded {seeded['placements']} placements in {time.perf_counter() - t0:.1f}s")
+    queries = get_benchmark_queries(seeded)
+
+    results = {"placements": seeded["placements"], "time": str(datetime.now())}
+    if args.compare:
+        connection.execute("ANALYZE")
+        results["without_indexes"] = run_queries(connection, queries, args.repeat, "Without query indexes")
+    t0 = time.perf_counter()
+    connection.executescript(common.read_sql_file(common.ROOM_DATA_TRACKING_QUERY_INDEXES_SQL))
+    connection.execute("ANALYZE")
+    print(f"\nCreated the query indexes in {time.perf_counter() - t0:.1f}s")
+    results["with_indexes"] = run_queries(connection, queries, args.repeat, "With query indexes")
+
+    if args.compare:
+        print("\n===== Speedup =====")
+        for description, _, _ in queries:
+            before = results["without_indexes"][description]["median_seconds"]
+            after = results["with_indexes"][description]["median_seconds"]
+            print(f"{description}: {before*1000:.1f}ms -> {after*1000:.1f}ms ({before / max(after, 1e-9):.1f}x)")
+
+    connection.close()
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,174 @@
+'''
+Created on Oct 19, 2026
+
+@author: willg
+
+Benchmarks ?record between two heavy players: the original query, which joins both players' placements on race_id, and the query that reads
+the head to head records (Head_To_Head, see data_tracking/migrations/head_to_head.sql).
+
+A synthetic database is seeded (see QueryPlanBenchmark), then two players with two fcs each play --heavy-races races each, in 12 race events,
+--shared of them against each other. Half of their events are written without the Place_Head_To_Head trigger and half with it, so the cost the trigger
+adds to writes can be compared. Head_To_Head is then checked against a full recompute, and each record query is timed and checked against the original query.
+
+Run from the bot's folder: python -m data_tracking.RecordBenchmark [--placements 1000000] [--heavy-races 30000] [--shared 0.5] [--database temp/record_benchmark.db] [--output results.json]
+'''
+import argparse
+import json
+import random
+import sqlite3
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+import common
+from data_tracking import QueryPlanBenchmark
+from data_tracking import StatsAggregatesCheck
+from data_tracking import Data_Tracker_SQL_Query_Builder as QB
+
+DEFAULT_DATABASE_FILE = "temp/record_benchmark.db"
+DEFAULT_PLACEMENTS = 1000000
+DEFAULT_HEAVY_RACES = 30000
+DEFAULT_SHARED = 0.5
+DEFAULT_REPEAT = 5
+
+PLAYER_DISCORD_ID = 200000000000000001
+OPPONENT_DISCORD_ID = 200000000000000002
+FCS_PER_HEAVY_PLAYER = 2
+
+
+def get_heavy_fcs(discord_id: int) -> List[str]:
+    return [QueryPlanBenchmark.get_fc(10**11 + discord_id % 1000 * 10 + fc_num) for fc_num in range(FCS_PER_HEAVY_PLAYER)]
+
+def add_heavy_players(connection: sqlite3.Connection):
+    connection.execute("BEGIN")
+    for discord_id in (PLAYER_DISCORD_ID, OPPONENT_DISCORD_ID):
+        for fc in get_heavy_fcs(discord_id):
+            connection.execute("INSERT INTO Player VALUES (?, ?, ?)", (fc, 0, "https://wiimmfi.de/stats/mkwx"))
+            connection.execute("INSERT INTO Player_FCs VALUES (?, ?)", (fc, discord_id))
+    connection.execute("COMMIT")
+
+def get_heavy_events(connection: sqlite3.Connection, heavy_races: int, shared: float, rng: random.Random) -> List[List[str]]:
+    '''Returns the fcs of each event the heavy players play in: events with both of them, then events with only one of them'''
+    event_count = heavy_races // QueryPlanBenchmark.RACES_PER_EVENT
+    shared_event_count = int(event_count * shared)
+    other_fcs = [fc for (fc,) in connection.execute("SELECT fc FROM Player WHERE fc NOT IN (SELECT fc FROM Player_FCs WHERE discord_id IN (?, ?))",
+                                                      (PLAYER_DISCORD_ID, OPPONENT_DISCORD_ID))]
+    player_fcs, opponent_fcs = get_heavy_fcs(PLAYER_DISCORD_ID), get_heavy_fcs(OPPONENT_DISCORD_ID)
+    events = []
+    for event_num in range(shared_event_count):
+        heavy_fcs = [player_fcs[event_num % FCS_PER_HEAVY_PLAYER], opponent_fcs[event_num % FCS_PER_HEAVY_PLAYER]]
+        events.append(heavy_fcs + rng.sample(other_fcs, QueryPlanBenchmark.PLAYERS_PER_RACE - 2))
+    for event_num in range(event_count - shared_event_count):
+        for heavy_fcs in (player_fcs, opponent_fcs):
+            events.append([heavy_fcs[event_num % FCS_PER_HEAVY_PLAYER]] + rng.sample(other_fcs, QueryPlanBenchmark.PLAYERS_PER_RACE - 1))
+    rng.shuffle(events)
+    return events
+
+def write_events(connection: sqlite3.Connection, events: List[List[str]], rng: random.Random) -> float:
+    '''Writes each event in its own transaction, like a room update. Returns the median time to write an event.'''
+    tracks = connection.execute("SELECT track_name, is_ct FROM Track").fetchall()
+    rt_tracks = [track_name for track_name, is_ct in tracks if not is_ct]
+    ct_tracks = [track_name for track_name, is_ct in tracks if is_ct]
+    event_id = connection.execute("SELECT max(event_id) FROM Event_ID").fetchone()[0] + 1
+    race_id = connection.execute("SELECT max(race_id) FROM Race").fetchone()[0] + 1
+    start_time = datetime.now() - timedelta(days=QueryPlanBenchmark.DAYS_OF_HISTORY)
+    timings = []
+    for event_num, event_fcs in enumerate(events):
+        event_time = start_time + timedelta(days=QueryPlanBenchmark.DAYS_OF_HISTORY * event_num / len(events))
+        is_ct = rng.random() < QueryPlanBenchmark.CT_EVENT_CHANCE
+        races = []
+        placements = []
+        for race_num in range(QueryPlanBenchmark.RACES_PER_EVENT):
+            race_time = event_time + timedelta(minutes=3 * race_num)
+            races.append((race_id, f"r{race_id:07}", QueryPlanBenchmark.get_timestamp(race_time), race_time.strftime("%Y-%m-%d %H:%M:%S"), race_num + 1, "AB12",
+                          rng.choice(ct_tracks if is_ct else rt_tracks), "Private Room", "150cc", "priv", 1, len(event_fcs), 100.0, 130.0, 115.0))
+            for place, fc in enumerate(rng.sample(event_fcs, len(event_fcs)), 1):
+                placements.append((race_id, fc, f"Player {fc}", place, 100 + place * 2.5 + rng.random(), 0.0, "ok", place, "priv",
+                                   0.0, "player", 5000, None, None, None, None, None, 1))
+            race_id += 1
+        t0 = time.perf_counter()
+        connection.execute("BEGIN")
+        connection.execute("INSERT INTO Event_ID VALUES (?)", (event_id,))
+        connection.execute("INSERT INTO Event VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                           (event_id, rng.randrange(10**17, 10**18), QueryPlanBenchmark.get_timestamp(event_time),
+                            QueryPlanBenchmark.get_timestamp(event_time + timedelta(minutes=40)), QueryPlanBenchmark.RACES_PER_EVENT, "priv", None, None, len(event_fcs)))
+        connection.executemany("INSERT INTO Race VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", races)
+        connection.executemany("INSERT INTO Place VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", placements)
+        connection.executemany("INSERT INTO Event_Races VALUES (?, ?)", [(event_id, race[0]) for race in races])
+        connection.execute("COMMIT")
+        timings.append(time.perf_counter() - t0)
+        event_id += 1
+    return statistics.median(timings)
+
+def time_record_queries(connection: sqlite3.Connection, repeat: int) -> Dict:
+    SQB = QB.SQL_Search_Query_Builder
+    results = {}
+    for days in (None, 30):
+        for is_ct in (False, True):
+            description = f"get_record(heavy player, heavy opponent, days={days}, is_ct={is_ct})"
+            original_time, _ = QueryPlanBenchmark.time_query(connection, *SQB.get_record_query(PLAYER_DISCORD_ID, OPPONENT_DISCORD_ID, days, is_ct), repeat)
+            aggregated_time, _ = QueryPlanBenchmark.time_query(connection, *SQB.get_record_aggregated_query(PLAYER_DISCORD_ID, OPPONENT_DISCORD_ID, days, is_ct), repeat)
+            expected = connection.execute(*SQB.get_record_query(PLAYER_DISCORD_ID, OPPONENT_DISCORD_ID, days, is_ct)).fetchall()
+            result = connection.execute(*SQB.get_record_aggregated_query(PLAYER_DISCORD_ID, OPPONENT_DISCORD_ID, days, is_ct)).fetchall()
+            results[description] = {"original_seconds": original_time, "head_to_head_seconds": aggregated_time, "record": result, "matches": result == expected}
+            print(f"{description}: {original_time*1000:.1f}ms -> {aggregated_time*1000:.2f}ms ({original_time / max(aggregated_time, 1e-9):.0f}x), "
+                  f"record {result[0]}{'' if result == expected else f' - DOES NOT MATCH the original query: {expected[0]}'}")
+    return results
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Compare the original ?record query to the head to head records for two heavy players on a synthetic room tracking database.")
+    parser.add_argument("--database", default=DEFAULT_DATABASE_FILE, help="where to create the synthetic database (it is overwritten)")
+    parser.add_argument("--placements", type=int, default=DEFAULT_PLACEMENTS, help="number of placements to seed the database with, before the heavy players' races")
+    parser.add_argument("--heavy-races", type=int, default=DEFAULT_HEAVY_RACES, help="number of races each heavy player plays")
+    parser.add_argument("--shared", type=float, default=DEFAULT_SHARED, help="fraction of the heavy players' races that they play against each other")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="number of times each query is timed")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="JSON file to write the results to")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    connection = QueryPlanBenchmark.create_database(args.database)
+    t0 = time.perf_counter()
+    seeded = QueryPlanBenchmark.seed_database(connection, args.placements, args.seed)
+    connection.executescript(common.read_sql_file(common.ROOM_DATA_TRACKING_QUERY_INDEXES_SQL))
+    add_heavy_players(connection)
+    print(f"Seeded {seeded['placements']} placements in {time.perf_counter() - t0:.1f}s")
+
+    #The first half of the heavy players' events are written without the trigger, the way they were before Head_To_Head
+    events = get_heavy_events(connection, args.heavy_races, args.shared, rng)
+    connection.executescript(common.read_sql_file(common.ROOM_DATA_TRACKING_HEAD_TO_HEAD_SQL))
+    connection.execute("DROP TRIGGER Place_Head_To_Head")
+    without_trigger_time = write_events(connection, events[:len(events) // 2], rng)
+
+    t0 = time.perf_counter()
+    StatsAggregatesCheck.rebuild_head_to_head(connection)
+    rebuild_time = time.perf_counter() - t0
+    head_to_head_rows = connection.execute("SELECT COUNT(*) FROM Head_To_Head").fetchone()[0]
+    print(f"Built Head_To_Head ({head_to_head_rows} rows) in {rebuild_time:.1f}s")
+
+    connection.executescript(common.read_sql_file(common.ROOM_DATA_TRACKING_HEAD_TO_HEAD_SQL))
+    with_trigger_time = write_events(connection, events[len(events) // 2:], rng)
+    print(f"Median time to write a 12 race event: {without_trigger_time*1000:.2f}ms without the trigger, {with_trigger_time*1000:.2f}ms with it")
+
+    differences = StatsAggregatesCheck.check_head_to_head(connection)
+    is_consistent = StatsAggregatesCheck.report_differences("Head_To_Head", differences)
+    connection.execute("ANALYZE")
+    player_races = connection.execute("""SELECT discord_id, COUNT(*) FROM Place JOIN Player_FCs USING (fc) WHERE discord_id IN (?, ?) GROUP BY discord_id""",
+                                      (PLAYER_DISCORD_ID, OPPONENT_DISCORD_ID)).fetchall()
+    print(f"\nHeavy players' races: {', '.join(str(race_count) for _, race_count in player_races)}")
+    query_results = time_record_queries(connection, args.repeat)
+    connection.close()
+
+    if args.output is not None:
+        results = {"placements": seeded["placements"], "time": str(datetime.now()), "heavy_races": args.heavy_races, "shared": args.shared,
+                   "head_to_head_rows": head_to_head_rows, "rebuild_seconds": rebuild_time,
+                   "event_write_seconds": {"without_trigger": without_trigger_time, "with_trigger": with_trigger_time},
+                   "consistent": is_consistent, "queries": query_results}
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    return 0 if is_consistent and all(result["matches"] for result in query_results.values()) else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,191 @@
+'''
+Created on Oct 19, 2026
+
+@author: willg
+
+Benchmarks how long DataTracker.initialize takes on a large room tracking database.
+
+A synthetic database is seeded (see QueryPlanBenchmark), with some races still stored under their track's sha and with the stats aggregates
+already built, like the production database. The bot is then "started" twice in each of these ways, each on its own copy of the database:
+ - legacy: the way the database was started before - every migration script is run, Player_FCs is deleted and refilled whenever its row count is different
+   from the number of fc links, every sha mapping is fixed in its own transaction, and the database is vacuumed
+ - current: DataTracker.initialize - migrations only run when their version in Schema_Versions changes, only the fc links that changed are written,
+   only the shas that are still in the database are fixed, and the database isn't vacuumed (the bot's maintenance job vacuums it when it needs it)
+The first start is the first one after updating the bot, the second is a restart. Some fc links are added before each start, like between restarts of the bot.
+
+Run from the bot's folder: python -m data_tracking.StartupBenchmark [--placements 2000000] [--database-folder temp/] [--output results.json]
+'''
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import time
+from datetime import datetime
+from typing import Dict
+
+import common
+#UserDataProcessing is imported before Race, like the bot does, since Race -> Placement -> UserDataProcessing -> DataTracker imports Race again
+import UserDataProcessing
+import Race
+from data_tracking import DataTracker
+from data_tracking import QueryPlanBenchmark
+from data_tracking import Data_Tracker_SQL_Query_Builder as QB
+
+DEFAULT_DATABASE_FOLDER = "temp/"
+DEFAULT_PLACEMENTS = 2000000
+DEFAULT_SHA_MAPPINGS = 300
+#Of the sha mappings, this many still have races stored under the sha
+DEFAULT_UNFIXED_SHAS = 20
+DEFAULT_CHANGED_LINKS = 50
+SHA_RACES = 24
+STARTS = 2
+
+
+def get_sha(sha_num: int) -> str:
+    return f"{sha_num:040x}"
+
+def seed_shas(connection: sqlite3.Connection, sha_mapping_count: int, unfixed_sha_count: int, seed=0) -> Dict[str, str]:
+    '''Adds races whose track is stored under its sha. Returns the sha mappings (sha: track name), like Race.sha_track_name_mappings.'''
+    rng = random.Random(seed)
+    sha_mappings = {get_sha(sha_num): f"Sha Track {sha_num} (Author) v1.0" for sha_num in range(sha_mapping_count)}
+    race_id = connection.execute("SELECT max(race_id) FROM Race").fetchone()[0] + 1
+    placement_fcs = [fc for (fc,) in connection.execute("SELECT fc FROM Player LIMIT ?", (QueryPlanBenchmark.PLAYERS_PER_RACE,))]
+    race_time = datetime.now()
+    connection.execute("BEGIN")
+    for sha in list(sha_mappings)[:unfixed_sha_count]:
+        connection.execute("INSERT INTO Track VALUES (?, 'No Track Page', ?, 1, ?)", (sha, sha, sha))
+        for _ in range(SHA_RACES):
+            connection.execute("INSERT INTO Race VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                               (race_id, f"r{race_id:07}", QueryPlanBenchmark.get_timestamp(race_time), race_time.strftime("%Y-%m-%d %H:%M:%S"), 1, "AB12",
+                                sha, "Private Room", "150cc", "priv", 1, len(placement_fcs), 100.0, 130.0, 115.0))
+            connection.executemany("INSERT INTO Place VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                   [(race_id, fc, f"Player {fc}", place, 100 + place * 2.5 + rng.random(), 0.0, "ok", place, "priv",
+                                     0.0, "player", 5000, None, None, None, None, None, 1) for place, fc in enumerate(placement_fcs, 1)])
+            race_id += 1
+    connection.execute("COMMIT")
+    return sha_mappings
+
+def build_stats_aggregates(connection: sqlite3.Connection):
+    connection.executescript(common.read_sql_file(common.ROOM_DATA_TRACKING_STATS_AGGREGATES_SQL))
+    connection.execute(QB.create_stats_dirty_buckets_script())
+    connection.execute("BEGIN")
+    for statement in QB.build_rebuild_stats_aggregates_statements():
+        connection.execute(statement)
+    connection.execute(QB.set_stats_aggregates_info_script(), ["tier_signature", connection.execute(QB.get_tier_signature_query()).fetchone()[0]])
+    connection.execute("COMMIT")
+
+def add_fc_links(fc_map: Dict, count: int, rng: random.Random):
+    '''Links some new fcs, and relinks some existing ones, the way fc links change between restarts of the bot'''
+    for link_num in range(count):
+        if link_num % 2 == 0:
+            fc_map[QueryPlanBenchmark.get_fc(10**11 + len(fc_map))] = (rng.randrange(10**17, 10**18), None)
+        else:
+            fc_map[rng.choice(list(fc_map))] = (rng.randrange(10**17, 10**18), None)
+
+
+def legacy_start(database_file: str, fc_map: Dict, sha_mappings: Dict[str, str]):
+    '''DataTracker.initialize from before migrations were versioned and the startup VACUUM was removed'''
+    connection = sqlite3.connect(database_file, isolation_level=None)
+    connection.execute("PRAGMA foreign_keys = ON;")
+    connection.execute("PRAGMA journal_mode=WAL;")
+    connection.execute("PRAGMA synchronous=NORMAL;")
+    connection.executescript(common.read_sql_file(common.ROOM_DATA_TRACKING_QUERY_INDEXES_SQL))
+    connection.executescript(common.read_sql_file(common.ROOM_DATA_POPULATE_TIER_TABLE_SQL))
+    connection.execute("DELETE FROM Score_Matrix;")
+    connection.executemany("INSERT INTO Score_Matrix VALUES (?, ?, ?)",
+                           [(room_size+1, place+1, common.scoreMatrix[room_size][place]) for room_size in range(12) for place in range(12)])
+    existing_count = connection.execute("SELECT count(*) FROM Player_FCs;").fetchone()[0]
+    if len(fc_map) != 0 and len(fc_map) != existing_count:
+        connection.execute("DELETE FROM Player_FCs;")
+        connection.executemany("insert into Player_FCs values (?, ?)", [(fc, discord_id) for fc, (discord_id, _) in fc_map.items()])
+    connection.executescript(common.read_sql_file(common.ROOM_DATA_TRACKING_STATS_AGGREGATES_SQL))
+    connection.execute(QB.create_stats_dirty_buckets_script())
+    for sha, track_name in sha_mappings.items():
+        no_author_name = Race.remove_author_and_version_from_name(track_name)
+        connection.execute("BEGIN IMMEDIATE")
+        for statement, args in QB.build_fix_sha_statements(sha, track_name, no_author_name, Race.get_track_name_lookup(no_author_name)):
+            connection.execute(statement, args)
+        connection.execute("COMMIT")
+    connection.execute("BEGIN IMMEDIATE")
+    for statement in QB.build_refresh_stats_aggregates_statements():
+        connection.execute(statement)
+    connection.execute("COMMIT")
+    connection.execute("VACUUM;")
+    connection.close()
+
+async def current_start(database_file: str, fc_map: Dict, sha_mappings: Dict[str, str]):
+    common.ROOM_DATA_TRACKING_DATABASE_FILE = database_file
+    UserDataProcessing.fc_discordId = fc_map
+    Race.sha_track_name_mappings = sha_mappings
+    await DataTracker.initialize()
+    await DataTracker.on_exit()
+
+
+async def run_benchmark(args) -> Dict:
+    os.makedirs(args.database_folder, exist_ok=True)
+    base_database_file = os.path.join(args.database_folder, "startup_benchmark_base.db")
+    connection = QueryPlanBenchmark.create_database(base_database_file)
+    t0 = time.perf_counter()
+    seeded = QueryPlanBenchmark.seed_database(connection, args.placements, args.seed)
+    sha_mappings = seed_shas(connection, args.sha_mappings, args.unfixed_shas, args.seed)
+    build_stats_aggregates(connection)
+    connection.execute("PRAGMA journal_mode=WAL;")
+    base_fc_map = {fc: (discord_id, None) for fc, discord_id in connection.execute("SELECT fc, discord_id FROM Player_FCs")}
+    connection.close()
+    print(f"Seeded {seeded['placements']} placements ({os.path.getsize(base_database_file) / 2**20:.0f} MiB) in {time.perf_counter() - t0:.1f}s")
+
+    #DataTracker's write queue and write lock belong to the event loop they were first used in, so every start is run in this one
+    original_database_file = common.ROOM_DATA_TRACKING_DATABASE_FILE
+    results = {"placements": seeded["placements"], "time": str(datetime.now())}
+    try:
+        for mode in ("legacy", "current"):
+            database_file = os.path.join(args.database_folder, f"startup_benchmark_{mode}.db")
+            for suffix in ("-wal", "-shm"):
+                if os.path.exists(database_file + suffix):
+                    os.remove(database_file + suffix)
+            shutil.copyfile(base_database_file, database_file)
+            #Each mode gets the same fc link changes
+            rng = random.Random(args.seed)
+            fc_map = dict(base_fc_map)
+            timings = []
+            for _ in range(STARTS):
+                add_fc_links(fc_map, args.changed_links, rng)
+                t0 = time.perf_counter()
+                if mode == "legacy":
+                    legacy_start(database_file, fc_map, dict(sha_mappings))
+                else:
+                    await current_start(database_file, fc_map, dict(sha_mappings))
+                timings.append(time.perf_counter() - t0)
+            results[mode] = {"first_start_seconds": timings[0], "restart_seconds": timings[1]}
+    finally:
+        common.ROOM_DATA_TRACKING_DATABASE_FILE = original_database_file
+
+    print("\n===== Startup time =====")
+    for mode in ("legacy", "current"):
+        print(f"{mode}: first start {results[mode]['first_start_seconds']:.2f}s, restart {results[mode]['restart_seconds']:.2f}s")
+    print(f"Restart speedup: {results['legacy']['restart_seconds'] / max(results['current']['restart_seconds'], 1e-9):.1f}x")
+    return results
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Compare DataTracker's startup time to the old startup on a synthetic room tracking database.")
+    parser.add_argument("--database-folder", default=DEFAULT_DATABASE_FOLDER, help="where to create the synthetic databases (they are overwritten)")
+    parser.add_argument("--placements", type=int, default=DEFAULT_PLACEMENTS, help="number of placements to seed the database with")
+    parser.add_argument("--sha-mappings", type=int, default=DEFAULT_SHA_MAPPINGS, help="number of sha: track name mappings")
+    parser.add_argument("--unfixed-shas", type=int, default=DEFAULT_UNFIXED_SHAS, help="number of the sha mappings that still have races stored under the sha")
+    parser.add_argument("--changed-links", type=int, default=DEFAULT_CHANGED_LINKS, help="number of fc links added or changed before each start")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="JSON file to write the results to")
+    args = parser.parse_args(argv)
+
+    results = asyncio.run(run_benchmark(args))
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,182 @@
+'''
+Created on Oct 19, 2026
+
+@author: willg
+
+Consistency checker for the stats aggregates (Player_Track_Stats, see data_tracking/migrations/stats_aggregates.sql)
+and the head to head records (Head_To_Head, see data_tracking/migrations/head_to_head.sql).
+
+The aggregates are compared to a full recompute from Place/Race (in the live database and its monthly archives, see ArchivePartitions):
+every row that is missing, extra or different is reported. With --queries, the stats commands' queries that read the aggregates are also
+compared to the original queries that read Place/Race, for a sample of players and tracks. With --rebuild, the aggregates are rebuilt if they don't match.
+
+Run from the bot's folder: python -m data_tracking.StatsAggregatesCheck [--database tablebot_data/room_data_tracking.db] [--queries 20] [--rebuild]
+'''
+import argparse
+import math
+import random
+import sqlite3
+import sys
+from typing import Dict, List, Tuple
+
+import common
+from data_tracking import ArchivePartitions
+from data_tracking import Data_Tracker_SQL_Query_Builder as QB
+
+STATS_COLUMNS = "fc, fixed_track_name, is_ct, tier, day, race_count, pts_sum, place_sum, best_time"
+HEAD_TO_HEAD_COLUMNS = "fc, opponent_fc, is_ct, day, race_count, win_count"
+#Averages are computed in a different order from the original queries, so they can differ in the last few bits
+FLOAT_TOLERANCE = 1e-9
+MAX_REPORTED_ROWS = 20
+
+
+def insert_archived_rows(connection: sqlite3.Connection, table_name: str, query: str):
+    '''Inserts the query's rows from each of the database's archives into the table'''
+    database_file = ArchivePartitions.get_database_file(connection)
+    for month in ArchivePartitions.get_archived_months(database_file):
+        rows = ArchivePartitions.execute_on_archives(database_file, [month], query)
+        if len(rows) > 0:
+            connection.executemany(f"INSERT OR REPLACE INTO {table_name} VALUES ({', '.join('?' * len(rows[0]))})", rows)
+
+def check_stats_aggregates(connection: sqlite3.Connection) -> Dict[str, List[Tuple]]:
+    '''Compares Player_Track_Stats to a full recompute. Returns the rows that are missing from the aggregates and the rows that
+    shouldn't be in them (a row that is different is in both).'''
+    connection.execute("DROP TABLE IF EXISTS temp.Expected_Player_Track_Stats")
+    connection.execute(f"CREATE TEMP TABLE Expected_Player_Track_Stats({STATS_COLUMNS})")
+    connection.execute(f"INSERT INTO temp.Expected_Player_Track_Stats {QB.build_stats_aggregates_query(dirty_buckets_only=False)}")
+    insert_archived_rows(connection, "temp.Expected_Player_Track_Stats", QB.build_stats_aggregates_query(dirty_buckets_only=False))
+    missing = connection.execute(f"""SELECT {STATS_COLUMNS} FROM temp.Expected_Player_Track_Stats
+EXCEPT SELECT {STATS_COLUMNS} FROM Player_Track_Stats""").fetchall()
+    extra = connection.execute(f"""SELECT {STATS_COLUMNS} FROM Player_Track_Stats
+EXCEPT SELECT {STATS_COLUMNS} FROM temp.Expected_Player_Track_Stats""").fetchall()
+    connection.execute("DROP TABLE temp.Expected_Player_Track_Stats")
+    return {"missing": missing, "extra": extra}
+
+def check_head_to_head(connection: sqlite3.Connection) -> Dict[str, List[Tuple]]:
+    '''Compares Head_To_Head to a full recompute, the same way check_stats_aggregates does'''
+    connection.execute("DROP TABLE IF EXISTS temp.Expected_Head_To_Head")
+    connection.execute(f"CREATE TEMP TABLE Expected_Head_To_Head({HEAD_TO_HEAD_COLUMNS})")
+    connection.execute(f"INSERT INTO temp.Expected_Head_To_Head {QB.build_head_to_head_query()}")
+    insert_archived_rows(connection, "temp.Expected_Head_To_Head", QB.build_head_to_head_query())
+    missing = connection.execute(f"""SELECT {HEAD_TO_HEAD_COLUMNS} FROM temp.Expected_Head_To_Head
+EXCEPT SELECT {HEAD_TO_HEAD_COLUMNS} FROM Head_To_Head""").fetchall()
+    extra = connection.execute(f"""SELECT {HEAD_TO_HEAD_COLUMNS} FROM Head_To_Head
+EXCEPT SELECT {HEAD_TO_HEAD_COLUMNS} FROM temp.Expected_Head_To_Head""").fetchall()
+    connection.execute("DROP TABLE temp.Expected_Head_To_Head")
+    return {"missing": missing, "extra": extra}
+
+def rows_match(rows: List[Tuple], expected_rows: List[Tuple]) -> bool:
+    if len(rows) != len(expected_rows):
+        return False
+    for row, expected_row in zip(rows, expected_rows):
+        for value, expected_value in zip(row, expected_row):
+            if isinstance(expected_value, float) and isinstance(value, (int, float)):
+                if not math.isclose(value, expected_value, rel_tol=FLOAT_TOLERANCE):
+                    return False
+            elif value != expected_value:
+                return False
+    return True
+
+def sort_rows(rows: List[Tuple]) -> List[Tuple]:
+    #The original queries only order by average points, so rows with the same average can come back in any order
+    return sorted(rows, key=lambda row: (-round(row[1], 9), str(row[0])))
+
+def compare_stats_queries(connection: sqlite3.Connection, sample_size: int, seed=0) -> List[str]:
+    '''Runs ?besttracks, ?topplayers and ?record queries for a sample of players and tracks with both the original and the aggregated queries.
+    Returns a description of each query whose results were different.'''
+    SQB = QB.SQL_Search_Query_Builder
+    rng = random.Random(seed)
+    discord_ids = [discord_id for (discord_id,) in connection.execute("SELECT DISTINCT discord_id FROM Player_FCs")]
+    tracks = [track for (track,) in connection.execute("SELECT DISTINCT fixed_track_name FROM Track")]
+    tiers = [None] + [tier for (tier,) in connection.execute("SELECT DISTINCT tier FROM Tier")]
+    #The original queries only read the live database, so when there are archives, only the days that are still in the live database are compared
+    day_ranges = [None, 7, 30, 365]
+    if len(ArchivePartitions.get_archived_months(ArchivePartitions.get_database_file(connection))) > 0:
+        day_ranges = [7, 30]
+    mismatches = []
+    for _ in range(sample_size):
+        tier = rng.choice(tiers)
+        days = rng.choice(day_ranges)
+        min_count = rng.choice([1, 5])
+        if len(discord_ids) > 0:
+            discord_id = rng.choice(discord_ids)
+            fcs = [fc for (fc,) in connection.execute("SELECT fc FROM Player_FCs WHERE discord_id = ?", (discord_id,))]
+            for is_ct in (False, True):
+                expected = connection.execute(*SQB.get_best_tracks(fcs, is_ct, tier, days, min_count)).fetchall()
+                result = connection.execute(*SQB.get_best_tracks_aggregated(fcs, is_ct, tier, days, min_count)).fetchall()
+                if not rows_match(sort_rows(result), sort_rows(expected)):
+                    mismatches.append(f"get_best_tracks(discord_id={discord_id}, is_ct={is_ct}, tier={tier}, days={days}, min_count={min_count})")
+            opponent_discord_id = rng.choice(discord_ids)
+            for is_ct in (False, True):
+                expected = connection.execute(*SQB.get_record_query(discord_id, opponent_discord_id, days, is_ct)).fetchall()
+                result = connection.execute(*SQB.get_record_aggregated_query(discord_id, opponent_discord_id, days, is_ct)).fetchall()
+                if result != expected:
+                    mismatches.append(f"get_record(discord_id={discord_id}, opponent_discord_id={opponent_discord_id}, days={days}, is_ct={is_ct})")
+        if len(tracks) > 0:
+            track = rng.choice(tracks)
+            expected = connection.execute(*SQB.get_top_players_query(track, tier, days, min_count)).fetchall()
+            result = connection.execute(*SQB.get_top_players_aggregated_query(track, tier, days, min_count)).fetchall()
+            #Only compare whole results when the LIMIT didn't cut off players with the same average as ones that were included
+            if len(expected) < 100 and not rows_match(sort_rows(result), sort_rows(expected)):
+                mismatches.append(f"get_top_players(track={track}, tier={tier}, days={days}, min_count={min_count})")
+    return mismatches
+
+def rebuild_stats_aggregates(connection: sqlite3.Connection):
+    connection.execute("BEGIN IMMEDIATE")
+    for statement in QB.build_rebuild_stats_aggregates_statements():
+        connection.execute(statement)
+    insert_archived_rows(connection, "Player_Track_Stats", QB.build_stats_aggregates_query(dirty_buckets_only=False))
+    tier_signature = connection.execute(QB.get_tier_signature_query()).fetchone()[0]
+    connection.execute(QB.set_stats_aggregates_info_script(), ["tier_signature", tier_signature])
+    connection.execute("COMMIT")
+
+def rebuild_head_to_head(connection: sqlite3.Connection):
+    connection.execute("BEGIN IMMEDIATE")
+    for statement in QB.build_rebuild_head_to_head_statements():
+        connection.execute(statement)
+    insert_archived_rows(connection, "Head_To_Head", QB.build_head_to_head_query())
+    connection.execute("COMMIT")
+
+def report_differences(table_name: str, differences: Dict[str, List[Tuple]]) -> bool:
+    '''Prints the differences from a full recompute. Returns whether there weren't any.'''
+    if len(differences["missing"]) == 0 and len(differences["extra"]) == 0:
+        print(f"{table_name} matches a full recompute.")
+        return True
+    print(f"{table_name} does not match a full recompute: {len(differences['missing'])} rows missing or different, {len(differences['extra'])} rows extra or different")
+    for label, rows in differences.items():
+        for row in rows[:MAX_REPORTED_ROWS]:
+            print(f"\t{label}: {row}")
+    return False
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Check the stats aggregates and head to head records against a full recompute from the room tracking database.")
+    parser.add_argument("--database", default=common.ROOM_DATA_TRACKING_DATABASE_FILE)
+    parser.add_argument("--queries", type=int, default=0, help="also compare this many samples of the stats queries to the original queries")
+    parser.add_argument("--rebuild", action="store_true", help="rebuild the aggregates if they don't match")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    connection = sqlite3.connect(args.database, isolation_level=None)
+    connection.executescript(common.read_sql_file(common.ROOM_DATA_TRACKING_STATS_AGGREGATES_SQL))
+    connection.executescript(common.read_sql_file(common.ROOM_DATA_TRACKING_HEAD_TO_HEAD_SQL))
+    connection.execute(QB.create_stats_dirty_buckets_script())
+    is_consistent = True
+    for table_name, check, rebuild in (("Player_Track_Stats", check_stats_aggregates, rebuild_stats_aggregates),
+                                       ("Head_To_Head", check_head_to_head, rebuild_head_to_head)):
+        if not report_differences(table_name, check(connection)):
+            is_consistent = False
+            if args.rebuild:
+                rebuild(connection)
+                print(f"Rebuilt {table_name}.")
+
+    mismatches = []
+    if args.queries > 0:
+        mismatches = compare_stats_queries(connection, args.queries, args.seed)
+        print(f"{len(mismatches)} of the sampled stats queries gave different results with the aggregates.")
+        for mismatch in mismatches:
+            print(f"\t{mismatch}")
+    connection.close()
+    return 0 if is_consistent and len(mismatches) == 0 else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,119 @@
+'''
+Created on Oct 19, 2026
+
+@author: willg
+
+In memory cache of the results of the DataRetriever stats queries (?toptracks/?besttracks, ?topplayers, ?record and ?popular).
+
+The same queries are run over and over with the same arguments from different servers, and their results barely change within a few minutes,
+so each result is kept for CACHE_SECONDS (the "stats_result_cache_seconds" property, 2 minutes if it isn't set). Results are keyed by the query's name
+and its normalized arguments (see DataRetriever).
+
+Each result also records what it depends on: the tier it's for (None for every tier), the track (None for every track) and the players' fcs (None for every player).
+When DataTracker writes a room, it calls invalidate with the tiers of the room's channel, the tracks of the races it wrote and the room's fcs, and every result
+that could include those races is removed before its time is up.
+
+If a query is already running when the same query is requested, the second request waits for the first one's result instead of running it again.
+If the first request is cancelled before its query finishes, the waiting requests run the query again themselves (only the first of them actually runs it).
+'''
+import asyncio
+import time
+from collections import OrderedDict, defaultdict
+from typing import Any, Awaitable, Callable, Hashable, Iterable, Optional
+
+import common
+
+CACHE_SECONDS = common.properties.get("stats_result_cache_seconds", 120)
+#Least recently used results are removed past this many
+MAX_CACHED_RESULTS = 2000
+
+#(query name, normalized arguments): (expires at, result, tier, track, fcs)
+cached_results = OrderedDict()
+#(query name, normalized arguments): future for the query that's currently running
+running_queries = {}
+#Incremented by every invalidation, so a query that was running while its data changed doesn't store its (possibly old) result
+invalidation_count = 0
+stats = defaultdict(lambda: {"hits": 0, "misses": 0, "waited": 0, "expired": 0, "invalidated": 0})
+
+
+class RunningQueryCancelled(Exception):
+    '''Set on a running query's future when the request running it is cancelled, so the requests waiting on it can run it themselves'''
+    pass
+
+
+def is_affected(tier, track, fcs, written_tiers, written_tracks, written_fcs) -> bool:
+    if tier is not None and tier not in written_tiers:
+        return False
+    if track is not None and track not in written_tracks:
+        return False
+    if fcs is not None and fcs.isdisjoint(written_fcs):
+        return False
+    return True
+
+async def get_cached(query_name: str, args: Hashable, run_query: Callable[[], Awaitable[Any]], tier=None, track=None, fcs: Optional[Iterable[str]]=None):
+    '''Returns the cached result of the query with the given name and (normalized) arguments, or runs run_query and caches its result.
+    tier, track and fcs are what the result depends on (None for all of them), see invalidate. fcs is only read once run_query has finished, so run_query can fill it in.'''
+    key = (query_name, args)
+    query_stats = stats[query_name]
+    cached_result = cached_results.get(key)
+    if cached_result is not None:
+        if cached_result[0] > time.monotonic():
+            query_stats["hits"] += 1
+            cached_results.move_to_end(key)
+            return cached_result[1]
+        query_stats["expired"] += 1
+        del cached_results[key]
+
+    if key in running_queries:
+        query_stats["waited"] += 1
+        try:
+            return await asyncio.shield(running_queries[key])
+        except RunningQueryCancelled:
+            return await get_cached(query_name, args, run_query, tier=tier, track=track, fcs=fcs)
+
+    query_stats["misses"] += 1
+    invalidation_count_at_start = invalidation_count
+    running_query = asyncio.get_running_loop().create_future()
+    running_queries[key] = running_query
+    try:
+        result = await run_query()
+    except (Exception, asyncio.CancelledError) as e:
+        #Cancelling the future would cancel every request that's waiting on it too, so they're told to run the query again instead
+        running_query.set_exception(RunningQueryCancelled() if isinstance(e, asyncio.CancelledError) else e)
+        #The exception is raised to every request that's waiting - this retrieves it so it isn't logged as never retrieved when nobody was waiting
+        running_query.exception()
+        raise
+    finally:
+        del running_queries[key]
+    running_query.set_result(result)
+
+    if invalidation_count_at_start == invalidation_count:
+        cached_results[key] = (time.monotonic() + CACHE_SECONDS, result, tier, track, None if fcs is None else frozenset(fcs))
+        while len(cached_results) > MAX_CACHED_RESULTS:
+            cached_results.popitem(last=False)
+    return result
+
+def invalidate(written_tiers: Iterable, written_tracks: Iterable[str], written_fcs: Iterable[str]):
+    '''Removes the results that could include races in the given tiers, on the given tracks, played by the given fcs'''
+    global invalidation_count
+    invalidation_count += 1
+    written_tiers, written_tracks, written_fcs = set(written_tiers), set(written_tracks), set(written_fcs)
+    for key, (_, _, tier, track, fcs) in list(cached_results.items()):
+        if is_affected(tier, track, fcs, written_tiers, written_tracks, written_fcs):
+            stats[key[0]]["invalidated"] += 1
+            del cached_results[key]
+
+def clear():
+    global invalidation_count
+    invalidation_count += 1
+    cached_results.clear()
+
+
+def get_stats_str() -> str:
+    lines = [f"**Stats result cache:** {len(cached_results)}/{MAX_CACHED_RESULTS} results cached for {CACHE_SECONDS}s, {len(running_queries)} queries running"]
+    for query_name, query_stats in sorted(stats.items()):
+        #Requests that waited for a running query didn't run it, so they count as hits
+        lookups = query_stats["hits"] + query_stats["waited"] + query_stats["misses"]
+        hit_rate = "n/a" if lookups == 0 else f"{(query_stats['hits'] + query_stats['waited']) / lookups:.1%}"
+        lines.append(f"{query_name}: Hit rate: {hit_rate} | Hits: {query_stats['hits']} | Waited: {query_stats['waited']} | Misses: {query_stats['misses']} | Expired: {query_stats['expired']} | Invalidated: {query_stats['invalidated']}")
+    return "\n".join(lines)
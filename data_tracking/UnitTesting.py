@@ -3,11 +3,27 @@ Created on Oct 29, 2021
 
 @author: willg
 '''
+import asyncio
+import os
+import random
+import sqlite3
+import tempfile
+import time
+import tracemalloc
 import unittest
+from datetime import date
+from typing import Tuple
+from unittest import mock
+import UserDataProcessing
 import Race
+from data_tracking import ArchivePartitions
 from data_tracking import DataTracker
+from data_tracking import QueryPlanBenchmark
+from data_tracking import StatsAggregatesCheck
+from data_tracking import StatsResultCache
 from data_tracking.Data_Tracker_SQL_Query_Builder import *
 import UtilityFunctions
+import common
 
 
 class SQLInsertStatementTests(unittest.TestCase):
@@ -183,7 +199,592 @@ class SQLDataValidation_tracks(unittest.TestCase):
         test_races = [Race.Race(None, None, 1, None, None, None, "Final Grounds", is_ct=True, trackURL="https://wiimmfi.de/test")]
         data_validator.validate_tracks_data(test_races)
     
+
+class FakeQueuedRoom:
+    def __init__(self, event_id, version=0):
+        self.event_id = event_id
+        self.version = version
+    def get_event_id(self):
+        return self.event_id
+
+class FakeQueuedChannelBot:
+    def __init__(self, event_id, version=0):
+        self.room = FakeQueuedRoom(event_id, version)
+    def getRoom(self):
+        return self.room
+
+class WriteQueueTests(unittest.IsolatedAsyncioTestCase):
+    '''queue_update, the writer task and flush_write_queue, with add_everything_to_database replaced by a fake'''
+    async def asyncSetUp(self):
+        DataTracker.write_queue = None
+        DataTracker.writer_task = None
+        DataTracker.queued_updates.clear()
+        for stat in DataTracker.write_queue_stats:
+            DataTracker.write_queue_stats[stat] = 0
+        self.written = []
+        self.fail_event_ids = set()
+        async def fake_add_everything_to_database(channel_bot):
+            await asyncio.sleep(0)
+            if channel_bot.getRoom().get_event_id() in self.fail_event_ids:
+                raise ValueError("Fake database failure")
+            self.written.append((channel_bot.getRoom().get_event_id(), channel_bot.getRoom().version))
+        patcher = mock.patch.object(DataTracker.RoomTracker, "add_everything_to_database", fake_add_everything_to_database)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_updates_are_written_in_order(self):
+        for event_id in range(5):
+            DataTracker.queue_update(FakeQueuedChannelBot(event_id))
+        DataTracker.start_writer()
+        self.assertTrue(await DataTracker.flush_write_queue())
+        self.assertEqual(self.written, [(event_id, 0) for event_id in range(5)])
+        self.assertEqual(DataTracker.write_queue_stats["written"], 5)
+        self.assertEqual(DataTracker.write_queue_depth(), 0)
+
+    async def test_repeated_updates_are_coalesced(self):
+        for version in range(4):
+            DataTracker.queue_update(FakeQueuedChannelBot(1, version))
+        DataTracker.queue_update(FakeQueuedChannelBot(2))
+        DataTracker.start_writer()
+        await DataTracker.flush_write_queue()
+        self.assertEqual(self.written, [(1, 3), (2, 0)])
+        self.assertEqual(DataTracker.write_queue_stats["coalesced"], 3)
+
+    async def test_updates_are_dropped_when_queue_is_full(self):
+        with mock.patch.object(DataTracker, "MAX_QUEUED_UPDATES", 2):
+            for event_id in range(3):
+                DataTracker.queue_update(FakeQueuedChannelBot(event_id))
+        self.assertEqual(DataTracker.write_queue_stats["dropped"], 1)
+        DataTracker.start_writer()
+        await DataTracker.flush_write_queue()
+        self.assertEqual(self.written, [(0, 0), (1, 0)])
+
+    async def test_failed_update_does_not_stop_writer(self):
+        self.fail_event_ids.add(1)
+        DataTracker.start_writer()
+        for event_id in range(3):
+            DataTracker.queue_update(FakeQueuedChannelBot(event_id))
+        with mock.patch.object(DataTracker.common, "log_traceback"):
+            await DataTracker.flush_write_queue()
+        self.assertEqual(self.written, [(0, 0), (2, 0)])
+        self.assertEqual(DataTracker.write_queue_stats["failed"], 1)
+        self.assertIsNone(DataTracker.writer_task)
+    
+
+class FakeTrackedRace:
+    def __init__(self, race_id):
+        self.race_id = race_id
+    def get_race_id(self):
+        return self.race_id
+
+class HighWaterMarkTests(unittest.TestCase):
+    '''get_races_to_write and set_high_water_mark'''
+    def setUp(self):
+        DataTracker.event_high_water_marks.clear()
+        self.races = [FakeTrackedRace(f"r{i:07}") for i in range(8)]
+
+    def test_first_write_is_full(self):
+        races, mii_races = DataTracker.get_races_to_write(1, self.races[:5], 100, 0)
+        self.assertEqual(races, self.races[:5])
+        self.assertEqual(mii_races, self.races[:5])
+
+    def test_only_new_races_are_written(self):
+        DataTracker.set_high_water_mark(1, self.races[:5], 100, 0)
+        races, mii_races = DataTracker.get_races_to_write(1, self.races, 100, 0)
+        #The last written race is written again
+        self.assertEqual(races, self.races[4:])
+        self.assertEqual(mii_races, self.races[4:])
+
+    def test_new_miis_update_all_races(self):
+        DataTracker.set_high_water_mark(1, self.races[:5], 100, 0)
+        races, mii_races = DataTracker.get_races_to_write(1, self.races, 100, 12)
+        self.assertEqual(races, self.races[4:])
+        self.assertEqual(mii_races, self.races)
+
+    def test_structure_change_is_full_write(self):
+        DataTracker.set_high_water_mark(1, self.races[:5], 100, 0)
+        races, _ = DataTracker.get_races_to_write(1, self.races, 101, 0)
+        self.assertEqual(races, self.races)
+
+    def test_removed_race_is_full_write(self):
+        DataTracker.set_high_water_mark(1, self.races[:5], 100, 0)
+        races, _ = DataTracker.get_races_to_write(1, self.races[:2] + self.races[3:], 100, 0)
+        self.assertEqual(len(races), 7)
+        races, _ = DataTracker.get_races_to_write(1, self.races[:4], 100, 0)
+        self.assertEqual(races, self.races[:4])
+
+    def test_marks_are_evicted(self):
+        with mock.patch.object(DataTracker, "MAX_EVENT_HIGH_WATER_MARKS", 2):
+            for event_id in range(3):
+                DataTracker.set_high_water_mark(event_id, self.races, 100, 0)
+        self.assertEqual(list(DataTracker.event_high_water_marks), [1, 2])
+    
+
+class StatsAggregatesTests(unittest.TestCase):
+    '''Player_Track_Stats and Head_To_Head, built and refreshed on a small synthetic database, compared to a full recompute and to the original stats queries'''
+    @classmethod
+    def setUpClass(cls):
+        cls.temp_folder = tempfile.TemporaryDirectory()
+        cls.connection = QueryPlanBenchmark.create_database(os.path.join(cls.temp_folder.name, "stats_aggregates.db"))
+        QueryPlanBenchmark.seed_database(cls.connection, 30000)
+        cls.connection.executescript(common.read_sql_file(common.ROOM_DATA_TRACKING_STATS_AGGREGATES_SQL))
+        cls.connection.execute(create_stats_dirty_buckets_script())
+        StatsAggregatesCheck.rebuild_stats_aggregates(cls.connection)
+        cls.connection.executescript(common.read_sql_file(common.ROOM_DATA_TRACKING_QUERY_INDEXES_SQL))
+        cls.connection.executescript(common.read_sql_file(common.ROOM_DATA_TRACKING_HEAD_TO_HEAD_SQL))
+        StatsAggregatesCheck.rebuild_head_to_head(cls.connection)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.connection.close()
+        cls.temp_folder.cleanup()
+
+    def add_race(self) -> int:
+        '''Copies the last race of an event as a new race in the event (with times a second faster). Returns the new race's id.'''
+        event_id, race_id = self.connection.execute("SELECT event_id, MAX(race_id) FROM Event_Races").fetchone()
+        new_race_id = race_id + 1000000
+        self.connection.execute("""INSERT INTO Race SELECT ?, rxx, strftime('%Y-%m-%d %H:%M:%f', 'now'), match_time, race_number + 1, room_name, track_name,
+room_type, cc, region, is_wiimmfi_race, num_players, first_place_time, last_place_time, avg_time FROM Race WHERE race_id = ?""", (new_race_id, race_id))
+        self.connection.execute("""INSERT INTO Place SELECT ?, fc, name, place, time - 1, lag_start, ol_status, room_position, region, connection_fails, role, vr,
+character, vehicle, discord_name, lounge_name, mii_hex, is_wiimmfi_place FROM Place WHERE race_id = ?""", (new_race_id, race_id))
+        self.connection.execute("INSERT INTO Event_Races VALUES (?, ?)", (event_id, new_race_id))
+        return new_race_id
+
+    def refresh(self):
+        for statement in build_refresh_stats_aggregates_statements():
+            self.connection.execute(statement)
+
+    def assert_consistent(self):
+        differences = StatsAggregatesCheck.check_stats_aggregates(self.connection)
+        self.assertEqual(differences, {"missing": [], "extra": []})
+
+    def test_rebuild_matches_recompute(self):
+        self.assert_consistent()
+
+    def test_aggregated_queries_match_original_queries(self):
+        self.assertEqual(StatsAggregatesCheck.compare_stats_queries(self.connection, 25), [])
+
+    def test_refresh_after_event_becomes_ineligible(self):
+        event_id, race_id = self.connection.execute("SELECT event_id, MIN(race_id) FROM Event_Races").fetchone()
+        self.connection.execute("UPDATE Event SET number_of_updates = 1 WHERE event_id = ?", (event_id,))
+        self.connection.execute(mark_event_races_dirty_script(), (event_id,))
+        self.refresh()
+        self.assert_consistent()
+        self.connection.execute("UPDATE Event SET number_of_updates = 12 WHERE event_id = ?", (event_id,))
+        self.connection.execute(mark_event_races_dirty_script(), (event_id,))
+        self.refresh()
+        self.assert_consistent()
+
+    def test_refresh_after_new_race(self):
+        new_race_id = self.add_race()
+        self.connection.execute(mark_races_dirty_script(), [build_json_list_arg([new_race_id])])
+        self.refresh()
+        self.assert_consistent()
+
+    def assert_head_to_head_consistent(self):
+        differences = StatsAggregatesCheck.check_head_to_head(self.connection)
+        self.assertEqual(differences, {"missing": [], "extra": []})
+
+    def test_head_to_head_rebuild_matches_recompute(self):
+        self.assert_head_to_head_consistent()
+
+    def test_head_to_head_trigger_adds_new_placements_once(self):
+        new_race_id = self.add_race()
+        self.assert_head_to_head_consistent()
+        #Written again with the race's next update - nothing is inserted, so nothing is counted again
+        self.connection.execute("""INSERT OR IGNORE INTO Place SELECT * FROM Place WHERE race_id = ?""", (new_race_id,))
+        self.assert_head_to_head_consistent()
+        #The other tests check Player_Track_Stats against a full recompute, so it's brought up to date with the new race too
+        self.connection.execute(mark_races_dirty_script(), [build_json_list_arg([new_race_id])])
+        self.refresh()
     
+class StatsResultCacheTests(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        StatsResultCache.clear()
+        StatsResultCache.stats.clear()
+        self.runs = 0
+
+    async def run_query(self):
+        self.runs += 1
+        await asyncio.sleep(0)
+        return [("result", self.runs)]
+
+    async def get_top_players(self, track="Luigi Circuit", tier=5):
+        return await StatsResultCache.get_cached("top_players", (track, tier), self.run_query, tier=tier, track=track)
+
+    async def test_result_is_cached(self):
+        self.assertEqual(await self.get_top_players(), await self.get_top_players())
+        self.assertEqual(self.runs, 1)
+        self.assertEqual(StatsResultCache.stats["top_players"]["hits"], 1)
+
+    async def test_result_expires(self):
+        await self.get_top_players()
+        with mock.patch.object(StatsResultCache.time, "monotonic", return_value=StatsResultCache.time.monotonic() + StatsResultCache.CACHE_SECONDS + 1):
+            await self.get_top_players()
+        self.assertEqual(self.runs, 2)
+        self.assertEqual(StatsResultCache.stats["top_players"]["expired"], 1)
+
+    async def test_same_running_query_is_only_run_once(self):
+        results = await asyncio.gather(*(self.get_top_players() for _ in range(5)))
+        self.assertEqual(self.runs, 1)
+        self.assertEqual(results, [[("result", 1)]] * 5)
+        self.assertEqual(StatsResultCache.stats["top_players"]["waited"], 4)
+
+    async def test_only_affected_results_are_invalidated(self):
+        await self.get_top_players("Luigi Circuit", 5)
+        await self.get_top_players("Moo Moo Meadows", 5)
+        await self.get_top_players("Luigi Circuit", 4)
+        await self.get_top_players("Luigi Circuit", None)
+        StatsResultCache.invalidate([5], ["Luigi Circuit"], ["0000-0000-0001"])
+        self.assertEqual(set(StatsResultCache.cached_results), {("top_players", ("Moo Moo Meadows", 5)), ("top_players", ("Luigi Circuit", 4))})
+
+    async def test_fcs_invalidation(self):
+        await StatsResultCache.get_cached("best_tracks", ("0000-0000-0001",), self.run_query, tier=None, fcs=["0000-0000-0001"])
+        StatsResultCache.invalidate([5], ["Luigi Circuit"], ["0000-0000-0002"])
+        self.assertEqual(len(StatsResultCache.cached_results), 1)
+        StatsResultCache.invalidate([], ["Luigi Circuit"], ["0000-0000-0001"])
+        self.assertEqual(len(StatsResultCache.cached_results), 0)
+
+    async def test_result_is_not_stored_when_invalidated_while_running(self):
+        async def run_query_during_write():
+            StatsResultCache.invalidate([5], ["Luigi Circuit"], [])
+            return await self.run_query()
+        await StatsResultCache.get_cached("top_players", ("Luigi Circuit", 5), run_query_during_write, tier=5, track="Luigi Circuit")
+        self.assertEqual(len(StatsResultCache.cached_results), 0)
+
+    async def test_waiting_requests_rerun_query_when_running_request_is_cancelled(self):
+        query_started = asyncio.Event()
+        async def slow_query():
+            query_started.set()
+            await asyncio.sleep(10)
+        running_request = asyncio.create_task(StatsResultCache.get_cached("top_players", ("Luigi Circuit", 5), slow_query))
+        await query_started.wait()
+        waiting_requests = [asyncio.create_task(self.get_top_players()) for _ in range(3)]
+        await asyncio.sleep(0)
+        running_request.cancel()
+        results = await asyncio.gather(*waiting_requests)
+        self.assertEqual(results, [[("result", 1)]] * 3)
+        self.assertEqual(self.runs, 1)
+        self.assertTrue(running_request.cancelled())
+
+    async def test_failed_query_is_not_cached(self):
+        async def failing_query():
+            raise ValueError("database is locked")
+        with self.assertRaises(ValueError):
+            await StatsResultCache.get_cached("record", (1, 2), failing_query)
+        self.assertEqual(len(StatsResultCache.cached_results), 0)
+        self.assertEqual(len(StatsResultCache.running_queries), 0)
+
+class ReadConnectionPoolTests(unittest.IsolatedAsyncioTestCase):
+    '''A long stats query on a read-only connection, run at the same time as a room write on the writer connection'''
+    #Counting this high takes SQLite a few hundred milliseconds
+    LONG_READ_QUERY = "WITH RECURSIVE counter(x) AS (SELECT 1 UNION ALL SELECT x+1 FROM counter LIMIT 1000000) SELECT COUNT(*) FROM counter, (SELECT COUNT(*) FROM Race)"
+
+    async def asyncSetUp(self):
+        self.temp_folder = tempfile.TemporaryDirectory()
+        database_file = os.path.join(self.temp_folder.name, "read_pool.db")
+        QueryPlanBenchmark.create_database(database_file).close()
+        self.database_file_patch = mock.patch.object(common, "ROOM_DATA_TRACKING_DATABASE_FILE", database_file)
+        self.database_file_patch.start()
+        await DataTracker.start_database()
+        await DataTracker.start_read_connection_pool(2)
+
+    async def asyncTearDown(self):
+        await DataTracker.close_read_connection_pool()
+        await DataTracker.db_connection.close()
+        DataTracker.db_connection = None
+        self.database_file_patch.stop()
+        self.temp_folder.cleanup()
+
+    async def write_room(self, event_id) -> float:
+        '''Returns how long the write took'''
+        write_start = time.perf_counter()
+        async with DataTracker.write_transaction():
+            await DataTracker.db_connection.execute("INSERT INTO Event_ID VALUES (?)", [event_id])
+        return time.perf_counter() - write_start
+
+    async def get_write_time_during_long_read(self, event_id=1) -> Tuple[float, float]:
+        '''Returns how long a write took while a long read was running, and how long the read took'''
+        read_start = time.perf_counter()
+        read_task = asyncio.create_task(DataTracker.execute_read(self.LONG_READ_QUERY))
+        await asyncio.sleep(0.05)
+        write_time = await self.write_room(event_id)
+        await read_task
+        return write_time, time.perf_counter() - read_start
+
+    async def test_database_is_in_wal_mode(self):
+        self.assertEqual(await DataTracker.db_connection.execute("PRAGMA journal_mode;"), [("wal",)])
+
+    async def test_read_connections_are_read_only(self):
+        async with DataTracker.read_connection() as connection:
+            with self.assertRaises(sqlite3.OperationalError):
+                await connection.execute("INSERT INTO Event_ID VALUES (1)")
+
+    async def test_reads_see_committed_writes(self):
+        await self.write_room(1)
+        self.assertEqual(await DataTracker.execute_read("SELECT event_id FROM Event_ID"), [(1,)])
+
+    async def test_long_read_does_not_delay_write(self):
+        write_time, read_time = await self.get_write_time_during_long_read()
+        self.assertLess(write_time, read_time / 4)
+
+    async def test_long_read_delays_write_on_shared_connection(self):
+        #Without the pool, reads run on the writer connection, so the write waits for the read to finish
+        await DataTracker.close_read_connection_pool()
+        write_time, read_time = await self.get_write_time_during_long_read()
+        self.assertGreater(write_time, read_time / 2)
+
+
+class StartupTests(unittest.IsolatedAsyncioTestCase):
+    '''The startup steps only write what changed since the last start'''
+    async def asyncSetUp(self):
+        self.temp_folder = tempfile.TemporaryDirectory()
+        database_file = os.path.join(self.temp_folder.name, "startup.db")
+        QueryPlanBenchmark.create_database(database_file).close()
+        self.database_file_patch = mock.patch.object(common, "ROOM_DATA_TRACKING_DATABASE_FILE", database_file)
+        self.database_file_patch.start()
+        await DataTracker.start_database()
+        await DataTracker.create_schema_versions()
+
+    async def asyncTearDown(self):
+        await DataTracker.db_connection.close()
+        DataTracker.db_connection = None
+        self.database_file_patch.stop()
+        self.temp_folder.cleanup()
+
+    async def get_player_fcs(self):
+        return {fc: int(discord_id) for fc, discord_id in await DataTracker.db_connection.execute("SELECT fc, discord_id FROM Player_FCs")}
+
+    async def test_migration_only_runs_when_its_version_changes(self):
+        self.assertTrue(await DataTracker.run_migration("query_indexes"))
+        self.assertFalse(await DataTracker.run_migration("query_indexes"))
+        migration_file, version = DataTracker.MIGRATION_VERSIONS["query_indexes"]
+        with mock.patch.dict(DataTracker.MIGRATION_VERSIONS, {"query_indexes": (migration_file, version + 1)}):
+            self.assertTrue(await DataTracker.run_migration("query_indexes"))
+        self.assertEqual(await DataTracker.get_schema_version("query_indexes"), str(version + 1))
+
+    async def test_player_fcs_are_synced_with_fc_links(self):
+        fc_map = {"0000-0000-0001": (1, None), "0000-0000-0002": (2, None), "0000-0000-0003": (3, None)}
+        with mock.patch.object(UserDataProcessing, "fc_discordId", fc_map):
+            await DataTracker.populate_player_fcs_table()
+            self.assertEqual(await self.get_player_fcs(), {"0000-0000-0001": 1, "0000-0000-0002": 2, "0000-0000-0003": 3})
+
+            #Same number of links as before, but one was removed and one was relinked
+            del fc_map["0000-0000-0001"]
+            fc_map["0000-0000-0002"] = (4, None)
+            fc_map["0000-0000-0005"] = (5, None)
+            await DataTracker.populate_player_fcs_table()
+            self.assertEqual(await self.get_player_fcs(), {"0000-0000-0002": 4, "0000-0000-0003": 3, "0000-0000-0005": 5})
+
+    async def test_unchanged_fc_links_are_not_read(self):
+        fc_map = {"0000-0000-0001": (1, None)}
+        with mock.patch.object(UserDataProcessing, "fc_discordId", fc_map):
+            await DataTracker.populate_player_fcs_table()
+            #Changed behind the sync's back, so it's only changed back if the table is read
+            await DataTracker.db_connection.execute("UPDATE Player_FCs SET discord_id = 2")
+            await DataTracker.populate_player_fcs_table()
+            self.assertEqual(await self.get_player_fcs(), {"0000-0000-0001": 2})
+
+    async def test_only_unfixed_shas_are_fixed(self):
+        await DataTracker.create_stats_aggregates()
+        await DataTracker.db_connection.execute("INSERT INTO Track VALUES ('abc123', 'No Track Page', 'abc123', 1, 'abc123')")
+        sha_mappings = {"abc123": "Fixed Track (Author) v1.0", "def456": "Already Fixed Track (Author) v1.0"}
+        await DataTracker.fix_shas(sha_mappings)
+        track_names = {track_name for (track_name,) in await DataTracker.db_connection.execute("SELECT track_name FROM Track")}
+        self.assertIn("Fixed Track (Author) v1.0", track_names)
+        self.assertNotIn("abc123", track_names)
+        #def456 was never in the database, so its track isn't added
+        self.assertNotIn("Already Fixed Track (Author) v1.0", track_names)
+
+    async def test_maintenance_only_vacuums_with_enough_free_pages(self):
+        await DataTracker.db_connection.execute("CREATE TABLE Filler(data BLOB)")
+        await DataTracker.db_connection.executemany("INSERT INTO Filler VALUES (?)", [(b"x" * 4000,) for _ in range(500)])
+        self.assertFalse(await DataTracker.database_maintenance())
+        await DataTracker.db_connection.execute("DELETE FROM Filler")
+        self.assertGreaterEqual(await DataTracker.get_free_page_ratio(), DataTracker.VACUUM_FREE_PAGE_RATIO)
+        self.assertTrue(await DataTracker.database_maintenance())
+        self.assertEqual(await DataTracker.get_free_page_ratio(), 0.0)
+
+
+class StreamingReadTests(unittest.IsolatedAsyncioTestCase):
+    '''A player with a huge mii history, read with get_random_previous_mii (streamed) and get_mii_hexes (all of the rows at once)'''
+    FC = "0000-0000-0001"
+    EVENT_COUNT = 20000
+    MII_COUNT = 4
+    #get_random_previous_mii should never have more than this allocated, no matter how many events the player was in
+    MEMORY_CEILING_BYTES = 2 * 2**20
+
+    async def asyncSetUp(self):
+        self.temp_folder = tempfile.TemporaryDirectory()
+        database_file = os.path.join(self.temp_folder.name, "streaming.db")
+        connection = QueryPlanBenchmark.create_database(database_file)
+        self.mii_hexes = [f"{mii_num:0148x}" for mii_num in range(self.MII_COUNT)]
+        connection.execute("BEGIN")
+        connection.execute("INSERT INTO Track VALUES ('Luigi Circuit', 'No Track Page', 'Luigi Circuit', 0, 'luigicircuit')")
+        connection.execute("INSERT INTO Player VALUES (?, 1, 'url')", (self.FC,))
+        connection.executemany("INSERT INTO Event_ID VALUES (?)", [(event_id,) for event_id in range(self.EVENT_COUNT)])
+        connection.executemany("INSERT INTO Event_FCs VALUES (?, ?, ?)", [(event_id, self.FC, self.mii_hexes[event_id % self.MII_COUNT]) for event_id in range(self.EVENT_COUNT)])
+        connection.executemany("INSERT INTO Race VALUES (?, ?, '2026-01-01 00:00:00.000', '2026-01-01 00:00:00', 1, 'AB12', 'Luigi Circuit', 'Private Room', '150cc', 'priv', 1, 12, 100, 130, 115)",
+                               [(race_id, f"r{race_id:07}") for race_id in range(self.EVENT_COUNT)])
+        connection.executemany("INSERT INTO Event_Races VALUES (?, ?)", [(event_id, event_id) for event_id in range(self.EVENT_COUNT)])
+        #The same race tabled by a second event, which is only counted once
+        connection.execute("INSERT INTO Event_ID VALUES (?)", (self.EVENT_COUNT,))
+        connection.execute("INSERT INTO Event_FCs VALUES (?, ?, ?)", (self.EVENT_COUNT, self.FC, self.mii_hexes[0]))
+        connection.execute("INSERT INTO Event_Races VALUES (?, 0)", (self.EVENT_COUNT,))
+        connection.execute("COMMIT")
+        connection.close()
+        self.database_file_patch = mock.patch.object(common, "ROOM_DATA_TRACKING_DATABASE_FILE", database_file)
+        self.database_file_patch.start()
+        await DataTracker.start_database()
+        await DataTracker.start_read_connection_pool(1)
+
+    async def asyncTearDown(self):
+        await DataTracker.close_read_connection_pool()
+        await DataTracker.db_connection.close()
+        DataTracker.db_connection = None
+        self.database_file_patch.stop()
+        self.temp_folder.cleanup()
+
+    async def get_peak_memory(self, coroutine_function):
+        tracemalloc.start()
+        try:
+            result = await coroutine_function()
+            return result, tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    async def test_random_previous_mii_memory_ceiling(self):
+        mii_hexes, all_rows_peak = await self.get_peak_memory(lambda: DataTracker.DataRetriever.get_mii_hexes([self.FC]))
+        selected_row, streamed_peak = await self.get_peak_memory(lambda: DataTracker.DataRetriever.get_random_previous_mii([self.FC]))
+        self.assertEqual(len(mii_hexes), self.EVENT_COUNT + 1)
+        self.assertIn(selected_row, mii_hexes)
+        self.assertLess(streamed_peak, self.MEMORY_CEILING_BYTES)
+        #Reading all of the rows at once goes well past the ceiling, so the ceiling is actually being tested
+        self.assertGreater(all_rows_peak, self.MEMORY_CEILING_BYTES * 2)
+
+    async def test_random_previous_mii_samples_every_mii_and_race(self):
+        rng = random.Random(0)
+        selected_rows = [await DataTracker.DataRetriever.get_random_previous_mii([self.FC], rng) for _ in range(200)]
+        self.assertEqual({row[-1] for row in selected_rows}, set(self.mii_hexes))
+        self.assertGreater(len({row[1] for row in selected_rows}), 150)
+        self.assertIsNone(await DataTracker.DataRetriever.get_random_previous_mii(["0000-0000-0002"]))
+
+    async def test_mii_races_count_each_race_once(self):
+        rows = [row async for row in DataTracker.iterate_read(*SQL_Search_Query_Builder.get_fc_mii_races_query([self.FC]))]
+        self.assertEqual(len(rows), self.EVENT_COUNT)
+        self.assertEqual(len({row[1] for row in rows}), self.EVENT_COUNT)
+
+
+class ArchivePartitionsTests(unittest.IsolatedAsyncioTestCase):
+    '''A year of synthetic history, split into monthly archives by DataTracker.archive_old_months, compared to the database before it was split'''
+    TRACKS_PLAYED_ARGS = [(is_ct, tier, days) for is_ct in (False, True) for tier in (None, 5) for days in (7, 30, 200, None)]
+
+    async def asyncSetUp(self):
+        self.temp_folder = tempfile.TemporaryDirectory()
+        self.database_file = os.path.join(self.temp_folder.name, "archives.db")
+        connection = QueryPlanBenchmark.create_database(self.database_file)
+        connection.execute("PRAGMA journal_mode=WAL;")
+        QueryPlanBenchmark.seed_database(connection, 30000)
+        connection.executescript(common.read_sql_file(common.ROOM_DATA_TRACKING_QUERY_INDEXES_SQL))
+        connection.executescript(common.read_sql_file(common.ROOM_DATA_TRACKING_STATS_AGGREGATES_SQL))
+        connection.execute(create_stats_dirty_buckets_script())
+        StatsAggregatesCheck.rebuild_stats_aggregates(connection)
+        connection.executescript(common.read_sql_file(common.ROOM_DATA_TRACKING_HEAD_TO_HEAD_SQL))
+        StatsAggregatesCheck.rebuild_head_to_head(connection)
+        self.race_count = connection.execute("SELECT COUNT(*) FROM Race").fetchone()[0]
+        self.expected_tracks_played = {args: connection.execute(*SQL_Search_Query_Builder.get_tracks_played_query(*args)).fetchall()
+                                       for args in self.TRACKS_PLAYED_ARGS}
+        self.mii_fcs = [fc for (fc,) in connection.execute("SELECT fc FROM Event_FCs GROUP BY fc ORDER BY COUNT(*) DESC LIMIT 3")]
+        self.expected_mii_hexes = {fc: connection.execute(*SQL_Search_Query_Builder.get_fc_mii_hexes_query([fc])).fetchall() for fc in self.mii_fcs}
+        self.expected_mii_races = {fc: connection.execute(*SQL_Search_Query_Builder.get_fc_mii_races_query([fc])).fetchall() for fc in self.mii_fcs}
+        connection.close()
+
+        self.database_file_patch = mock.patch.object(common, "ROOM_DATA_TRACKING_DATABASE_FILE", self.database_file)
+        self.database_file_patch.start()
+        StatsResultCache.clear()
+        await DataTracker.start_database()
+        await DataTracker.ensure_foreign_keys_on()
+        await DataTracker.create_schema_versions()
+        await DataTracker.create_stats_aggregates()
+        self.archived_months = await DataTracker.archive_old_months()
+
+    async def asyncTearDown(self):
+        ArchivePartitions.close_archive_connections()
+        await DataTracker.db_connection.close()
+        DataTracker.db_connection = None
+        self.database_file_patch.stop()
+        self.temp_folder.cleanup()
+
+    def check_tables(self, check):
+        connection = sqlite3.connect(self.database_file)
+        try:
+            return check(connection)
+        finally:
+            connection.close()
+
+    async def test_old_months_are_moved_to_archives(self):
+        self.assertEqual(self.archived_months, ArchivePartitions.get_archived_months(self.database_file))
+        self.assertEqual(len(self.archived_months), 13 - ArchivePartitions.ARCHIVE_AFTER_MONTHS)
+        cutoff = f"{ArchivePartitions.get_archive_cutoff_month()}-01"
+        self.assertEqual(await DataTracker.db_connection.execute("SELECT COUNT(*) FROM Race WHERE time_added < ?", [cutoff]), [(0,)])
+        live_race_count = (await DataTracker.db_connection.execute("SELECT COUNT(*) FROM Race"))[0][0]
+        archived_race_count = len(ArchivePartitions.execute_on_archives(self.database_file, self.archived_months, "SELECT race_id FROM Race"))
+        self.assertEqual(live_race_count + archived_race_count, self.race_count)
+        #Nothing is left to archive
+        self.assertEqual(await DataTracker.archive_old_months(), [])
+
+    async def test_queries_match_unsplit_database(self):
+        for args in self.TRACKS_PLAYED_ARGS:
+            self.assertEqual(await DataTracker.DataRetriever.get_tracks_played_count(*args), self.expected_tracks_played[args], args)
+        for fc in self.mii_fcs:
+            self.assertEqual(await DataTracker.DataRetriever.get_mii_hexes([fc]), self.expected_mii_hexes[fc])
+
+    async def test_streamed_rows_include_archives(self):
+        for fc in self.mii_fcs:
+            rows = [row async for row in DataTracker.iterate_read_partitioned(*SQL_Search_Query_Builder.get_fc_mii_races_query([fc]), batch_size=7)]
+            #An event whose races are on both sides of the end of an archived month has its first race in each database
+            self.assertLessEqual(set(self.expected_mii_races[fc]), set(rows))
+            self.assertLessEqual(len(rows) - len(self.expected_mii_races[fc]), len(self.archived_months))
+
+    async def test_recent_queries_only_read_live_database(self):
+        with mock.patch.object(ArchivePartitions, "connect_archive") as connect_archive:
+            await DataTracker.DataRetriever.get_tracks_played_count(False, None, 30)
+        connect_archive.assert_not_called()
+
+    async def test_aggregates_are_rebuilt_from_archives(self):
+        await DataTracker.rebuild_stats_aggregates()
+        await DataTracker.rebuild_head_to_head()
+        self.assertEqual(self.check_tables(StatsAggregatesCheck.check_stats_aggregates), {"missing": [], "extra": []})
+        self.assertEqual(self.check_tables(StatsAggregatesCheck.check_head_to_head), {"missing": [], "extra": []})
+        self.assertEqual(self.check_tables(lambda connection: StatsAggregatesCheck.compare_stats_queries(connection, 10)), [])
+
+    async def test_fix_shas_renames_archived_races(self):
+        sha = "abc123"
+        archive_file = ArchivePartitions.get_archive_file(self.database_file, self.archived_months[0])
+        archive = sqlite3.connect(archive_file, isolation_level=None)
+        (track_name, race_id), = archive.execute("SELECT track_name, MIN(race_id) FROM Race")
+        archive.execute("UPDATE Race SET track_name = ? WHERE race_id = ?", (sha, race_id))
+        archive.close()
+        await DataTracker.db_connection.execute("INSERT INTO Track VALUES (?, 'No Track Page', ?, 1, ?)", [sha, sha, sha])
+        await DataTracker.rebuild_stats_aggregates()
+
+        await DataTracker.fix_shas({sha: track_name})
+        async with DataTracker.write_transaction():
+            await DataTracker.refresh_stats_aggregates()
+        self.assertEqual(ArchivePartitions.execute_on_archives(self.database_file, self.archived_months[:1], "SELECT track_name FROM Race WHERE race_id = ?", [race_id]),
+                         [(track_name,)])
+        self.assertEqual(self.check_tables(StatsAggregatesCheck.check_stats_aggregates), {"missing": [], "extra": []})
+
+    def test_months_in_window(self):
+        months = ["2026-05", "2026-06", "2026-07"]
+        today = date(2026, 8, 10)
+        self.assertEqual(ArchivePartitions.get_months_in_window(months, 7, today), [])
+        self.assertEqual(ArchivePartitions.get_months_in_window(months, 15, today), ["2026-07"])
+        self.assertEqual(ArchivePartitions.get_months_in_window(months, None, today), months)
+        self.assertEqual(ArchivePartitions.get_archive_cutoff_month(3, today), "2026-06")
+
+
 if __name__ == '__main__':
     unittest.main()
     
\ No newline at end of file
@@ -0,0 +1,225 @@
+'''
+Created on Oct 19, 2026
+
+@author: willg
+
+Benchmarks the per-update write latency of RoomTracker.add_everything_to_database.
+
+A synthetic 12 player room is "updated" once after every race, the same way a table is updated in the bot: each update sends every race
+played so far. Each update is written in each of these ways, each into its own fresh database:
+ - legacy: the way updates were written before - every statement autocommits on its own, the inserts use RETURNING to report what was added,
+   and the mii updates first look up which rows are missing their mii
+ - batched: the way RoomTrackerSQL writes them now - one transaction per update (DataTracker.write_transaction), multi-row inserts run with
+   DataTracker.insert_rows, and row counts instead of RETURNING. Every race played so far is written, and the INSERT OR IGNOREs skip the
+   rows that are already in the database
+ - delta: batched, but only writing the races since the event's high-water mark, the way RoomTracker does once it has written the event
+   (see DataTracker.get_races_to_write)
+
+Run from the bot's folder: python -m data_tracking.WriteBenchmark [--rooms 20] [--races 12] [--database-folder temp/] [--output results.json]
+'''
+import argparse
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+from itertools import chain
+from typing import Dict, List
+
+import aiosqlite
+
+import common
+from data_tracking import DataTracker
+from data_tracking import Data_Tracker_SQL_Query_Builder as QB
+
+DEFAULT_DATABASE_FOLDER = "temp/"
+DEFAULT_ROOMS = 20
+DEFAULT_RACES = 12
+PLAYERS_PER_ROOM = 12
+TRACK_COUNT = 32
+#Rooms share players, so later rooms mostly insert players that are already in the database (like they do in the bot)
+PLAYER_POOL_SIZE = 60
+
+
+def get_fc(player_num: int) -> str:
+    digits = f"{player_num:012}"
+    return f"{digits[:4]}-{digits[4:8]}-{digits[8:]}"
+
+def get_timestamp(moment: datetime) -> str:
+    return moment.strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+
+
+def build_rooms(room_count: int, races_per_room: int, seed=0) -> List[Dict]:
+    '''Returns the rows RoomTrackerSQL would build for each race of each room, in the same shape as the RoomTrackerSQL.get_*_tuple methods'''
+    rng = random.Random(seed)
+    tracks = [(f"Track {i}", f"https://wiki.tockdom.com/wiki/Track_{i}", f"Track {i}", False, f"track{i}") for i in range(TRACK_COUNT)]
+    start_time = datetime.now() - timedelta(days=1)
+    rooms = []
+    race_id = 0
+    for room_num in range(room_count):
+        fcs = rng.sample([get_fc(player_num) for player_num in range(PLAYER_POOL_SIZE)], PLAYERS_PER_ROOM)
+        event_id = 900000000000000000 + room_num
+        mii_hexes = {fc: f"{rng.getrandbits(74*8):0148x}" for fc in fcs}
+        races = []
+        for race_num in range(races_per_room):
+            race_time = start_time + timedelta(minutes=30 * room_num + 3 * race_num)
+            track = rng.choice(tracks)
+            times = sorted(100 + rng.random() * 30 for _ in fcs)
+            race = (race_id, f"r{race_id:07}", get_timestamp(race_time), race_num + 1, "AB12", track[0], "Private Room", "150cc", "priv",
+                    True, PLAYERS_PER_ROOM, times[0], times[-1], sum(times) / len(times))
+            placements = [(race_id, fc, f"Player {fc}", place, race_time_seconds, 0.0, "ok", place, "priv", 0, "player", 5000,
+                           None, None, None, None, None, True)
+                          for place, (fc, race_time_seconds) in enumerate(zip(rng.sample(fcs, len(fcs)), times), 1)]
+            races.append({"race": race, "track": track, "placements": placements})
+            race_id += 1
+        rooms.append({"event_id": event_id,
+                      "players": [(fc, int(fc.replace("-", "")), f"https://wiimmfi.de/stats/mkwx/list/p{fc}") for fc in fcs],
+                      "mii_hexes": mii_hexes,
+                      "races": races})
+    return rooms
+
+def get_update(room: Dict, races_played: int, first_race=0) -> Dict:
+    '''Returns the rows written by the update after races_played races of the room, writing the races from first_race (0 based) onwards.
+    The event structure is only written when all of the races are.'''
+    races = room["races"][first_race:races_played]
+    event_id = room["event_id"]
+    event_structure = None if first_race > 0 else (event_id, *([json.dumps([])] * 11), False, 0, "Benchmark", 1, PLAYERS_PER_ROOM, PLAYERS_PER_ROOM, 1)
+    return {"players": room["players"],
+            "tracks": list({race["track"][0]: race["track"] for race in races}.values()),
+            "races": [race["race"] for race in races],
+            "placements": [placement for race in races for placement in race["placements"]],
+            "place_miis": [(room["mii_hexes"][placement[1]], placement[0], placement[1]) for race in races for placement in race["placements"]],
+            "event_id": [(event_id,)],
+            "event_races": [(event_id, race["race"][0]) for race in races],
+            "event": (event_id, 1, 0, "priv", None, None, PLAYERS_PER_ROOM),
+            "event_fcs": [(event_id, fc, None) for fc in room["mii_hexes"]],
+            "event_fc_miis": [(mii_hex, event_id, fc) for fc, mii_hex in room["mii_hexes"].items()],
+            "event_structure": event_structure}
+
+
+async def write_update_legacy(update: Dict):
+    '''Writes the update the way it was written before it was batched into one transaction'''
+    connection = DataTracker.db_connection
+    async def insert_returning(script, rows, returning):
+        return await connection.execute(f"{script.rstrip(';')}\nRETURNING {returning};", list(chain.from_iterable(rows)))
+    await insert_returning(QB.build_insert_missing_players_script(update["players"]), update["players"], "fc")
+    await insert_returning(QB.build_insert_missing_tracks_script(update["tracks"]), update["tracks"], "track_name")
+    await insert_returning(QB.build_insert_missing_races_script(update["races"]), update["races"], "race_id")
+    await insert_returning(QB.build_insert_missing_placement_script(update["placements"]), update["placements"], "race_id, fc")
+    missing_place_miis = [(race_id, fc, None) for _, race_id, fc in update["place_miis"]]
+    await connection.execute(QB.get_existing_race_fcs_in_Place_table_with_null_mii_hex(missing_place_miis), list(chain.from_iterable(missing_place_miis)))
+    await connection.executemany(QB.update_mii_hex_script(), update["place_miis"])
+    await insert_returning(QB.build_missing_event_id_table_script(update["event_id"]), update["event_id"], "*")
+    added_event_races = await insert_returning(QB.build_missing_event_ids_race_ids_script(update["event_races"]), update["event_races"], "*")
+    await connection.execute(QB.build_event_upsert_script(len(added_event_races) > 0), update["event"])
+    await insert_returning(QB.build_missing_event_fcs_table_script(update["event_fcs"]), update["event_fcs"], "*")
+    missing_event_fc_miis = [(event_id, fc, None) for _, event_id, fc in update["event_fc_miis"]]
+    await connection.execute(QB.get_existing_event_fcs_in_with_null_mii_hex(missing_event_fc_miis), list(chain.from_iterable(missing_event_fc_miis)))
+    await connection.executemany(QB.update_mii_hex_script_event_fcs(), update["event_fc_miis"])
+    await connection.execute(QB.build_event_structure_script(), update["event_structure"])
+
+async def write_update_batched(update: Dict):
+    '''Writes the update the same way RoomTracker.add_everything_to_database does'''
+    connection = DataTracker.db_connection
+    async with DataTracker.write_transaction():
+        await DataTracker.insert_rows(QB.build_insert_missing_players_script, update["players"])
+        await DataTracker.insert_rows(QB.build_insert_missing_tracks_script, update["tracks"])
+        await DataTracker.insert_rows(QB.build_insert_missing_races_script, update["races"])
+        await DataTracker.insert_rows(QB.build_insert_missing_placement_script, update["placements"])
+        await connection.executemany_count(QB.update_mii_hex_script(), update["place_miis"])
+        await DataTracker.insert_rows(QB.build_missing_event_id_table_script, update["event_id"])
+        added_event_races = await DataTracker.insert_rows(QB.build_missing_event_ids_race_ids_script, update["event_races"])
+        await connection.execute(QB.build_event_upsert_script(added_event_races > 0), update["event"])
+        await DataTracker.insert_rows(QB.build_missing_event_fcs_table_script, update["event_fcs"])
+        await connection.executemany_count(QB.update_mii_hex_script_event_fcs(), update["event_fc_miis"])
+        if update["event_structure"] is not None:
+            await connection.execute(QB.build_event_structure_script(), update["event_structure"])
+
+#mode: (function that writes an update, whether only the races since the high-water mark are written)
+WRITE_MODES = {"legacy": (write_update_legacy, False),
+               "batched": (write_update_batched, False),
+               "delta": (write_update_batched, True)}
+
+
+def create_database(database_file: str):
+    if os.path.exists(database_file):
+        os.remove(database_file)
+    connection = sqlite3.connect(database_file, isolation_level=None)
+    connection.executescript(common.read_sql_file(common.ROOM_DATA_TRACKING_DATABASE_CREATION_SQL))
+    connection.executescript(common.read_sql_file(common.ROOM_DATA_TRACKING_QUERY_INDEXES_SQL))
+    connection.close()
+
+def get_row_counts(database_file: str) -> Dict[str, int]:
+    connection = sqlite3.connect(database_file)
+    tables = ["Player", "Track", "Race", "Place", "Event_ID", "Event_Races", "Event", "Event_FCs", "Event_Structure"]
+    row_counts = {table: connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in tables}
+    row_counts["Place miis"] = connection.execute("SELECT COUNT(*) FROM Place WHERE mii_hex IS NOT NULL").fetchone()[0]
+    connection.close()
+    return row_counts
+
+async def run_mode(mode: str, rooms: List[Dict], database_file: str) -> Dict:
+    create_database(database_file)
+    DataTracker.db_connection = DataTracker.ConnectionWrapper(await aiosqlite.connect(database_file, isolation_level=None))
+    await DataTracker.ensure_foreign_keys_on()
+    write_update, is_delta = WRITE_MODES[mode]
+    timings = []
+    try:
+        for room in rooms:
+            for races_played in range(1, len(room["races"]) + 1):
+                #The last written race is written again, like DataTracker.get_races_to_write does
+                update = get_update(room, races_played, max(races_played - 2, 0) if is_delta else 0)
+                t0 = time.perf_counter()
+                await write_update(update)
+                timings.append(time.perf_counter() - t0)
+    finally:
+        await DataTracker.db_connection.close()
+        DataTracker.db_connection = None
+    timings.sort()
+    return {"updates": len(timings),
+            "mean_ms": statistics.mean(timings) * 1000,
+            "p50_ms": timings[len(timings) // 2] * 1000,
+            "p95_ms": timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1000,
+            "row_counts": get_row_counts(database_file)}
+
+async def run_benchmark(args) -> Dict:
+    os.makedirs(args.database_folder, exist_ok=True)
+    rooms = build_rooms(args.rooms, args.races, args.seed)
+    results = {"rooms": args.rooms, "races_per_room": args.races, "time": str(datetime.now())}
+    for mode in WRITE_MODES:
+        database_file = os.path.join(args.database_folder, f"write_benchmark_{mode}.db")
+        results[mode] = await run_mode(mode, rooms, database_file)
+        print(f"{mode}: {results[mode]['updates']} updates, mean {results[mode]['mean_ms']:.2f}ms, "
+              f"p50 {results[mode]['p50_ms']:.2f}ms, p95 {results[mode]['p95_ms']:.2f}ms")
+        if not args.keep:
+            os.remove(database_file)
+    for mode in WRITE_MODES:
+        if mode == "legacy":
+            continue
+        if results["legacy"]["row_counts"] != results[mode]["row_counts"]:
+            print(f"Row counts differ! legacy: {results['legacy']['row_counts']}, {mode}: {results[mode]['row_counts']}")
+        print(f"Speedup of {mode}: {results['legacy']['mean_ms'] / results[mode]['mean_ms']:.1f}x mean, "
+              f"{results['legacy']['p95_ms'] / results[mode]['p95_ms']:.1f}x p95")
+    return results
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Compare the per-update write latency of the legacy, batched and delta room tracking writes.")
+    parser.add_argument("--database-folder", default=DEFAULT_DATABASE_FOLDER, help="folder to create the benchmark databases in")
+    parser.add_argument("--rooms", type=int, default=DEFAULT_ROOMS, help="number of rooms to simulate")
+    parser.add_argument("--races", type=int, default=DEFAULT_RACES, help="number of races in each room (there is one update after each race)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--keep", action="store_true", help="don't delete the benchmark databases afterwards")
+    parser.add_argument("--output", default=None, help="JSON file to write the results to")
+    args = parser.parse_args(argv)
+
+    results = asyncio.run(run_benchmark(args))
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
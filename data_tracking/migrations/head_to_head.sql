@@ -0,0 +1,43 @@
+/* Head to head records for ?record, so it doesn't have to join both players' whole Place history every time.
+   Every statement is IF NOT EXISTS, so this is safe to run on a database that already has them. DataTracker runs it when its version in Schema_Versions is out of date,
+   and then fills the table from the existing placements (see Data_Tracker_SQL_Query_Builder.build_rebuild_head_to_head_statements).
+   data_tracking/StatsAggregatesCheck.py compares it to a full recompute, and data_tracking/RecordBenchmark.py compares the record queries. */
+
+BEGIN;
+
+/* One row for each pair of players (fcs) who were in the same race, for each track type (is_ct) and day (the date the races were added),
+   for the placements that ?record counts: placements with a time under 6 minutes. Every pair is in the table twice, once from each player's side,
+   so a player's rows are found by the primary key, and win_count is the number of those races where fc finished ahead of opponent_fc. */
+CREATE TABLE IF NOT EXISTS Head_To_Head(
+    fc TEXT NOT NULL,
+    opponent_fc TEXT NOT NULL,
+    is_ct TINYINT(1) NOT NULL,
+    day TEXT NOT NULL,
+    race_count INT NOT NULL,
+    win_count INT NOT NULL,
+    PRIMARY KEY(fc, opponent_fc, is_ct, day)
+) WITHOUT ROWID;
+
+/* Placements are only ever inserted (never changed or deleted, apart from their mii), so each new placement adds its races against the placements
+   already in the race. INSERT OR IGNORE only fires this for the placements it actually inserts, so a placement is never counted twice. */
+CREATE TRIGGER IF NOT EXISTS Place_Head_To_Head AFTER INSERT ON Place
+WHEN NEW.time < 6 * 60
+BEGIN
+    INSERT INTO Head_To_Head (fc, opponent_fc, is_ct, day, race_count, win_count)
+    SELECT NEW.fc, Opponent.fc, Track.is_ct, date(Race.time_added), 1, NEW.place < Opponent.place
+    FROM Place AS Opponent
+        JOIN Race ON Race.race_id = Opponent.race_id
+        JOIN Track ON Track.track_name = Race.track_name
+    WHERE Opponent.race_id = NEW.race_id AND Opponent.fc != NEW.fc AND Opponent.time < 6 * 60
+    ON CONFLICT DO UPDATE SET race_count = race_count + excluded.race_count, win_count = win_count + excluded.win_count;
+
+    INSERT INTO Head_To_Head (fc, opponent_fc, is_ct, day, race_count, win_count)
+    SELECT Opponent.fc, NEW.fc, Track.is_ct, date(Race.time_added), 1, Opponent.place < NEW.place
+    FROM Place AS Opponent
+        JOIN Race ON Race.race_id = Opponent.race_id
+        JOIN Track ON Track.track_name = Race.track_name
+    WHERE Opponent.race_id = NEW.race_id AND Opponent.fc != NEW.fc AND Opponent.time < 6 * 60
+    ON CONFLICT DO UPDATE SET race_count = race_count + excluded.race_count, win_count = win_count + excluded.win_count;
+END;
+
+COMMIT;
@@ -0,0 +1,34 @@
+/* Indexes for the stats queries built by Data_Tracker_SQL_Query_Builder.SQL_Search_Query_Builder.
+   Every statement is IF NOT EXISTS, so this is safe to run on a database that already has them. DataTracker runs it when its version in Schema_Versions is out of date.
+   See data_tracking/QueryPlanBenchmark.py for the query plans and timings with and without these indexes. */
+
+BEGIN;
+
+/* Place's primary key is (fc, race_id), which covers looking up an FC's placements, but not a race's placements:
+   ?topplayers looks up the placements of every race on the track, and the record queries join Place to Race on race_id */
+CREATE INDEX IF NOT EXISTS Place_race_id ON Place(race_id, fc, place, time);
+
+/* Races of a track (?topplayers, ?toptracks), races in the last x days, and races with the same rxx (tier filter) */
+CREATE INDEX IF NOT EXISTS Race_track_name ON Race(track_name);
+CREATE INDEX IF NOT EXISTS Race_time_added ON Race(time_added);
+CREATE INDEX IF NOT EXISTS Race_rxx ON Race(rxx);
+
+/* ?topplayers looks up a track by its fixed name */
+CREATE INDEX IF NOT EXISTS Track_fixed_track_name ON Track(fixed_track_name, is_ct);
+
+/* Event_Races' primary key is (event_id, race_id), so joining from a race to its events needs the other order */
+CREATE INDEX IF NOT EXISTS Event_Races_race_id ON Event_Races(race_id, event_id);
+
+/* Mii hex lookups (?miihistory) are by FC, and Event_FCs' primary key is (event_id, fc) */
+CREATE INDEX IF NOT EXISTS Event_FCs_fc ON Event_FCs(fc, event_id) WHERE mii_hex IS NOT NULL;
+
+/* Tier filters join Event to Tier on channel_id */
+CREATE INDEX IF NOT EXISTS Event_channel_id ON Event(channel_id);
+
+/* Record queries look up the FCs of a discord ID */
+CREATE INDEX IF NOT EXISTS Player_FCs_discord_id ON Player_FCs(discord_id, fc);
+
+COMMIT;
+
+/* Lets the query planner gather statistics for the new indexes (this is cheap when nothing has changed) */
+PRAGMA optimize;
@@ -0,0 +1,9 @@
+/* The version of each migration script (and of the data synced from outside of the database) that the database has, so DataTracker.initialize
+   only runs the migrations that have changed since the last time the database was started, instead of all of them every time.
+   The versions are set by DataTracker (see DataTracker.MIGRATION_VERSIONS). */
+
+CREATE TABLE IF NOT EXISTS Schema_Versions(
+    name TEXT PRIMARY KEY NOT NULL,
+    version TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
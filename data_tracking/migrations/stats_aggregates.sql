@@ -0,0 +1,41 @@
+/* Summary table for the stats commands (?toptracks/?besttracks and ?topplayers), so they don't have to aggregate the whole Place/Race history every time.
+   Every statement is IF NOT EXISTS, so this is safe to run on a database that already has them. DataTracker runs it when its version in Schema_Versions is out of date.
+   The temp table of dirty buckets isn't created here, since it has to be created for each connection (see Data_Tracker_SQL_Query_Builder.create_stats_dirty_buckets_script).
+   DataTracker keeps the table up to date as it writes rooms (see DataTracker.refresh_stats_aggregates), and data_tracking/StatsAggregatesCheck.py
+   compares it to a full recompute. */
+
+BEGIN;
+
+/* One row for each player (fc), track, tier and day (the date the races were added), for the placements that the stats commands count:
+   placements with a time under 6 minutes, in races tabled in a valid 12 player event in a tiered channel.
+   tier is -1 (Data_Tracker_SQL_Query_Builder.ANY_TIER) for the placements of every tier together - a race tabled in more than one tier is only counted once there.
+   The sums (instead of averages) let rows be added together for any range of days. */
+CREATE TABLE IF NOT EXISTS Player_Track_Stats(
+    fc TEXT NOT NULL,
+    fixed_track_name TEXT NOT NULL,
+    is_ct TINYINT(1) NOT NULL,
+    tier INT NOT NULL,
+    day TEXT NOT NULL,
+    race_count INT NOT NULL,
+    pts_sum INT NOT NULL,
+    place_sum INT NOT NULL,
+    best_time REAL NOT NULL,
+    PRIMARY KEY(fc, fixed_track_name, is_ct, tier, day)
+) WITHOUT ROWID;
+
+/* ?topplayers reads every player's rows of a track for a tier (the per track, per tier aggregates) - the index covers the query, so it never has to read the table.
+   (?besttracks reads a player's rows, which is the primary key.) */
+CREATE INDEX IF NOT EXISTS Player_Track_Stats_track ON Player_Track_Stats(fixed_track_name, tier, day, fc, race_count, pts_sum, place_sum, best_time);
+/* Refreshing a track's day rewrites every player's rows for that track and day */
+CREATE INDEX IF NOT EXISTS Player_Track_Stats_track_day ON Player_Track_Stats(fixed_track_name, is_ct, day);
+
+/* Finding the races of a track on a day, when refreshing the rows for that track and day */
+CREATE INDEX IF NOT EXISTS Race_track_name_time_added ON Race(track_name, time_added);
+
+/* Things the aggregates were built from that are changed outside of room updates (the Tier table is repopulated every time the bot starts) */
+CREATE TABLE IF NOT EXISTS Stats_Aggregates_Info(
+    name TEXT PRIMARY KEY NOT NULL,
+    value TEXT
+);
+
+COMMIT;
@@ -0,0 +1,62 @@
+/* The tables of a monthly archive database (see data_tracking/ArchivePartitions.py): the races of one month, with their placements and Event_Races rows.
+   They're the same as the live database's tables, without the foreign keys - the tracks, players and events they refer to are in the live database.
+   Every statement is IF NOT EXISTS, so this is safe to run on an archive that already has them. */
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS Place(
+    race_id INT UNSIGNED NOT NULL,
+    fc TEXT NOT NULL,
+    name TEXT NOT NULL,
+    place INT NOT NULL,
+    time DOUBLE(8, 3) NULL,
+    lag_start DOUBLE(8, 2) NULL,
+    ol_status TEXT NOT NULL,
+    room_position INT NOT NULL,
+    region TEXT NOT NULL,
+    connection_fails DOUBLE(8, 2) NULL,
+    role TEXT NOT NULL,
+    vr INT NULL,
+    character TEXT NULL,
+    vehicle TEXT NULL,
+    discord_name TEXT NULL,
+    lounge_name TEXT NULL,
+    mii_hex TEXT NULL,
+    is_wiimmfi_place TINYINT(1) NOT NULL,
+    PRIMARY KEY(fc, race_id)
+);
+
+CREATE TABLE IF NOT EXISTS Race(
+    race_id INT UNSIGNED NOT NULL,
+    rxx TEXT NOT NULL,
+    time_added TIMESTAMP NOT NULL,
+    match_time TEXT NOT NULL,
+    race_number INT NOT NULL,
+    room_name TEXT NOT NULL,
+    track_name TEXT NOT NULL,
+    room_type TEXT NOT NULL,
+    cc TEXT NOT NULL,
+    region TEXT NULL,
+    is_wiimmfi_race TINYINT(1) NOT NULL,
+    num_players INT NOT NULL,
+    first_place_time DOUBLE(8, 3),
+    last_place_time  DOUBLE(8, 3),
+    avg_time         DOUBLE(8, 3),
+    PRIMARY KEY(race_id)
+);
+
+CREATE TABLE IF NOT EXISTS Event_Races(
+    event_id INT UNSIGNED NOT NULL,
+    race_id INT UNSIGNED NOT NULL,
+    PRIMARY KEY(event_id, race_id)
+);
+
+/* The live database's query indexes on these tables (see migrations/query_indexes.sql and migrations/stats_aggregates.sql) */
+CREATE INDEX IF NOT EXISTS Place_race_id ON Place(race_id, fc, place, time);
+CREATE INDEX IF NOT EXISTS Race_track_name ON Race(track_name);
+CREATE INDEX IF NOT EXISTS Race_time_added ON Race(time_added);
+CREATE INDEX IF NOT EXISTS Race_rxx ON Race(rxx);
+CREATE INDEX IF NOT EXISTS Race_track_name_time_added ON Race(track_name, time_added);
+CREATE INDEX IF NOT EXISTS Event_Races_race_id ON Event_Races(race_id, event_id);
+
+COMMIT;
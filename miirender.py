@@ -1,8 +1,10 @@
+import asyncio
 from struct import pack
 from binascii import hexlify, unhexlify
 from requests import get
-from gen1_wii import Gen1Wii
 import common
+import MiiDecoder
+import MiiImageCache
 
 
 def u8(data):
@@ -12,7 +14,7 @@ def get_mii_url(mii_data, picture_width=512):
     return "https://studio.mii.nintendo.com/miis/image.png?data=" + mii_data.decode("utf-8") + f"&type=face&width={picture_width}&instanceCount=1"
 
 def format_mii_data(original_mii_data):
-    orig_mii = Gen1Wii.from_bytes(unhexlify(original_mii_data))
+    orig_mii = MiiDecoder.decode(unhexlify(original_mii_data))
 
 
     studio_mii = {}
@@ -21,7 +23,7 @@ def format_mii_data(original_mii_data):
 
     wrinkles = {4: 5, 5: 2, 6: 3, 7: 7, 8: 8, 10: 9, 11: 11}  # lookup table
 
-    # ue generate the Mii Studio file by reading each Mii format from the Kaitai files.
+    # ue generate the Mii Studio file by reading each Mii format from the decoded Wii Mii.
     # unlike consoles which store Mii data in an odd number of bits,
     # all the Mii data for a Mii Studio Mii is stored as unsigned 8-bit integers. makes it easier.
 
@@ -109,11 +111,24 @@ def format_mii_data(original_mii_data):
 
 
 async def download_mii(original_mii_data, file_name, picture_width=512):
+    cache_key = MiiImageCache.get_mii_picture_key(original_mii_data, picture_width)
+    #The cache copies and writes files (and can wait on the image workers for its lock), so it's used off the event loop
+    loop = asyncio.get_running_loop()
+    if await loop.run_in_executor(None, MiiImageCache.copy_to, cache_key, file_name):
+        return True
+
     mii_data = format_mii_data(original_mii_data)
-    
     mii_url = get_mii_url(mii_data, picture_width)
-    success = await common.download_image(mii_url, file_name)
-    return success if success else None
+    image_bytes = await common.download_image_bytes(mii_url)
+    if image_bytes is None:
+        return None
+    await loop.run_in_executor(None, save_downloaded_mii, cache_key, file_name, image_bytes)
+    return True
+
+def save_downloaded_mii(cache_key, file_name, image_bytes: bytes):
+    with open(file_name, mode='wb+') as f:
+        f.write(image_bytes)
+    MiiImageCache.store_bytes(cache_key, image_bytes)
 
 
 